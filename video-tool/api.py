@@ -3,21 +3,36 @@
 
 此模塊提供一個Flask API，用於將文本轉換為語音。
 支持普通話、粵語和英語，以及男聲和女聲選項。
+配置了多個TTS服務提供商時，每個請求發送到當前最快的健康服務提供商（見tts_router.py）。
 """
 
 from flask import Flask, request, jsonify, send_file
 import os
 import uuid
 from tts_module import TextToSpeech, Language, Gender, TTSProvider
+from tracing import get_tracer, register_trace_routes
+from metrics import get_registry, register_metrics_route
+from tts_router import TTSRouter
+from provider_rate_limiter import register_priority_hook
 
 app = Flask(__name__)
 
+# 鏈路追蹤：記錄帶有X-Trace-Id請求頭的請求
+tracer = get_tracer()
+register_trace_routes(app, tracer, "tts")
+
+# Prometheus指標
+register_metrics_route(app, get_registry(), "tts")
+
+# 服務提供商配額按網關傳來的請求優先級排隊
+register_priority_hook(app)
+
 # 創建輸出目錄
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# 初始化TTS
-tts = TextToSpeech(provider=TTSProvider.GOOGLE)
+# 初始化TTS：按延遲和錯誤率在TTS_PROVIDERS中選擇服務提供商，設置TTS_HEDGE_AFTER時對慢請求發起對沖
+tts = TTSRouter.from_env(TextToSpeech, TTSProvider)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -76,17 +91,20 @@ def synthesize_speech():
         output_file = os.path.join(OUTPUT_DIR, f"{file_id}.mp3")
         
         # 生成語音
-        tts.synthesize_speech(
-            text=text,
-            language=language,
-            gender=gender,
-            output_file=output_file,
-            speaking_rate=speaking_rate,
-            pitch=pitch
-        )
+        with tracer.span("tts.provider", language=language_str) as span:
+            _, provider, role = tts.synthesize_with_provider(
+                text=text,
+                language=language,
+                gender=gender,
+                output_file=output_file,
+                speaking_rate=speaking_rate,
+                pitch=pitch
+            )
+            span.set(provider=provider, role=role)
         
         # 獲取時間戳
-        timestamps = tts.get_timestamps(text, output_file)
+        with tracer.span("tts.timestamps"):
+            timestamps = tts.get_timestamps(text, output_file)
         
         # 返回結果
         return jsonify({
@@ -99,6 +117,16 @@ def synthesize_speech():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/providers', methods=['GET'])
+def get_providers():
+    """
+    獲取各TTS服務提供商最近調用的延遲、錯誤率和健康狀態
+    
+    返回:
+    - 服務提供商到調用統計的映射
+    """
+    return jsonify(tts.report())
+
 @app.route('/audio/<file_id>', methods=['GET'])
 def get_audio(file_id):
     """
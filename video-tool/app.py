@@ -5,38 +5,101 @@
 支持上傳演講稿或語音文件，選擇語言和聲線，並生成包含相關場景的視頻。
 """
 
-from flask import Flask, request, jsonify, render_template, send_file, url_for
+from flask import Flask, request, jsonify, render_template, send_file, send_from_directory, url_for
 from flask_cors import CORS
 import os
 import sys
 import uuid
 import json
 import requests
+import math
 import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from werkzeug.utils import secure_filename
 
 # 添加模塊路徑
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "modules"))
 
+from render_settings import get_render_settings
+from video_packaging import VideoPackager
+from progressive_output import ProgressiveComposer, split_paragraphs
+from render_manifest import RenderManifest
+from render_cache import file_digest
+from tracing import get_tracer, register_trace_routes
+from metrics import get_registry, register_metrics_route, provider_call
+from job_scheduler import get_scheduler, SchedulerFull, PRIORITY_CLASSES, DEFAULT_TENANT
+from provider_rate_limiter import PRIORITY_HEADER
+
 # 創建應用
 app = Flask(__name__)
 CORS(app)  # 啟用跨域請求
 
+# 鏈路追蹤：上傳、生成和修訂請求開始新的追蹤，追蹤ID通過請求頭傳遞到各服務
+tracer = get_tracer()
+register_trace_routes(app, tracer, "gateway", root_endpoints={"upload_file", "generate_video", "revise_video"})
+
+# Prometheus指標
+metrics_registry = get_registry()
+register_metrics_route(app, metrics_registry, "gateway")
+video_download_bytes = metrics_registry.counter("video_download_bytes_total", "從下游服務下載的視頻字節數", ("service",))
+
 # 配置
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 app.config['OUTPUT_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB最大上傳大小
 app.config['ALLOWED_EXTENSIONS'] = {'txt', 'docx', 'pdf', 'mp3', 'wav'}
+app.config['JOB_FOLDER'] = os.path.join(app.config['OUTPUT_FOLDER'], "jobs")
+app.config['HLS_FOLDER'] = os.path.join(app.config['OUTPUT_FOLDER'], "hls")
+app.config['LIVE_FOLDER'] = os.path.join(app.config['OUTPUT_FOLDER'], "live")
+app.config['PROGRESSIVE_JOB_TTL'] = int(os.environ.get("PROGRESSIVE_JOB_TTL", 3600))  # 已結束的漸進式任務保留的秒數
+app.config['SECTION_ENCODE_WORKERS'] = int(os.environ.get("SECTION_ENCODE_WORKERS", 2))
 
 # 確保目錄存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+os.makedirs(app.config['HLS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['LIVE_FOLDER'], exist_ok=True)
 
 # 服務配置
 TTS_SERVICE_URL = "http://localhost:5000"
 DIGITAL_HUMAN_SERVICE_URL = "http://localhost:5001"
 SCENE_SERVICE_URL = "http://localhost:5002"
 
+# HLS打包器和各類文件的MIME類型
+video_packager = VideoPackager()
+HLS_MIMETYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.ts': 'video/mp2t'
+}
+
+# 漸進式生成任務的狀態
+progressive_jobs = {}
+progressive_jobs_lock = threading.Lock()
+
+# 生成任務的准入控制：按租戶公平排隊，限制同時執行的任務數和各階段並發數
+scheduler = get_scheduler()
+
+# 段落先按租戶公平取得段落渲染位置再提交到線程池，線程數與位置數一致，線程池本身不排隊
+paragraph_gate = scheduler.stages["paragraph"]
+paragraph_executor = ThreadPoolExecutor(max_workers=paragraph_gate.capacity)
+
+# 段落視頻的統一編碼和切片在獨立的線程池中執行，不阻塞任務線程收集其他段落的渲染結果
+section_executor = ThreadPoolExecutor(max_workers=max(1, app.config['SECTION_ENCODE_WORKERS']))
+
+# 隊列深度在抓取指標時才讀取
+metrics_registry.gauge_callback(
+    "progressive_paragraph_queue_depth", "等待渲染的漸進式段落數", lambda: paragraph_gate.snapshot()["queued"]
+)
+metrics_registry.gauge_callback(
+    "progressive_jobs_active", "進行中的漸進式生成任務數",
+    lambda: sum(1 for job in list(progressive_jobs.values()) if job["status"] == "processing")
+)
+
 # 工具函數
 def allowed_file(filename):
     """檢查文件是否允許上傳"""
@@ -73,6 +136,361 @@ def extract_text_from_file(file_path):
     else:
         return ""
 
+def save_job_record(job_id, record):
+    """保存生成任務記錄"""
+    job_file = os.path.join(app.config['JOB_FOLDER'], f"{secure_filename(job_id)}.json")
+    with open(job_file, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+
+def load_job_record(job_id):
+    """讀取生成任務記錄，不存在時返回None"""
+    job_file = os.path.join(app.config['JOB_FOLDER'], f"{secure_filename(job_id)}.json")
+    if not os.path.exists(job_file):
+        return None
+    with open(job_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def fetch_video_to_local(video_id):
+    """確保視頻保存在本地輸出目錄，返回本地路徑；各服務都沒有該視頻時返回None，服務出錯時拋出requests.RequestException"""
+    local_video_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{video_id}.mp4")
+    
+    if os.path.exists(local_video_path):
+        return local_video_path
+    
+    # 依次嘗試從場景服務和數字人服務獲取
+    for service, service_url in (("scene", SCENE_SERVICE_URL), ("digital_human", DIGITAL_HUMAN_SERVICE_URL)):
+        response = requests.get(f"{service_url}/video/{video_id}", stream=True, headers=tracer.inject(), timeout=300)
+        
+        if response.status_code == 404:
+            continue
+        response.raise_for_status()
+        
+        # 先寫入同目錄的臨時文件，完整下載後再重命名，中斷時不會留下被當作完整視頻的文件
+        fd, temp_path = tempfile.mkstemp(dir=app.config['OUTPUT_FOLDER'], suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+            os.replace(temp_path, local_video_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        video_download_bytes.inc(os.path.getsize(local_video_path), service=service)
+        return local_video_path
+    
+    return None
+
+def start_hls_packaging(video_id):
+    """在後台將視頻打包為多碼率HLS，視頻不在本地時先下載"""
+    video_id = secure_filename(video_id)
+    video_packager.package_in_background(
+        tracer.bind(lambda: fetch_video_to_local(video_id)),
+        os.path.join(app.config['HLS_FOLDER'], video_id)
+    )
+
+def request_admission(data, render_settings):
+    """從請求頭或請求數據中獲取租戶和優先級，未指定優先級時草稿預覽為draft，其餘為interactive"""
+    tenant = request.headers.get('X-Tenant-Id') or data.get('tenant_id') or DEFAULT_TENANT
+    priority = data.get('priority') or ("draft" if render_settings["quality"] == "draft" else "interactive")
+    return tenant, priority
+
+def service_headers(priority):
+    """調用下游服務的請求頭：追蹤ID和請求優先級，下游服務按優先級排隊等待服務提供商配額"""
+    return {**tracer.inject(), PRIORITY_HEADER: priority}
+
+def scheduler_full_response(error):
+    """隊列已滿時返回429和Retry-After"""
+    retry_after = math.ceil(error.retry_after)
+    response = jsonify({"error": f"服務繁忙，請稍後重試: {str(error)}", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def render_paragraph_video(paragraph, params, render_settings, level=None, reuse=None, ticket=None):
+    """為單個段落依次生成語音、數字人視頻和場景合成視頻，level為avatar或audio時重用原段落對應階段的產物"""
+    tenant = ticket.tenant if ticket else DEFAULT_TENANT
+    priority = ticket.priority if ticket else "interactive"
+    
+    if level in ("avatar", "audio"):
+        audio_file_id = reuse["audio_id"]
+    else:
+        with scheduler.stage("tts", tenant, priority), tracer.span("tts.synthesize"), provider_call("tts") as call:
+            tts_response = requests.post(
+                f"{TTS_SERVICE_URL}/synthesize",
+                json={
+                    "text": paragraph,
+                    "voice_id": params["voice_id"],
+                    "language": params["language"]
+                },
+                headers=service_headers(priority),
+                timeout=30
+            )
+            call.status(tts_response.status_code)
+        if tts_response.status_code != 200:
+            raise RuntimeError(f"TTS服務錯誤: {tts_response.text}")
+        audio_file_id = tts_response.json().get("audio_id")
+    
+    if level == "avatar":
+        digital_human_video_id = reuse["digital_human_video_id"]
+    else:
+        with scheduler.stage("avatar", tenant, priority), tracer.span("avatar.generate"), \
+                provider_call("digital_human") as call:
+            dh_response = requests.post(
+                f"{DIGITAL_HUMAN_SERVICE_URL}/generate",
+                json={
+                    "avatar_id": params["avatar_id"],
+                    "audio_file_id": audio_file_id,
+                    "background_color": "#00FF00",
+                    "resolution": render_settings["resolution"],
+                    "quality": render_settings["quality"],
+                    "profile": render_settings["profile"],
+                    "fps": render_settings["fps"]
+                },
+                headers=service_headers(priority),
+                timeout=120
+            )
+            call.status(dh_response.status_code)
+        if dh_response.status_code != 200:
+            raise RuntimeError(f"數字人生成錯誤: {dh_response.text}")
+        digital_human_video_id = dh_response.json().get("video_id")
+    
+    scene_request = {
+        "text": paragraph,
+        "digital_human_video_id": digital_human_video_id,
+        "audio_file_id": audio_file_id,
+        "style": "realistic",
+        "scene_duration": 5,
+        "resolution": render_settings["resolution"],
+        "quality": render_settings["quality"],
+        "profile": render_settings["profile"],
+        "fps": render_settings["fps"],
+        "preset": render_settings["preset"],
+        "scene_type": params["scene_type"]
+    }
+    with scheduler.stage("scene", tenant, priority), tracer.span("scene.compose", video_mode=params["video_mode"]), \
+            provider_call("scene") as call:
+        if params["video_mode"] == "scene_switching":
+            scene_response = requests.post(
+                f"{SCENE_SERVICE_URL}/process", json=scene_request, headers=service_headers(priority), timeout=300
+            )
+        else:
+            scene_request.update({"pip_position": "bottom-right", "pip_size_ratio": 0.3})
+            scene_response = requests.post(
+                f"{SCENE_SERVICE_URL}/picture-in-picture", json=scene_request, headers=service_headers(priority),
+                timeout=300
+            )
+        call.status(scene_response.status_code)
+    if scene_response.status_code != 200:
+        raise RuntimeError(f"場景生成錯誤: {scene_response.text}")
+    
+    scene_video_id = scene_response.json().get("video_id")
+    with tracer.span("fetch_video"):
+        video_path = fetch_video_to_local(scene_video_id)
+    if not video_path:
+        raise RuntimeError("無法獲取段落視頻")
+    
+    return {
+        "audio_id": audio_file_id,
+        "digital_human_video_id": digital_human_video_id,
+        "scene_video_id": scene_video_id,
+        "video_file": video_path
+    }
+
+def render_paragraph(item, params, render_settings, ticket=None):
+    """按渲染計劃渲染一個段落，整個段落記錄為一個追蹤階段"""
+    with tracer.span("paragraph", index=item["index"], reuse=item["level"]):
+        return render_paragraph_video(item["text"], params, render_settings, item["level"], item["reuse"], ticket)
+
+def run_paragraph_slot(slot, future, item, params, render_settings, ticket):
+    """在取得的段落渲染位置內渲染段落，結果或異常設置到future，完成後釋放位置"""
+    try:
+        future.set_result(render_paragraph(item, params, render_settings, ticket))
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        slot.release()
+
+def dispatch_paragraphs(items, futures, params, render_settings, ticket, stop):
+    """
+    依次為任務的段落申請段落渲染位置，取得後提交到線程池；每個任務同時只有一個段落在排隊，
+    多個任務的段落按優先級和租戶權重輪流渲染，不會因為先提交的大任務而全部排在後面
+    """
+    for item, future in zip(items, futures):
+        slot = paragraph_gate.submit(ticket.tenant, ticket.priority)
+        slot.wait()
+        if stop.is_set():
+            slot.release()
+            return
+        paragraph_executor.submit(tracer.bind(run_paragraph_slot), slot, future, item, params, render_settings, ticket)
+
+def record_manifest_segment(manifest, composer, item, outputs):
+    """將段落的產物和編碼段落文件摘要記錄到渲染清單"""
+    section_file = composer.section_file(item["index"])
+    manifest.set_segment(item["index"], {
+        "text": item["text"],
+        "hashes": item["hashes"],
+        "audio_id": outputs["audio_id"],
+        "digital_human_video_id": outputs["digital_human_video_id"],
+        "scene_video_id": outputs["scene_video_id"],
+        "section_file": section_file,
+        "section_hash": file_digest(section_file)
+    })
+
+def expire_progressive_jobs():
+    """移除結束超過PROGRESSIVE_JOB_TTL秒的漸進式任務，釋放其合成器和渲染清單，清單已保存在磁盤上可供修訂"""
+    deadline = time.time() - app.config['PROGRESSIVE_JOB_TTL']
+    with progressive_jobs_lock:
+        expired = [
+            job_id for job_id, job in progressive_jobs.items()
+            if job.get("finished_at") is not None and job["finished_at"] < deadline
+        ]
+        for job_id in expired:
+            del progressive_jobs[job_id]
+    return len(expired)
+
+def run_progressive_job(job_id, plan, params, render_settings, ticket):
+    """後台執行漸進式生成任務：排隊獲得執行權後段落並行渲染，完成後按順序追加到直播播放列表，未變化的段落直接重用"""
+    job = progressive_jobs[job_id]
+    composer = job["composer"]
+    manifest = job["manifest"]
+    stop = threading.Event()
+    futures = {}
+    pending = set()
+    status = "failed"
+    
+    try:
+        with tracer.span("scheduler.queue", tenant=ticket.tenant, priority=ticket.priority):
+            ticket.wait()
+        job["status"] = "processing"
+        job["queue_time"] = time.time() - job["started_at"]
+        
+        # 需要渲染的段落逐個申請渲染位置，同時在當前線程加入可重用的段落
+        render_items = [item for item in plan if item["level"] != "section"]
+        futures = {Future(): item for item in render_items}
+        threading.Thread(
+            target=tracer.bind(dispatch_paragraphs),
+            args=(render_items, list(futures), params, render_settings, ticket, stop),
+            daemon=True
+        ).start()
+        
+        for item in plan:
+            if item["level"] == "section":
+                job["published"] = composer.add_encoded_section(item["index"], item["reuse"]["section_file"])
+                record_manifest_segment(manifest, composer, item, item["reuse"])
+                job["rendered"] += 1
+                
+                if job["published"] and not job.get("first_segment_time"):
+                    job["first_segment_time"] = time.time() - job["started_at"]
+        
+        # 段落渲染完成後提交編碼，編碼在線程池中並行執行，當前線程只匯總結果
+        encodes = {}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in futures:
+                    item = futures[future]
+                    outputs = future.result()
+                    encode = section_executor.submit(
+                        tracer.bind(composer.add_section), item["index"], outputs["video_file"]
+                    )
+                    encodes[encode] = (item, outputs)
+                    pending.add(encode)
+                    continue
+                
+                item, outputs = encodes[future]
+                future.result()
+                job["published"] = composer.published_sections
+                record_manifest_segment(manifest, composer, item, outputs)
+                job["rendered"] += 1
+                
+                # 記錄首個段落可播放的時間
+                if job["published"] and not job.get("first_segment_time"):
+                    job["first_segment_time"] = time.time() - job["started_at"]
+        
+        manifest.final_file = composer.finish(os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}.mp4"))
+        status = "completed"
+    except Exception as e:
+        print(f"漸進式生成任務失敗: {job_id}, {str(e)}")
+        composer.finish()
+        job["error"] = str(e)
+    finally:
+        # 任務失敗時不再為剩下的段落申請渲染位置，也不再編碼尚未開始的段落
+        stop.set()
+        for future in pending.difference(futures):
+            future.cancel()
+        ticket.release()
+        job["render_time"] = time.time() - job["started_at"]
+        
+        # 失敗的任務也保存已完成段落的清單，修訂時可以重用；保存後才更新狀態，客戶端看到結束即可修訂
+        try:
+            manifest.save(app.config['JOB_FOLDER'])
+        except OSError as e:
+            print(f"保存渲染清單失敗: {job_id}, {str(e)}")
+        job["status"] = status
+        job["finished_at"] = time.time()
+    
+    if status == "completed":
+        start_hls_packaging(job_id)
+
+def start_progressive_job(text, params, render_settings, previous_manifest=None, tenant=DEFAULT_TENANT,
+                          priority="interactive"):
+    """
+    創建漸進式生成任務並排隊，獲得執行權後在後台開始渲染，指定原任務的渲染清單時只渲染變化的段落，返回任務ID，
+    隊列已滿時拋出SchedulerFull
+    """
+    job_id = str(uuid.uuid4())
+    paragraphs = split_paragraphs(text)
+    
+    manifest = RenderManifest(
+        job_id, params, render_settings,
+        parent_job_id=previous_manifest.job_id if previous_manifest else None
+    )
+    if previous_manifest:
+        plan = previous_manifest.plan(paragraphs, params, render_settings)
+    else:
+        plan = manifest.plan(paragraphs, params, render_settings)
+    
+    # 任務代價為需要渲染的段落數，大任務佔用租戶更多的份額
+    ticket = scheduler.submit(tenant, priority, max(1, sum(1 for item in plan if item["level"] != "section")))
+    
+    composer = ProgressiveComposer(
+        os.path.join(app.config['LIVE_FOLDER'], job_id),
+        resolution=render_settings["resolution"],
+        fps=render_settings["fps"],
+        encoder=render_settings
+    )
+    composer.start()
+    
+    expire_progressive_jobs()
+    with progressive_jobs_lock:
+        progressive_jobs[job_id] = {
+            "status": "processing" if ticket.granted else "queued",
+            "tenant": tenant,
+            "priority": priority,
+            "total": len(paragraphs),
+            "rendered": 0,
+            "published": 0,
+            "reused": sum(1 for item in plan if item["level"] == "section"),
+            "parent_job_id": manifest.parent_job_id,
+            "trace_id": tracer.current_trace_id(),
+            "error": None,
+            "started_at": time.time(),
+            "finished_at": None,
+            "composer": composer,
+            "manifest": manifest
+        }
+    
+    threading.Thread(
+        target=tracer.bind(run_progressive_job),
+        args=(job_id, plan, params, render_settings, ticket),
+        daemon=True
+    ).start()
+    
+    return job_id
+
 # 路由
 @app.route('/')
 def index():
@@ -264,13 +682,15 @@ def upload_file():
     # 如果是文本文件，提取文本
     text = ""
     if file_ext in ['txt', 'docx', 'pdf']:
-        text = extract_text_from_file(file_path)
+        with tracer.span("extract_text", file_ext=file_ext):
+            text = extract_text_from_file(file_path)
     
     return jsonify({
         "message": "文件上傳成功",
         "file_id": file_id,
         "file_ext": file_ext,
-        "text": text
+        "text": text,
+        "trace_id": tracer.current_trace_id()
     })
 
 @app.route('/api/generate', methods=['POST'])
@@ -291,6 +711,14 @@ def generate_video():
     voice_id = data.get('voice_id', '')
     avatar_id = data.get('avatar_id', '')
     video_mode = data.get('video_mode', 'scene_switching')  # scene_switching 或 picture_in_picture
+    quality = data.get('quality', 'final')  # draft（草稿預覽）或 final（最終成片）
+    draft_id = data.get('draft_id', '')  # 最終成片可指定之前的草稿任務，重用其語音
+    progressive = bool(data.get('progressive', False))  # 邊生成邊播放
+    profile = data.get('profile')  # fast、balanced 或 archival，默認使用服務的 RENDER_PROFILE
+    scene_type = data.get('scene_type')  # video（文本生成視頻）或 still（圖片加推拉平移），默認使用服務的 SCENE_TYPE
+    
+    render_settings = get_render_settings(quality, profile)
+    started_at = time.time()
     
     # 檢查必要參數
     if not text and not (file_id and file_ext in ['mp3', 'wav']):
@@ -302,20 +730,71 @@ def generate_video():
     if not avatar_id:
         return jsonify({"error": "缺少數字人頭像選擇"}), 400
     
+    tenant, priority = request_admission(data, render_settings)
+    if priority not in PRIORITY_CLASSES:
+        return jsonify({"error": f"不支持的優先級: {priority}"}), 400
+    
+    # 漸進式模式：按段落渲染，立即返回直播播放列表
+    if progressive and text:
+        params = {
+            "voice_id": voice_id,
+            "language": language,
+            "avatar_id": avatar_id,
+            "video_mode": video_mode,
+            "scene_type": scene_type
+        }
+        try:
+            job_id = start_progressive_job(text, params, render_settings, tenant=tenant, priority=priority)
+        except SchedulerFull as e:
+            return scheduler_full_response(e)
+        
+        return jsonify({
+            "message": "已開始生成，第一個段落完成後即可播放",
+            "job_id": job_id,
+            "quality": render_settings["quality"],
+            "profile": render_settings["profile"],
+            "live_url": url_for('get_progressive_file', job_id=job_id, filename='index.m3u8'),
+            "status_url": url_for('get_progressive_status', job_id=job_id),
+            "trace_url": url_for('get_job_trace', job_id=job_id)
+        })
+    
+    # 同步模式在請求線程中排隊，排隊超時同樣返回429
+    try:
+        with tracer.span("scheduler.queue", tenant=tenant, priority=priority):
+            ticket = scheduler.acquire(tenant, priority)
+    except SchedulerFull as e:
+        return scheduler_full_response(e)
+    
     try:
         # 步驟1：生成語音
         audio_file_id = None
-        if text:
+        
+        # 草稿的文本、聲線和輸入文件都相同時直接重用其語音，
+        # 語音旁的口型時間軸和場景服務中的內容分析結果也隨之重用
+        draft_record = load_job_record(draft_id) if draft_id else None
+        if draft_record and all(
+            draft_record.get(key) == value
+            for key, value in (("text", text), ("file_id", file_id), ("voice_id", voice_id), ("language", language))
+        ):
+            audio_file_id = draft_record.get("audio_id")
+        
+        if audio_file_id:
+            print(f"重用草稿任務的語音: {draft_id}")
+        elif text:
             # 如果有文本，使用TTS服務生成語音
-            tts_response = requests.post(
-                f"{TTS_SERVICE_URL}/synthesize",
-                json={
-                    "text": text,
-                    "voice_id": voice_id,
-                    "language": language
-                },
-                timeout=30
-            )
+            with scheduler.stage("tts", tenant, priority), tracer.span("tts.synthesize"), \
+                    provider_call("tts") as call:
+                tts_response = requests.post(
+                    f"{TTS_SERVICE_URL}/synthesize",
+                    json={
+                        "text": text,
+                        "voice_id": voice_id,
+                        "language": language
+                    },
+                    headers=service_headers(priority),
+                    timeout=30
+                )
+                call.status(tts_response.status_code)
             
             if tts_response.status_code != 200:
                 return jsonify({"error": f"TTS服務錯誤: {tts_response.text}"}), 500
@@ -326,13 +805,15 @@ def generate_video():
             audio_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.{file_ext}")
             
             # 上傳音頻文件到TTS服務
-            with open(audio_file_path, 'rb') as f:
+            with tracer.span("tts.upload_audio"), provider_call("tts") as call, open(audio_file_path, 'rb') as f:
                 files = {'file': f}
                 tts_response = requests.post(
                     f"{TTS_SERVICE_URL}/upload_audio",
                     files=files,
+                    headers=service_headers(priority),
                     timeout=30
                 )
+                call.status(tts_response.status_code)
             
             if tts_response.status_code != 200:
                 return jsonify({"error": f"音頻上傳錯誤: {tts_response.text}"}), 500
@@ -340,16 +821,23 @@ def generate_video():
             audio_file_id = tts_response.json().get("audio_id")
         
         # 步驟2：生成數字人視頻
-        dh_response = requests.post(
-            f"{DIGITAL_HUMAN_SERVICE_URL}/generate",
-            json={
-                "avatar_id": avatar_id,
-                "audio_file_id": audio_file_id,
-                "background_color": "#00FF00",  # 綠幕背景
-                "resolution": "1080p"
-            },
-            timeout=120
-        )
+        with scheduler.stage("avatar", tenant, priority), tracer.span("avatar.generate"), \
+                provider_call("digital_human") as call:
+            dh_response = requests.post(
+                f"{DIGITAL_HUMAN_SERVICE_URL}/generate",
+                json={
+                    "avatar_id": avatar_id,
+                    "audio_file_id": audio_file_id,
+                    "background_color": "#00FF00",  # 綠幕背景
+                    "resolution": render_settings["resolution"],
+                    "quality": render_settings["quality"],
+                    "profile": render_settings["profile"],
+                    "fps": render_settings["fps"]
+                },
+                headers=service_headers(priority),
+                timeout=120
+            )
+            call.status(dh_response.status_code)
         
         if dh_response.status_code != 200:
             return jsonify({"error": f"數字人生成錯誤: {dh_response.text}"}), 500
@@ -359,90 +847,252 @@ def generate_video():
         # 步驟3：生成場景並合成最終視頻
         final_video_id = None
         
-        if video_mode == "scene_switching":
-            # 場景切換模式
-            scene_response = requests.post(
-                f"{SCENE_SERVICE_URL}/process",
-                json={
-                    "text": text,
-                    "digital_human_video_id": digital_human_video_id,
-                    "audio_file_id": audio_file_id,
-                    "style": "realistic",
-                    "scene_duration": 5,
-                    "resolution": "1080p"
-                },
-                timeout=300
-            )
-        else:
-            # 畫中畫模式
-            scene_response = requests.post(
-                f"{SCENE_SERVICE_URL}/picture-in-picture",
-                json={
-                    "text": text,
-                    "digital_human_video_id": digital_human_video_id,
-                    "audio_file_id": audio_file_id,
-                    "style": "realistic",
-                    "scene_duration": 5,
-                    "resolution": "1080p",
-                    "pip_position": "bottom-right",
-                    "pip_size_ratio": 0.3
-                },
-                timeout=300
-            )
+        with scheduler.stage("scene", tenant, priority), tracer.span("scene.compose", video_mode=video_mode), \
+                provider_call("scene") as call:
+            if video_mode == "scene_switching":
+                # 場景切換模式
+                scene_response = requests.post(
+                    f"{SCENE_SERVICE_URL}/process",
+                    json={
+                        "text": text,
+                        "digital_human_video_id": digital_human_video_id,
+                        "audio_file_id": audio_file_id,
+                        "style": "realistic",
+                        "scene_duration": 5,
+                        "resolution": render_settings["resolution"],
+                        "quality": render_settings["quality"],
+                        "profile": render_settings["profile"],
+                        "fps": render_settings["fps"],
+                        "preset": render_settings["preset"],
+                        "scene_type": scene_type
+                    },
+                    headers=service_headers(priority),
+                    timeout=300
+                )
+            else:
+                # 畫中畫模式
+                scene_response = requests.post(
+                    f"{SCENE_SERVICE_URL}/picture-in-picture",
+                    json={
+                        "text": text,
+                        "digital_human_video_id": digital_human_video_id,
+                        "audio_file_id": audio_file_id,
+                        "style": "realistic",
+                        "scene_duration": 5,
+                        "resolution": render_settings["resolution"],
+                        "quality": render_settings["quality"],
+                        "profile": render_settings["profile"],
+                        "fps": render_settings["fps"],
+                        "preset": render_settings["preset"],
+                        "scene_type": scene_type,
+                        "pip_position": "bottom-right",
+                        "pip_size_ratio": 0.3
+                    },
+                    headers=service_headers(priority),
+                    timeout=300
+                )
+            call.status(scene_response.status_code)
         
         if scene_response.status_code != 200:
             return jsonify({"error": f"場景生成錯誤: {scene_response.text}"}), 500
         
         final_video_id = scene_response.json().get("video_id")
         
+        # 記錄任務，供之後的最終成片重用草稿產物
+        job_id = str(uuid.uuid4())
+        render_time = time.time() - started_at
+        save_job_record(job_id, {
+            "job_id": job_id,
+            "quality": render_settings["quality"],
+            "profile": render_settings["profile"],
+            "text": text,
+            "file_id": file_id,
+            "voice_id": voice_id,
+            "language": language,
+            "avatar_id": avatar_id,
+            "video_mode": video_mode,
+            "scene_type": scene_type,
+            "trace_id": tracer.current_trace_id(),
+            "audio_id": audio_file_id,
+            "digital_human_video_id": digital_human_video_id,
+            "final_video_id": final_video_id,
+            "draft_id": draft_id if draft_record else "",
+            "render_time": render_time,
+            "created_at": time.time()
+        })
+        
+        # 成片完成後即開始打包HLS，打包完成前播放器使用MP4
+        start_hls_packaging(final_video_id)
+        
         # 返回結果
         return jsonify({
             "message": "視頻生成成功",
+            "job_id": job_id,
+            "quality": render_settings["quality"],
+            "profile": render_settings["profile"],
+            "render_time": render_time,
             "audio_id": audio_file_id,
             "digital_human_video_id": digital_human_video_id,
             "final_video_id": final_video_id,
+            "trace_url": url_for('get_job_trace', job_id=job_id),
             "preview_url": url_for('get_video', video_id=final_video_id),
+            "hls_url": url_for('get_hls_master', video_id=final_video_id),
             "download_url": url_for('download_video', video_id=final_video_id)
         })
     
     except Exception as e:
         return jsonify({"error": f"處理請求時發生錯誤: {str(e)}"}), 500
+    finally:
+        ticket.release()
 
 @app.route('/api/video/<video_id>', methods=['GET'])
 def get_video(video_id):
     """獲取視頻"""
-    # 首先檢查本地是否有視頻
-    local_video_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{video_id}.mp4")
+    # 首先檢查本地是否有視頻，沒有時從場景服務或數字人服務獲取
+    try:
+        local_video_path = fetch_video_to_local(video_id)
+    except:
+        return jsonify({"error": "獲取視頻時發生錯誤"}), 500
     
-    if os.path.exists(local_video_path):
+    if local_video_path:
         return send_file(local_video_path, mimetype='video/mp4')
+    else:
+        return jsonify({"error": "視頻不存在"}), 404
+
+@app.route('/api/hls/<video_id>/master.m3u8', methods=['GET'])
+def get_hls_master(video_id):
+    """獲取視頻的HLS主播放列表，打包在後台進行，完成前返回202"""
+    video_id = secure_filename(video_id)
+    hls_dir = os.path.join(app.config['HLS_FOLDER'], video_id)
+    
+    # 任務完成時已開始打包；服務重啟前的視頻在首次請求時開始打包
+    state = video_packager.packaging_state(hls_dir)
+    if state["status"] == "none":
+        start_hls_packaging(video_id)
+        state = video_packager.packaging_state(hls_dir)
+    
+    if state["status"] == "packaged":
+        return send_from_directory(hls_dir, "master.m3u8", mimetype=HLS_MIMETYPES['.m3u8'])
+    if state["status"] == "missing":
+        return jsonify({"error": "視頻不存在"}), 404
+    if state["status"] == "failed":
+        return jsonify({"error": f"打包視頻時發生錯誤: {state['error']}"}), 500
+    
+    response = jsonify({"status": "packaging", "message": "正在打包HLS，請先播放MP4"})
+    response.status_code = 202
+    response.headers['Retry-After'] = '3'
+    return response
+
+@app.route('/api/hls/<video_id>/<path:filename>', methods=['GET'])
+def get_hls_file(video_id, filename):
+    """獲取HLS媒體播放列表、初始化分片和媒體分片"""
+    hls_dir = os.path.join(app.config['HLS_FOLDER'], secure_filename(video_id))
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+    
+    # 打包完成後文件不再變化，允許瀏覽器和CDN緩存
+    return send_from_directory(hls_dir, filename, mimetype=mimetype, max_age=86400)
+
+@app.route('/api/progressive/<job_id>/status', methods=['GET'])
+def get_progressive_status(job_id):
+    """獲取漸進式生成任務的進度"""
+    job = progressive_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "任務不存在或已過期"}), 404
+    
+    result = {
+        "job_id": job_id,
+        "status": job["status"],
+        "total": job["total"],
+        "rendered": job["rendered"],
+        "published": job["published"],
+        "reused": job["reused"],
+        "parent_job_id": job["parent_job_id"],
+        "queue_time": job.get("queue_time"),
+        "first_segment_time": job.get("first_segment_time"),
+        "render_time": job.get("render_time"),
+        "error": job["error"]
+    }
+    
+    if job["status"] == "completed":
+        result.update({
+            "final_video_id": job_id,
+            "preview_url": url_for('get_video', video_id=job_id),
+            "hls_url": url_for('get_hls_master', video_id=job_id),
+            "download_url": url_for('download_video', video_id=job_id)
+        })
+    
+    return jsonify(result)
+
+@app.route('/api/revise/<job_id>', methods=['POST'])
+def revise_video(job_id):
+    """修改演講稿後重新生成視頻，只渲染有變化的段落"""
+    data = request.json
+    if not data or not data.get('text'):
+        return jsonify({"error": "缺少修訂後的文本"}), 400
+    
+    manifest = RenderManifest.load(app.config['JOB_FOLDER'], secure_filename(job_id))
+    if not manifest:
+        # 同步任務整段渲染，沒有逐段落的產物可以重用，修訂只會全部重新渲染，應直接重新生成
+        if load_job_record(job_id):
+            return jsonify({
+                "error": "該任務不是漸進式生成，沒有渲染清單，無法只重新渲染變化的段落，請以progressive模式重新生成"
+            }), 409
+        return jsonify({"error": "任務不存在"}), 404
+    
+    params = manifest.params
+    render_settings = manifest.render_settings
+    
+    tenant, priority = request_admission(data, render_settings)
+    if priority not in PRIORITY_CLASSES:
+        return jsonify({"error": f"不支持的優先級: {priority}"}), 400
     
-    # 如果本地沒有，嘗試從場景服務獲取
     try:
-        response = requests.get(f"{SCENE_SERVICE_URL}/video/{video_id}", stream=True)
-        
-        if response.status_code == 200:
-            # 保存到本地
-            with open(local_video_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            return send_file(local_video_path, mimetype='video/mp4')
-        else:
-            # 如果場景服務沒有，嘗試從數字人服務獲取
-            response = requests.get(f"{DIGITAL_HUMAN_SERVICE_URL}/video/{video_id}", stream=True)
-            
-            if response.status_code == 200:
-                # 保存到本地
-                with open(local_video_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                return send_file(local_video_path, mimetype='video/mp4')
-            else:
-                return jsonify({"error": "視頻不存在"}), 404
-    except:
-        return jsonify({"error": "獲取視頻時發生錯誤"}), 500
+        new_job_id = start_progressive_job(data['text'], params, render_settings, manifest, tenant, priority)
+    except SchedulerFull as e:
+        return scheduler_full_response(e)
+    job = progressive_jobs[new_job_id]
+    
+    return jsonify({
+        "message": f"已開始重新生成，{job['total']}個段落中重用{job['reused']}個",
+        "job_id": new_job_id,
+        "parent_job_id": job_id,
+        "total": job["total"],
+        "reused": job["reused"],
+        "quality": render_settings["quality"],
+        "profile": render_settings["profile"],
+        "live_url": url_for('get_progressive_file', job_id=new_job_id, filename='index.m3u8'),
+        "status_url": url_for('get_progressive_status', job_id=new_job_id),
+        "trace_url": url_for('get_job_trace', job_id=new_job_id)
+    })
+
+@app.route('/api/scheduler', methods=['GET'])
+def get_scheduler_status():
+    """獲取生成任務隊列和各階段的並發狀態"""
+    return jsonify(scheduler.snapshot())
+
+@app.route('/api/trace/<job_id>', methods=['GET'])
+def get_job_trace(job_id):
+    """下載任務的Chrome trace時間線，合併網關和各服務記錄的階段"""
+    job = progressive_jobs.get(job_id) or load_job_record(job_id)
+    if not job:
+        return jsonify({"error": "任務不存在"}), 404
+    if not job.get("trace_id"):
+        return jsonify({"error": "任務沒有追蹤記錄，可能未啟用TRACING_ENABLED"}), 404
+    
+    trace = tracer.collect(job["trace_id"], (TTS_SERVICE_URL, DIGITAL_HUMAN_SERVICE_URL, SCENE_SERVICE_URL))
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(job_id)}.trace.json"'
+    return response
+
+@app.route('/api/progressive/<job_id>/<path:filename>', methods=['GET'])
+def get_progressive_file(job_id, filename):
+    """獲取漸進式生成任務的直播播放列表和分片"""
+    live_dir = os.path.join(app.config['LIVE_FOLDER'], secure_filename(job_id))
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+    
+    # 播放列表在生成過程中不斷更新，不能緩存；分片寫入後不再變化
+    max_age = 0 if filename.endswith('.m3u8') else 86400
+    return send_from_directory(live_dir, filename, mimetype=mimetype, max_age=max_age)
 
 @app.route('/api/download/<video_id>', methods=['GET'])
 def download_video(video_id):
@@ -458,6 +1108,21 @@ def download_video(video_id):
             download_name=f"digital_human_video_{video_id}.mp4"
         )
     
-    # 如果本地沒有，嘗試從場景服務獲取
+    # 如果本地沒有，從場景服務或數字人服務獲取
     try:
-        response = requests.get(f"{SCENE_SERVICE_URL}/video/{vi<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>
\ No newline at end of file
+        local_video_path = fetch_video_to_local(video_id)
+    except requests.RequestException:
+        return jsonify({"error": "獲取視頻時發生錯誤"}), 500
+    
+    if not local_video_path:
+        return jsonify({"error": "視頻不存在"}), 404
+    
+    return send_file(
+        local_video_path,
+        mimetype='video/mp4',
+        as_attachment=True,
+        download_name=f"digital_human_video_{video_id}.mp4"
+    )
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=8080, debug=True)
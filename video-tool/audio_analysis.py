@@ -0,0 +1,520 @@
+"""
+音頻分析模塊 - 提供向量化的語音音頻分析功能
+
+此模塊提供以下功能：
+1. 使用FFmpeg將任意格式的音頻解碼為單聲道PCM數組
+2. 使用NumPy向量化計算逐幀RMS能量包絡
+3. 檢測靜音區間，並在停頓處將長音頻切分為時長受限的片段
+4. 片段邊界對齊到視頻幀，便於分段渲染後精確拼接
+5. 計算口型（視位）和能量時間軸，保存在音頻旁邊並按音頻摘要緩存，供各渲染器共用
+"""
+
+import os
+import uuid
+import wave
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from video_concat import FFMPEG_BINARY
+from render_cache import file_digest
+
+# 視位（口型）類別，順序即保存在時間軸文件中的編號
+VISEMES = ["rest", "closed", "open", "round", "wide", "teeth"]
+
+# 時間軸文件格式版本，分析算法變化時遞增以使舊文件失效
+TIMELINE_VERSION = 1
+
+# 頻帶劃分（Hz）：低頻對應圓唇元音，中頻對應開口元音，高頻對應齒音和擦音
+VISEME_BANDS = [(80, 500), (500, 2000), (2000, 7000)]
+
+class AudioAnalyzer:
+    """音頻分析類，基於解碼後的PCM數據進行向量化分析"""
+    
+    def __init__(self, sample_rate: int = 16000, frame_ms: float = 20.0):
+        """
+        初始化音頻分析類
+        
+        Args:
+            sample_rate: 解碼採樣率
+            frame_ms: 分析幀長度（毫秒）
+        """
+        self.sample_rate = sample_rate
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+    
+    def load_pcm(self, audio_file: str) -> np.ndarray:
+        """
+        將音頻文件解碼為單聲道float32 PCM數組
+        
+        Args:
+            audio_file: 音頻文件路徑
+            
+        Returns:
+            取值範圍為[-1, 1]的採樣數組
+        """
+        command = [
+            FFMPEG_BINARY, "-v", "error",
+            "-i", audio_file,
+            "-f", "s16le", "-acodec", "pcm_s16le",
+            "-ac", "1", "-ar", str(self.sample_rate),
+            "-"
+        ]
+        result = subprocess.run(command, capture_output=True, check=True)
+        return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+    
+    def frame_rms(self, samples: np.ndarray) -> np.ndarray:
+        """
+        計算逐幀RMS能量（不足一幀的尾部補零）
+        
+        Args:
+            samples: PCM採樣數組
+            
+        Returns:
+            每幀的RMS能量數組
+        """
+        n_frames = int(np.ceil(len(samples) / self.frame_length)) if len(samples) else 0
+        padded = np.zeros(n_frames * self.frame_length, dtype=np.float32)
+        padded[:len(samples)] = samples
+        frames = padded.reshape(n_frames, self.frame_length)
+        return np.sqrt(np.mean(frames * frames, axis=1))
+    
+    def detect_silences(
+        self,
+        samples: np.ndarray,
+        threshold_db: float = -35.0,
+        min_silence: float = 0.3
+    ) -> List[Tuple[float, float]]:
+        """
+        檢測靜音區間
+        
+        Args:
+            samples: PCM採樣數組
+            threshold_db: 相對於最大幀能量的靜音閾值（dB）
+            min_silence: 最短靜音時長（秒）
+            
+        Returns:
+            靜音區間列表，格式為 [(開始時間, 結束時間)]
+        """
+        rms = self.frame_rms(samples)
+        if len(rms) == 0:
+            return []
+        
+        level_db = 20 * np.log10(np.maximum(rms, 1e-10) / max(float(rms.max()), 1e-10))
+        silent = (level_db < threshold_db).astype(np.int8)
+        
+        # 用差分找到連續靜音幀的起止位置
+        edges = np.diff(np.concatenate(([0], silent, [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        
+        frame_seconds = self.frame_length / self.sample_rate
+        min_frames = int(np.ceil(min_silence / frame_seconds))
+        keep = (ends - starts) >= min_frames
+        
+        return [(float(s * frame_seconds), float(e * frame_seconds)) for s, e in zip(starts[keep], ends[keep])]
+    
+    def plan_segments(
+        self,
+        samples: np.ndarray,
+        max_segment: float = 30.0,
+        min_segment: float = 5.0,
+        fps: int = 25,
+        threshold_db: float = -35.0,
+        min_silence: float = 0.3
+    ) -> List[Tuple[int, int]]:
+        """
+        在停頓處規劃切分點，每個片段不超過max_segment秒
+        
+        切分點取靜音區間的中點，並對齊到視頻幀邊界，
+        使每個片段的時長都是整數幀，分段渲染後可以精確拼接。
+        
+        Args:
+            samples: PCM採樣數組
+            max_segment: 片段最長時長（秒）
+            min_segment: 片段最短時長（秒）
+            fps: 渲染視頻的幀率
+            threshold_db: 靜音閾值（dB）
+            min_silence: 最短靜音時長（秒）
+            
+        Returns:
+            片段採樣區間列表，格式為 [(開始採樣, 結束採樣)]
+        """
+        total = len(samples)
+        samples_per_frame = self.sample_rate / fps
+        
+        def align(sample_index: float) -> int:
+            return int(round(round(sample_index / samples_per_frame) * samples_per_frame))
+        
+        silences = self.detect_silences(samples, threshold_db, min_silence)
+        candidates = np.array([align((s + e) / 2 * self.sample_rate) for s, e in silences], dtype=np.int64)
+        
+        max_samples = int(max_segment * self.sample_rate)
+        min_samples = int(min_segment * self.sample_rate)
+        rms = self.frame_rms(samples)
+        
+        segments = []
+        start = 0
+        while total - start > max_samples:
+            window = candidates[(candidates >= start + min_samples) & (candidates <= start + max_samples)]
+            if len(window):
+                cut = int(window[-1])
+            else:
+                # 窗口內沒有停頓時，在後半段能量最低的幀處切分
+                lo = (start + min_samples) // self.frame_length
+                hi = (start + max_samples) // self.frame_length
+                quietest = lo + int(np.argmin(rms[lo:hi])) if hi > lo else hi
+                cut = align(quietest * self.frame_length)
+            if cut <= start:
+                cut = align(start + max_samples)
+            segments.append((start, cut))
+            start = cut
+        
+        if start < total:
+            segments.append((start, total))
+        
+        return segments
+    
+    def write_wav(self, samples: np.ndarray, output_file: str) -> str:
+        """
+        將PCM採樣寫入16位單聲道WAV文件
+        
+        Args:
+            samples: PCM採樣數組
+            output_file: 輸出文件路徑
+            
+        Returns:
+            輸出文件路徑
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        with wave.open(output_file, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes(pcm.tobytes())
+        return output_file
+    
+    def split_audio(
+        self,
+        audio_file: str,
+        output_dir: str,
+        max_segment: float = 30.0,
+        min_segment: float = 5.0,
+        fps: int = 25
+    ) -> List[Dict[str, Any]]:
+        """
+        在停頓處將音頻切分為多個WAV片段
+        
+        Args:
+            audio_file: 音頻文件路徑
+            output_dir: 片段輸出目錄
+            max_segment: 片段最長時長（秒）
+            min_segment: 片段最短時長（秒）
+            fps: 渲染視頻的幀率
+            
+        Returns:
+            片段列表，每個元素包含file、start和end（秒）
+        """
+        samples = self.load_pcm(audio_file)
+        segments = []
+        
+        for i, (start, end) in enumerate(self.plan_segments(samples, max_segment, min_segment, fps)):
+            segment_file = os.path.join(output_dir, f"segment_{i:04d}.wav")
+            self.write_wav(samples[start:end], segment_file)
+            segments.append({
+                "file": segment_file,
+                "start": start / self.sample_rate,
+                "end": end / self.sample_rate
+            })
+        
+        return segments
+
+class VisemeTimeline:
+    """口型和能量時間軸，以固定步長保存每個分析幀的能量、頻帶能量和視位"""
+    
+    def __init__(
+        self,
+        energy: np.ndarray,
+        bands: np.ndarray,
+        visemes: np.ndarray,
+        hop: float,
+        duration: float,
+        digest: str = ""
+    ):
+        """
+        初始化口型和能量時間軸
+        
+        Args:
+            energy: 每幀的歸一化能量，取值範圍為[0, 1]
+            bands: 每幀低、中、高頻帶的能量佔比，形狀為(幀數, 3)
+            visemes: 每幀的視位編號，對應VISEMES
+            hop: 分析幀步長（秒）
+            duration: 音頻時長（秒）
+            digest: 音頻內容摘要
+        """
+        self.energy = energy
+        self.bands = bands
+        self.visemes = visemes
+        self.hop = hop
+        self.duration = duration
+        self.digest = digest
+    
+    def sample(self, fps: float) -> Dict[str, np.ndarray]:
+        """
+        按視頻幀率重新採樣時間軸
+        
+        Args:
+            fps: 視頻幀率
+            
+        Returns:
+            包含energy和visemes數組的字典，長度等於視頻幀數
+        """
+        n_frames = int(np.ceil(self.duration * fps))
+        if len(self.energy) == 0:
+            return {"energy": np.zeros(n_frames, dtype=np.float32), "visemes": np.zeros(n_frames, dtype=np.intp)}
+        
+        index = np.minimum(np.round(np.arange(n_frames) / fps / self.hop).astype(np.intp), len(self.energy) - 1)
+        return {
+            "energy": self.energy[index].astype(np.float32),
+            "visemes": self.visemes[index].astype(np.intp)
+        }
+    
+    def to_expressions(self, min_duration: float = 0.06) -> List[Dict[str, Any]]:
+        """
+        轉換為口型變化列表（與generate_video的expressions格式相同），只保留口型變化的時間點，
+        作為服務提供商請求中的口型提示
+        
+        Args:
+            min_duration: 最短口型持續時間（秒），更短的口型併入前一個口型
+            
+        Returns:
+            表情列表，格式為 [{"timestamp": 1.5, "expression": "open", "energy": 0.8}]
+        """
+        if len(self.visemes) == 0:
+            return []
+        
+        changes = np.flatnonzero(np.diff(self.visemes)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.append(starts[1:], len(self.visemes))
+        
+        expressions = []
+        for start, end in zip(starts, ends):
+            viseme = VISEMES[int(self.visemes[start])]
+            if expressions and ((end - start) * self.hop < min_duration or expressions[-1]["expression"] == viseme):
+                continue
+            expressions.append({
+                "timestamp": round(float(start * self.hop), 3),
+                "expression": viseme,
+                "energy": round(float(self.energy[start:end].mean()), 3)
+            })
+        
+        return expressions
+    
+    def save(self, file_path: str) -> str:
+        """
+        保存為壓縮的NumPy數組文件（原子替換）
+        
+        Args:
+            file_path: 文件路徑，應以.npz結尾
+            
+        Returns:
+            文件路徑
+        """
+        temp_file = f"{file_path}.{uuid.uuid4().hex}.tmp.npz"
+        np.savez_compressed(
+            temp_file,
+            version=np.array(TIMELINE_VERSION),
+            energy=self.energy.astype(np.float16),
+            bands=self.bands.astype(np.float16),
+            visemes=self.visemes.astype(np.uint8),
+            hop=np.array(self.hop),
+            duration=np.array(self.duration),
+            digest=np.array(self.digest)
+        )
+        os.replace(temp_file, file_path)
+        return file_path
+    
+    @classmethod
+    def load(cls, file_path: str) -> Optional["VisemeTimeline"]:
+        """
+        從文件加載時間軸
+        
+        Args:
+            file_path: 文件路徑
+            
+        Returns:
+            時間軸，文件不存在或版本不一致時返回None
+        """
+        if not os.path.exists(file_path):
+            return None
+        
+        with np.load(file_path) as data:
+            if int(data["version"]) != TIMELINE_VERSION:
+                return None
+            return cls(
+                energy=data["energy"],
+                bands=data["bands"],
+                visemes=data["visemes"],
+                hop=float(data["hop"]),
+                duration=float(data["duration"]),
+                digest=str(data["digest"])
+            )
+
+class VisemeAnalyzer:
+    """視位分析類，對每個音頻只分析一次並按音頻摘要緩存結果"""
+    
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: float = 25.0,
+        hop_ms: float = 10.0,
+        memory_entries: int = 64
+    ):
+        """
+        初始化視位分析類
+        
+        Args:
+            sample_rate: 解碼採樣率
+            frame_ms: FFT分析窗口長度（毫秒）
+            hop_ms: 分析幀步長（毫秒）
+            memory_entries: 內存中保留的時間軸數量
+        """
+        self.analyzer = AudioAnalyzer(sample_rate=sample_rate)
+        self.sample_rate = sample_rate
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self.hop_length = int(sample_rate * hop_ms / 1000)
+        self.n_fft = 1 << (self.frame_length - 1).bit_length()
+        self.memory_entries = memory_entries
+        
+        self._memory: "OrderedDict[str, VisemeTimeline]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # 頻帶矩陣：功率譜乘以該矩陣即得到各頻帶能量
+        freqs = np.fft.rfftfreq(self.n_fft, 1.0 / sample_rate)
+        self._band_matrix = np.stack([(freqs >= lo) & (freqs < hi) for lo, hi in VISEME_BANDS], axis=1).astype(np.float32)
+        self._window = np.hanning(self.frame_length).astype(np.float32)
+    
+    @staticmethod
+    def timeline_path(audio_file: str) -> str:
+        """
+        獲取音頻對應的時間軸文件路徑（與音頻放在同一目錄）
+        
+        Args:
+            audio_file: 音頻文件路徑
+            
+        Returns:
+            時間軸文件路徑
+        """
+        return f"{os.path.splitext(audio_file)[0]}.visemes.npz"
+    
+    def get_timeline(self, audio_file: str) -> VisemeTimeline:
+        """
+        獲取音頻的口型和能量時間軸，依次查找內存、音頻旁的時間軸文件，都未命中時才分析音頻
+        
+        Args:
+            audio_file: 音頻文件路徑
+            
+        Returns:
+            口型和能量時間軸
+        """
+        digest = file_digest(audio_file)
+        
+        with self._lock:
+            timeline = self._memory.get(digest)
+            if timeline is not None:
+                self._memory.move_to_end(digest)
+                return timeline
+        
+        timeline_file = self.timeline_path(audio_file)
+        try:
+            timeline = VisemeTimeline.load(timeline_file)
+        except Exception as e:
+            print(f"讀取口型時間軸失敗: {timeline_file}, {str(e)}")
+            timeline = None
+        
+        # 音頻內容變化後舊的時間軸文件作廢
+        if timeline is None or timeline.digest != digest:
+            timeline = self.analyze(audio_file)
+            timeline.digest = digest
+            try:
+                timeline.save(timeline_file)
+            except OSError as e:
+                print(f"保存口型時間軸失敗: {timeline_file}, {str(e)}")
+        
+        with self._lock:
+            self._memory[digest] = timeline
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        
+        return timeline
+    
+    def analyze(self, audio_file: str) -> VisemeTimeline:
+        """
+        分析音頻，計算每個分析幀的能量、頻帶分佈和視位
+        
+        Args:
+            audio_file: 音頻文件路徑
+            
+        Returns:
+            口型和能量時間軸
+        """
+        samples = self.analyzer.load_pcm(audio_file)
+        duration = len(samples) / self.sample_rate
+        hop = self.hop_length / self.sample_rate
+        
+        if len(samples) == 0:
+            empty = np.zeros(0, dtype=np.float32)
+            return VisemeTimeline(empty, np.zeros((0, len(VISEME_BANDS)), dtype=np.float32), empty.astype(np.uint8), hop, duration)
+        
+        # 補齊尾部使最後一幀覆蓋音頻結尾，再以步幅視圖分幀（不複製數據）
+        n_frames = int(np.ceil(len(samples) / self.hop_length))
+        padded = np.zeros((n_frames - 1) * self.hop_length + self.frame_length, dtype=np.float32)
+        padded[:len(samples)] = samples
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.frame_length)[::self.hop_length]
+        
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        spectrum = np.fft.rfft(frames * self._window, n=self.n_fft, axis=1)
+        band_energy = (np.abs(spectrum) ** 2).astype(np.float32) @ self._band_matrix
+        bands = band_energy / np.maximum(band_energy.sum(axis=1, keepdims=True), 1e-10)
+        
+        level_db = 20 * np.log10(np.maximum(rms, 1e-10) / max(float(rms.max()), 1e-10))
+        voiced = rms[level_db >= -35.0]
+        reference = float(np.percentile(voiced, 90)) if len(voiced) else 1.0
+        energy = np.clip(rms / max(reference, 1e-10), 0.0, 1.0)
+        
+        low, high = bands[:, 0], bands[:, 2]
+        visemes = np.select(
+            [level_db < -35.0, energy < 0.15, high > 0.5, low > 0.7, high > 0.25],
+            [VISEMES.index("rest"), VISEMES.index("closed"), VISEMES.index("teeth"),
+             VISEMES.index("round"), VISEMES.index("wide")],
+            default=VISEMES.index("open")
+        ).astype(np.uint8)
+        
+        # 去除只持續一幀的口型，避免嘴型閃爍
+        if len(visemes) > 2:
+            flicker = (visemes[:-2] == visemes[2:]) & (visemes[1:-1] != visemes[:-2])
+            visemes[1:-1][flicker] = visemes[:-2][flicker]
+        
+        return VisemeTimeline(energy.astype(np.float32), bands, visemes, hop, duration)
+
+_shared_viseme_analyzer = None
+_shared_viseme_analyzer_lock = threading.Lock()
+
+def get_viseme_timeline(audio_file: str) -> VisemeTimeline:
+    """
+    使用進程內共享的分析器獲取音頻的口型和能量時間軸
+    
+    Args:
+        audio_file: 音頻文件路徑
+        
+    Returns:
+        口型和能量時間軸
+    """
+    global _shared_viseme_analyzer
+    with _shared_viseme_analyzer_lock:
+        if _shared_viseme_analyzer is None:
+            _shared_viseme_analyzer = VisemeAnalyzer()
+    return _shared_viseme_analyzer.get_timeline(audio_file)
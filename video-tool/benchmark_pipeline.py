@@ -0,0 +1,587 @@
+"""
+端到端流水線基準測試 - 在模擬服務提供商上離線運行完整流水線並記錄各階段性能
+
+此腳本提供以下功能：
+1. 按文本長度、並發數和分辨率組合出測試場景，每個場景運行多個視頻任務
+2. 每個任務按段落依次執行語音合成、數字人、場景和合成四個階段，最後拼接成片
+3. 服務提供商的響應時間由可配置、帶種子的延遲模型模擬，結果可重現
+4. 記錄每個場景的吞吐量、任務延遲和各階段的p50/p95延遲及峰值內存（RSS）
+5. 將結果保存為JSON，並可與保存的基線比較，標記超出容差的性能回退
+
+使用方法：
+    python benchmark_pipeline.py --output baseline.json
+    python benchmark_pipeline.py --text-lengths 200 800 --concurrency 1 4 --resolutions 360p 720p --output result.json
+    python benchmark_pipeline.py --compare baseline.json --output result.json
+    python benchmark_pipeline.py --input result.json --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+
+import cv2
+import numpy as np
+
+from latency_model import LatencyModel
+from tts_module_mock import TextToSpeech, Language, Gender
+from digital_human_module import DigitalHumanGenerator, DigitalHumanProvider
+from ken_burns import KenBurnsAnimator
+from progressive_output import split_paragraphs
+from render_settings import get_encoder_settings, get_frame_size, video_encoder_args
+from video_concat import FFMPEG_BINARY, VideoConcatenator
+
+# 結果文件格式版本，格式不兼容時遞增
+RESULT_VERSION = 1
+
+# 各階段名稱，按流水線順序排列
+STAGES = ("tts", "avatar", "scene", "compose", "concat")
+
+# 模擬服務提供商的默認延遲模型，工作量分別為字符數、音頻秒數和場景秒數
+DEFAULT_TTS_LATENCY = "base=0.3,per_unit=0.002,jitter=0.2,distribution=lognormal,seed=1"
+DEFAULT_AVATAR_LATENCY = "base=0.5,per_unit=0.05,jitter=0.2,distribution=lognormal,seed=2"
+DEFAULT_SCENE_LATENCY = "base=0.5,per_unit=0.05,jitter=0.2,distribution=lognormal,seed=3"
+
+# 生成測試文本使用的句子，循環拼接到指定長度
+CORPUS = [
+    "人工智能正在改變我們製作視頻的方式。",
+    "數字人可以根據文本自動生成自然的口型和表情。",
+    "場景畫面會根據每個段落的內容自動匹配。",
+    "香港的夜景吸引了來自世界各地的遊客。",
+    "今天我們介紹這個系統的主要功能和使用方法。",
+    "整個流程只需要上傳一份演講稿即可完成。",
+    "每個段落的語音、數字人和場景可以並行渲染。",
+    "最後所有段落會按順序拼接成完整的視頻。"
+]
+
+# 比較時各指標的最小絕對變化，低於此值的變化視為噪聲
+MIN_DELTA = {
+    "seconds": 0.05,
+    "peak_rss_mb": 5.0,
+    "throughput_jobs_per_min": 0.1
+}
+
+def build_text(length: int) -> str:
+    """
+    生成指定長度的測試文本，相同長度每次生成相同的文本
+    
+    Args:
+        length: 字符數
+        
+    Returns:
+        測試文本
+    """
+    text = ""
+    index = 0
+    while len(text) < length:
+        text += CORPUS[index % len(CORPUS)]
+        index += 1
+    return text[:length]
+
+def write_scene_image(output_file: str, seed: int, size: Tuple[int, int] = (1920, 1080)) -> str:
+    """
+    寫入帶漸變和紋理的合成場景圖片，相同種子生成相同的圖片
+    
+    Args:
+        output_file: 輸出文件路徑
+        seed: 隨機數種子
+        size: 圖片尺寸（寬度, 高度）
+        
+    Returns:
+        輸出文件路徑
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    colors = rng.integers(40, 220, size=(2, 3)).astype(np.float32)
+    image = colors[0] * (1 - gradient) + colors[1] * gradient
+    image = np.repeat(image, height, axis=0)
+    image += rng.normal(0, 12, size=(height, width, 1)).astype(np.float32)
+    cv2.imwrite(output_file, np.clip(image, 0, 255).astype(np.uint8))
+    return output_file
+
+def read_rss_kb(pid: int) -> int:
+    """讀取進程的常駐內存（KB），進程已退出時返回0"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def descendant_pids(pid: int) -> List[int]:
+    """列出進程的所有子孫進程（FFmpeg等編碼進程）"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                # 進程名可能包含空格，父進程ID在最後一個右括號之後
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    
+    result = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+class StageRecorder:
+    """階段記錄類，記錄各階段耗時，並在後台採樣本進程及子進程的總內存"""
+    
+    def __init__(self, sample_interval: float = 0.1):
+        """
+        初始化階段記錄類
+        
+        Args:
+            sample_interval: 內存採樣間隔（秒）
+        """
+        self.sample_interval = sample_interval
+        self.durations: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.peak_rss_kb: Dict[str, int] = {stage: 0 for stage in STAGES}
+        
+        # 正在運行的各階段數量，採樣結果計入所有正在運行的階段
+        self._active: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._supported = os.path.exists("/proc/self/status")
+    
+    def start(self) -> None:
+        """啟動內存採樣線程，不支持/proc的系統不記錄內存"""
+        if not self._supported:
+            print("警告: 當前系統不支持/proc，不記錄峰值內存")
+            return
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """停止內存採樣線程"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        記錄一個階段的耗時，階段開始和結束時各採樣一次內存
+        
+        Args:
+            name: 階段名稱
+        """
+        with self._lock:
+            self._active[name] += 1
+        self._sample()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._sample()
+            with self._lock:
+                self._active[name] -= 1
+                self.durations[name].append(elapsed)
+    
+    def _sample(self) -> None:
+        """採樣一次內存並更新正在運行的階段的峰值"""
+        if not self._supported:
+            return
+        pid = os.getpid()
+        rss = read_rss_kb(pid) + sum(read_rss_kb(child) for child in descendant_pids(pid))
+        with self._lock:
+            for name, count in self._active.items():
+                if count and rss > self.peak_rss_kb[name]:
+                    self.peak_rss_kb[name] = rss
+    
+    def _sample_loop(self) -> None:
+        """後台採樣循環"""
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    計算百分位數（線性插值）
+    
+    Args:
+        values: 數值列表
+        q: 百分位（0-100）
+        
+    Returns:
+        百分位數，列表為空時返回None
+    """
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    """匯總一組耗時的計數、p50、p95、平均值和最大值"""
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "mean": None, "max": None}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(max(values), 3)
+    }
+
+class PipelineBenchmark:
+    """流水線基準測試類，在模擬服務提供商上運行完整的視頻生成流水線"""
+    
+    def __init__(
+        self,
+        work_dir: str,
+        tts_latency: LatencyModel,
+        avatar_latency: LatencyModel,
+        scene_latency: LatencyModel,
+        profile: Optional[str] = None,
+        speaking_rate: float = 1.0
+    ):
+        """
+        初始化流水線基準測試類
+        
+        Args:
+            work_dir: 工作目錄
+            tts_latency: 語音合成的延遲模型，工作量為字符數
+            avatar_latency: 數字人服務的延遲模型，工作量為音頻秒數
+            scene_latency: 場景服務的延遲模型，工作量為場景秒數
+            profile: 編碼配置名稱，默認讀取RENDER_PROFILE環境變量
+            speaking_rate: 模擬語音的語速，與文本長度一起決定音頻和視頻時長
+        """
+        self.work_dir = work_dir
+        self.tts_latency = tts_latency
+        self.avatar_latency = avatar_latency
+        self.scene_latency = scene_latency
+        self.profile = profile
+        self.encoder = get_encoder_settings(profile)
+        self.speaking_rate = speaking_rate
+        
+        self.tts = TextToSpeech(latency=tts_latency)
+        self.avatar_generator = DigitalHumanGenerator(provider=DigitalHumanProvider.MOCK)
+        self.animator = KenBurnsAnimator(encoder=self.encoder)
+        self.scene_image = write_scene_image(os.path.join(work_dir, "scene.png"), seed=0)
+    
+    def run_scenario(self, text_length: int, concurrency: int, resolution: str, jobs: int) -> Dict[str, Any]:
+        """
+        運行一個測試場景
+        
+        Args:
+            text_length: 每個任務的文本長度（字符數）
+            concurrency: 同時運行的任務數
+            resolution: 視頻分辨率
+            jobs: 任務總數
+            
+        Returns:
+            場景結果字典
+        """
+        name = f"len{text_length}_c{concurrency}_{resolution}"
+        scenario_dir = os.path.join(self.work_dir, name)
+        os.makedirs(scenario_dir, exist_ok=True)
+        
+        # 每個場景從相同的延遲序列開始，不同場景的結果可以比較
+        for model in (self.tts_latency, self.avatar_latency, self.scene_latency):
+            model.reset()
+        
+        text = build_text(text_length)
+        recorder = StageRecorder()
+        latencies: List[float] = []
+        errors: List[str] = []
+        
+        def run(job_index: int) -> None:
+            job_dir = os.path.join(scenario_dir, f"job_{job_index:03d}")
+            started = time.perf_counter()
+            try:
+                self.run_job(text, resolution, job_dir, recorder)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(str(e))
+                print(f"任務失敗: {name} #{job_index}: {str(e)}")
+        
+        recorder.start()
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run, range(jobs)))
+        finally:
+            wall_time = time.perf_counter() - started
+            recorder.stop()
+            shutil.rmtree(scenario_dir, ignore_errors=True)
+        
+        return {
+            "name": name,
+            "text_length": text_length,
+            "paragraphs": len(split_paragraphs(text)),
+            "concurrency": concurrency,
+            "resolution": resolution,
+            "jobs": jobs,
+            "errors": len(errors),
+            "wall_time": round(wall_time, 3),
+            "throughput_jobs_per_min": round(len(latencies) / wall_time * 60, 2) if wall_time > 0 else None,
+            "job_latency": summarize(latencies),
+            "stages": {
+                stage: {
+                    **summarize(recorder.durations[stage]),
+                    "peak_rss_mb": round(recorder.peak_rss_kb[stage] / 1024, 1) if recorder.peak_rss_kb[stage] else None
+                }
+                for stage in STAGES
+            }
+        }
+    
+    def run_job(self, text: str, resolution: str, job_dir: str, recorder: StageRecorder) -> str:
+        """
+        運行一個視頻任務：逐段落生成語音、數字人和場景並合成，最後拼接成片
+        
+        Args:
+            text: 演講稿文本
+            resolution: 視頻分辨率
+            job_dir: 任務工作目錄
+            recorder: 階段記錄器
+            
+        Returns:
+            成片路徑
+        """
+        os.makedirs(job_dir, exist_ok=True)
+        
+        section_files = []
+        for index, paragraph in enumerate(split_paragraphs(text)):
+            prefix = os.path.join(job_dir, f"paragraph_{index:03d}")
+            
+            with recorder.stage("tts"):
+                audio_file = self.tts.synthesize_speech(
+                    paragraph, Language.MANDARIN, Gender.FEMALE, f"{prefix}.wav", speaking_rate=self.speaking_rate
+                )
+                duration = self.tts.get_audio_duration(audio_file)
+            
+            with recorder.stage("avatar"):
+                self.avatar_latency.wait(duration)
+                avatar_file = self.avatar_generator.generate_video(
+                    "benchmark", audio_file, f"{prefix}_avatar.mp4", resolution=resolution, profile=self.profile
+                )
+            
+            with recorder.stage("scene"):
+                self.scene_latency.wait(duration)
+                scene_file = self.animator.render(
+                    self.scene_image, f"{prefix}_scene.mp4", duration, resolution, motion="zoom_in"
+                )
+            
+            with recorder.stage("compose"):
+                section_files.append(self.compose(scene_file, avatar_file, f"{prefix}_section.mp4", resolution))
+        
+        with recorder.stage("concat"):
+            return VideoConcatenator(temp_dir=job_dir, encoder=self.encoder).concatenate(
+                section_files, os.path.join(job_dir, "final.mp4")
+            )
+    
+    def compose(self, scene_file: str, avatar_file: str, output_file: str, resolution: str) -> str:
+        """
+        將綠幕數字人摳像後疊加在場景右下角，使用數字人視頻的音頻
+        
+        Args:
+            scene_file: 場景視頻
+            avatar_file: 綠幕數字人視頻
+            output_file: 輸出文件路徑
+            resolution: 視頻分辨率
+            
+        Returns:
+            輸出文件路徑
+        """
+        width, height = get_frame_size(resolution)
+        fps = 25
+        avatar_width = (width // 3) // 2 * 2
+        
+        subprocess.run([
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", scene_file, "-i", avatar_file,
+            "-filter_complex", (
+                f"[0:v]scale={width}:{height},fps={fps}[bg];"
+                f"[1:v]scale={avatar_width}:-2,chromakey=0x00FF00:0.15:0.1[fg];"
+                f"[bg][fg]overlay=W-w-20:H-h[v]"
+            ),
+            "-map", "[v]", "-map", "1:a:0",
+            *video_encoder_args(self.encoder, fps),
+            "-c:a", "aac", "-ar", "48000", "-ac", "2",
+            "-shortest",
+            output_file
+        ], capture_output=True, check=True)
+        return output_file
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    與基線比較，找出超出容差的性能回退
+    
+    Args:
+        current: 本次結果
+        baseline: 基線結果
+        tolerance: 相對容差，0.15表示允許變差15%
+        
+    Returns:
+        回退列表，每個元素包含場景、指標、基線值、本次值和變化比例
+    """
+    baseline_scenarios = {scenario["name"]: scenario for scenario in baseline.get("scenarios", [])}
+    regressions = []
+    
+    def check(scenario: str, metric: str, base: Optional[float], value: Optional[float], kind: str, higher_is_better: bool = False) -> None:
+        if base is None or value is None or base <= 0:
+            return
+        delta = base - value if higher_is_better else value - base
+        if delta > base * tolerance and delta > MIN_DELTA[kind]:
+            regressions.append({
+                "scenario": scenario,
+                "metric": metric,
+                "baseline": base,
+                "current": value,
+                "change": round(delta / base, 3)
+            })
+    
+    for scenario in current.get("scenarios", []):
+        base = baseline_scenarios.get(scenario["name"])
+        if not base:
+            print(f"基線中沒有場景 {scenario['name']}，跳過比較")
+            continue
+        
+        name = scenario["name"]
+        check(name, "throughput_jobs_per_min", base["throughput_jobs_per_min"], scenario["throughput_jobs_per_min"],
+              "throughput_jobs_per_min", higher_is_better=True)
+        for q in ("p50", "p95"):
+            check(name, f"job_latency.{q}", base["job_latency"][q], scenario["job_latency"][q], "seconds")
+        
+        for stage, stats in scenario["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if not base_stats:
+                continue
+            for q in ("p50", "p95"):
+                check(name, f"{stage}.{q}", base_stats[q], stats[q], "seconds")
+            check(name, f"{stage}.peak_rss_mb", base_stats["peak_rss_mb"], stats["peak_rss_mb"], "peak_rss_mb")
+    
+    return regressions
+
+def print_results(results: Dict[str, Any]) -> None:
+    """以表格打印各場景和各階段的結果"""
+    header = f"{'場景':<24}{'階段':<10}{'次數':>6}{'p50(秒)':>10}{'p95(秒)':>10}{'峰值內存(MB)':>14}"
+    print(header)
+    print("-" * len(header))
+    for scenario in results["scenarios"]:
+        job = scenario["job_latency"]
+        print(
+            f"{scenario['name']:<24}{'任務':<10}{job['count']:>6}{str(job['p50']):>10}{str(job['p95']):>10}"
+            f"{'':>14}  吞吐量 {scenario['throughput_jobs_per_min']} 任務/分鐘，失敗 {scenario['errors']}"
+        )
+        for stage, stats in scenario["stages"].items():
+            print(
+                f"{'':<24}{stage:<10}{stats['count']:>6}{str(stats['p50']):>10}{str(stats['p95']):>10}"
+                f"{str(stats['peak_rss_mb']):>14}"
+            )
+
+def print_regressions(regressions: List[Dict[str, Any]], tolerance: float) -> None:
+    """打印性能回退列表"""
+    if not regressions:
+        print(f"\n沒有超出容差（{tolerance:.0%}）的性能回退")
+        return
+    
+    print(f"\n發現 {len(regressions)} 項超出容差（{tolerance:.0%}）的性能回退:")
+    for regression in regressions:
+        print(
+            f"  {regression['scenario']:<24}{regression['metric']:<28}"
+            f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="在模擬服務提供商上運行端到端流水線基準測試")
+    parser.add_argument("--text-lengths", nargs="*", type=int, default=[200, 600], help="每個任務的文本長度（字符數）")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=[1, 4], help="同時運行的任務數")
+    parser.add_argument("--resolutions", nargs="*", default=["360p", "720p"], help="視頻分辨率")
+    parser.add_argument("--jobs", type=int, default=4, help="每個場景運行的任務數")
+    parser.add_argument("--profile", help="編碼配置，默認讀取RENDER_PROFILE環境變量")
+    parser.add_argument("--speaking-rate", type=float, default=1.0, help="模擬語音的語速")
+    parser.add_argument("--tts-latency", default=DEFAULT_TTS_LATENCY, help="語音合成的延遲模型，工作量為字符數")
+    parser.add_argument("--avatar-latency", default=DEFAULT_AVATAR_LATENCY, help="數字人服務的延遲模型，工作量為音頻秒數")
+    parser.add_argument("--scene-latency", default=DEFAULT_SCENE_LATENCY, help="場景服務的延遲模型，工作量為場景秒數")
+    parser.add_argument("--input", help="讀取已有的結果文件而不運行測試，用於與基線比較")
+    parser.add_argument("--compare", help="與基線結果文件比較，有性能回退時以狀態碼1退出")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="比較時的相對容差")
+    parser.add_argument("--output", help="將結果保存為JSON文件")
+    parser.add_argument("--keep", action="store_true", help="保留工作目錄")
+    args = parser.parse_args()
+    
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            results = json.load(f)
+    else:
+        latency_models = {
+            "tts": LatencyModel.from_spec(args.tts_latency),
+            "avatar": LatencyModel.from_spec(args.avatar_latency),
+            "scene": LatencyModel.from_spec(args.scene_latency)
+        }
+        
+        work_dir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+        try:
+            benchmark = PipelineBenchmark(
+                work_dir, latency_models["tts"], latency_models["avatar"], latency_models["scene"],
+                profile=args.profile, speaking_rate=args.speaking_rate
+            )
+            
+            scenarios = []
+            for text_length in args.text_lengths:
+                for concurrency in args.concurrency:
+                    for resolution in args.resolutions:
+                        print(f"運行場景: 文本長度 {text_length}，並發數 {concurrency}，分辨率 {resolution}...")
+                        scenarios.append(benchmark.run_scenario(text_length, concurrency, resolution, args.jobs))
+        finally:
+            if args.keep:
+                print(f"工作目錄保存在 {work_dir}")
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        
+        results = {
+            "version": RESULT_VERSION,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count()
+            },
+            "config": {
+                "jobs": args.jobs,
+                "profile": benchmark.encoder["profile"],
+                "speaking_rate": args.speaking_rate,
+                "latency_models": {name: model.to_dict() for name, model in latency_models.items()}
+            },
+            "scenarios": scenarios
+        }
+    
+    print()
+    print_results(results)
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已保存到 {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results.get("config"):
+            print("\n警告: 基線的測試配置與本次不同，比較結果可能不可靠")
+        regressions = compare_results(results, baseline, args.tolerance)
+        print_regressions(regressions, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
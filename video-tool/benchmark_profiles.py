@@ -0,0 +1,162 @@
+"""
+編碼配置基準測試 - 測量各編碼配置的編碼速度和輸出大小
+
+此腳本提供以下功能：
+1. 在參考片段上依次使用fast、balanced和archival配置重新編碼
+2. 記錄每個配置的編碼幀率、耗時、輸出大小和平均碼率
+3. 未指定參考片段時自動生成合成畫面和模擬數字人兩種片段
+4. 以表格輸出結果，並可保存為JSON供運維人員選擇配置
+
+使用方法：
+    python benchmark_profiles.py
+    python benchmark_profiles.py --clips intro.mp4 talk.mp4 --profiles fast balanced --output result.json
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Any
+
+from mock_avatar_renderer import MockAvatarRenderer
+from render_settings import RenderProfile, get_encoder_settings, get_frame_size, video_encoder_args
+from video_concat import FFMPEG_BINARY, VideoConcatenator
+
+def create_reference_clips(work_dir: str, duration: int = 10, resolution: str = "1080p") -> List[str]:
+    """
+    生成參考片段：高運動量的合成畫面和低運動量的模擬數字人
+    
+    Args:
+        work_dir: 輸出目錄
+        duration: 片段時長（秒）
+        resolution: 片段分辨率
+        
+    Returns:
+        參考片段路徑列表
+    """
+    width, height = get_frame_size(resolution)
+    # 參考片段使用接近無損的質量，避免源片段的壓縮瑕疵影響結果
+    source_encoder = {"preset": "ultrafast", "crf": 10}
+    
+    motion_clip = os.path.join(work_dir, "reference_motion.mp4")
+    subprocess.run([
+        FFMPEG_BINARY, "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        *video_encoder_args(source_encoder, 25),
+        "-c:a", "aac", "-shortest",
+        motion_clip
+    ], capture_output=True, check=True)
+    
+    # 模擬數字人使用帶音量變化的音頻驅動口型
+    audio_file = os.path.join(work_dir, "reference_speech.wav")
+    subprocess.run([
+        FFMPEG_BINARY, "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=16000:duration={duration}",
+        "-af", "volume='0.2+0.8*abs(sin(2*PI*t*1.5))':eval=frame",
+        audio_file
+    ], capture_output=True, check=True)
+    
+    avatar_clip = os.path.join(work_dir, "reference_avatar.mp4")
+    MockAvatarRenderer(fps=25, encoder=source_encoder).render(
+        audio_file, avatar_clip, avatar_id="benchmark", resolution=resolution
+    )
+    
+    return [motion_clip, avatar_clip]
+
+def benchmark_profile(clip: str, profile: str, work_dir: str) -> Dict[str, Any]:
+    """
+    使用指定編碼配置重新編碼參考片段並測量結果
+    
+    Args:
+        clip: 參考片段路徑
+        profile: 編碼配置名稱
+        work_dir: 輸出目錄
+        
+    Returns:
+        測量結果字典
+    """
+    info = VideoConcatenator(temp_dir=work_dir).probe(clip)
+    fps = float(info["fps"] or 25)
+    frames = int(round(info["duration"] * fps))
+    
+    encoder = get_encoder_settings(profile)
+    output_file = os.path.join(work_dir, f"{os.path.splitext(os.path.basename(clip))[0]}_{profile}.mp4")
+    
+    started_at = time.perf_counter()
+    subprocess.run([
+        FFMPEG_BINARY, "-y", "-v", "error",
+        "-i", clip,
+        *video_encoder_args(encoder, fps),
+        "-c:a", "copy",
+        output_file
+    ], capture_output=True, check=True)
+    elapsed = time.perf_counter() - started_at
+    
+    size = os.path.getsize(output_file)
+    return {
+        "clip": os.path.basename(clip),
+        "profile": profile,
+        "preset": encoder["preset"],
+        "crf": encoder["crf"],
+        "resolution": f"{info['width']}x{info['height']}",
+        "frames": frames,
+        "encode_seconds": round(elapsed, 3),
+        "encode_fps": round(frames / elapsed, 1) if elapsed > 0 else None,
+        "size_bytes": size,
+        "bitrate_kbps": round(size * 8 / info["duration"] / 1000, 1) if info["duration"] else None
+    }
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    """以表格打印測量結果"""
+    header = f"{'片段':<28}{'配置':<10}{'預設':<11}{'CRF':>5}{'編碼幀率':>10}{'耗時(秒)':>10}{'大小(MB)':>10}{'碼率(kbps)':>12}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['clip']:<28}{result['profile']:<10}{result['preset']:<11}{result['crf']:>5}"
+            f"{result['encode_fps']:>10}{result['encode_seconds']:>10}"
+            f"{result['size_bytes'] / 1024 / 1024:>10.2f}{result['bitrate_kbps']:>12}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="測量各編碼配置的編碼速度和輸出大小")
+    parser.add_argument("--clips", nargs="*", help="參考片段，默認自動生成")
+    parser.add_argument(
+        "--profiles", nargs="*", default=[profile.value for profile in RenderProfile],
+        help="要測試的編碼配置，默認為全部"
+    )
+    parser.add_argument("--duration", type=int, default=10, help="自動生成的參考片段時長（秒）")
+    parser.add_argument("--resolution", default="1080p", help="自動生成的參考片段分辨率")
+    parser.add_argument("--output", help="將結果保存為JSON文件")
+    parser.add_argument("--keep", action="store_true", help="保留編碼輸出，便於比較畫質")
+    args = parser.parse_args()
+    
+    work_dir = tempfile.mkdtemp(prefix="profile_benchmark_")
+    try:
+        clips = args.clips or create_reference_clips(work_dir, args.duration, args.resolution)
+        
+        results = []
+        for clip in clips:
+            for profile in args.profiles:
+                print(f"編碼 {os.path.basename(clip)}，配置 {profile}...")
+                results.append(benchmark_profile(clip, profile, work_dir))
+        
+        print()
+        print_results(results)
+        
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"\n結果已保存到 {args.output}")
+    finally:
+        if args.keep:
+            print(f"編碼輸出保存在 {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
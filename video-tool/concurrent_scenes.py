@@ -0,0 +1,394 @@
+"""
+並發場景生成模塊 - 支持所有段落的場景任務同時提交並按完成順序收集結果
+
+此模塊提供以下功能：
+1. 使用asyncio同時提交所有段落的場景生成任務
+2. 按服務提供商限制並發數：同一服務提供商在進程內共用一個並發上限，
+   多個請求同時生成場景（包括SceneGenerator.generate_scene的同步調用）時總並發數不超過上限
+3. 異步輪詢服務提供商的渲染任務狀態，並在線程池中下載結果，不阻塞事件循環
+4. 按完成順序返回結果，場景階段總耗時接近最慢的單個場景
+5. 提交和輪詢請求受服務提供商配額限制（見provider_rate_limiter.py），排隊等待而不是觸發429
+"""
+
+import os
+import json
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Tuple, Callable, AsyncIterator, Iterator
+
+from render_settings import get_render_settings
+from provider_rate_limiter import provider_request
+
+# 各服務提供商的默認最大並發數，可通過SCENE_MAX_CONCURRENCY_<PROVIDER>環境變量覆蓋
+DEFAULT_MAX_CONCURRENCY = {
+    "zebracat": 4,
+    "runway": 2,
+    "mock": os.cpu_count() or 2
+}
+
+# 服務提供商表示渲染完成或失敗的狀態值
+COMPLETED_STATUSES = {"complete", "completed", "succeeded", "success"}
+FAILED_STATUSES = {"failed", "error", "cancelled"}
+
+def default_max_concurrency(provider: str) -> int:
+    """
+    服務提供商的默認最大並發數，SCENE_MAX_CONCURRENCY_<PROVIDER>環境變量優先
+    
+    Args:
+        provider: 服務提供商名稱
+        
+    Returns:
+        最大並發數
+    """
+    env_value = os.getenv(f"SCENE_MAX_CONCURRENCY_{provider.upper()}")
+    if env_value:
+        return int(env_value)
+    return DEFAULT_MAX_CONCURRENCY.get(provider, 1)
+
+class ProviderConcurrency:
+    """
+    服務提供商的並發上限，可在多個事件循環和線程之間共用
+    
+    asyncio.Semaphore綁定單個事件循環，而generate_scenes每次調用都會創建新的事件循環，
+    因此用線程鎖記錄佔用數，釋放時把位置直接交給最早的等待者。
+    """
+    
+    def __init__(self, limit: int):
+        """
+        初始化並發上限
+        
+        Args:
+            limit: 最大並發數
+        """
+        self.limit = max(1, limit)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+    
+    async def __aenter__(self) -> "ProviderConcurrency":
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return self
+            waiter = loop.create_future()
+            entry = (loop, waiter)
+            self._waiters.append(entry)
+        
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    raise
+            # 取消前已經分到位置：_grant會把已取消等待者的位置轉交出去，已設置結果時由這裡釋放
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        self.release()
+        return False
+    
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        """在同步代碼中佔用一個位置，沒有空閒位置時阻塞等待"""
+        event = None
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+            else:
+                event = threading.Event()
+                self._waiters.append((None, event))
+        if event is not None:
+            event.wait()
+        
+        try:
+            yield
+        finally:
+            self.release()
+    
+    def release(self) -> None:
+        """釋放一個位置，有等待者時直接交給最早的等待者"""
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                if loop is None:
+                    waiter.set()
+                    return
+                try:
+                    loop.call_soon_threadsafe(self._grant, waiter)
+                    return
+                except RuntimeError:
+                    # 等待者的事件循環已經關閉
+                    continue
+            self._active -= 1
+    
+    def _grant(self, waiter: asyncio.Future) -> None:
+        """在等待者的事件循環中交付位置，等待者已取消時繼續轉交"""
+        if waiter.cancelled():
+            self.release()
+        else:
+            waiter.set_result(None)
+    
+    @property
+    def active(self) -> int:
+        """當前佔用的位置數"""
+        return self._active
+
+_provider_concurrency: Dict[str, ProviderConcurrency] = {}
+_provider_concurrency_lock = threading.Lock()
+
+def get_provider_concurrency(provider: str, limit: Optional[int] = None) -> ProviderConcurrency:
+    """
+    獲取服務提供商在進程內共用的並發上限
+    
+    Args:
+        provider: 服務提供商名稱
+        limit: 最大並發數，指定時更新共用的上限，默認使用default_max_concurrency
+        
+    Returns:
+        ProviderConcurrency實例
+    """
+    with _provider_concurrency_lock:
+        concurrency = _provider_concurrency.get(provider)
+        if concurrency is None:
+            concurrency = ProviderConcurrency(limit or default_max_concurrency(provider))
+            _provider_concurrency[provider] = concurrency
+        elif limit:
+            concurrency.limit = max(1, limit)
+        return concurrency
+
+class ConcurrentSceneGenerator:
+    """並發場景生成類，包裝SceneGenerator並以受限並發執行多個場景任務"""
+    
+    def __init__(
+        self,
+        generator: Any,
+        max_concurrency: Optional[Dict[str, int]] = None,
+        poll_interval: float = 2.0,
+        max_poll_interval: float = 15.0,
+        poll_timeout: float = 600.0,
+        request_timeout: float = 60.0
+    ):
+        """
+        初始化並發場景生成類
+        
+        Args:
+            generator: SceneGenerator實例
+            max_concurrency: 服務提供商到最大並發數的映射，未指定的提供商使用默認值；
+                上限在進程內按服務提供商共用，指定時會更新共用的上限
+            poll_interval: 首次輪詢任務狀態的間隔（秒）
+            max_poll_interval: 輪詢間隔上限（秒），間隔按1.5倍遞增
+            poll_timeout: 單個任務的最長等待時間（秒）
+            request_timeout: 單個HTTP請求的超時時間（秒）
+        """
+        self.generator = generator
+        self.max_concurrency = max_concurrency or {}
+        
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_timeout = poll_timeout
+        self.request_timeout = request_timeout
+    
+    def generate_scenes(
+        self,
+        jobs: List[Dict[str, Any]],
+        on_complete: Optional[Callable[[int, str], None]] = None
+    ) -> List[str]:
+        """
+        並發生成場景並等待全部完成
+        
+        Args:
+            jobs: 場景任務列表，每個元素包含prompt、output_file，以及可選的style、duration、resolution、quality、
+                scene_type、image_file、profile和keywords
+            on_complete: 每個場景完成時的回調函數，參數為任務索引和輸出文件路徑
+            
+        Returns:
+            與任務順序一致的輸出文件路徑列表
+        """
+        async def collect() -> List[str]:
+            results = [None] * len(jobs)
+            async for index, output_file in self.iter_completed(jobs):
+                results[index] = output_file
+                if on_complete:
+                    on_complete(index, output_file)
+            return results
+        
+        return asyncio.run(collect())
+    
+    async def iter_completed(self, jobs: List[Dict[str, Any]]) -> AsyncIterator[Tuple[int, str]]:
+        """
+        同時提交所有場景任務，並按完成順序逐個產出結果
+        
+        Args:
+            jobs: 場景任務列表
+            
+        Yields:
+            (任務索引, 輸出文件路徑)
+        """
+        provider = self.generator.provider.value
+        concurrency = get_provider_concurrency(provider, self.max_concurrency.get(provider))
+        
+        async def run(index: int, job: Dict[str, Any]) -> Tuple[int, str]:
+            async with concurrency:
+                return index, await self.generate_scene_async(**job)
+        
+        tasks = [asyncio.create_task(run(i, job)) for i, job in enumerate(jobs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def generate_scene_async(
+        self,
+        prompt: str,
+        output_file: str,
+        style: str = "realistic",
+        duration: int = 5,
+        resolution: str = "1080p",
+        quality: Optional[str] = None,
+        scene_type: Optional[str] = None,
+        image_file: Optional[str] = None,
+        profile: Optional[str] = None,
+        keywords: Optional[List[str]] = None
+    ) -> str:
+        """
+        異步生成單個場景視頻，失敗時回退到模擬場景
+        
+        Args:
+            prompt: 場景描述
+            output_file: 輸出文件路徑
+            style: 視覺風格
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
+            quality: 渲染質量（draft或final），指定時使用該質量的分辨率
+            scene_type: 場景類型（video或still），默認使用場景生成器的默認類型
+            image_file: 靜態圖片場景使用的圖片
+            profile: 靜態圖片場景在本地編碼使用的編碼配置
+            keywords: 段落的關鍵詞和實體，用於檢索素材庫
+            
+        Returns:
+            輸出文件路徑
+        """
+        if quality:
+            resolution = get_render_settings(quality)["resolution"]
+        
+        generator = self.generator
+        provider = generator.provider.value
+        
+        # 靜態圖片場景和模擬模式在本地渲染，直接放到線程池執行（包括素材庫檢索和緩存查找）
+        if provider == "mock" or (scene_type or generator.default_scene_type) == "still":
+            return await asyncio.to_thread(
+                generator.generate_scene, prompt, output_file, style, duration, resolution,
+                quality, scene_type, image_file, profile, keywords
+            )
+        
+        # 素材庫中有足夠相關的素材時不提交生成任務
+        library_file = await asyncio.to_thread(
+            generator.generate_from_library, prompt, output_file, style, duration, resolution, quality, keywords, profile
+        )
+        if library_file:
+            return library_file
+        
+        if generator.cache:
+            cached_file = await asyncio.to_thread(
+                generator.cache.lookup, prompt, output_file, style, duration, resolution, provider
+            )
+            if cached_file:
+                print(f"場景緩存命中: {prompt}")
+                return cached_file
+        
+        try:
+            url, headers, data = generator._build_provider_request(prompt, style, duration, resolution)
+            
+            response = await asyncio.to_thread(
+                provider_request, provider, "generate", "post", url,
+                headers=headers, data=json.dumps(data), timeout=self.request_timeout
+            )
+            
+            if response.status_code not in (200, 201, 202):
+                print(f"生成{provider}場景失敗: {response.status_code}, {response.text}")
+                return await self._fallback(prompt, output_file, style, duration, resolution)
+            
+            result = response.json()
+            scene_url = generator._get_result_url(result)
+            
+            # 服務提供商返回異步任務時，輪詢直到渲染完成
+            if not scene_url and result.get("id"):
+                scene_url = await self._poll_job(result["id"])
+            
+            if not scene_url:
+                return await self._fallback(prompt, output_file, style, duration, resolution)
+            
+            await asyncio.to_thread(generator._download_file, scene_url, output_file)
+            
+            if generator.cache:
+                await asyncio.to_thread(
+                    generator.cache.store, prompt, output_file, style, duration, resolution, provider
+                )
+            
+            return output_file
+        except Exception as e:
+            print(f"生成{provider}場景時發生錯誤: {str(e)}")
+            return await self._fallback(prompt, output_file, style, duration, resolution)
+    
+    async def _poll_job(self, job_id: str) -> Optional[str]:
+        """
+        異步輪詢渲染任務狀態，輪詢間隔逐步增加
+        
+        Args:
+            job_id: 服務提供商返回的任務ID
+            
+        Returns:
+            視頻URL，任務失敗或超時時返回None
+        """
+        generator = self.generator
+        status_url = generator._get_job_status_url(job_id)
+        headers = generator._get_api_headers()
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.poll_timeout
+        interval = self.poll_interval
+        
+        while loop.time() < deadline:
+            await asyncio.sleep(interval)
+            
+            response = await asyncio.to_thread(
+                provider_request, generator.provider.value, "status", "get", status_url,
+                headers=headers, timeout=self.request_timeout
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                status = str(result.get("status", "")).lower()
+                
+                if status in COMPLETED_STATUSES:
+                    return generator._get_result_url(result)
+                elif status in FAILED_STATUSES:
+                    print(f"場景渲染任務失敗: {job_id}, {result.get('error')}")
+                    return None
+            
+            interval = min(interval * 1.5, self.max_poll_interval)
+        
+        print(f"等待場景渲染任務超時: {job_id}")
+        return None
+    
+    async def _fallback(
+        self,
+        prompt: str,
+        output_file: str,
+        style: str,
+        duration: int,
+        resolution: str
+    ) -> str:
+        """在線程池中生成模擬場景作為回退"""
+        return await asyncio.to_thread(
+            self.generator._generate_mock_scene, prompt, output_file, style, duration, resolution
+        )
@@ -10,13 +10,28 @@
 
 import os
 import json
-import time
 import uuid
+import shutil
+import tempfile
+import threading
+import mimetypes
 import requests
 from enum import Enum
-from typing import Dict, List, Optional, Any, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Any
 from dotenv import load_dotenv
 
+# 導入渲染任務跟蹤器和渲染緩存
+from render_tracker import get_render_tracker
+from render_cache import AvatarRenderCache
+from audio_analysis import AudioAnalyzer, get_viseme_timeline
+from mock_avatar_renderer import MockAvatarRenderer
+from render_settings import get_encoder_settings, get_render_settings
+from video_concat import VideoConcatenator
+from tracing import get_tracer, register_trace_routes, traced
+from metrics import get_registry, register_metrics_route
+from provider_rate_limiter import provider_request, register_priority_hook
+
 # 導入環境變量處理
 load_dotenv()
 
@@ -40,14 +55,26 @@ class DigitalHumanProvider(Enum):
 class DigitalHumanGenerator:
     """數字人生成類，支持DeepBrain和模擬模式"""
     
-    def __init__(self, provider: DigitalHumanProvider = DigitalHumanProvider.MOCK):
+    def __init__(
+        self,
+        provider: DigitalHumanProvider = DigitalHumanProvider.MOCK,
+        cache: Optional[AvatarRenderCache] = None
+    ):
         """
         初始化數字人生成類
         
         Args:
             provider: 數字人服務提供商，默認為模擬模式
+            cache: 數字人渲染緩存，默認不使用緩存
         """
         self.provider = provider
+        self.cache = cache
+        
+        # 記錄當前線程的渲染是否回退到模擬模式，回退結果不寫入緩存
+        self._render_state = threading.local()
+        
+        # 模擬模式和回退時使用的本地渲染器，音頻驅動口型
+        self.mock_renderer = MockAvatarRenderer(fps=int(os.getenv("MOCK_AVATAR_FPS", "25")))
         
         # 初始化DeepBrain配置
         if provider == DigitalHumanProvider.DEEPBRAIN:
@@ -57,7 +84,7 @@ class DigitalHumanGenerator:
                 print("警告: 未設置DEEPBRAIN_API_KEY環境變量，將使用模擬模式")
                 self.provider = DigitalHumanProvider.MOCK
             
-            self.api_base_url = "https://api.deepbrain.io/v1"
+            self.api_base_url = os.getenv("DEEPBRAIN_API_BASE_URL", "https://api.deepbrain.io/v1")
         
         # 初始化Synthesia配置
         elif provider == DigitalHumanProvider.SYNTHESIA:
@@ -67,7 +94,7 @@ class DigitalHumanGenerator:
                 print("警告: 未設置SYNTHESIA_API_KEY環境變量，將使用模擬模式")
                 self.provider = DigitalHumanProvider.MOCK
             
-            self.api_base_url = "https://api.synthesia.io/v2"
+            self.api_base_url = os.getenv("SYNTHESIA_API_BASE_URL", "https://api.synthesia.io/v2")
     
     def get_available_avatars(self, language: AvatarLanguage, gender: AvatarGender) -> List[Dict[str, Any]]:
         """
@@ -111,7 +138,7 @@ class DigitalHumanGenerator:
                 "gender": gender.value
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = provider_request("deepbrain", "avatars", "get", url, headers=headers, params=params)
             
             if response.status_code == 200:
                 avatars = response.json().get("avatars", [])
@@ -142,7 +169,7 @@ class DigitalHumanGenerator:
                 "Content-Type": "application/json"
             }
             
-            response = requests.get(url, headers=headers)
+            response = provider_request("synthesia", "avatars", "get", url, headers=headers)
             
             if response.status_code == 200:
                 all_avatars = response.json()
@@ -218,6 +245,7 @@ class DigitalHumanGenerator:
         
         return mock_avatars
     
+    @traced("avatar.generate_video")
     def generate_video(
         self, 
         avatar_id: str, 
@@ -225,11 +253,16 @@ class DigitalHumanGenerator:
         output_file: str,
         background_color: str = "#00FF00",  # 綠幕背景
         resolution: str = "1080p",
-        expressions: List[Dict[str, Any]] = None
+        expressions: List[Dict[str, Any]] = None,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None
     ) -> str:
         """
         生成數字人視頻
         
+        此方法同步返回：使用Synthesia時阻塞調用線程直到渲染完成（見_wait_for_synthesia_video），
+        不希望佔用線程的調用方請使用generate_video_async。
+        
         Args:
             avatar_id: 數字人頭像ID
             audio_file: 音頻文件路徑
@@ -237,17 +270,223 @@ class DigitalHumanGenerator:
             background_color: 背景顏色，默認為綠幕
             resolution: 視頻分辨率，默認為1080p
             expressions: 表情和動作列表，格式為 [{"timestamp": 1.5, "expression": "smile"}]
+            quality: 渲染質量（draft或final），指定時使用該質量的分辨率、幀率和編碼預設
+            profile: 本地編碼使用的編碼配置（fast、balanced或archival），默認讀取RENDER_PROFILE環境變量
             
         Returns:
             輸出視頻文件路徑
         """
+        settings = get_render_settings(quality, profile) if quality else None
+        if settings:
+            resolution = settings["resolution"]
+        encoder = settings or get_encoder_settings(profile)
+        
+        # 在上傳音頻之前查找緩存，相同頭像、音頻和渲染參數只渲染一次
+        cache_key = None
+        if self.cache:
+            # 模擬模式在本地編碼，不同編碼配置的輸出不同
+            provider_key = self.provider.value
+            if self.provider == DigitalHumanProvider.MOCK:
+                provider_key = f"{provider_key}:{encoder['profile']}"
+            cache_key = self.cache.make_key(avatar_id, audio_file, background_color, resolution, expressions, provider_key)
+            cached_file = self.cache.lookup(cache_key, output_file)
+            if cached_file:
+                print(f"數字人緩存命中: {avatar_id}")
+                return cached_file
+        
+        self._render_state.used_mock_fallback = False
+        self._render_state.settings = settings
+        self._render_state.encoder = encoder
+        
         if self.provider == DigitalHumanProvider.DEEPBRAIN:
-            return self._generate_deepbrain_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+            result = self._generate_deepbrain_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
         elif self.provider == DigitalHumanProvider.SYNTHESIA:
-            return self._generate_synthesia_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+            result = self._generate_synthesia_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
         else:
-            return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+            result = self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+        
+        # 回退到模擬模式的結果不能代表提供商的渲染，不寫入緩存
+        if cache_key and not self._render_state.used_mock_fallback:
+            self.cache.store(cache_key, result, avatar_id, resolution)
+        
+        return result
     
+    def generate_video_async(
+        self, 
+        avatar_id: str, 
+        audio_file: str, 
+        output_file: str,
+        background_color: str = "#00FF00",
+        resolution: str = "1080p",
+        expressions: List[Dict[str, Any]] = None,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None
+    ) -> Future:
+        """
+        異步生成數字人視頻，立即返回Future而不阻塞調用線程
+        
+        Synthesia任務提交後由共享的渲染任務跟蹤器輪詢（或接收Webhook），
+        完成後在後台下載；其他服務提供商在跟蹤器的線程池中生成。
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            audio_file: 音頻文件路徑
+            output_file: 輸出視頻文件路徑
+            background_color: 背景顏色，默認為綠幕
+            resolution: 視頻分辨率，默認為1080p
+            expressions: 表情和動作列表
+            quality: 渲染質量（draft或final）
+            profile: 本地編碼使用的編碼配置（fast、balanced或archival）
+            
+        Returns:
+            完成時結果為輸出視頻文件路徑的Future
+        """
+        tracker = get_render_tracker()
+        if quality:
+            resolution = get_render_settings(quality)["resolution"]
+        args = (avatar_id, audio_file, output_file, background_color, resolution, expressions)
+        
+        if self.provider != DigitalHumanProvider.SYNTHESIA:
+            return tracker.run_in_background(get_tracer().bind(self.generate_video), *args, quality, profile)
+        
+        result = Future()
+        cache_key = None
+        
+        def fallback():
+            tracker.run_in_background(self._fallback_to_mock_video, *args).add_done_callback(
+                lambda f: result.set_exception(f.exception()) if f.exception() else result.set_result(f.result())
+            )
+        
+        def on_rendered(render_future: Future):
+            if render_future.exception() or not render_future.result():
+                print(f"Synthesia視頻生成失敗: {render_future.exception()}")
+                fallback()
+                return
+            download = tracker.run_in_background(self._download_file, render_future.result(), output_file)
+            download.add_done_callback(lambda f: fallback() if f.exception() else finish())
+        
+        def finish():
+            if cache_key:
+                self.cache.store(cache_key, output_file, avatar_id, resolution)
+            result.set_result(output_file)
+        
+        def submit():
+            nonlocal cache_key
+            if self.cache:
+                cache_key = self.cache.make_key(avatar_id, audio_file, background_color, resolution, expressions, self.provider.value)
+                if self.cache.lookup(cache_key, output_file):
+                    result.set_result(output_file)
+                    return
+            
+            video_id = self._submit_synthesia_video(avatar_id, audio_file, background_color)
+            if not video_id:
+                fallback()
+                return
+            tracker.track(video_id, self._fetch_synthesia_status, provider="synthesia").add_done_callback(on_rendered)
+        
+        # 上傳音頻和提交任務同樣在後台執行，提交過程中的異常同樣回退到模擬模式
+        tracker.run_in_background(get_tracer().bind(submit)).add_done_callback(
+            lambda f: fallback() if f.exception() else None
+        )
+        return result
+    
+    @traced("avatar.generate_chunked")
+    def generate_video_chunked(
+        self, 
+        avatar_id: str, 
+        audio_file: str, 
+        output_file: str,
+        background_color: str = "#00FF00",
+        resolution: str = "1080p",
+        expressions: List[Dict[str, Any]] = None,
+        max_segment: float = 30.0,
+        fps: int = 25,
+        max_workers: Optional[int] = None,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None
+    ) -> str:
+        """
+        分段並行生成數字人視頻
+        
+        在停頓處將音頻切分為不超過max_segment秒的片段，各片段並行渲染，
+        再以流複製拼接並重新封裝原始音頻，總耗時接近最長片段的渲染時間。
+        每個片段單獨查找和寫入緩存，重新生成時只渲染有變化的片段。
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            audio_file: 音頻文件路徑
+            output_file: 輸出視頻文件路徑
+            background_color: 背景顏色，默認為綠幕
+            resolution: 視頻分辨率，默認為1080p
+            expressions: 表情和動作列表
+            max_segment: 片段最長時長（秒）
+            fps: 渲染視頻的幀率，片段邊界對齊到幀
+            max_workers: 最大並行渲染數，默認讀取DIGITAL_HUMAN_MAX_CONCURRENCY環境變量
+            quality: 渲染質量（draft或final），指定時覆蓋分辨率和幀率
+            profile: 本地編碼使用的編碼配置（fast、balanced或archival）
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        settings = get_render_settings(quality, profile) if quality else {}
+        if settings:
+            resolution, fps = settings["resolution"], settings["fps"]
+        
+        work_dir = tempfile.mkdtemp(prefix="avatar_chunks_")
+        
+        try:
+            segments = AudioAnalyzer().split_audio(audio_file, work_dir, max_segment=max_segment, fps=fps)
+            
+            # 音頻不需要切分時直接整段渲染
+            if len(segments) <= 1:
+                return self.generate_video(
+                    avatar_id, audio_file, output_file, background_color, resolution, expressions, quality, profile
+                )
+            
+            print(f"數字人音頻切分為{len(segments)}個片段並行渲染")
+            
+            if max_workers is None:
+                max_workers = int(os.getenv("DIGITAL_HUMAN_MAX_CONCURRENCY", "4"))
+            
+            def render(index: int, segment: Dict[str, Any], background: bool = False) -> Any:
+                # 表情時間戳轉換為片段內的相對時間
+                segment_expressions = None
+                if expressions:
+                    segment_expressions = [
+                        dict(item, timestamp=item["timestamp"] - segment["start"])
+                        for item in expressions
+                        if segment["start"] <= item.get("timestamp", 0) < segment["end"]
+                    ]
+                segment_output = os.path.join(work_dir, f"segment_{index:04d}.mp4")
+                generate = self.generate_video_async if background else self.generate_video
+                return generate(
+                    avatar_id, segment["file"], segment_output, background_color, resolution, segment_expressions,
+                    quality, profile
+                )
+            
+            if self.provider == DigitalHumanProvider.SYNTHESIA:
+                # Synthesia片段全部提交後由共享的跟蹤器統一輪詢，不為每個片段佔用一個等待線程
+                futures = [render(index, segment, True) for index, segment in enumerate(segments)]
+                segment_videos = [future.result() for future in futures]
+            else:
+                with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                    segment_videos = list(executor.map(get_tracer().bind(render), range(len(segments)), segments))
+            
+            concatenator = VideoConcatenator(temp_dir=work_dir, encoder=settings or get_encoder_settings(profile))
+            joined_file = os.path.join(work_dir, "joined.mp4")
+            concatenator.concatenate(segment_videos, joined_file)
+            
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            return concatenator.replace_audio(joined_file, audio_file, output_file)
+        except Exception as e:
+            print(f"分段生成數字人視頻時發生錯誤: {str(e)}")
+            return self.generate_video(
+                avatar_id, audio_file, output_file, background_color, resolution, expressions, quality, profile
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    @traced("avatar.deepbrain")
     def _generate_deepbrain_video(
         self, 
         avatar_id: str, 
@@ -312,8 +551,22 @@ class DigitalHumanGenerator:
             if expression_data:
                 data["expressions"] = expression_data
             
-            # 發送請求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            # 附上從音頻分析的口型變化，與表情分開傳遞，時間軸緩存在音頻旁邊，模擬渲染器回退時直接重用
+            try:
+                lipsync = get_viseme_timeline(audio_file).to_expressions()
+            except Exception as e:
+                print(f"分析口型時間軸失敗，不附帶口型提示: {str(e)}")
+                lipsync = []
+            if lipsync:
+                data["lipsync"] = {
+                    "visemes": [
+                        {"timestamp": item["timestamp"], "viseme": item["expression"], "energy": item["energy"]}
+                        for item in lipsync
+                    ]
+                }
+            
+            # 在配額內發送請求
+            response = provider_request("deepbrain", "generate", "post", url, headers=headers, data=json.dumps(data))
             
             if response.status_code == 200:
                 result = response.json()
@@ -325,10 +578,10 @@ class DigitalHumanGenerator:
                 return output_file
             else:
                 print(f"生成DeepBrain視頻失敗: {response.status_code}, {response.text}")
-                return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+                return self._fallback_to_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
         except Exception as e:
             print(f"生成DeepBrain視頻時發生錯誤: {str(e)}")
-            return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+            return self._fallback_to_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
     
     def _generate_synthesia_video(
         self, 
@@ -353,6 +606,99 @@ class DigitalHumanGenerator:
         Returns:
             輸出視頻文件路徑
         """
+        try:
+            # 提交渲染任務
+            video_id = self._submit_synthesia_video(avatar_id, audio_file, background_color)
+            
+            if video_id:
+                # 等待視頻生成完成
+                video_url = self._wait_for_synthesia_video(video_id)
+                
+                if video_url:
+                    # 下載視頻
+                    self._download_file(video_url, output_file)
+                    return output_file
+                else:
+                    print("等待Synthesia視頻生成超時")
+                    return self._fallback_to_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+            else:
+                return self._fallback_to_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+        except Exception as e:
+            print(f"生成Synthesia視頻時發生錯誤: {str(e)}")
+            return self._fallback_to_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+    
+    def _fallback_to_mock_video(
+        self, 
+        avatar_id: str, 
+        audio_file: str, 
+        output_file: str,
+        background_color: str = "#00FF00",
+        resolution: str = "1080p",
+        expressions: List[Dict[str, Any]] = None
+    ) -> str:
+        """
+        服務提供商失敗時回退到模擬視頻，並標記本次渲染不寫入緩存
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            audio_file: 音頻文件路徑
+            output_file: 輸出視頻文件路徑
+            background_color: 背景顏色
+            resolution: 視頻分辨率
+            expressions: 表情和動作列表
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        self._render_state.used_mock_fallback = True
+        return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+    
+    @traced("avatar.render_mock")
+    def _generate_mock_video(
+        self, 
+        avatar_id: str, 
+        audio_file: str, 
+        output_file: str,
+        background_color: str = "#00FF00",
+        resolution: str = "1080p",
+        expressions: List[Dict[str, Any]] = None
+    ) -> str:
+        """
+        在本地生成模擬數字人視頻，口型由音頻能量驅動
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            audio_file: 音頻文件路徑
+            output_file: 輸出視頻文件路徑
+            background_color: 背景顏色
+            resolution: 視頻分辨率
+            expressions: 表情和動作列表
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        print(f"使用模擬模式生成數字人視頻: {avatar_id}")
+        
+        # 按本次請求的渲染質量和編碼配置選擇幀率和編碼參數
+        settings = getattr(self._render_state, "settings", None) or {}
+        return self.mock_renderer.render(
+            audio_file, output_file, avatar_id, background_color, resolution, expressions,
+            fps=settings.get("fps"), encoder=getattr(self._render_state, "encoder", None)
+        )
+    
+    @traced("avatar.submit_provider")
+    def _submit_synthesia_video(self, avatar_id: str, audio_file: str, background_color: str = "#00FF00") -> Optional[str]:
+        """
+        上傳音頻並提交Synthesia渲染任務
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            audio_file: 音頻文件路徑
+            background_color: 背景顏色，默認為綠幕
+            
+        Returns:
+            Synthesia視頻ID，提交失敗時返回None
+        """
         try:
             url = f"{self.api_base_url}/videos"
             
@@ -384,42 +730,53 @@ class DigitalHumanGenerator:
                 "title": f"Generated Video {uuid.uuid4()}"
             }
             
-            # 發送請求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            # 在配額內發送請求
+            response = provider_request("synthesia", "generate", "post", url, headers=headers, data=json.dumps(data))
             
             if response.status_code == 201:
-                result = response.json()
-                video_id = result.get("id")
-                
-                # 等待視頻生成完成
-                video_url = self._wait_for_synthesia_video(video_id)
-                
-                if video_url:
-                    # 下載視頻
-                    self._download_file(video_url, output_file)
-                    return output_file
-                else:
-                    print("等待Synthesia視頻生成超時")
-                    return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+                return response.json().get("id")
             else:
                 print(f"生成Synthesia視頻失敗: {response.status_code}, {response.text}")
-                return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+                return None
         except Exception as e:
-            print(f"生成Synthesia視頻時發生錯誤: {str(e)}")
-            return self._generate_mock_video(avatar_id, audio_file, output_file, background_color, resolution, expressions)
+            print(f"提交Synthesia視頻時發生錯誤: {str(e)}")
+            return None
     
+    @traced("avatar.poll_provider")
     def _wait_for_synthesia_video(self, video_id: str, max_attempts: int = 30, delay: int = 10) -> Optional[str]:
         """
-        等待Synthesia視頻生成完成
+        等待Synthesia視頻生成完成（阻塞的同步兼容接口）
+        
+        輪詢和Webhook回調由共享的渲染任務跟蹤器在後台處理，此方法不發送請求，
+        只阻塞調用線程等待跟蹤器的結果，供generate_video的同步路徑使用。
+        generate_video_async在跟蹤器的完成回調中繼續下載，不阻塞任何線程。
         
         Args:
             video_id: 視頻ID
-            max_attempts: 最大嘗試次數
+            max_attempts: 最大嘗試次數（與delay一起決定最長等待時間）
             delay: 每次嘗試間隔（秒）
             
         Returns:
             視頻URL或None（如果生成失敗）
         """
+        future = get_render_tracker().track(video_id, self._fetch_synthesia_status, provider="synthesia")
+        
+        try:
+            return future.result(timeout=max_attempts * delay)
+        except Exception as e:
+            print(f"Synthesia視頻生成失敗: {str(e)}")
+            return None
+    
+    def _fetch_synthesia_status(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢Synthesia視頻的渲染狀態
+        
+        Args:
+            video_id: 視頻ID
+            
+        Returns:
+            包含status、download和error的字典，查詢失敗時返回None
+        """
         url = f"{self.api_base_url}/videos/{video_id}"
         
         headers = {
@@ -427,15 +784,273 @@ class DigitalHumanGenerator:
             "Content-Type": "application/json"
         }
         
-        for attempt in range(max_attempts):
-            response = requests.get(url, headers=headers)
+        response = provider_request("synthesia", "status", "get", url, headers=headers, timeout=30)
+        
+        if response.status_code == 200:
+            return response.json()
+        
+        print(f"查詢Synthesia視頻狀態失敗: {response.status_code}, {response.text}")
+        return None
+    
+    def _upload_audio_file(self, audio_file: str) -> str:
+        """
+        上傳音頻文件到服務提供商的素材接口，返回渲染任務引用的音頻URL
+        
+        Args:
+            audio_file: 音頻文件路徑
             
-            if response.status_code == 200:
-                result = response.json()
-                status = result.get("status")
+        Returns:
+            音頻URL
+            
+        Raises:
+            RuntimeError: 上傳失敗或響應中沒有URL
+        """
+        url = f"{self.api_base_url}/assets"
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        # 先讀入內存，收到429重試時可以重新發送
+        with open(audio_file, "rb") as f:
+            content = f.read()
+        mimetype = mimetypes.guess_type(audio_file)[0] or "application/octet-stream"
+        
+        response = provider_request(
+            self.provider.value, "upload", "post", url, headers=headers,
+            files={"file": (os.path.basename(audio_file), content, mimetype)}, timeout=120
+        )
+        
+        if response.status_code not in (200, 201):
+            raise RuntimeError(f"上傳音頻文件失敗: {response.status_code}, {response.text}")
+        
+        audio_url = response.json().get("url")
+        if not audio_url:
+            raise RuntimeError(f"上傳音頻文件的響應中沒有URL: {response.text}")
+        return audio_url
+    
+    def _download_file(self, url: str, output_file: str) -> None:
+        """
+        下載渲染結果，先寫入臨時文件，完成後再移動到輸出路徑
+        
+        Args:
+            url: 文件URL
+            output_file: 輸出文件路徑
+            
+        Raises:
+            RuntimeError: 下載失敗
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        
+        response = requests.get(url, stream=True, timeout=300)
+        if response.status_code != 200:
+            raise RuntimeError(f"下載文件失敗: {response.status_code}, {url}")
+        
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_file)), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+            os.replace(temp_file, output_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+def create_app(provider: Optional[DigitalHumanProvider] = None):
+    """
+    創建數字人服務的Flask應用
+    
+    音頻優先從與其他服務共用的輸出目錄讀取，不存在時從TTS服務下載。
+    設置RENDER_WEBHOOK_SECRET時註冊渲染完成回調端點（默認/webhooks/render，可由RENDER_WEBHOOK_PATH覆蓋），
+    服務提供商回調後渲染任務立即完成，輪詢降為低頻的兜底檢查。
+    數字人渲染緩存默認開啟，緩存目錄和磁盤配額見AvatarRenderCache，設置AVATAR_CACHE_ENABLED=false時關閉。
+    
+    Args:
+        provider: 數字人服務提供商，默認讀取DIGITAL_HUMAN_PROVIDER環境變量（默認mock）
+        
+    Returns:
+        Flask應用
+    """
+    from flask import Flask, request, jsonify, send_file
+    
+    app = Flask(__name__)
+    
+    # 鏈路追蹤、Prometheus指標和服務提供商配額的請求優先級
+    tracer = get_tracer()
+    register_trace_routes(app, tracer, "digital_human")
+    register_metrics_route(app, get_registry(), "digital_human")
+    register_priority_hook(app)
+    
+    # 渲染完成回調
+    if os.getenv("RENDER_WEBHOOK_SECRET"):
+        from render_tracker import register_webhook_route
+        register_webhook_route(app, get_render_tracker(), os.getenv("RENDER_WEBHOOK_PATH", "/webhooks/render"))
+    
+    output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    tts_service_url = os.getenv("TTS_SERVICE_URL", "http://localhost:5000")
+    
+    cache = None
+    if os.getenv("AVATAR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+        cache = AvatarRenderCache()
+    
+    generator = DigitalHumanGenerator(
+        provider=provider or DigitalHumanProvider(os.getenv("DIGITAL_HUMAN_PROVIDER", DigitalHumanProvider.MOCK.value)),
+        cache=cache
+    )
+    
+    # 請求中的語言可以是名稱或語言代碼
+    language_map = {
+        'mandarin': AvatarLanguage.MANDARIN,
+        'cantonese': AvatarLanguage.CANTONESE,
+        'english': AvatarLanguage.ENGLISH
+    }
+    language_map.update({language.value.lower(): language for language in AvatarLanguage})
+    
+    def fetch_audio(audio_file_id: str) -> str:
+        """取得TTS服務生成的音頻：共用輸出目錄中已有時直接使用，否則下載到輸出目錄"""
+        if not audio_file_id or '..' in audio_file_id or '/' in audio_file_id:
+            raise ValueError(f"無效的音頻ID: {audio_file_id}")
+        
+        audio_file = os.path.join(output_dir, f"{audio_file_id}.mp3")
+        if not os.path.exists(audio_file):
+            generator._download_file(f"{tts_service_url}/audio/{audio_file_id}", audio_file)
+        return audio_file
+    
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        """健康檢查端點"""
+        return jsonify({"status": "ok", "message": "數字人服務正常運行"})
+    
+    @app.route('/avatars', methods=['GET'])
+    def get_avatars():
+        """
+        獲取可用的數字人頭像
+        
+        查詢參數:
+        - language: 語言 (mandarin, cantonese, english或語言代碼)
+        - gender: 性別 (male, female)
+        
+        返回:
+        - 數字人頭像列表
+        """
+        try:
+            language = language_map.get(request.args.get('language', 'mandarin').lower())
+            if not language:
+                return jsonify({"error": f"不支持的語言: {request.args.get('language')}"}), 400
+            
+            try:
+                gender = AvatarGender(request.args.get('gender', 'female').lower())
+            except ValueError:
+                return jsonify({"error": f"不支持的性別: {request.args.get('gender')}"}), 400
+            
+            return jsonify({"avatars": generator.get_available_avatars(language, gender)})
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/generate', methods=['POST'])
+    def generate_video():
+        """
+        生成數字人視頻
+        
+        請求參數:
+        - avatar_id: 數字人頭像ID
+        - audio_file_id: TTS服務生成的音頻ID
+        - background_color: 背景顏色 (可選，默認綠幕)
+        - resolution: 分辨率 (可選，默認1080p)
+        - quality, profile: 渲染質量和編碼配置 (可選)
+        
+        返回:
+        - 視頻ID
+        """
+        try:
+            data = request.json or {}
+            avatar_id = data.get('avatar_id')
+            if not avatar_id or not data.get('audio_file_id'):
+                return jsonify({"error": "缺少必要參數: avatar_id或audio_file_id"}), 400
+            
+            video_id = str(uuid.uuid4())
+            generator.generate_video(
+                avatar_id=avatar_id,
+                audio_file=fetch_audio(data['audio_file_id']),
+                output_file=os.path.join(output_dir, f"{video_id}.mp4"),
+                background_color=data.get('background_color', '#00FF00'),
+                resolution=data.get('resolution', '1080p'),
+                expressions=data.get('expressions'),
+                quality=data.get('quality'),
+                profile=data.get('profile')
+            )
+            
+            return jsonify({"message": "數字人視頻生成成功", "video_id": video_id})
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/video/<video_id>', methods=['GET'])
+    def get_video(video_id):
+        """
+        獲取生成的視頻文件
+        
+        路徑參數:
+        - video_id: 視頻ID
+        
+        返回:
+        - 視頻文件
+        """
+        try:
+            if not video_id or '..' in video_id:
+                return jsonify({"error": "無效的視頻ID"}), 400
+            
+            file_path = os.path.join(output_dir, f"{video_id}.mp4")
+            if not os.path.exists(file_path):
+                return jsonify({"error": "文件不存在"}), 404
+            
+            return send_file(file_path, mimetype='video/mp4')
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/examples', methods=['GET'])
+    def generate_examples():
+        """
+        使用每種語言的第一個女性頭像生成示例視頻
+        
+        查詢參數:
+        - audio_file_id: TTS服務生成的音頻ID
+        
+        返回:
+        - 示例視頻的ID列表
+        """
+        try:
+            audio_file_id = request.args.get('audio_file_id')
+            if not audio_file_id:
+                return jsonify({"error": "缺少必要參數: audio_file_id"}), 400
+            audio_file = fetch_audio(audio_file_id)
+            
+            examples = []
+            for language in AvatarLanguage:
+                avatars = generator.get_available_avatars(language, AvatarGender.FEMALE)
+                if not avatars:
+                    continue
                 
-                if status == "complete":
-                    return result.get("download")
-                elif status == "failed":
-                    print(f"Synthesia視頻生成失敗: {result.get('error')}")
-                    r<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>
\ No newline at end of file
+                video_id = str(uuid.uuid4())
+                generator.generate_video(
+                    avatar_id=avatars[0]["id"],
+                    audio_file=audio_file,
+                    output_file=os.path.join(output_dir, f"{video_id}.mp4"),
+                    quality="draft"
+                )
+                examples.append({"id": video_id, "avatar_id": avatars[0]["id"], "language": language.value})
+            
+            return jsonify({"message": "示例生成成功", "examples": examples})
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    return app
+
+if __name__ == '__main__':
+    create_app().run(host='0.0.0.0', port=int(os.getenv("DIGITAL_HUMAN_SERVICE_PORT", "5001")))
@@ -0,0 +1,598 @@
+"""
+本地服務提供商替身 - 模擬各服務提供商的API，用於離線測試並發、重試和輪詢
+
+此模塊提供以下功能：
+1. 按tts_module、digital_human_module和scene_generation_module使用的請求和響應格式，
+   模擬Google TTS、Azure Speech、DeepBrain、Synthesia、Zebracat和Runway的API
+2. 每個提供商的響應延遲和渲染耗時由可配置的延遲模型生成
+3. 按提供商限制請求速率，超出時返回429和Retry-After
+4. 異步渲染任務經歷pending、complete或failed狀態，可按比例注入任務失敗
+5. 可按比例注入服務器錯誤（500）和超時
+6. 每個提供商在獨立端口運行，啟動時打印指向替身的環境變量
+
+使用方法：
+    python fake_providers.py
+    python fake_providers.py --providers synthesia runway --error-rate 0.05 --rate-limit 2
+    python fake_providers.py --config providers.json
+"""
+
+import io
+import os
+import json
+import time
+import logging
+import uuid
+import wave
+import base64
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+from flask import Flask, request, jsonify, send_file, Response
+from werkzeug.serving import make_server
+
+from latency_model import LatencyModel
+from video_concat import FFMPEG_BINARY
+
+# 各提供商的默認配置
+# latency: 處理請求的延遲；render_latency: 異步任務從提交到完成的時間，工作量為文本字符數或視頻秒數
+# rate_limit: 每秒請求數（0表示不限制），burst: 允許的突發請求數
+# error_rate: 返回500的比例；timeout_rate: 掛起timeout_seconds後返回504的比例
+# failure_rate: 異步任務最終失敗的比例；async: 場景提供商是否以異步任務返回結果
+DEFAULT_CONFIG = {
+    "google": {
+        "port": 5101,
+        "latency": "base=0.2,per_unit=0.001,jitter=0.3,distribution=lognormal,seed=11",
+        "rate_limit": 10,
+        "burst": 20
+    },
+    "azure": {
+        "port": 5102,
+        "latency": "base=0.25,per_unit=0.001,jitter=0.3,distribution=lognormal,seed=12",
+        "rate_limit": 20,
+        "burst": 20
+    },
+    "deepbrain": {
+        "port": 5103,
+        "latency": "base=3,per_unit=0.5,jitter=0.3,distribution=lognormal,seed=13",
+        "rate_limit": 2,
+        "burst": 5
+    },
+    "synthesia": {
+        "port": 5104,
+        "latency": "base=0.1,jitter=0.2,distribution=lognormal,seed=14",
+        "render_latency": "base=20,per_unit=2,jitter=0.4,distribution=lognormal,seed=24",
+        "rate_limit": 1,
+        "burst": 10
+    },
+    "zebracat": {
+        "port": 5105,
+        "latency": "base=0.2,jitter=0.2,distribution=lognormal,seed=15",
+        "render_latency": "base=10,per_unit=1,jitter=0.4,distribution=lognormal,seed=25",
+        "rate_limit": 4,
+        "burst": 8,
+        "async": True
+    },
+    "runway": {
+        "port": 5106,
+        "latency": "base=0.2,jitter=0.2,distribution=lognormal,seed=16",
+        "render_latency": "base=30,per_unit=3,jitter=0.5,distribution=lognormal,seed=26",
+        "rate_limit": 2,
+        "burst": 4,
+        "async": True
+    }
+}
+
+# 所有提供商共用的默認值
+COMMON_DEFAULTS = {
+    "latency": "0",
+    "render_latency": "0",
+    "rate_limit": 0,
+    "burst": 1,
+    "error_rate": 0.0,
+    "timeout_rate": 0.0,
+    "timeout_seconds": 60.0,
+    "failure_rate": 0.0,
+    "async": False,
+    "seed": 0
+}
+
+# 客戶端使用的環境變量，指向對應的替身
+CLIENT_ENV = {
+    "google": ("GOOGLE_TTS_ENDPOINT", ""),
+    "azure": ("AZURE_SPEECH_ENDPOINT", ""),
+    "deepbrain": ("DEEPBRAIN_API_BASE_URL", "/v1"),
+    "synthesia": ("SYNTHESIA_API_BASE_URL", "/v2"),
+    "zebracat": ("ZEBRACAT_API_BASE_URL", "/v1"),
+    "runway": ("RUNWAY_API_BASE_URL", "/v1")
+}
+
+# 數字人頭像列表
+FAKE_AVATARS = [
+    {"id": f"fake-{language}-{gender}", "name": f"Fake {language} {gender}", "languages": [language], "gender": gender}
+    for language in ("zh-CN", "zh-HK", "en-US")
+    for gender in ("male", "female")
+]
+
+class TokenBucket:
+    """令牌桶，按固定速率補充令牌"""
+    
+    def __init__(self, rate: float, burst: int):
+        """
+        初始化令牌桶
+        
+        Args:
+            rate: 每秒補充的令牌數，0表示不限制
+            burst: 令牌桶容量
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> float:
+        """
+        嘗試取得一個令牌
+        
+        Returns:
+            0表示已取得，否則為需要等待的秒數
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+def synthesize_wav(text: str, speaking_rate: float = 1.0, sample_rate: int = 16000) -> bytes:
+    """
+    生成時長與文本長度成正比的WAV音頻
+    
+    Args:
+        text: 文本
+        speaking_rate: 語速
+        sample_rate: 採樣率
+        
+    Returns:
+        WAV文件內容
+    """
+    duration = max(0.5, len(text) / (5.0 * max(speaking_rate, 0.25)))
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    envelope = 0.2 + 0.8 * np.abs(np.sin(2 * np.pi * 1.5 * t))
+    samples = (np.sin(2 * np.pi * 220 * t) * envelope * 0.5 * 32767).astype(np.int16)
+    
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def create_sample_video(output_file: str, duration: int = 5, resolution: str = "640x360") -> str:
+    """生成渲染任務完成後返回的示例視頻，綠幕背景以便合成"""
+    subprocess.run([
+        FFMPEG_BINARY, "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"color=c=0x00FF00:size={resolution}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=48000:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest",
+        "-movflags", "+faststart",
+        output_file
+    ], capture_output=True, check=True)
+    return output_file
+
+class FakeProvider:
+    """服務提供商替身類，處理延遲、速率限制、錯誤注入和異步任務狀態"""
+    
+    def __init__(self, name: str, config: Dict[str, Any], video_file: str):
+        """
+        初始化服務提供商替身
+        
+        Args:
+            name: 提供商名稱
+            config: 提供商配置，缺少的字段使用COMMON_DEFAULTS
+            video_file: 渲染任務完成後返回的視頻
+        """
+        self.name = name
+        self.config = {**COMMON_DEFAULTS, **config}
+        self.video_file = video_file
+        
+        self.latency = LatencyModel.from_spec(self.config["latency"])
+        self.render_latency = LatencyModel.from_spec(self.config["render_latency"])
+        self.bucket = TokenBucket(float(self.config["rate_limit"]), int(self.config["burst"]))
+        self.random = random.Random(self.config["seed"])
+        self._random_lock = threading.Lock()
+        
+        # 任務ID到任務狀態的映射，以及上傳的文件
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.files: Dict[str, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+        
+        # 各類響應的計數，供測試結束後對照客戶端的統計
+        self.stats: Dict[str, int] = {}
+        
+        self.app = Flask(f"fake_{name}")
+        self.app.before_request(self._before_request)
+        self.app.after_request(self._after_request)
+        self._register_common_routes()
+        getattr(self, f"_register_{name}_routes")()
+    
+    @property
+    def base_url(self) -> str:
+        """替身的根地址"""
+        return f"http://127.0.0.1:{self.config['port']}"
+    
+    def _chance(self, rate: float) -> bool:
+        """按比例抽樣，使用帶種子的隨機數生成器"""
+        if rate <= 0:
+            return False
+        with self._random_lock:
+            return self.random.random() < rate
+    
+    def _count(self, key: str) -> None:
+        """累加響應計數"""
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+    
+    def _before_request(self) -> Optional[Tuple[Response, int]]:
+        """在處理請求之前執行速率限制和錯誤注入"""
+        if request.path.startswith(("/files/", "/_fake/")):
+            return None
+        
+        retry_after = self.bucket.acquire()
+        if retry_after:
+            self._count("rate_limited")
+            response = jsonify({"error": "rate limit exceeded", "provider": self.name})
+            response.headers["Retry-After"] = str(max(1, int(round(retry_after + 0.5))))
+            return response, 429
+        
+        if self._chance(self.config["timeout_rate"]):
+            self._count("timeout")
+            time.sleep(self.config["timeout_seconds"])
+            return jsonify({"error": "injected timeout", "provider": self.name}), 504
+        
+        if self._chance(self.config["error_rate"]):
+            self._count("error")
+            return jsonify({"error": "injected server error", "provider": self.name}), 500
+        
+        return None
+    
+    def _after_request(self, response: Response) -> Response:
+        """按狀態碼統計響應"""
+        self._count(str(response.status_code))
+        return response
+    
+    def _file_url(self, file_id: str) -> str:
+        """文件的下載地址"""
+        return f"{request.host_url.rstrip('/')}/files/{file_id}"
+    
+    def _create_job(self, units: float = 0.0) -> Dict[str, Any]:
+        """
+        創建異步渲染任務，任務在渲染延遲之後完成或失敗
+        
+        Args:
+            units: 渲染工作量
+            
+        Returns:
+            任務字典
+        """
+        job = {
+            "id": str(uuid.uuid4()),
+            "created_at": time.time(),
+            "ready_at": time.time() + self.render_latency.sample(units),
+            "fail": self._chance(self.config["failure_rate"])
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+        return job
+    
+    def _job_status(self, job_id: str) -> Optional[str]:
+        """查詢任務狀態：pending、complete或failed，任務不存在時返回None"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if not job:
+            return None
+        if time.time() < job["ready_at"]:
+            return "pending"
+        return "failed" if job["fail"] else "complete"
+    
+    def _register_common_routes(self) -> None:
+        """註冊所有提供商共用的文件上傳、下載和統計接口"""
+        app = self.app
+        
+        @app.route('/files/<file_id>', methods=['GET'])
+        def get_file(file_id):
+            with self._lock:
+                stored = self.files.get(file_id)
+            if stored:
+                return Response(stored[0], mimetype=stored[1])
+            # 渲染結果都返回同一個示例視頻
+            return send_file(self.video_file, mimetype='video/mp4', conditional=True)
+        
+        @app.route('/upload', methods=['POST'])
+        @app.route(f"{CLIENT_ENV[self.name][1]}/assets", methods=['POST'])
+        def upload_file():
+            self.latency.wait()
+            uploaded = request.files.get("file")
+            data = uploaded.read() if uploaded else request.get_data()
+            file_id = str(uuid.uuid4())
+            with self._lock:
+                self.files[file_id] = (data, uploaded.mimetype if uploaded else "application/octet-stream")
+            return jsonify({"id": file_id, "url": self._file_url(file_id)})
+        
+        @app.route('/_fake/stats', methods=['GET'])
+        def get_stats():
+            with self._lock:
+                responses = dict(self.stats)
+                job_ids = list(self.jobs)
+            jobs: Dict[str, int] = {}
+            for job_id in job_ids:
+                status = self._job_status(job_id)
+                jobs[status] = jobs.get(status, 0) + 1
+            return jsonify({"provider": self.name, "responses": responses, "jobs": jobs})
+    
+    def _register_google_routes(self) -> None:
+        """Google Cloud Text-to-Speech REST API: POST /v1/text:synthesize"""
+        @self.app.route('/v1/text:synthesize', methods=['POST'])
+        def synthesize():
+            data = request.get_json(silent=True) or {}
+            text = (data.get("input") or {}).get("text") or (data.get("input") or {}).get("ssml") or ""
+            if not text:
+                return jsonify({"error": {"code": 400, "message": "input.text is required", "status": "INVALID_ARGUMENT"}}), 400
+            
+            speaking_rate = float((data.get("audioConfig") or {}).get("speakingRate") or 1.0)
+            self.latency.wait(len(text))
+            return jsonify({"audioContent": base64.b64encode(synthesize_wav(text, speaking_rate)).decode("ascii")})
+        
+        @self.app.route('/v1/voices', methods=['GET'])
+        def list_voices():
+            return jsonify({"voices": [
+                {"name": "zh-CN-Wavenet-A", "languageCodes": ["cmn-CN"], "ssmlGender": "FEMALE"},
+                {"name": "zh-CN-Wavenet-B", "languageCodes": ["cmn-CN"], "ssmlGender": "MALE"},
+                {"name": "yue-HK-Standard-A", "languageCodes": ["yue-HK"], "ssmlGender": "FEMALE"},
+                {"name": "en-US-Neural2-F", "languageCodes": ["en-US"], "ssmlGender": "FEMALE"}
+            ]})
+    
+    def _register_azure_routes(self) -> None:
+        """Azure Speech REST API: POST /cognitiveservices/v1，請求體為SSML"""
+        @self.app.route('/cognitiveservices/v1', methods=['POST'])
+        def synthesize():
+            ssml = request.get_data(as_text=True)
+            if not ssml.strip():
+                return Response("SSML body is required", status=400)
+            
+            self.latency.wait(len(ssml))
+            return Response(synthesize_wav(ssml), mimetype="audio/wav")
+        
+        @self.app.route('/cognitiveservices/voices/list', methods=['GET'])
+        def list_voices():
+            return jsonify([
+                {"ShortName": "zh-CN-XiaoxiaoNeural", "Locale": "zh-CN", "Gender": "Female"},
+                {"ShortName": "zh-CN-YunxiNeural", "Locale": "zh-CN", "Gender": "Male"},
+                {"ShortName": "zh-HK-HiuMaanNeural", "Locale": "zh-HK", "Gender": "Female"},
+                {"ShortName": "en-US-JennyNeural", "Locale": "en-US", "Gender": "Female"}
+            ])
+    
+    def _register_deepbrain_routes(self) -> None:
+        """DeepBrain API：同步生成，POST /v1/videos在渲染完成後返回video_url"""
+        @self.app.route('/v1/avatars', methods=['GET'])
+        def list_avatars():
+            language = request.args.get("language")
+            gender = request.args.get("gender")
+            avatars = [
+                avatar for avatar in FAKE_AVATARS
+                if (not language or language in avatar["languages"]) and (not gender or avatar["gender"] == gender)
+            ]
+            return jsonify({"avatars": avatars})
+        
+        @self.app.route('/v1/videos', methods=['POST'])
+        def create_video():
+            data = request.get_json(force=True, silent=True) or {}
+            if not (data.get("avatar") or {}).get("id"):
+                return jsonify({"error": "avatar.id is required"}), 400
+            
+            # 同步接口在同一個請求中完成渲染，失敗的渲染返回500
+            self.latency.wait(len(data.get("expressions") or []))
+            if self._chance(self.config["failure_rate"]):
+                return jsonify({"error": "render failed"}), 500
+            return jsonify({"id": str(uuid.uuid4()), "status": "complete", "video_url": self._file_url("render.mp4")})
+    
+    def _register_synthesia_routes(self) -> None:
+        """Synthesia API：POST /v2/videos返回201和任務ID，GET /v2/videos/<id>查詢狀態"""
+        @self.app.route('/v2/avatars', methods=['GET'])
+        def list_avatars():
+            return jsonify(FAKE_AVATARS)
+        
+        @self.app.route('/v2/videos', methods=['POST'])
+        def create_video():
+            data = request.get_json(force=True, silent=True) or {}
+            scenes = data.get("input") or []
+            if not scenes or not scenes[0].get("avatar"):
+                return jsonify({"error": "input[0].avatar is required"}), 400
+            
+            self.latency.wait()
+            job = self._create_job(len(scenes))
+            return jsonify({"id": job["id"], "status": "pending", "title": data.get("title", "")}), 201
+        
+        @self.app.route('/v2/videos/<video_id>', methods=['GET'])
+        def get_video(video_id):
+            status = self._job_status(video_id)
+            if not status:
+                return jsonify({"error": "video not found"}), 404
+            
+            result = {"id": video_id, "status": status}
+            if status == "complete":
+                result["download"] = self._file_url("render.mp4")
+            elif status == "failed":
+                result["error"] = "injected render failure"
+            return jsonify(result)
+    
+    def _register_zebracat_routes(self) -> None:
+        """Zebracat API：POST /v1/scenes同步返回url，或異步返回任務ID，GET /v1/scenes/<id>查詢狀態"""
+        @self.app.route('/v1/scenes', methods=['POST'])
+        def create_scene():
+            data = request.get_json(force=True, silent=True) or {}
+            if not data.get("prompt"):
+                return jsonify({"error": "prompt is required"}), 400
+            return self._create_scene(data.get("duration", 5), "url")
+        
+        @self.app.route('/v1/scenes/<job_id>', methods=['GET'])
+        def get_scene(job_id):
+            return self._get_scene(job_id, "url")
+    
+    def _register_runway_routes(self) -> None:
+        """Runway API：POST /v1/text-to-video同步返回output，或異步返回任務ID，GET /v1/tasks/<id>查詢狀態"""
+        @self.app.route('/v1/text-to-video', methods=['POST'])
+        def create_video():
+            data = request.get_json(force=True, silent=True) or {}
+            if not data.get("prompt"):
+                return jsonify({"error": "prompt is required"}), 400
+            return self._create_scene(int(data.get("num_frames", 150)) / 30, "output")
+        
+        @self.app.route('/v1/tasks/<job_id>', methods=['GET'])
+        def get_task(job_id):
+            return self._get_scene(job_id, "output")
+    
+    def _create_scene(self, duration: float, url_key: str) -> Tuple[Response, int]:
+        """
+        創建場景渲染：異步模式返回202和任務ID，同步模式等待渲染完成後返回視頻URL
+        
+        Args:
+            duration: 場景時長（秒），作為渲染工作量
+            url_key: 響應中視頻URL的字段名
+            
+        Returns:
+            (響應, 狀態碼)
+        """
+        self.latency.wait()
+        if self.config["async"]:
+            job = self._create_job(duration)
+            return jsonify({"id": job["id"], "status": "pending"}), 202
+        
+        time.sleep(self.render_latency.sample(duration))
+        if self._chance(self.config["failure_rate"]):
+            return jsonify({"error": "render failed"}), 500
+        return jsonify({"id": str(uuid.uuid4()), "status": "complete", url_key: self._file_url("render.mp4")}), 200
+    
+    def _get_scene(self, job_id: str, url_key: str) -> Tuple[Response, int]:
+        """查詢場景渲染任務狀態"""
+        status = self._job_status(job_id)
+        if not status:
+            return jsonify({"error": "task not found"}), 404
+        
+        result = {"id": job_id, "status": status}
+        if status == "complete":
+            result[url_key] = self._file_url("render.mp4")
+        elif status == "failed":
+            result["error"] = "injected render failure"
+        return jsonify(result), 200
+
+def load_config(
+    config_file: Optional[str] = None,
+    providers: Optional[List[str]] = None,
+    overrides: Optional[Dict[str, Any]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    合併默認配置、配置文件和命令行覆蓋
+    
+    Args:
+        config_file: JSON配置文件，格式為 {提供商: {字段: 值}}
+        providers: 要啟動的提供商，默認為全部
+        overrides: 應用到所有提供商的字段
+        
+    Returns:
+        提供商名稱到配置的映射
+    """
+    config = {name: dict(values) for name, values in DEFAULT_CONFIG.items()}
+    if config_file:
+        with open(config_file, encoding="utf-8") as f:
+            for name, values in json.load(f).items():
+                if name not in config:
+                    raise ValueError(f"不支持的提供商: {name}")
+                config[name].update(values)
+    
+    for name in config:
+        config[name].update(overrides or {})
+    
+    return {name: config[name] for name in (providers or config)}
+
+def start_fake_providers(
+    config: Dict[str, Dict[str, Any]],
+    video_file: Optional[str] = None
+) -> Tuple[Dict[str, FakeProvider], List[Any]]:
+    """
+    在獨立線程中啟動服務提供商替身
+    
+    Args:
+        config: 提供商名稱到配置的映射
+        video_file: 渲染結果視頻，默認自動生成
+        
+    Returns:
+        (提供商名稱到替身的映射, HTTP服務器列表)，調用server.shutdown()停止
+    """
+    if not video_file:
+        video_file = os.path.join(tempfile.mkdtemp(prefix="fake_providers_"), "render.mp4")
+        create_sample_video(video_file)
+    
+    fakes = {}
+    servers = []
+    for name, provider_config in config.items():
+        fake = FakeProvider(name, provider_config, video_file)
+        server = make_server("127.0.0.1", int(fake.config["port"]), fake.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        fakes[name] = fake
+        servers.append(server)
+    return fakes, servers
+
+def main():
+    parser = argparse.ArgumentParser(description="啟動本地服務提供商替身")
+    parser.add_argument("--providers", nargs="*", choices=list(DEFAULT_CONFIG), help="要啟動的提供商，默認為全部")
+    parser.add_argument("--config", help="JSON配置文件，格式為 {提供商: {字段: 值}}")
+    parser.add_argument("--video", help="渲染任務返回的視頻，默認自動生成綠幕視頻")
+    parser.add_argument("--error-rate", type=float, help="所有提供商返回500的比例")
+    parser.add_argument("--timeout-rate", type=float, help="所有提供商掛起後返回504的比例")
+    parser.add_argument("--failure-rate", type=float, help="所有提供商渲染任務失敗的比例")
+    parser.add_argument("--rate-limit", type=float, help="所有提供商的每秒請求數，0表示不限制")
+    args = parser.parse_args()
+    
+    overrides = {
+        key: value for key, value in (
+            ("error_rate", args.error_rate),
+            ("timeout_rate", args.timeout_rate),
+            ("failure_rate", args.failure_rate),
+            ("rate_limit", args.rate_limit)
+        ) if value is not None
+    }
+    
+    # 負載測試時每個請求一行日誌會淹沒輸出，只保留警告
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    
+    fakes, servers = start_fake_providers(load_config(args.config, args.providers, overrides), args.video)
+    
+    print("服務提供商替身已啟動，在客戶端設置以下環境變量:")
+    for name, fake in fakes.items():
+        env_name, path = CLIENT_ENV[name]
+        print(f"  export {env_name}={fake.base_url}{path}")
+    print("  export DEEPBRAIN_API_KEY=fake SYNTHESIA_API_KEY=fake ZEBRACAT_API_KEY=fake RUNWAY_API_KEY=fake")
+    print("  export AZURE_SPEECH_KEY=fake AZURE_SPEECH_REGION=local")
+    
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+
+if __name__ == "__main__":
+    main()
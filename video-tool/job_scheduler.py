@@ -0,0 +1,416 @@
+"""
+任務調度模塊 - 生成任務的准入控制、按租戶加權公平排隊和背壓
+
+此模塊提供以下功能：
+1. 生成任務先排隊再執行，同時執行的任務數受限，不在Flask線程中無限堆積
+2. 優先級分類（草稿預覽優先於交互任務，交互任務優先於批量任務），同一優先級內按租戶加權公平排隊，
+   大客戶一次提交大量任務時不會阻塞其他租戶
+3. 語音、數字人、場景等各階段有全局並發上限，等待的請求同樣按優先級和租戶公平分配；
+   漸進式任務的每個段落也要先取得段落渲染位置，多個任務的段落按租戶公平輪流渲染
+4. 總隊列或租戶隊列已滿時拋出SchedulerFull，網關返回429和Retry-After
+
+配置（環境變量）：
+    SCHEDULER_MAX_JOBS               同時執行的生成任務數，默認4
+    SCHEDULER_MAX_QUEUE              排隊的任務總數上限，默認50
+    SCHEDULER_MAX_QUEUE_PER_TENANT   每個租戶排隊的任務數上限，默認20
+    SCHEDULER_QUEUE_TIMEOUT          同步請求最長排隊時間（秒），默認120
+    SCHEDULER_STAGE_LIMITS           各階段並發上限，例如 "tts=4,avatar=2,scene=2,paragraph=2"
+    SCHEDULER_TENANT_WEIGHTS         租戶權重，例如 "acme=2,bulk=0.5"，未列出的租戶權重為1
+"""
+
+import os
+import heapq
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Iterator
+
+from metrics import get_registry
+
+# 優先級分類，越靠前越優先
+PRIORITY_CLASSES = ("draft", "interactive", "batch")
+
+# 各階段默認的並發上限
+DEFAULT_STAGE_LIMITS = {
+    "tts": 4,
+    "avatar": 2,
+    "scene": 2,
+    # 同時渲染的漸進式段落數
+    "paragraph": 2
+}
+
+DEFAULT_TENANT = "default"
+
+class SchedulerFull(Exception):
+    """隊列已滿或排隊超時，調用方應在retry_after秒後重試"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def parse_weights(spec: Optional[str]) -> Dict[str, float]:
+    """
+    解析 "name=value,..." 格式的配置
+    
+    Args:
+        spec: 配置字符串
+        
+    Returns:
+        名稱到數值的映射
+    """
+    values = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            values[name.strip()] = float(value)
+    return values
+
+class Ticket:
+    """排隊憑證，獲得執行權後需要調用release釋放"""
+    
+    def __init__(self, gate: "FairGate", tenant: str, priority: str, cost: float):
+        self.gate = gate
+        self.tenant = tenant
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = time.time()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._granted = threading.Event()
+    
+    @property
+    def granted(self) -> bool:
+        """是否已獲得執行權"""
+        return self._granted.is_set()
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待執行權
+        
+        Args:
+            timeout: 最長等待時間（秒），為None時一直等待
+            
+        Returns:
+            是否已獲得執行權，超時時自動退出隊列並返回False
+        """
+        if self._granted.wait(timeout):
+            return True
+        self.gate.cancel(self)
+        # 退出隊列的同時可能恰好獲得了執行權
+        return self.granted
+    
+    def release(self) -> None:
+        """釋放執行權，未獲得執行權時退出隊列"""
+        self.gate.release(self)
+
+class FairGate:
+    """
+    公平准入門，限制同時執行的數量
+    
+    等待者先按優先級排序，同一優先級內按加權公平排隊（WFQ）：每個租戶的請求按
+    虛擬完成時間 = max(全局虛擬時間, 該租戶上一個請求的虛擬完成時間) + 代價 / 權重 排序，
+    租戶提交再多的請求也只能按其權重分得執行權。
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        max_queue: Optional[int] = None,
+        max_queue_per_tenant: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        """
+        初始化公平准入門
+        
+        Args:
+            name: 名稱，用於錯誤信息和指標
+            capacity: 同時執行的上限
+            max_queue: 排隊總數上限，為None時不限制
+            max_queue_per_tenant: 每個租戶排隊數上限，為None時不限制
+            weights: 租戶權重，未列出的租戶權重為1
+        """
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.weights = weights or {}
+        
+        self._lock = threading.Lock()
+        self._heap: List[Any] = []
+        self._sequence = itertools.count()
+        self._queued: Dict[str, int] = {}
+        self._running = 0
+        self._virtual_time = 0.0
+        self._tenant_finish: Dict[str, float] = {}
+        
+        # 執行時長的指數移動平均，用於估算Retry-After
+        self._average_duration: Optional[float] = None
+    
+    def submit(self, tenant: str = DEFAULT_TENANT, priority: str = "interactive", cost: float = 1.0) -> Ticket:
+        """
+        提交請求，有空閒時立即獲得執行權，否則排隊
+        
+        Args:
+            tenant: 租戶ID
+            priority: 優先級分類
+            cost: 請求的代價（例如段落數），代價越大佔用租戶份額越多
+            
+        Returns:
+            排隊憑證
+            
+        Raises:
+            SchedulerFull: 總隊列或租戶隊列已滿
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"不支持的優先級: {priority}")
+        
+        ticket = Ticket(self, tenant, priority, cost)
+        with self._lock:
+            queued = len(self._heap)
+            if self.max_queue is not None and queued >= self.max_queue:
+                raise SchedulerFull(f"{self.name}隊列已滿", self._retry_after(queued))
+            if self.max_queue_per_tenant is not None and self._queued.get(tenant, 0) >= self.max_queue_per_tenant:
+                raise SchedulerFull(f"租戶 {tenant} 的{self.name}隊列已滿", self._retry_after(self._queued[tenant]))
+            
+            start = max(self._virtual_time, self._tenant_finish.get(tenant, 0.0))
+            finish = start + cost / self.weights.get(tenant, 1.0)
+            self._tenant_finish[tenant] = finish
+            
+            heapq.heappush(self._heap, (PRIORITY_CLASSES.index(priority), finish, next(self._sequence), ticket))
+            self._queued[tenant] = self._queued.get(tenant, 0) + 1
+            self._dispatch()
+        return ticket
+    
+    def release(self, ticket: Ticket) -> None:
+        """釋放執行權並把空出的位置分配給下一個等待者"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self._running -= 1
+                duration = time.time() - ticket.granted_at
+                self._average_duration = (
+                    duration if self._average_duration is None else 0.8 * self._average_duration + 0.2 * duration
+                )
+            else:
+                self._remove(ticket)
+            self._dispatch()
+    
+    def cancel(self, ticket: Ticket) -> None:
+        """尚未獲得執行權時退出隊列"""
+        with self._lock:
+            if not ticket.granted and not ticket.released:
+                ticket.released = True
+                self._remove(ticket)
+    
+    def _remove(self, ticket: Ticket) -> None:
+        """從隊列中移除等待者，調用時必須持有鎖"""
+        self._heap = [entry for entry in self._heap if entry[3] is not ticket]
+        heapq.heapify(self._heap)
+        self._queued[ticket.tenant] -= 1
+    
+    def _dispatch(self) -> None:
+        """按優先級和虛擬完成時間分配空閒位置，調用時必須持有鎖"""
+        while self._heap and self._running < self.capacity:
+            _, finish, _, ticket = heapq.heappop(self._heap)
+            self._queued[ticket.tenant] -= 1
+            self._virtual_time = max(self._virtual_time, finish)
+            self._running += 1
+            ticket.granted_at = time.time()
+            ticket._granted.set()
+        
+        # 所有租戶都空閒時清理虛擬完成時間，避免字典無限增長
+        if not self._heap and not self._running:
+            self._tenant_finish.clear()
+    
+    def _retry_after(self, ahead: int) -> float:
+        """根據前面的等待數和平均執行時長估算重試等待時間（秒），調用時必須持有鎖"""
+        average = self._average_duration or 1.0
+        return max(1.0, average * (ahead + 1) / self.capacity)
+    
+    def retry_after(self) -> float:
+        """按當前排隊數估算的重試等待時間（秒）"""
+        with self._lock:
+            return self._retry_after(len(self._heap))
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """當前狀態：執行數、排隊數和各租戶排隊數"""
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "running": self._running,
+                "queued": len(self._heap),
+                "queued_by_tenant": {tenant: count for tenant, count in self._queued.items() if count},
+                "average_duration": round(self._average_duration, 3) if self._average_duration else None
+            }
+
+class JobScheduler:
+    """生成任務調度類，包含任務准入門和各階段的並發門"""
+    
+    def __init__(
+        self,
+        max_jobs: int = 4,
+        max_queue: int = 50,
+        max_queue_per_tenant: int = 20,
+        stage_limits: Optional[Dict[str, int]] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        queue_timeout: Optional[float] = 120.0
+    ):
+        """
+        初始化生成任務調度類
+        
+        Args:
+            max_jobs: 同時執行的生成任務數
+            max_queue: 排隊的任務總數上限
+            max_queue_per_tenant: 每個租戶排隊的任務數上限
+            stage_limits: 各階段並發上限，未列出的階段不限制
+            tenant_weights: 租戶權重
+            queue_timeout: 同步請求最長排隊時間（秒），為None時一直等待
+        """
+        self.tenant_weights = tenant_weights or {}
+        self.queue_timeout = queue_timeout
+        self.jobs = FairGate("生成任務", max_jobs, max_queue, max_queue_per_tenant, self.tenant_weights)
+        self.stages = {
+            name: FairGate(name, limit, weights=self.tenant_weights)
+            for name, limit in (stage_limits if stage_limits is not None else DEFAULT_STAGE_LIMITS).items()
+        }
+    
+    @classmethod
+    def from_env(cls) -> "JobScheduler":
+        """根據環境變量創建調度器"""
+        stage_limits = dict(DEFAULT_STAGE_LIMITS)
+        stage_limits.update({
+            name: int(limit) for name, limit in parse_weights(os.getenv("SCHEDULER_STAGE_LIMITS")).items()
+        })
+        return cls(
+            max_jobs=int(os.getenv("SCHEDULER_MAX_JOBS", "4")),
+            max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", "50")),
+            max_queue_per_tenant=int(os.getenv("SCHEDULER_MAX_QUEUE_PER_TENANT", "20")),
+            stage_limits=stage_limits,
+            tenant_weights=parse_weights(os.getenv("SCHEDULER_TENANT_WEIGHTS")),
+            queue_timeout=float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "120"))
+        )
+    
+    def submit(self, tenant: str = DEFAULT_TENANT, priority: str = "interactive", cost: float = 1.0) -> Ticket:
+        """
+        提交生成任務，隊列已滿時拋出SchedulerFull
+        
+        Args:
+            tenant: 租戶ID
+            priority: 優先級分類
+            cost: 任務代價，通常為段落數
+            
+        Returns:
+            排隊憑證，任務結束後需要調用release
+        """
+        return self.jobs.submit(tenant, priority, cost)
+    
+    def acquire(
+        self,
+        tenant: str = DEFAULT_TENANT,
+        priority: str = "interactive",
+        cost: float = 1.0,
+        timeout: Optional[float] = None
+    ) -> Ticket:
+        """
+        提交生成任務並等待執行權
+        
+        Args:
+            tenant: 租戶ID
+            priority: 優先級分類
+            cost: 任務代價
+            timeout: 最長排隊時間（秒），默認使用queue_timeout
+            
+        Returns:
+            已獲得執行權的排隊憑證，任務結束後需要調用release
+            
+        Raises:
+            SchedulerFull: 隊列已滿或排隊超時
+        """
+        ticket = self.submit(tenant, priority, cost)
+        if not ticket.wait(self.queue_timeout if timeout is None else timeout):
+            raise SchedulerFull("排隊超時", self.jobs.retry_after())
+        return ticket
+    
+    @contextmanager
+    def run(
+        self,
+        tenant: str = DEFAULT_TENANT,
+        priority: str = "interactive",
+        cost: float = 1.0,
+        timeout: Optional[float] = None
+    ) -> Iterator[Ticket]:
+        """
+        排隊並在獲得執行權後執行，退出時釋放
+        
+        Args:
+            tenant: 租戶ID
+            priority: 優先級分類
+            cost: 任務代價
+            timeout: 最長排隊時間（秒），默認使用queue_timeout
+            
+        Raises:
+            SchedulerFull: 隊列已滿或排隊超時
+        """
+        ticket = self.acquire(tenant, priority, cost, timeout)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+    
+    @contextmanager
+    def stage(self, name: str, tenant: str = DEFAULT_TENANT, priority: str = "interactive") -> Iterator[None]:
+        """
+        在階段並發上限內執行，未配置上限的階段直接執行
+        
+        Args:
+            name: 階段名稱
+            tenant: 租戶ID
+            priority: 優先級分類
+        """
+        gate = self.stages.get(name)
+        if gate is None:
+            yield
+            return
+        
+        ticket = gate.submit(tenant, priority)
+        try:
+            ticket.wait()
+            yield
+        finally:
+            ticket.release()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """調度器狀態，包括任務隊列和各階段"""
+        return {
+            "jobs": self.jobs.snapshot(),
+            "stages": {name: gate.snapshot() for name, gate in self.stages.items()}
+        }
+
+_shared_scheduler = None
+_shared_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> JobScheduler:
+    """
+    獲取進程內共享的調度器
+    
+    Returns:
+        JobScheduler實例
+    """
+    global _shared_scheduler
+    with _shared_scheduler_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = JobScheduler.from_env()
+            
+            scheduler = _shared_scheduler
+            registry = get_registry()
+            registry.gauge_callback(
+                "scheduler_jobs_queued", "排隊等待執行的生成任務數", lambda: scheduler.jobs.snapshot()["queued"]
+            )
+            registry.gauge_callback(
+                "scheduler_jobs_running", "正在執行的生成任務數", lambda: scheduler.jobs.snapshot()["running"]
+            )
+        return _shared_scheduler
@@ -0,0 +1,205 @@
+"""
+Ken Burns動畫模塊 - 將單張圖片渲染為帶推拉和平移運動的場景視頻
+
+此模塊提供以下功能：
+1. 以向量化方式一次性預計算整段視頻每一幀的仿射變換矩陣
+2. 根據輸出尺寸和最大縮放倍數預先縮小源圖片，逐幀變換時只處理需要的像素
+3. 使用cv2.warpAffine按批次變換到共享的幀緩衝區，每批一次寫入FFmpeg管道
+4. 相比文本生成視頻，只需一張圖片即可生成有運動的場景，渲染成本低幾個數量級
+"""
+
+import os
+import zlib
+import time
+import subprocess
+from typing import Dict, Optional, Any, Tuple
+
+import cv2
+import numpy as np
+
+from render_settings import get_encoder_settings, get_frame_size, video_encoder_args
+from video_concat import FFMPEG_BINARY
+from metrics import observe_render
+
+# 運動方式：(起始縮放, 結束縮放, 起始焦點, 結束焦點)，焦點為圖片寬高的比例
+MOTIONS = {
+    "zoom_in": (1.0, 1.25, (0.5, 0.5), (0.5, 0.45)),
+    "zoom_out": (1.25, 1.0, (0.5, 0.45), (0.5, 0.5)),
+    "pan_left": (1.15, 1.15, (0.65, 0.5), (0.35, 0.5)),
+    "pan_right": (1.15, 1.15, (0.35, 0.5), (0.65, 0.5)),
+    "pan_up": (1.15, 1.15, (0.5, 0.65), (0.5, 0.35)),
+    "pan_down": (1.15, 1.15, (0.5, 0.35), (0.5, 0.65))
+}
+
+class KenBurnsAnimator:
+    """Ken Burns動畫類，將靜態圖片渲染為推拉平移的視頻"""
+    
+    def __init__(self, fps: int = 25, encoder: Optional[Dict[str, Any]] = None, batch_size: int = 16):
+        """
+        初始化Ken Burns動畫類
+        
+        Args:
+            fps: 輸出視頻幀率
+            encoder: 編碼參數（get_encoder_settings返回值），默認使用RENDER_PROFILE環境變量對應的配置
+            batch_size: 每批變換並寫入管道的幀數
+        """
+        self.fps = fps
+        self.encoder = encoder or get_encoder_settings()
+        self.batch_size = batch_size
+    
+    def choose_motion(self, key: str) -> str:
+        """
+        根據圖片或場景描述穩定地選擇運動方式，相鄰場景的運動各不相同
+        
+        Args:
+            key: 選擇依據，通常為圖片路徑或場景描述
+            
+        Returns:
+            運動方式名稱
+        """
+        names = sorted(MOTIONS)
+        return names[zlib.crc32(key.encode("utf-8")) % len(names)]
+    
+    def plan_motion(
+        self,
+        source_size: Tuple[int, int],
+        output_size: Tuple[int, int],
+        n_frames: int,
+        motion: str = "zoom_in"
+    ) -> np.ndarray:
+        """
+        一次性計算所有幀的仿射變換矩陣
+        
+        Args:
+            source_size: 源圖片尺寸 (寬度, 高度)
+            output_size: 輸出幀尺寸 (寬度, 高度)
+            n_frames: 幀數
+            motion: 運動方式，見MOTIONS
+            
+        Returns:
+            形狀為 (n_frames, 2, 3) 的float32矩陣數組，將源圖片坐標映射到輸出幀坐標
+        """
+        src_w, src_h = source_size
+        out_w, out_h = output_size
+        zoom_start, zoom_end, focus_start, focus_end = MOTIONS.get(motion, MOTIONS["zoom_in"])
+        
+        # 緩入緩出的進度曲線，避免運動在開頭和結尾突然啟停
+        t = np.linspace(0.0, 1.0, n_frames) if n_frames > 1 else np.zeros(1)
+        progress = t * t * (3.0 - 2.0 * t)
+        
+        # 基礎縮放使圖片剛好覆蓋輸出幀，再乘以運動的縮放倍數
+        cover = max(out_w / src_w, out_h / src_h)
+        scale = cover * (zoom_start + (zoom_end - zoom_start) * progress)
+        
+        # 焦點限制在可見範圍內，畫面不會露出圖片邊緣
+        half_w = out_w / (2.0 * scale)
+        half_h = out_h / (2.0 * scale)
+        center_x = np.clip((focus_start[0] + (focus_end[0] - focus_start[0]) * progress) * src_w, half_w, src_w - half_w)
+        center_y = np.clip((focus_start[1] + (focus_end[1] - focus_start[1]) * progress) * src_h, half_h, src_h - half_h)
+        
+        matrices = np.zeros((len(progress), 2, 3), dtype=np.float32)
+        matrices[:, 0, 0] = scale
+        matrices[:, 1, 1] = scale
+        matrices[:, 0, 2] = out_w / 2.0 - scale * center_x
+        matrices[:, 1, 2] = out_h / 2.0 - scale * center_y
+        
+        return matrices
+    
+    def prepare_source(self, image: np.ndarray, output_size: Tuple[int, int], motion: str) -> np.ndarray:
+        """
+        將源圖片縮小到運動過程中需要的最大分辨率，減少逐幀變換的計算量和鋸齒
+        
+        Args:
+            image: 源圖片（BGR）
+            output_size: 輸出幀尺寸 (寬度, 高度)
+            motion: 運動方式
+            
+        Returns:
+            縮小後的圖片，不需要縮小時返回原圖
+        """
+        out_w, out_h = output_size
+        src_h, src_w = image.shape[:2]
+        zoom_start, zoom_end, _, _ = MOTIONS.get(motion, MOTIONS["zoom_in"])
+        
+        max_scale = max(out_w / src_w, out_h / src_h) * max(zoom_start, zoom_end)
+        if max_scale >= 1.0:
+            return image
+        
+        size = (max(out_w, int(round(src_w * max_scale))), max(out_h, int(round(src_h * max_scale))))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    
+    def render(
+        self,
+        image_file: str,
+        output_file: str,
+        duration: float = 5,
+        resolution: str = "1080p",
+        motion: Optional[str] = None,
+        fps: Optional[int] = None,
+        encoder: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        將圖片渲染為Ken Burns運動視頻
+        
+        Args:
+            image_file: 圖片文件路徑
+            output_file: 輸出視頻文件路徑
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
+            motion: 運動方式，默認根據圖片路徑選擇
+            fps: 本次渲染的幀率，默認使用初始化時的幀率
+            encoder: 本次渲染的編碼參數，默認使用初始化時的編碼參數
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        fps = fps or self.fps
+        encoder = encoder or self.encoder
+        motion = motion or self.choose_motion(os.path.basename(image_file))
+        
+        image = cv2.imread(image_file, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"無法讀取圖片: {image_file}")
+        
+        width, height = get_frame_size(resolution)
+        source = self.prepare_source(image, (width, height), motion)
+        n_frames = max(1, int(round(duration * fps)))
+        matrices = self.plan_motion((source.shape[1], source.shape[0]), (width, height), n_frames, motion)
+        
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            *video_encoder_args(encoder, fps),
+            "-an",
+            "-movflags", "+faststart",
+            output_file
+        ]
+        
+        # 整段視頻共用一個批次緩衝區，warpAffine直接寫入緩衝區，不分配新幀
+        batch = np.empty((self.batch_size, height, width, 3), dtype=np.uint8)
+        
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for start in range(0, n_frames, self.batch_size):
+                count = min(self.batch_size, n_frames - start)
+                for i in range(count):
+                    cv2.warpAffine(
+                        source, matrices[start + i], (width, height), dst=batch[i],
+                        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT
+                    )
+                process.stdin.write(batch[:count].data)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        
+        stderr = process.stderr.read().decode("utf-8", errors="ignore")
+        if process.wait() != 0:
+            raise RuntimeError(f"Ken Burns視頻編碼失敗: {stderr}")
+        
+        observe_render("ken_burns", n_frames, time.perf_counter() - started)
+        return output_file
@@ -0,0 +1,142 @@
+"""
+延遲模型模塊 - 為模擬服務提供商生成可配置、可重現的響應延遲
+
+此模塊提供以下功能：
+1. 延遲由固定部分和按工作量（例如字符數、秒數）線性增長的部分組成
+2. 支持固定、均勻分佈和對數正態分佈三種抖動
+3. 使用獨立的帶種子隨機數生成器，相同配置每次產生相同的延遲序列
+4. 可以從 "base=0.5,per_unit=0.002,jitter=0.2,distribution=lognormal,seed=1" 格式的字符串解析
+"""
+
+import time
+import random
+import threading
+from typing import Dict, Any
+
+DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+class LatencyModel:
+    """延遲模型類，根據工作量生成延遲並可選地等待"""
+    
+    def __init__(
+        self,
+        base: float = 0.0,
+        per_unit: float = 0.0,
+        jitter: float = 0.0,
+        distribution: str = "fixed",
+        seed: int = 0
+    ):
+        """
+        初始化延遲模型
+        
+        Args:
+            base: 固定延遲（秒）
+            per_unit: 每單位工作量增加的延遲（秒）
+            jitter: 抖動幅度，uniform為相對幅度（0.2表示±20%），lognormal為對數標準差
+            distribution: 抖動分佈（fixed、uniform或lognormal）
+            seed: 隨機數種子
+        """
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"不支持的延遲分佈: {distribution}")
+        
+        self.base = base
+        self.per_unit = per_unit
+        self.jitter = jitter
+        self.distribution = distribution
+        self.seed = seed
+        
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_spec(cls, spec: str) -> "LatencyModel":
+        """
+        從字符串解析延遲模型
+        
+        Args:
+            spec: 逗號分隔的 key=value 配置，只寫一個數字時表示固定延遲
+            
+        Returns:
+            LatencyModel實例
+        """
+        spec = (spec or "").strip()
+        if not spec:
+            return cls()
+        
+        try:
+            return cls(base=float(spec))
+        except ValueError:
+            pass
+        
+        options: Dict[str, Any] = {}
+        for item in spec.split(","):
+            key, _, value = item.partition("=")
+            key = key.strip()
+            if key == "distribution":
+                options[key] = value.strip()
+            elif key == "seed":
+                options[key] = int(value)
+            elif key in ("base", "per_unit", "jitter"):
+                options[key] = float(value)
+            else:
+                raise ValueError(f"無效的延遲模型配置: {item}")
+        return cls(**options)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """導出配置，用於記錄在基準測試結果中"""
+        return {
+            "base": self.base,
+            "per_unit": self.per_unit,
+            "jitter": self.jitter,
+            "distribution": self.distribution,
+            "seed": self.seed
+        }
+    
+    def reset(self) -> None:
+        """重置隨機數生成器，重新產生相同的延遲序列"""
+        with self._lock:
+            self._random = random.Random(self.seed)
+    
+    def sample(self, units: float = 0.0) -> float:
+        """
+        生成一個延遲
+        
+        Args:
+            units: 工作量
+            
+        Returns:
+            延遲（秒），不小於0
+        """
+        expected = self.base + self.per_unit * units
+        if expected <= 0 or self.distribution == "fixed" or self.jitter <= 0:
+            return max(0.0, expected)
+        
+        with self._lock:
+            if self.distribution == "uniform":
+                factor = self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            else:
+                # 對數正態分佈的均值保持為expected，長尾來自少數很慢的請求
+                factor = self._random.lognormvariate(-self.jitter ** 2 / 2, self.jitter)
+        
+        return max(0.0, expected * factor)
+    
+    def wait(self, units: float = 0.0) -> float:
+        """
+        按生成的延遲等待
+        
+        Args:
+            units: 工作量
+            
+        Returns:
+            實際等待的延遲（秒）
+        """
+        delay = self.sample(units)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+    
+    def __repr__(self) -> str:
+        return (
+            f"LatencyModel(base={self.base}, per_unit={self.per_unit}, jitter={self.jitter}, "
+            f"distribution={self.distribution!r}, seed={self.seed})"
+        )
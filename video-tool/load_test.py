@@ -0,0 +1,606 @@
+"""
+網關負載測試 - 按真實的請求組合對網關API施加並發負載，找出飽和點
+
+此腳本提供以下功能：
+1. 按權重混合上傳、兩種視頻模式的生成、視頻範圍讀取和健康檢查請求
+2. 開環模式按泊松到達率逐級提高負載，閉環模式逐級增加並發用戶數
+3. 記錄每一級負載的吞吐量、錯誤率和各類請求的p50/p95/p99延遲
+4. 請求被丟棄、延遲相對最低負載明顯增長、延遲超出目標或錯誤率超出閾值時標記為飽和
+5. 提供語音、數字人和場景服務的本地替身，可以在單台Linux機器上完成測試
+
+使用方法：
+    python load_test.py standins
+    python app.py
+    python load_test.py run --rates 1 2 4 8 --stage-duration 30 --output load.json
+    python load_test.py run --mode closed --concurrency 1 2 4 8 16 --mix health=1,video=4,generate_pip=1
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Tuple
+
+import requests
+from flask import Flask, request, jsonify, send_file
+from werkzeug.serving import make_server
+
+from latency_model import LatencyModel
+from benchmark_pipeline import build_text, percentile
+from video_concat import FFMPEG_BINARY
+
+# 請求類型及默認權重
+DEFAULT_MIX = "upload=1,generate_scene_switching=1,generate_pip=1,video=4,health=2"
+OPERATIONS = ("upload", "generate_scene_switching", "generate_pip", "video", "health")
+
+# 本地替身服務的端口，與網關的服務配置一致
+STANDIN_PORTS = {
+    "tts": 5000,
+    "digital_human": 5001,
+    "scene": 5002
+}
+
+# 替身服務的默認延遲模型
+DEFAULT_STANDIN_LATENCY = {
+    "tts": "base=0.3,per_unit=0.002,jitter=0.3,distribution=lognormal,seed=1",
+    "digital_human": "base=2,jitter=0.3,distribution=lognormal,seed=2",
+    "scene": "base=3,per_unit=0.005,jitter=0.3,distribution=lognormal,seed=3"
+}
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """
+    解析請求組合
+    
+    Args:
+        spec: 逗號分隔的 請求類型=權重
+        
+    Returns:
+        請求類型到權重的映射
+    """
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"不支持的請求類型: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def create_standin_video(output_file: str, duration: int = 10, resolution: str = "640x360") -> str:
+    """生成替身服務返回的示例視頻"""
+    subprocess.run([
+        FFMPEG_BINARY, "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest",
+        "-movflags", "+faststart",
+        output_file
+    ], capture_output=True, check=True)
+    return output_file
+
+def create_standin_app(service: str, latency: LatencyModel, video_file: str) -> Flask:
+    """
+    創建一個下游服務的替身應用，只實現網關調用的接口
+    
+    Args:
+        service: 服務名稱（tts、digital_human或scene）
+        latency: 處理請求的延遲模型，語音和場景服務的工作量為文本字符數
+        video_file: 視頻接口返回的示例視頻
+        
+    Returns:
+        Flask應用
+    """
+    app = Flask(f"standin_{service}")
+    
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        return jsonify({"status": "ok", "message": f"{service}替身服務正常運行"})
+    
+    if service == "tts":
+        @app.route('/synthesize', methods=['POST'])
+        def synthesize():
+            text = (request.json or {}).get("text", "")
+            latency.wait(len(text))
+            return jsonify({"message": "語音生成成功", "audio_id": str(uuid.uuid4())})
+        
+        @app.route('/upload_audio', methods=['POST'])
+        def upload_audio():
+            latency.wait()
+            return jsonify({"message": "音頻上傳成功", "audio_id": str(uuid.uuid4())})
+    elif service == "digital_human":
+        @app.route('/generate', methods=['POST'])
+        def generate():
+            latency.wait()
+            return jsonify({"message": "數字人視頻生成成功", "video_id": str(uuid.uuid4())})
+    else:
+        def compose():
+            text = (request.json or {}).get("text", "")
+            latency.wait(len(text))
+            return jsonify({"message": "場景視頻生成成功", "video_id": str(uuid.uuid4())})
+        
+        app.add_url_rule('/process', 'process', compose, methods=['POST'])
+        app.add_url_rule('/picture-in-picture', 'picture_in_picture', compose, methods=['POST'])
+    
+    if service != "tts":
+        @app.route('/video/<video_id>', methods=['GET'])
+        def get_video(video_id):
+            return send_file(video_file, mimetype='video/mp4')
+    
+    return app
+
+def run_standins(latency_specs: Dict[str, str], video_file: Optional[str] = None) -> None:
+    """
+    在獨立線程中啟動所有替身服務，直到按Ctrl+C
+    
+    Args:
+        latency_specs: 服務名稱到延遲模型配置的映射
+        video_file: 示例視頻，默認自動生成
+    """
+    if not video_file:
+        video_file = os.path.join(tempfile.mkdtemp(prefix="standin_"), "sample.mp4")
+        create_standin_video(video_file)
+    
+    servers = []
+    for service, port in STANDIN_PORTS.items():
+        latency = LatencyModel.from_spec(latency_specs[service])
+        server = make_server("127.0.0.1", port, create_standin_app(service, latency, video_file), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        print(f"{service}替身服務: http://127.0.0.1:{port}，延遲模型 {latency}")
+    
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+
+class LoadGenerator:
+    """負載生成類，按請求組合向網關發送請求並記錄結果"""
+    
+    def __init__(
+        self,
+        gateway_url: str,
+        mix: Dict[str, float],
+        text_length: int = 300,
+        quality: str = "draft",
+        range_size: int = 1024 * 1024,
+        timeout: float = 600.0,
+        seed: int = 0
+    ):
+        """
+        初始化負載生成類
+        
+        Args:
+            gateway_url: 網關地址
+            mix: 請求類型到權重的映射
+            text_length: 上傳和生成請求的文本長度（字符數）
+            quality: 生成請求的渲染質量
+            range_size: 視頻範圍讀取的字節數
+            timeout: 單個請求的超時時間（秒）
+            seed: 選擇請求類型和到達間隔的隨機數種子
+        """
+        self.gateway_url = gateway_url.rstrip("/")
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.text = build_text(text_length)
+        self.quality = quality
+        self.range_size = range_size
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        
+        # 生成成功的視頻，供範圍讀取使用：視頻ID到文件大小（未知時為None）
+        self.videos: Dict[str, Optional[int]] = {}
+        self._videos_lock = threading.Lock()
+        self._local = threading.local()
+    
+    @property
+    def session(self) -> requests.Session:
+        """每個線程使用獨立的連接池"""
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+    
+    def choose_operation(self) -> str:
+        """按權重選擇請求類型"""
+        return self.random.choices(self.operations, self.weights)[0]
+    
+    def warm_up(self) -> None:
+        """為範圍讀取準備至少一個視頻"""
+        if "video" in self.operations and not self.videos:
+            print("預熱: 生成一個視頻供範圍讀取使用...")
+            status, error = self.generate("picture_in_picture")
+            if error:
+                print(f"警告: 預熱生成視頻失敗，範圍讀取請求將被跳過: {error}")
+    
+    def execute(self, operation: str) -> Dict[str, Any]:
+        """
+        發送一個請求並記錄結果
+        
+        Args:
+            operation: 請求類型
+            
+        Returns:
+            結果字典，包含operation、status、latency和error
+        """
+        started = time.perf_counter()
+        try:
+            if operation == "upload":
+                status, error = self.upload()
+            elif operation == "generate_scene_switching":
+                status, error = self.generate("scene_switching")
+            elif operation == "generate_pip":
+                status, error = self.generate("picture_in_picture")
+            elif operation == "video":
+                status, error = self.read_video_range()
+            else:
+                status, error = self.health()
+        except requests.RequestException as e:
+            status, error = None, f"{type(e).__name__}: {str(e)}"
+        
+        return {
+            "operation": operation,
+            "status": status,
+            "latency": time.perf_counter() - started,
+            "error": error
+        }
+    
+    def upload(self) -> Tuple[int, Optional[str]]:
+        """上傳演講稿文本文件"""
+        response = self.session.post(
+            f"{self.gateway_url}/api/upload",
+            files={"file": ("script.txt", self.text.encode("utf-8"), "text/plain")},
+            timeout=self.timeout
+        )
+        return response.status_code, None if response.status_code == 200 else response.text[:200]
+    
+    def generate(self, video_mode: str) -> Tuple[int, Optional[str]]:
+        """以指定視頻模式生成視頻，成功後記錄視頻ID"""
+        response = self.session.post(
+            f"{self.gateway_url}/api/generate",
+            json={
+                "text": self.text,
+                "language": "zh-CN",
+                "voice_id": "load-test-voice",
+                "avatar_id": "load-test-avatar",
+                "video_mode": video_mode,
+                "quality": self.quality
+            },
+            timeout=self.timeout
+        )
+        if response.status_code != 200:
+            return response.status_code, response.text[:200]
+        
+        video_id = response.json().get("final_video_id")
+        if video_id:
+            with self._videos_lock:
+                self.videos.setdefault(video_id, None)
+        return response.status_code, None
+    
+    def read_video_range(self) -> Tuple[Optional[int], Optional[str]]:
+        """按隨機偏移讀取已生成視頻的一段字節範圍，模擬播放器的拖動和分段加載"""
+        with self._videos_lock:
+            if not self.videos:
+                return None, "沒有可讀取的視頻"
+            video_id = self.random.choice(list(self.videos))
+            size = self.videos[video_id]
+        
+        start = self.random.randrange(0, max(1, size - self.range_size)) if size else 0
+        response = self.session.get(
+            f"{self.gateway_url}/api/video/{video_id}",
+            headers={"Range": f"bytes={start}-{start + self.range_size - 1}"},
+            timeout=self.timeout
+        )
+        # 讀完響應體，延遲包含傳輸時間
+        _ = response.content
+        
+        if response.status_code not in (200, 206):
+            return response.status_code, response.text[:200]
+        
+        content_range = response.headers.get("Content-Range", "")
+        if size is None and "/" in content_range:
+            with self._videos_lock:
+                self.videos[video_id] = int(content_range.rsplit("/", 1)[1])
+        return response.status_code, None
+    
+    def health(self) -> Tuple[int, Optional[str]]:
+        """輪詢健康檢查"""
+        response = self.session.get(f"{self.gateway_url}/api/health", timeout=self.timeout)
+        return response.status_code, None if response.status_code == 200 else response.text[:200]
+    
+    def run_open_stage(self, rate: float, duration: float, max_in_flight: int) -> Dict[str, Any]:
+        """
+        開環負載：按泊松過程以固定到達率發送請求，不等待之前的請求完成
+        
+        Args:
+            rate: 到達率（請求/秒）
+            duration: 持續時間（秒）
+            max_in_flight: 最大同時進行的請求數，超出時丟棄新請求並記為客戶端飽和
+            
+        Returns:
+            本級負載的結果
+        """
+        results: List[Dict[str, Any]] = []
+        in_flight = threading.Semaphore(max_in_flight)
+        dropped = 0
+        
+        def run(operation: str) -> None:
+            try:
+                results.append(self.execute(operation))
+            finally:
+                in_flight.release()
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            next_arrival = started
+            sent = 0
+            while True:
+                next_arrival += self.random.expovariate(rate)
+                if next_arrival - started >= duration:
+                    break
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                sent += 1
+                if not in_flight.acquire(blocking=False):
+                    dropped += 1
+                    continue
+                executor.submit(run, self.choose_operation())
+        elapsed = time.perf_counter() - started
+        
+        stage = summarize_stage(results, elapsed)
+        stage.update({"offered_rate": rate, "arrival_rate": round(sent / duration, 3), "sent": sent, "dropped": dropped})
+        return stage
+    
+    def run_closed_stage(self, concurrency: int, duration: float) -> Dict[str, Any]:
+        """
+        閉環負載：固定數量的用戶各自連續發送請求，上一個請求完成後立即發送下一個
+        
+        Args:
+            concurrency: 並發用戶數
+            duration: 持續時間（秒）
+            
+        Returns:
+            本級負載的結果
+        """
+        results: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+        deadline = started + duration
+        
+        def user() -> None:
+            while time.perf_counter() < deadline:
+                results.append(self.execute(self.choose_operation()))
+        
+        threads = [threading.Thread(target=user) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        stage = summarize_stage(results, elapsed)
+        stage["concurrency"] = concurrency
+        return stage
+
+def summarize_latency(latencies: List[float]) -> Dict[str, Any]:
+    """匯總延遲的p50、p95、p99和最大值"""
+    if not latencies:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "count": len(latencies),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies), 3)
+    }
+
+def summarize_stage(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """
+    匯總一級負載的結果
+    
+    Args:
+        results: 請求結果列表
+        elapsed: 本級負載的實際耗時（秒），包括等待最後的請求完成
+        
+    Returns:
+        匯總結果字典
+    """
+    errors = [result for result in results if result["error"]]
+    operations = {}
+    for name in OPERATIONS:
+        subset = [result for result in results if result["operation"] == name]
+        if not subset:
+            continue
+        failed = [result for result in subset if result["error"]]
+        operations[name] = {
+            **summarize_latency([result["latency"] for result in subset if not result["error"]]),
+            "errors": len(failed),
+            "error_rate": round(len(failed) / len(subset), 4)
+        }
+    
+    error_samples = {}
+    for result in errors:
+        key = f"{result['operation']}:{result['status']}"
+        error_samples.setdefault(key, result["error"])
+    
+    return {
+        "elapsed": round(elapsed, 3),
+        "requests": len(results),
+        "throughput": round((len(results) - len(errors)) / elapsed, 3) if elapsed > 0 else None,
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "latency": summarize_latency([result["latency"] for result in results if not result["error"]]),
+        "operations": operations,
+        "error_samples": error_samples
+    }
+
+def find_saturation(
+    stages: List[Dict[str, Any]],
+    mode: str,
+    slo_p95: Optional[float],
+    max_error_rate: float,
+    latency_factor: float = 2.0,
+    min_gain: float = 0.1
+) -> Optional[Dict[str, Any]]:
+    """
+    找出第一個飽和的負載級別
+    
+    開環模式下有請求被丟棄，或任一類請求的p50延遲超過其首次出現時的latency_factor倍時視為飽和
+    （請求開始排隊）；閉環模式下增加並發後吞吐量的增幅低於min_gain時視為飽和。
+    兩種模式下p95延遲超出目標或錯誤率超出閾值時也視為飽和。
+    
+    Args:
+        stages: 各級負載的結果
+        mode: 負載模式（open或closed）
+        slo_p95: p95延遲目標（秒），為None時不檢查
+        max_error_rate: 最大錯誤率
+        latency_factor: 開環模式下延遲相對最低負載的最大增長倍數
+        min_gain: 閉環模式下吞吐量的最小相對增幅
+        
+    Returns:
+        飽和級別和原因，所有級別都未飽和時返回None
+    """
+    previous = None
+    baseline: Dict[str, float] = {}
+    for stage in stages:
+        reasons = []
+        if stage["error_rate"] > max_error_rate:
+            reasons.append(f"錯誤率 {stage['error_rate']:.1%} 超過 {max_error_rate:.1%}")
+        if slo_p95 and stage["latency"]["p95"] and stage["latency"]["p95"] > slo_p95:
+            reasons.append(f"p95延遲 {stage['latency']['p95']}秒 超過 {slo_p95}秒")
+        
+        if mode == "open":
+            if stage["dropped"]:
+                reasons.append(f"客戶端丟棄 {stage['dropped']} 個請求")
+            for name, operation in stage["operations"].items():
+                base = baseline.setdefault(name, operation["p50"])
+                # 忽略毫秒級的波動
+                if base and operation["p50"] and operation["p50"] > max(base * latency_factor, base + 0.05):
+                    reasons.append(f"{name} p50延遲從 {base}秒 增加到 {operation['p50']}秒")
+        elif previous and previous["throughput"]:
+            gain = (stage["throughput"] - previous["throughput"]) / previous["throughput"]
+            if gain < min_gain:
+                reasons.append(f"並發從 {previous['concurrency']} 增加到 {stage['concurrency']} 後吞吐量只增加 {gain:.1%}")
+        
+        if reasons:
+            return {"level": stage.get("offered_rate", stage.get("concurrency")), "reasons": reasons}
+        previous = stage
+    return None
+
+def print_stages(stages: List[Dict[str, Any]], mode: str) -> None:
+    """以表格打印各級負載的結果"""
+    level_name = "到達率" if mode == "open" else "並發數"
+    header = (
+        f"{level_name:<8}{'請求數':>8}{'吞吐量/秒':>11}{'錯誤率':>9}"
+        f"{'p50(秒)':>10}{'p95(秒)':>10}{'p99(秒)':>10}{'丟棄':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for stage in stages:
+        level = stage.get("offered_rate", stage.get("concurrency"))
+        latency = stage["latency"]
+        print(
+            f"{str(level):<8}{stage['requests']:>8}{str(stage['throughput']):>11}{stage['error_rate']:>9.1%}"
+            f"{str(latency['p50']):>10}{str(latency['p95']):>10}{str(latency['p99']):>10}{stage.get('dropped', 0):>6}"
+        )
+        for name, operation in stage["operations"].items():
+            print(
+                f"  {name:<26}{operation['count']:>6}{operation['error_rate']:>9.1%}"
+                f"{str(operation['p50']):>10}{str(operation['p95']):>10}{str(operation['p99']):>10}"
+            )
+        for key, error in stage["error_samples"].items():
+            print(f"  錯誤 {key}: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="對網關API施加並發負載")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    standins_parser = subparsers.add_parser("standins", help="啟動語音、數字人和場景服務的本地替身")
+    standins_parser.add_argument("--video", help="替身服務返回的示例視頻，默認自動生成")
+    for service in STANDIN_PORTS:
+        standins_parser.add_argument(
+            f"--{service.replace('_', '-')}-latency", dest=f"{service}_latency", default=DEFAULT_STANDIN_LATENCY[service],
+            help=f"{service}替身服務的延遲模型"
+        )
+    
+    run_parser = subparsers.add_parser("run", help="運行負載測試")
+    run_parser.add_argument("--gateway", default="http://127.0.0.1:8080", help="網關地址")
+    run_parser.add_argument("--mode", choices=("open", "closed"), default="open", help="開環（到達率）或閉環（並發用戶）")
+    run_parser.add_argument("--rates", nargs="*", type=float, default=[0.5, 1, 2, 4], help="開環模式各級的到達率（請求/秒）")
+    run_parser.add_argument("--concurrency", nargs="*", type=int, default=[1, 2, 4, 8], help="閉環模式各級的並發用戶數")
+    run_parser.add_argument("--stage-duration", type=float, default=30, help="每級負載的持續時間（秒）")
+    run_parser.add_argument("--max-in-flight", type=int, default=64, help="開環模式最大同時進行的請求數")
+    run_parser.add_argument("--mix", default=DEFAULT_MIX, help="請求組合，格式為 請求類型=權重")
+    run_parser.add_argument("--text-length", type=int, default=300, help="上傳和生成請求的文本長度")
+    run_parser.add_argument("--quality", default="draft", help="生成請求的渲染質量")
+    run_parser.add_argument("--range-size", type=int, default=1024 * 1024, help="視頻範圍讀取的字節數")
+    run_parser.add_argument("--slo-p95", type=float, help="p95延遲目標（秒），超出時視為飽和")
+    run_parser.add_argument("--max-error-rate", type=float, default=0.01, help="最大錯誤率，超出時視為飽和")
+    run_parser.add_argument("--latency-factor", type=float, default=2.0, help="開環模式下延遲相對最低負載的最大增長倍數")
+    run_parser.add_argument("--seed", type=int, default=0, help="隨機數種子")
+    run_parser.add_argument("--output", help="將結果保存為JSON文件")
+    args = parser.parse_args()
+    
+    if args.command == "standins":
+        run_standins({service: getattr(args, f"{service}_latency") for service in STANDIN_PORTS}, args.video)
+        return
+    
+    generator = LoadGenerator(
+        args.gateway, parse_mix(args.mix), text_length=args.text_length, quality=args.quality,
+        range_size=args.range_size, seed=args.seed
+    )
+    try:
+        generator.health()
+    except requests.RequestException as e:
+        print(f"無法連接到網關 {args.gateway}: {str(e)}")
+        sys.exit(1)
+    generator.warm_up()
+    
+    stages = []
+    levels = args.rates if args.mode == "open" else args.concurrency
+    for level in levels:
+        if args.mode == "open":
+            print(f"到達率 {level} 請求/秒，持續 {args.stage_duration} 秒...")
+            stage = generator.run_open_stage(level, args.stage_duration, args.max_in_flight)
+        else:
+            print(f"並發用戶 {level}，持續 {args.stage_duration} 秒...")
+            stage = generator.run_closed_stage(level, args.stage_duration)
+        stages.append(stage)
+        
+        # 已嚴重過載時不再繼續提高負載
+        if stage["error_rate"] > 0.5:
+            print("錯誤率超過50%，停止提高負載")
+            break
+    
+    saturation = find_saturation(stages, args.mode, args.slo_p95, args.max_error_rate, args.latency_factor)
+    
+    print()
+    print_stages(stages, args.mode)
+    print()
+    if saturation:
+        print(f"飽和點: {saturation['level']}（{'；'.join(saturation['reasons'])}）")
+    else:
+        print("所有負載級別均未飽和")
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "gateway": args.gateway,
+                "mode": args.mode,
+                "mix": parse_mix(args.mix),
+                "stage_duration": args.stage_duration,
+                "text_length": args.text_length,
+                "quality": args.quality,
+                "stages": stages,
+                "saturation": saturation
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已保存到 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+"""
+指標模塊 - 以Prometheus文本格式導出各服務的運行指標
+
+此模塊提供以下功能：
+1. 計數器、儀表和直方圖三種指標，支持標籤
+2. 每個線程寫入自己的分片，熱路徑上不加鎖；導出時合併所有分片，已結束線程的分片併入匯總
+3. 回調儀表在導出時才計算（例如隊列深度），不在熱路徑上維護
+4. 在Flask應用中記錄每個路由的請求延遲、並發請求數和傳輸字節數，並註冊/metrics端點
+5. 記錄服務提供商調用的並發數、延遲和錯誤次數
+"""
+
+import time
+import bisect
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Callable, Iterable, Iterator, Tuple
+
+# 默認的延遲分桶（秒），覆蓋從毫秒級接口到數分鐘的視頻生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# 渲染幀率的分桶（幀每秒）
+FPS_BUCKETS = (1, 5, 10, 15, 25, 30, 50, 75, 100, 150, 200, 300, 500)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[str, ...]
+
+class _ThreadShards:
+    """每個線程獨立寫入的分片集合，只有線程第一次寫入時才加鎖註冊分片"""
+    
+    def __init__(self, merge: Callable[[Dict[LabelKey, Any], LabelKey, Any], None]):
+        """
+        初始化分片集合
+        
+        Args:
+            merge: 將一個分片值合併到匯總字典的函數，參數為匯總字典、標籤鍵和分片值
+        """
+        self._merge = merge
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict[LabelKey, Any]]] = []
+        self._retired: Dict[LabelKey, Any] = {}
+        self._lock = threading.Lock()
+    
+    def local(self) -> Dict[LabelKey, Any]:
+        """當前線程的分片"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+    
+    def collect(self) -> Dict[LabelKey, Any]:
+        """
+        合併所有分片，已結束線程的分片併入匯總後丟棄，避免線程頻繁創建時分片無限增長
+        
+        Returns:
+            標籤鍵到合併值的字典
+        """
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                # dict.copy在CPython中是原子操作，寫入線程不需要停下來
+                snapshot = shard.copy()
+                if thread.is_alive():
+                    live.append((thread, shard, snapshot))
+                else:
+                    for key, value in snapshot.items():
+                        self._merge(self._retired, key, value)
+            self._shards = [(thread, shard) for thread, shard, _ in live]
+            
+            total: Dict[LabelKey, Any] = {}
+            for key, value in self._retired.items():
+                self._merge(total, key, value)
+            for _, _, snapshot in live:
+                for key, value in snapshot.items():
+                    self._merge(total, key, value)
+        
+        return total
+
+def _merge_number(total: Dict[LabelKey, Any], key: LabelKey, value: float) -> None:
+    total[key] = total.get(key, 0) + value
+
+def _merge_buckets(total: Dict[LabelKey, Any], key: LabelKey, value: List[float]) -> None:
+    current = total.get(key)
+    if current is None:
+        total[key] = list(value)
+    else:
+        total[key] = [a + b for a, b in zip(current, value)]
+
+def _format_value(value: float) -> str:
+    """格式化指標值"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    """轉義標籤值中的反斜杠、引號和換行"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """格式化標籤"""
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+class Metric:
+    """指標基類"""
+    
+    type = "untyped"
+    
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        """
+        初始化指標
+        
+        Args:
+            name: 指標名稱
+            help: 說明文字
+            labelnames: 標籤名稱
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+    
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        """按標籤名稱順序生成標籤鍵"""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """
+        導出樣本
+        
+        Returns:
+            [(樣本名, 格式化的標籤, 值)]
+        """
+        raise NotImplementedError
+    
+    def expose(self) -> List[str]:
+        """以Prometheus文本格式導出"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+class Counter(Metric):
+    """只增不減的計數器"""
+    
+    type = "counter"
+    
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._shards = _ThreadShards(_merge_number)
+    
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """
+        增加計數
+        
+        Args:
+            amount: 增加量
+            **labels: 標籤值
+        """
+        shard = self._shards.local()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+    
+    def values(self) -> Dict[LabelKey, float]:
+        """合併後的各標籤值"""
+        return self._shards.collect()
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [
+            (self.name, _format_labels(self.labelnames, key), value)
+            for key, value in sorted(self.values().items())
+        ]
+
+class Gauge(Counter):
+    """可增可減的儀表，例如進行中的調用數；各線程的增減量在導出時相加"""
+    
+    type = "gauge"
+    
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        """減少儀表值"""
+        self.inc(-amount, **labels)
+
+class CallbackGauge(Metric):
+    """導出時才調用函數取值的儀表，不在熱路徑上維護"""
+    
+    type = "gauge"
+    
+    def __init__(self, name: str, help: str, func: Callable[[], Any], labelnames: Iterable[str] = ()):
+        """
+        初始化回調儀表
+        
+        Args:
+            name: 指標名稱
+            help: 說明文字
+            func: 取值函數，沒有標籤時返回數值，有標籤時返回標籤值元組到數值的字典
+            labelnames: 標籤名稱
+        """
+        super().__init__(name, help, labelnames)
+        self.func = func
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        try:
+            value = self.func()
+        except Exception as e:
+            print(f"讀取指標失敗: {self.name}, {str(e)}")
+            return []
+        
+        if not self.labelnames:
+            return [(self.name, "", value)]
+        return [
+            (self.name, _format_labels(self.labelnames, key), item)
+            for key, item in sorted(value.items())
+        ]
+
+class Histogram(Metric):
+    """直方圖，記錄觀測值的分桶計數、總和和次數"""
+    
+    type = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _ThreadShards(_merge_buckets)
+    
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        記錄一個觀測值
+        
+        Args:
+            value: 觀測值
+            **labels: 標籤值
+        """
+        shard = self._shards.local()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # 各分桶的非累計計數（最後一個是+Inf），以及觀測值總和
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+    
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """記錄代碼塊耗時（秒）的上下文管理器"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        for key, state in sorted(self._shards.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, state[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """指標註冊表，同名指標只創建一次"""
+    
+    def __init__(self):
+        self._metrics: "OrderedDict[str, Metric]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _register(self, metric_type: type, name: str, *args, **kwargs) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_type(name, *args, **kwargs)
+            elif type(metric) is not metric_type:
+                raise ValueError(f"指標 {name} 已註冊為 {metric.type}")
+            return metric
+    
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        """獲取或創建計數器"""
+        return self._register(Counter, name, help, labelnames)
+    
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        """獲取或創建儀表"""
+        return self._register(Gauge, name, help, labelnames)
+    
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """獲取或創建直方圖"""
+        return self._register(Histogram, name, help, labelnames, buckets)
+    
+    def gauge_callback(self, name: str, help: str, func: Callable[[], Any], labelnames: Iterable[str] = ()) -> CallbackGauge:
+        """
+        註冊回調儀表，同名時替換取值函數
+        
+        Args:
+            name: 指標名稱
+            help: 說明文字
+            func: 取值函數
+            labelnames: 標籤名稱
+            
+        Returns:
+            CallbackGauge實例
+        """
+        metric = self._register(CallbackGauge, name, help, func, labelnames)
+        metric.func = func
+        return metric
+    
+    def expose(self) -> str:
+        """以Prometheus文本格式導出所有指標"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+def get_registry() -> MetricsRegistry:
+    """
+    獲取進程內共享的指標註冊表
+    
+    Returns:
+        MetricsRegistry實例
+    """
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = MetricsRegistry()
+        return _shared_registry
+
+# 服務提供商調用和本地渲染的指標
+PROVIDER_CALLS_IN_FLIGHT = get_registry().gauge("provider_calls_in_flight", "進行中的服務提供商調用數", ("provider",))
+PROVIDER_CALL_DURATION = get_registry().histogram(
+    "provider_call_duration_seconds", "服務提供商調用耗時（秒）", ("provider",)
+)
+PROVIDER_CALLS = get_registry().counter("provider_calls_total", "服務提供商調用次數", ("provider", "outcome"))
+RENDER_FRAMES = get_registry().counter("render_frames_total", "本地渲染的總幀數", ("renderer",))
+RENDER_FPS = get_registry().histogram("render_fps", "本地渲染的幀率（幀每秒）", ("renderer",), FPS_BUCKETS)
+
+class ProviderCall:
+    """一次服務提供商調用，記錄HTTP狀態碼以區分成功和失敗"""
+    
+    __slots__ = ("failed",)
+    
+    def __init__(self):
+        self.failed = False
+    
+    def status(self, status_code: int) -> None:
+        """根據HTTP狀態碼標記調用結果"""
+        self.failed = status_code >= 400
+    
+    def fail(self) -> None:
+        """標記調用失敗"""
+        self.failed = True
+
+@contextmanager
+def provider_call(provider: str) -> Iterator[ProviderCall]:
+    """
+    記錄服務提供商調用的並發數、延遲和結果，拋出異常或標記失敗的調用計為錯誤
+    
+    Args:
+        provider: 服務提供商或下游服務名稱
+        
+    Yields:
+        ProviderCall，調用方可以記錄狀態碼
+    """
+    call = ProviderCall()
+    
+    PROVIDER_CALLS_IN_FLIGHT.inc(provider=provider)
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.failed = True
+        raise
+    finally:
+        PROVIDER_CALLS_IN_FLIGHT.dec(provider=provider)
+        PROVIDER_CALL_DURATION.observe(time.perf_counter() - start, provider=provider)
+        PROVIDER_CALLS.inc(provider=provider, outcome="error" if call.failed else "ok")
+
+def observe_render(renderer: str, frames: int, seconds: float) -> None:
+    """
+    記錄一次本地渲染的幀數和幀率
+    
+    Args:
+        renderer: 渲染器名稱
+        frames: 渲染的幀數
+        seconds: 渲染耗時（秒）
+    """
+    RENDER_FRAMES.inc(frames, renderer=renderer)
+    if seconds > 0:
+        RENDER_FPS.observe(frames / seconds, renderer=renderer)
+
+def register_metrics_route(app: Any, registry: MetricsRegistry, service: str, path: str = "/metrics") -> None:
+    """
+    在Flask應用中記錄每個路由的請求指標，並註冊Prometheus抓取端點
+    
+    Args:
+        app: Flask應用
+        registry: 指標註冊表
+        service: 服務名稱，作為service標籤
+        path: 抓取端點路徑
+    """
+    from flask import request, g, Response
+    
+    latency = registry.histogram(
+        "http_request_duration_seconds", "HTTP請求耗時（秒）", ("service", "method", "route", "status")
+    )
+    in_flight = registry.gauge("http_requests_in_flight", "進行中的HTTP請求數", ("service",))
+    received = registry.counter("http_request_bytes_total", "HTTP請求體字節數", ("service", "route"))
+    sent = registry.counter("http_response_bytes_total", "HTTP響應體字節數", ("service", "route"))
+    
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        in_flight.inc(service=service)
+    
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        
+        # 使用路由規則而不是實際路徑，避免視頻ID等參數造成標籤爆炸
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        latency.observe(
+            time.perf_counter() - start,
+            service=service, method=request.method, route=route, status=response.status_code
+        )
+        if request.content_length:
+            received.inc(request.content_length, service=service, route=route)
+        if response.content_length:
+            sent.inc(response.content_length, service=service, route=route)
+        return response
+    
+    @app.teardown_request
+    def end_request_metrics(exc):
+        in_flight.dec(service=service)
+    
+    def metrics():
+        """Prometheus抓取端點"""
+        return Response(registry.expose(), mimetype="text/plain", content_type=CONTENT_TYPE)
+    
+    app.add_url_rule(path, "metrics", metrics, methods=["GET"])
@@ -0,0 +1,327 @@
+"""
+模擬數字人渲染模塊 - 在本地CPU上生成由音頻驅動口型的數字人視頻
+
+此模塊提供以下功能：
+1. 使用共享的口型和能量時間軸，向量化映射為每幀的嘴型和張嘴程度
+2. 預先合成背景、頭像和各種嘴型、眨眼狀態的圖層，逐幀只替換變化的區域
+3. 將原始幀通過管道直接送入FFmpeg編碼，不在內存中保存整段視頻
+4. 720p下渲染速度快於實時，可用於預發布環境和壓力測試
+"""
+
+import os
+import zlib
+import time
+import threading
+import subprocess
+from typing import Dict, List, Optional, Any, Tuple
+
+import cv2
+import numpy as np
+
+from audio_analysis import VISEMES, get_viseme_timeline
+from render_settings import get_encoder_settings, get_frame_size, video_encoder_args
+from video_concat import FFMPEG_BINARY
+from metrics import observe_render
+
+# 張嘴程度的級數
+MOUTH_LEVELS = 8
+
+# 支持的表情，未知表情按neutral渲染
+EXPRESSIONS = ["neutral", "smile"]
+
+# 各視位的嘴型：(嘴寬比例, 最大開口比例, 是否露出牙齒)
+VISEME_SHAPES = {
+    "rest": (0.8, 0.0, False),
+    "closed": (0.75, 0.0, False),
+    "open": (0.8, 1.0, True),
+    "round": (0.5, 0.85, False),
+    "wide": (1.0, 0.55, True),
+    "teeth": (0.9, 0.35, True)
+}
+
+class MockAvatarRenderer:
+    """模擬數字人渲染類，使用預合成圖層和音頻能量包絡生成口型同步視頻"""
+    
+    def __init__(self, fps: int = 25, encoder: Optional[Dict[str, Any]] = None):
+        """
+        初始化模擬數字人渲染類
+        
+        Args:
+            fps: 輸出視頻幀率
+            encoder: 編碼參數（get_encoder_settings返回值），默認使用RENDER_PROFILE環境變量對應的配置
+        """
+        self.fps = fps
+        self.encoder = encoder or get_encoder_settings()
+        
+        # 按(頭像, 分辨率, 背景色)緩存預合成圖層，多次渲染同一頭像時不重複繪製
+        self._layers: Dict[Tuple[str, int, int, Tuple[int, int, int]], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def render(
+        self,
+        audio_file: str,
+        output_file: str,
+        avatar_id: str = "",
+        background_color: str = "#00FF00",
+        resolution: str = "720p",
+        expressions: Optional[List[Dict[str, Any]]] = None,
+        fps: Optional[int] = None,
+        encoder: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        渲染口型與音頻同步的模擬數字人視頻
+        
+        Args:
+            audio_file: 音頻文件路徑
+            output_file: 輸出視頻文件路徑
+            avatar_id: 數字人頭像ID，決定膚色和髮色
+            background_color: 背景顏色
+            resolution: 視頻分辨率
+            expressions: 表情列表，格式為 [{"timestamp": 1.5, "expression": "smile"}]
+            fps: 本次渲染的幀率，默認使用初始化時的幀率
+            encoder: 本次渲染的編碼參數，默認使用初始化時的編碼參數
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        fps = fps or self.fps
+        encoder = encoder or self.encoder
+        
+        width, height = get_frame_size(resolution)
+        layers = self._get_layers(avatar_id, width, height, self._parse_color(background_color))
+        
+        mouth, visemes = self.mouth_track(audio_file, fps)
+        n_frames = len(mouth)
+        expression = self._expression_track(expressions, n_frames, fps)
+        blink = self._blink_track(avatar_id, n_frames, fps)
+        
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-i", audio_file,
+            "-map", "0:v:0", "-map", "1:a:0",
+            *video_encoder_args(encoder, fps),
+            "-c:a", "aac",
+            "-shortest",
+            "-movflags", "+faststart",
+            output_file
+        ]
+        
+        mouth_y0, mouth_y1, mouth_x0, mouth_x1 = layers["mouth_box"]
+        eyes_y0, eyes_y1, eyes_x0, eyes_x1 = layers["eyes_box"]
+        mouth_patches = layers["mouth"]
+        eye_patches = layers["eyes"]
+        
+        # 整段視頻共用一個幀緩衝區，每幀只覆蓋嘴部和眼部區域
+        frame = layers["base"].copy()
+        
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for i in range(n_frames):
+                frame[mouth_y0:mouth_y1, mouth_x0:mouth_x1] = mouth_patches[expression[i], visemes[i], mouth[i]]
+                frame[eyes_y0:eyes_y1, eyes_x0:eyes_x1] = eye_patches[blink[i]]
+                process.stdin.write(frame.data)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        
+        stderr = process.stderr.read().decode("utf-8", errors="ignore")
+        if process.wait() != 0:
+            raise RuntimeError(f"模擬數字人視頻編碼失敗: {stderr}")
+        
+        # 幀率包含編碼時間，反映端到端的渲染速度
+        observe_render("mock_avatar", n_frames, time.perf_counter() - started)
+        return output_file
+    
+    def mouth_track(self, audio_file: str, fps: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        根據口型和能量時間軸計算每幀的張嘴程度和視位
+        
+        Args:
+            audio_file: 音頻文件路徑
+            fps: 視頻幀率，默認使用初始化時的幀率
+            
+        Returns:
+            (每幀的張嘴級數數組, 每幀的視位編號數組)
+        """
+        sampled = get_viseme_timeline(audio_file).sample(fps or self.fps)
+        
+        # 輕微平滑能量，避免嘴型抖動
+        smoothed = np.convolve(sampled["energy"], [0.25, 0.5, 0.25], mode="same")
+        levels = np.clip(np.round(smoothed * (MOUTH_LEVELS - 1)), 0, MOUTH_LEVELS - 1).astype(np.intp)
+        
+        return levels, sampled["visemes"]
+    
+    def _expression_track(self, expressions: Optional[List[Dict[str, Any]]], n_frames: int, fps: int) -> np.ndarray:
+        """
+        將表情時間點展開為每幀的表情索引
+        
+        Args:
+            expressions: 表情列表
+            n_frames: 總幀數
+            fps: 視頻幀率
+            
+        Returns:
+            每幀的表情索引數組
+        """
+        track = np.zeros(n_frames, dtype=np.intp)
+        if not expressions:
+            return track
+        
+        items = sorted(expressions, key=lambda item: item.get("timestamp", 0))
+        start_frames = np.array([int(item.get("timestamp", 0) * fps) for item in items])
+        values = np.array([
+            EXPRESSIONS.index(item.get("expression")) if item.get("expression") in EXPRESSIONS else 0
+            for item in items
+        ], dtype=np.intp)
+        
+        # 每幀使用最近一個已開始的表情
+        index = np.searchsorted(start_frames, np.arange(n_frames), side="right") - 1
+        track[index >= 0] = values[index[index >= 0]]
+        return track
+    
+    def _blink_track(self, avatar_id: str, n_frames: int, fps: int) -> np.ndarray:
+        """
+        生成每幀的眨眼狀態，大約每4秒眨眼一次
+        
+        Args:
+            avatar_id: 數字人頭像ID，用於錯開不同頭像的眨眼時間
+            n_frames: 總幀數
+            fps: 視頻幀率
+            
+        Returns:
+            每幀的眼部狀態索引數組（0為睜眼，1為閉眼）
+        """
+        period = fps * 4
+        offset = zlib.crc32(avatar_id.encode("utf-8")) % period
+        return (((np.arange(n_frames) + offset) % period) < max(1, fps // 8)).astype(np.intp)
+    
+    def _get_layers(self, avatar_id: str, width: int, height: int, background: Tuple[int, int, int]) -> Dict[str, Any]:
+        """
+        獲取預合成圖層，首次使用時繪製並緩存
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            width: 幀寬度
+            height: 幀高度
+            background: 背景顏色（BGR）
+            
+        Returns:
+            包含底圖、嘴部和眼部區域貼片的字典
+        """
+        key = (avatar_id, width, height, background)
+        with self._lock:
+            if key not in self._layers:
+                self._layers[key] = self._build_layers(avatar_id, width, height, background)
+            return self._layers[key]
+    
+    def _build_layers(self, avatar_id: str, width: int, height: int, background: Tuple[int, int, int]) -> Dict[str, Any]:
+        """
+        繪製頭像圖層並預先合成所有嘴型和眼部狀態的區域貼片
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            width: 幀寬度
+            height: 幀高度
+            background: 背景顏色（BGR）
+            
+        Returns:
+            包含底圖、嘴部和眼部區域貼片的字典
+        """
+        # 由頭像ID決定膚色和髮色，同一頭像每次渲染外觀一致
+        rng = np.random.default_rng(zlib.crc32(avatar_id.encode("utf-8")))
+        skin = tuple(int(c) for c in rng.integers([150, 170, 200], [190, 205, 240]))
+        hair = tuple(int(c) for c in rng.integers(20, 90, size=3))
+        
+        cx, cy = width // 2, int(height * 0.45)
+        head_w, head_h = int(height * 0.2), int(height * 0.27)
+        
+        # 身體、頭髮和臉部圖層
+        avatar = np.zeros((height, width, 4), dtype=np.uint8)
+        cv2.ellipse(avatar, (cx, height), (int(head_w * 2.1), int(head_h * 1.1)), 0, 180, 360, (90, 60, 40, 255), -1, cv2.LINE_AA)
+        cv2.rectangle(avatar, (cx - head_w // 3, cy + head_h - head_h // 6), (cx + head_w // 3, cy + head_h + head_h // 4), skin + (255,), -1)
+        cv2.ellipse(avatar, (cx, cy - head_h // 8), (int(head_w * 1.08), int(head_h * 1.02)), 0, 0, 360, hair + (255,), -1, cv2.LINE_AA)
+        cv2.ellipse(avatar, (cx, cy), (head_w, head_h), 0, 0, 360, skin + (255,), -1, cv2.LINE_AA)
+        
+        base = np.empty((height, width, 3), dtype=np.uint8)
+        base[:] = background
+        self._alpha_blend(base, avatar)
+        
+        # 眼部區域
+        eye_dx, eye_y, eye_r = head_w * 2 // 5, cy - head_h // 6, max(2, head_h // 10)
+        eyes_box = (eye_y - eye_r * 2, eye_y + eye_r * 2, cx - eye_dx - eye_r * 2, cx + eye_dx + eye_r * 2)
+        
+        eye_patches = []
+        for closed in (False, True):
+            sprite = np.zeros((height, width, 4), dtype=np.uint8)
+            for x in (cx - eye_dx, cx + eye_dx):
+                if closed:
+                    cv2.line(sprite, (x - eye_r, eye_y), (x + eye_r, eye_y), (40, 40, 40, 255), max(1, eye_r // 3), cv2.LINE_AA)
+                else:
+                    cv2.circle(sprite, (x, eye_y), eye_r, (255, 255, 255, 255), -1, cv2.LINE_AA)
+                    cv2.circle(sprite, (x, eye_y), eye_r // 2, (40, 30, 20, 255), -1, cv2.LINE_AA)
+            eye_patches.append(self._compose_patch(base, sprite, eyes_box))
+        
+        # 嘴部區域：每種表情、視位和張嘴程度各一個貼片，只在區域大小的畫布上繪製
+        mouth_y, mouth_w = cy + head_h // 2, head_w // 2
+        max_open = head_h // 5
+        mouth_box = (mouth_y - max_open - 4, mouth_y + max_open + 4, cx - mouth_w - 4, cx + mouth_w + 4)
+        box_h, box_w = mouth_box[1] - mouth_box[0], mouth_box[3] - mouth_box[2]
+        mx, my = cx - mouth_box[2], mouth_y - mouth_box[0]
+        
+        mouth_patches = np.empty((len(EXPRESSIONS), len(VISEMES), MOUTH_LEVELS, box_h, box_w, 3), dtype=np.uint8)
+        for e, expression in enumerate(EXPRESSIONS):
+            for v, viseme in enumerate(VISEMES):
+                width_scale, open_scale, teeth = VISEME_SHAPES[viseme]
+                w = max(2, int(mouth_w * width_scale))
+                for level in range(MOUTH_LEVELS):
+                    sprite = np.zeros((box_h, box_w, 4), dtype=np.uint8)
+                    opening = max(1, int(max_open * open_scale * level / (MOUTH_LEVELS - 1)))
+                    if expression == "smile":
+                        # 微笑時嘴角上揚，開口只向下張開
+                        cv2.ellipse(sprite, (mx, my - 2), (w, opening * 2 // 3 + max_open // 3), 0, 0, 180, (60, 40, 150, 255), -1, cv2.LINE_AA)
+                        cv2.ellipse(sprite, (mx, my - 2), (w, max_open // 6 + 1), 0, 0, 180, (245, 245, 245, 255), -1, cv2.LINE_AA)
+                    else:
+                        cv2.ellipse(sprite, (mx, my), (w, opening), 0, 0, 360, (50, 30, 120, 255), -1, cv2.LINE_AA)
+                        if teeth and opening >= max_open // 3:
+                            cv2.ellipse(sprite, (mx, my - opening + opening // 4), (w * 3 // 4, opening // 4), 0, 0, 360, (240, 240, 240, 255), -1, cv2.LINE_AA)
+                    mouth_patches[e, v, level] = self._compose_patch(base, sprite, mouth_box)
+        
+        return {
+            "base": base,
+            "mouth": mouth_patches,
+            "mouth_box": mouth_box,
+            "eyes": np.stack(eye_patches),
+            "eyes_box": eyes_box
+        }
+    
+    @staticmethod
+    def _compose_patch(base: np.ndarray, sprite: np.ndarray, box: Tuple[int, int, int, int]) -> np.ndarray:
+        """將RGBA圖層合成到底圖的指定區域，返回該區域的貼片（圖層可以是整幀或區域大小）"""
+        y0, y1, x0, x1 = box
+        patch = base[y0:y1, x0:x1].copy()
+        if sprite.shape[:2] != patch.shape[:2]:
+            sprite = sprite[y0:y1, x0:x1]
+        MockAvatarRenderer._alpha_blend(patch, sprite)
+        return patch
+    
+    @staticmethod
+    def _alpha_blend(target: np.ndarray, rgba: np.ndarray) -> None:
+        """按Alpha通道將BGRA圖層就地疊加到BGR圖像上"""
+        alpha = rgba[..., 3:4].astype(np.float32) / 255.0
+        target[:] = (rgba[..., :3] * alpha + target * (1.0 - alpha)).astype(np.uint8)
+    
+    @staticmethod
+    def _parse_color(color: str) -> Tuple[int, int, int]:
+        """將#RRGGBB顏色轉換為BGR元組，無法解析時使用綠幕"""
+        try:
+            value = color.lstrip("#")
+            r, g, b = int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+            return (b, g, r)
+        except (ValueError, AttributeError):
+            return (0, 255, 0)
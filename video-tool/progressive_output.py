@@ -0,0 +1,300 @@
+"""
+漸進式輸出模塊 - 在流水線仍在渲染時即可播放已完成的部分
+
+此模塊提供以下功能：
+1. 將演講稿分割為段落，每個段落單獨渲染
+2. 每完成一個段落，立即以統一參數編碼並切分為HLS分片
+3. 按段落順序追加到EVENT類型的直播播放列表，先完成的後續段落等待前面的段落
+4. 全部完成後結束播放列表，並以流複製方式拼接出完整的MP4
+"""
+
+import os
+import re
+import shutil
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+from render_settings import get_encoder_settings, get_frame_size, video_encoder_args
+from video_concat import FFMPEG_BINARY, VideoConcatenator
+from tracing import trace_span, traced
+
+# 直播播放列表文件名
+LIVE_PLAYLIST = "index.m3u8"
+
+def split_paragraphs(text: str, max_chars: int = 200) -> List[str]:
+    """
+    將演講稿分割為段落，與場景分析的分段規則一致
+    
+    Args:
+        text: 演講稿文本
+        max_chars: 沒有換行的長文本按句子組合時，每段的最大字符數
+        
+    Returns:
+        段落列表
+    """
+    paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
+    
+    # 只有一個長段落時按句子切分，再組合成適當大小的段落
+    if len(paragraphs) <= 1 and len(text) > max_chars:
+        sentences = [s.strip() for s in re.split(r'(?<=[。！？.!?])\s*', text) if s.strip()]
+        paragraphs = []
+        current = ""
+        for sentence in sentences:
+            if current and len(current) + len(sentence) > max_chars:
+                paragraphs.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current and sentence[0].isascii() else current + sentence
+        if current:
+            paragraphs.append(current)
+    
+    return paragraphs
+
+class ProgressiveComposer:
+    """漸進式合成類，將逐個完成的段落視頻追加到直播HLS播放列表"""
+    
+    def __init__(
+        self,
+        output_dir: str,
+        resolution: str = "1080p",
+        fps: int = 25,
+        encoder: Optional[Dict[str, Any]] = None,
+        segment_duration: int = 4
+    ):
+        """
+        初始化漸進式合成類
+        
+        Args:
+            output_dir: 播放列表和分片的輸出目錄
+            resolution: 輸出分辨率
+            fps: 輸出幀率
+            encoder: 編碼參數（get_encoder_settings返回值），默認使用RENDER_PROFILE環境變量對應的配置
+            segment_duration: HLS分片時長（秒）
+        """
+        self.output_dir = output_dir
+        self.width, self.height = get_frame_size(resolution)
+        self.fps = fps
+        self.encoder = encoder or get_encoder_settings()
+        self.segment_duration = segment_duration
+        self.playlist_file = os.path.join(output_dir, LIVE_PLAYLIST)
+        
+        # 已發布到播放列表的段落（按順序），以及已編碼但在等待前面段落的段落
+        self._published: List[Tuple[int, List[Tuple[str, float]]]] = []
+        self._pending: Dict[int, List[Tuple[str, float]]] = {}
+        self._section_files: Dict[int, str] = {}
+        self._next_index = 0
+        self._ended = False
+        self._lock = threading.Lock()
+        
+        os.makedirs(output_dir, exist_ok=True)
+    
+    def start(self) -> str:
+        """
+        寫入空的直播播放列表，播放器可以立即開始輪詢
+        
+        Returns:
+            播放列表路徑
+        """
+        with self._lock:
+            self._write_playlist()
+        return self.playlist_file
+    
+    @property
+    def published_sections(self) -> int:
+        """已發布到播放列表的段落數"""
+        with self._lock:
+            return len(self._published)
+    
+    def add_section(self, index: int, video_file: str) -> int:
+        """
+        編碼一個段落視頻並在前面的段落都發布後追加到播放列表
+        
+        Args:
+            index: 段落序號（從0開始）
+            video_file: 段落的合成視頻文件
+            
+        Returns:
+            當前已發布的段落數
+        """
+        # 編碼和切片不持有鎖，多個段落可以同時處理
+        section_file = self._encode_section(index, video_file)
+        return self._publish_section(index, section_file)
+    
+    def add_encoded_section(self, index: int, section_file: str) -> int:
+        """
+        加入以相同參數編碼好的段落文件（例如修訂前任務的段落），不重新編碼
+        
+        Args:
+            index: 段落序號（從0開始）
+            section_file: 已編碼的段落文件
+            
+        Returns:
+            當前已發布的段落數
+        """
+        target = os.path.join(self.output_dir, f"section_{index:04d}.mp4")
+        if os.path.abspath(section_file) != os.path.abspath(target):
+            if os.path.exists(target):
+                os.remove(target)
+            # 同一文件系統上使用硬鏈接，避免複製整個段落
+            try:
+                os.link(section_file, target)
+            except OSError:
+                shutil.copyfile(section_file, target)
+        
+        return self._publish_section(index, target)
+    
+    def section_file(self, index: int) -> Optional[str]:
+        """
+        獲取段落的編碼文件路徑
+        
+        Args:
+            index: 段落序號
+            
+        Returns:
+            編碼後的段落文件路徑，段落尚未完成時返回None
+        """
+        with self._lock:
+            return self._section_files.get(index)
+    
+    def _publish_section(self, index: int, section_file: str) -> int:
+        """
+        切分段落並在前面的段落都發布後追加到播放列表
+        
+        Args:
+            index: 段落序號
+            section_file: 編碼後的段落文件
+            
+        Returns:
+            當前已發布的段落數
+        """
+        segments = self._segment_section(index, section_file)
+        
+        with self._lock:
+            self._section_files[index] = section_file
+            self._pending[index] = segments
+            
+            while self._next_index in self._pending:
+                self._published.append((self._next_index, self._pending.pop(self._next_index)))
+                self._next_index += 1
+            
+            self._write_playlist()
+            return len(self._published)
+    
+    def finish(self, output_file: Optional[str] = None) -> Optional[str]:
+        """
+        結束直播播放列表，可選地拼接出完整的MP4
+        
+        Args:
+            output_file: 完整視頻的輸出路徑，為None時只結束播放列表
+            
+        Returns:
+            完整視頻路徑，未拼接時返回None
+        """
+        with self._lock:
+            self._ended = True
+            self._write_playlist()
+            section_files = [self._section_files[index] for index, _ in self._published]
+        
+        if not output_file or not section_files:
+            return None
+        
+        # 所有段落以相同參數編碼，拼接時直接流複製
+        with trace_span("compose.concatenate", sections=len(section_files)):
+            return VideoConcatenator(temp_dir=self.output_dir, encoder=self.encoder).concatenate(section_files, output_file)
+    
+    @traced("compose.encode_section")
+    def _encode_section(self, index: int, video_file: str) -> str:
+        """
+        將段落視頻編碼為統一的分辨率、幀率和音頻格式，關鍵幀與分片邊界對齊
+        
+        Args:
+            index: 段落序號
+            video_file: 段落視頻文件
+            
+        Returns:
+            編碼後的段落文件路徑
+        """
+        section_file = os.path.join(self.output_dir, f"section_{index:04d}.mp4")
+        has_audio = bool(VideoConcatenator().probe(video_file)["audio_codec"])
+        
+        command = [FFMPEG_BINARY, "-y", "-v", "error", "-i", video_file]
+        if not has_audio:
+            command += ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=48000"]
+        
+        command += [
+            "-map", "0:v:0", "-map", "0:a:0" if has_audio else "1:a:0",
+            "-vf", (
+                f"scale={self.width}:{self.height}:force_original_aspect_ratio=decrease,"
+                f"pad={self.width}:{self.height}:(ow-iw)/2:(oh-ih)/2,fps={self.fps}"
+            ),
+            *video_encoder_args(self.encoder, self.fps),
+            "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_duration})",
+            "-c:a", "aac", "-ar", "48000", "-ac", "2",
+            "-shortest",
+            section_file
+        ]
+        subprocess.run(command, capture_output=True, check=True)
+        
+        return section_file
+    
+    @traced("compose.segment_section")
+    def _segment_section(self, index: int, section_file: str) -> List[Tuple[str, float]]:
+        """
+        以流複製方式將段落切分為MPEG-TS分片
+        
+        Args:
+            index: 段落序號
+            section_file: 編碼後的段落文件
+            
+        Returns:
+            分片列表，格式為 [(文件名, 時長)]
+        """
+        segment_list = os.path.join(self.output_dir, f"section_{index:04d}.csv")
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", section_file,
+            "-map", "0", "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(self.segment_duration),
+            "-segment_format", "mpegts",
+            "-segment_list", segment_list,
+            "-segment_list_type", "csv",
+            os.path.join(self.output_dir, f"section_{index:04d}_%03d.ts")
+        ]
+        subprocess.run(command, capture_output=True, check=True)
+        
+        segments = []
+        with open(segment_list, "r", encoding="utf-8") as f:
+            for line in f:
+                name, start, end = line.strip().rsplit(",", 2)
+                segments.append((os.path.basename(name), float(end) - float(start)))
+        os.remove(segment_list)
+        
+        return segments
+    
+    def _write_playlist(self) -> None:
+        """原子地重寫直播播放列表（調用方持有鎖）"""
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.segment_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT"
+        ]
+        
+        for position, (_, segments) in enumerate(self._published):
+            # 各段落獨立編碼，時間戳從零開始，需要標記不連續
+            if position > 0:
+                lines.append("#EXT-X-DISCONTINUITY")
+            for name, duration in segments:
+                lines.append(f"#EXTINF:{duration:.3f},")
+                lines.append(name)
+        
+        if self._ended:
+            lines.append("#EXT-X-ENDLIST")
+        
+        temp_file = f"{self.playlist_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_file, self.playlist_file)
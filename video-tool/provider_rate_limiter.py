@@ -0,0 +1,427 @@
+"""
+服務提供商限流模塊 - 按服務提供商和端點的配額共享令牌桶，排隊等待而不是觸發429
+
+此模塊提供以下功能：
+1. 每個服務提供商（或其某個端點）一個令牌桶，同一進程內的所有調用共享配額
+2. 沒有令牌時排隊等待，等待的請求按優先級（draft、interactive、batch）依次獲得令牌
+3. 服務提供商仍返回429時按Retry-After暫停該令牌桶並重試，不直接回退到模擬輸出
+4. 報告各配額最近一分鐘的使用率、排隊數和等待時間，並導出為Prometheus指標
+
+配置（環境變量）：
+    PROVIDER_RATE_LIMITS          配額，例如 "google=1000/min,synthesia.generate=30/min:5"，
+                                  鍵為 服務提供商 或 服務提供商.端點，值為 次數/單位（s、min、h），冒號後為突發容量
+    PROVIDER_RATE_LIMIT_MAX_WAIT  單個請求最長排隊時間（秒），默認300
+
+使用方法：
+    response = provider_request("synthesia", "generate", "post", url, headers=headers, data=payload)
+    
+    # 批量任務讓出配額給交互請求
+    with request_priority("batch"):
+        ...
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+
+import requests
+
+from metrics import get_registry, provider_call
+from job_scheduler import PRIORITY_CLASSES
+
+# 各服務提供商的默認配額（按標準層級設置，實際配額請通過PROVIDER_RATE_LIMITS覆蓋）
+DEFAULT_RATE_LIMITS = {
+    "google": "1000/min",
+    "azure": "200/min",
+    "deepbrain": "60/min",
+    "synthesia.generate": "30/min",
+    "synthesia.status": "120/min",
+    "zebracat": "60/min",
+    "runway": "60/min"
+}
+
+# 傳遞請求優先級的請求頭
+PRIORITY_HEADER = "X-Request-Priority"
+
+UNIT_SECONDS = {"s": 1, "sec": 1, "min": 60, "h": 3600}
+
+# 計算使用率的時間窗口（秒）
+UTILIZATION_WINDOW = 60.0
+
+_request_priority = contextvars.ContextVar("provider_request_priority", default="interactive")
+
+class RateLimitTimeout(Exception):
+    """排隊等待配額超時"""
+
+def parse_rate(spec: str) -> Tuple[float, Optional[int]]:
+    """
+    解析 "次數/單位[:突發容量]" 格式的配額
+    
+    Args:
+        spec: 配額，例如 "30/min" 或 "10/s:20"
+        
+    Returns:
+        (每秒令牌數, 突發容量)，未指定突發容量時為None
+    """
+    rate, _, burst = spec.partition(":")
+    count, _, unit = rate.partition("/")
+    seconds = UNIT_SECONDS.get(unit.strip() or "s")
+    if seconds is None:
+        raise ValueError(f"不支持的配額單位: {spec}")
+    return float(count) / seconds, int(burst) if burst.strip() else None
+
+def current_priority() -> str:
+    """當前上下文的請求優先級"""
+    return _request_priority.get()
+
+@contextmanager
+def request_priority(priority: str) -> Iterator[None]:
+    """
+    在上下文中指定請求優先級，其中發出的服務提供商請求按此優先級排隊
+    
+    Args:
+        priority: 優先級分類
+    """
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"不支持的優先級: {priority}")
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+class QuotaBucket:
+    """單個配額的令牌桶，沒有令牌時等待者按優先級排隊"""
+    
+    def __init__(self, name: str, rate: float, burst: Optional[int] = None):
+        """
+        初始化令牌桶
+        
+        Args:
+            name: 配額名稱（服務提供商或服務提供商.端點）
+            rate: 每秒補充的令牌數
+            burst: 令牌桶容量，默認為10秒的配額
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst if burst is not None else int(rate * 10))
+        
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._waiters: List[List[int]] = []
+        self._sequence = itertools.count()
+        
+        self._granted: deque = deque()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._throttled = 0
+    
+    def acquire(self, priority: str = "interactive", timeout: Optional[float] = None) -> float:
+        """
+        取得一個令牌，沒有令牌時排隊等待
+        
+        Args:
+            priority: 優先級分類，優先級高的等待者先獲得令牌
+            timeout: 最長等待時間（秒），為None時一直等待
+            
+        Returns:
+            等待的秒數
+            
+        Raises:
+            RateLimitTimeout: 等待超時
+        """
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        entry = [PRIORITY_CLASSES.index(priority), next(self._sequence)]
+        
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                
+                # 只有隊首的等待者可以取得令牌，後到的高優先級請求會排到前面
+                delay = None
+                if self._waiters[0] is entry:
+                    if self._tokens >= 1 and now >= self._paused_until:
+                        heapq.heappop(self._waiters)
+                        self._tokens -= 1
+                        waited = now - start
+                        self._record(now, waited)
+                        self._condition.notify_all()
+                        return waited
+                    delay = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.001)
+                
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._waiters.remove(entry)
+                        heapq.heapify(self._waiters)
+                        self._condition.notify_all()
+                        raise RateLimitTimeout(f"等待{self.name}配額超時（{timeout}秒）")
+                    delay = remaining if delay is None else min(delay, remaining)
+                
+                self._condition.wait(delay)
+    
+    def pause(self, seconds: float) -> None:
+        """
+        服務提供商返回429時暫停發放令牌，並清空已積累的令牌
+        
+        Args:
+            seconds: 暫停的秒數
+        """
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._throttled += 1
+            self._condition.notify_all()
+    
+    def _refill(self, now: float) -> None:
+        """按經過的時間補充令牌，暫停期間不補充，調用時必須持有鎖"""
+        since = max(self._updated, self._paused_until)
+        if now > since:
+            self._tokens = min(self.burst, self._tokens + (now - since) * self.rate)
+        self._updated = now
+    
+    def _record(self, now: float, waited: float) -> None:
+        """記錄發放的令牌和等待時間，調用時必須持有鎖"""
+        self._granted.append(now)
+        while self._granted and self._granted[0] < now - UTILIZATION_WINDOW:
+            self._granted.popleft()
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+    
+    def report(self) -> Dict[str, Any]:
+        """配額使用情況：最近一分鐘的請求數和使用率、排隊數、等待時間和收到的429次數"""
+        with self._condition:
+            now = time.monotonic()
+            while self._granted and self._granted[0] < now - UTILIZATION_WINDOW:
+                self._granted.popleft()
+            used = len(self._granted)
+            quota = self.rate * UTILIZATION_WINDOW
+            return {
+                "quota_per_minute": round(quota, 2),
+                "burst": self.burst,
+                "used_last_minute": used,
+                "utilization": round(used / quota, 4) if quota else 0.0,
+                "waiting": len(self._waiters),
+                "wait_total": round(self._wait_total, 3),
+                "wait_max": round(self._wait_max, 3),
+                "throttled": self._throttled,
+                "paused_for": round(max(0.0, self._paused_until - now), 3)
+            }
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析Retry-After請求頭，支持秒數和HTTP日期兩種格式
+    
+    Args:
+        value: Retry-After請求頭的值
+        
+    Returns:
+        需要等待的秒數（不小於0），缺失或無法解析時返回None
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+class ProviderRateLimiter:
+    """服務提供商限流類，按服務提供商和端點查找配額"""
+    
+    def __init__(self, limits: Optional[Dict[str, str]] = None, max_wait: Optional[float] = 300.0):
+        """
+        初始化服務提供商限流類
+        
+        Args:
+            limits: 配額名稱到配額的映射，配額名稱為 服務提供商 或 服務提供商.端點，未配置的請求不限流
+            max_wait: 單個請求最長排隊時間（秒），為None時一直等待
+        """
+        self.max_wait = max_wait
+        self.buckets: Dict[str, QuotaBucket] = {}
+        for name, spec in (limits if limits is not None else DEFAULT_RATE_LIMITS).items():
+            rate, burst = parse_rate(spec)
+            if rate > 0:
+                self.buckets[name] = QuotaBucket(name, rate, burst)
+    
+    @classmethod
+    def from_env(cls) -> "ProviderRateLimiter":
+        """根據環境變量創建限流器，PROVIDER_RATE_LIMITS中的配額覆蓋默認配額"""
+        limits = dict(DEFAULT_RATE_LIMITS)
+        for item in os.getenv("PROVIDER_RATE_LIMITS", "").split(","):
+            name, _, spec = item.partition("=")
+            if name.strip() and spec.strip():
+                limits[name.strip()] = spec.strip()
+        return cls(limits, max_wait=float(os.getenv("PROVIDER_RATE_LIMIT_MAX_WAIT", "300")))
+    
+    def bucket(self, provider: str, endpoint: Optional[str] = None) -> Optional[QuotaBucket]:
+        """
+        查找請求使用的令牌桶，端點沒有單獨配額時使用服務提供商的配額
+        
+        Args:
+            provider: 服務提供商
+            endpoint: 端點名稱
+            
+        Returns:
+            令牌桶，未配置配額時返回None
+        """
+        if endpoint and f"{provider}.{endpoint}" in self.buckets:
+            return self.buckets[f"{provider}.{endpoint}"]
+        return self.buckets.get(provider)
+    
+    def acquire(self, provider: str, endpoint: Optional[str] = None, priority: Optional[str] = None) -> float:
+        """
+        在發送請求前取得配額，未配置配額時立即返回
+        
+        Args:
+            provider: 服務提供商
+            endpoint: 端點名稱
+            priority: 優先級分類，默認使用當前上下文的優先級
+            
+        Returns:
+            等待的秒數
+            
+        Raises:
+            RateLimitTimeout: 等待超過max_wait
+        """
+        bucket = self.bucket(provider, endpoint)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire(priority or current_priority(), self.max_wait)
+    
+    def throttled(self, provider: str, endpoint: Optional[str] = None, retry_after: Optional[str] = None) -> float:
+        """
+        服務提供商返回429時暫停對應的令牌桶，未配置配額時在當前線程等待
+        
+        Args:
+            provider: 服務提供商
+            endpoint: 端點名稱
+            retry_after: 響應的Retry-After請求頭（秒數或HTTP日期），缺失或無法解析時暫停1秒
+            
+        Returns:
+            暫停的秒數
+        """
+        seconds = parse_retry_after(retry_after)
+        if seconds is None:
+            seconds = 1.0
+        
+        bucket = self.bucket(provider, endpoint)
+        if bucket is not None:
+            bucket.pause(seconds)
+        else:
+            # 沒有令牌桶可以暫停，直接等待，避免立即重試
+            time.sleep(seconds)
+        return seconds
+    
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """各配額的使用情況"""
+        return {name: bucket.report() for name, bucket in self.buckets.items()}
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> ProviderRateLimiter:
+    """
+    獲取進程內共享的服務提供商限流器
+    
+    Returns:
+        ProviderRateLimiter實例
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = ProviderRateLimiter.from_env()
+            
+            limiter = _shared_limiter
+            
+            def read(field: str) -> Dict[Tuple[str], float]:
+                return {(name,): report[field] for name, report in limiter.report().items()}
+            
+            registry = get_registry()
+            registry.gauge_callback(
+                "provider_quota_utilization", "服務提供商配額最近一分鐘的使用率", lambda: read("utilization"), ("quota",)
+            )
+            registry.gauge_callback(
+                "provider_quota_waiting", "排隊等待服務提供商配額的請求數", lambda: read("waiting"), ("quota",)
+            )
+            registry.gauge_callback(
+                "provider_quota_throttled", "服務提供商返回429的次數", lambda: read("throttled"), ("quota",)
+            )
+        return _shared_limiter
+
+def provider_request(
+    provider: str,
+    endpoint: str,
+    method: str,
+    url: str,
+    retries: int = 2,
+    **kwargs
+) -> requests.Response:
+    """
+    在配額內發送服務提供商HTTP請求，仍收到429時按Retry-After暫停配額後重試
+    
+    Args:
+        provider: 服務提供商
+        endpoint: 端點名稱
+        method: HTTP方法
+        url: 請求地址
+        retries: 收到429後的最大重試次數
+        **kwargs: 傳給requests.request的參數
+        
+    Returns:
+        最後一次請求的響應
+    """
+    limiter = get_rate_limiter()
+    for attempt in range(retries + 1):
+        limiter.acquire(provider, endpoint)
+        with provider_call(provider) as call:
+            response = requests.request(method, url, **kwargs)
+            call.status(response.status_code)
+        
+        if response.status_code != 429 or attempt == retries:
+            return response
+        
+        seconds = limiter.throttled(provider, endpoint, response.headers.get("Retry-After"))
+        print(f"{provider}配額已滿，{seconds}秒後重試: {url}")
+    return response
+
+def register_priority_hook(app: Any) -> None:
+    """
+    從請求頭讀取請求優先級，處理請求時發出的服務提供商請求按此優先級排隊
+    
+    Args:
+        app: Flask應用
+    """
+    from flask import request, g
+    
+    @app.before_request
+    def set_request_priority():
+        priority = request.headers.get(PRIORITY_HEADER)
+        if priority in PRIORITY_CLASSES:
+            g.priority_token = _request_priority.set(priority)
+    
+    @app.teardown_request
+    def reset_request_priority(error=None):
+        token = g.pop("priority_token", None)
+        if token is not None:
+            _request_priority.reset(token)
@@ -0,0 +1,780 @@
+"""
+渲染緩存模塊 - 支持將渲染結果持久化到磁盤並重複使用
+
+此模塊提供以下功能：
+1. 基於鍵的磁盤文件緩存，索引持久化為JSON
+2. 按總大小（LRU）和存活時間淘汰緩存條目
+3. 統計緩存命中、未命中和淘汰次數
+4. 場景渲染緩存：以標準化提示詞和渲染參數為鍵，可裁剪較長的緩存片段滿足較短的時長請求，
+   精確未命中時按TF-IDF餘弦相似度重用近似場景描述的渲染結果
+5. 數字人渲染緩存：以頭像ID、音頻內容摘要和渲染參數為鍵，按磁盤配額淘汰
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from scene_library import prompt_terms
+from video_concat import FFMPEG_BINARY
+from metrics import get_registry
+
+# 緩存查找次數，按緩存類型和結果（hit或miss）分組，命中率由抓取端計算
+CACHE_LOOKUPS = get_registry().counter("render_cache_lookups_total", "渲染緩存查找次數", ("cache", "result"))
+
+def file_digest(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    計算文件內容的SHA-256摘要
+    
+    Args:
+        file_path: 文件路徑
+        chunk_size: 每次讀取的字節數
+        
+    Returns:
+        十六進制摘要字符串
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _copy_atomic(source_file: str, output_file: str) -> None:
+    """
+    先複製到同目錄下唯一的臨時文件再重命名，並發寫同一路徑時不會互相覆蓋臨時文件
+    
+    Args:
+        source_file: 源文件路徑
+        output_file: 輸出文件路徑
+    """
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_file)), suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(source_file, temp_file)
+        os.replace(temp_file, output_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def _limit_from_env(value: Optional[float], env_name: str, default: float, cast: type) -> Optional[float]:
+    """
+    讀取緩存限制：顯式傳入的值優先（包括表示不限制的0），否則讀取環境變量
+    
+    Args:
+        value: 顯式傳入的值
+        env_name: 環境變量名
+        default: 環境變量未設置時的默認值
+        cast: 轉換類型（int或float）
+        
+    Returns:
+        限制值，0表示不限制
+    """
+    if value is not None:
+        return value
+    return cast(os.getenv(env_name, default))
+
+class RenderCache:
+    """通用渲染緩存類，將渲染文件按鍵保存在磁盤目錄中"""
+    
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 10 * 1024 * 1024 * 1024,
+        max_age: Optional[float] = 30 * 24 * 3600
+    ):
+        """
+        初始化渲染緩存類
+        
+        Args:
+            cache_dir: 緩存目錄
+            max_bytes: 緩存總大小上限（字節），None或0表示不限制，默認10GB
+            max_age: 緩存條目最長存活時間（秒），None或0表示不過期，默認30天
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_file = os.path.join(cache_dir, "index.json")
+        
+        self._lock = threading.Lock()
+        
+        # 正在複製到輸出文件的條目及其讀取者數量，淘汰時跳過這些條目
+        self._pins: Dict[str, int] = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+    
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        """
+        加載緩存索引，並移除文件已丟失的條目
+        
+        Returns:
+            緩存索引
+        """
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        
+        return {
+            key: entry for key, entry in index.items()
+            if os.path.exists(os.path.join(self.cache_dir, entry["file"]))
+        }
+    
+    def _save_index(self) -> None:
+        """原子地保存緩存索引"""
+        fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, prefix="index.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.index, f, ensure_ascii=False)
+            os.replace(temp_file, self.index_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+    
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        """判斷緩存條目是否已過期"""
+        return bool(self.max_age) and now - entry["created"] > self.max_age
+    
+    def _remove_entry(self, key: str) -> None:
+        """刪除緩存條目及其文件（調用方需持有鎖）"""
+        entry = self.index.pop(key, None)
+        if entry:
+            file_path = os.path.join(self.cache_dir, entry["file"])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            self.stats["evictions"] += 1
+    
+    def get(self, key: str, output_file: str) -> Optional[str]:
+        """
+        查找緩存文件並複製到輸出文件
+        
+        持有鎖時只固定條目，複製在鎖外完成；固定期間條目不會被淘汰，其他線程的查找和寫入不需要等待複製。
+        
+        Args:
+            key: 緩存鍵
+            output_file: 輸出文件路徑
+            
+        Returns:
+            輸出文件路徑，未命中時返回None
+        """
+        with self._lock:
+            entry = self.index.get(key)
+            now = time.time()
+            
+            if entry is None:
+                self.stats["misses"] += 1
+                CACHE_LOOKUPS.inc(cache=type(self).__name__, result="miss")
+                return None
+            
+            if self._is_expired(entry, now):
+                if key not in self._pins:
+                    self._remove_entry(key)
+                    self._save_index()
+                self.stats["misses"] += 1
+                CACHE_LOOKUPS.inc(cache=type(self).__name__, result="miss")
+                return None
+            
+            self._pins[key] = self._pins.get(key, 0) + 1
+            cache_file = os.path.join(self.cache_dir, entry["file"])
+        
+        copied = False
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            _copy_atomic(cache_file, output_file)
+            copied = True
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                if copied:
+                    entry["last_access"] = now
+                    self.stats["hits"] += 1
+        
+        CACHE_LOOKUPS.inc(cache=type(self).__name__, result="hit")
+        return output_file
+    
+    def put(self, key: str, source_file: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        將渲染文件複製到緩存中
+        
+        Args:
+            key: 緩存鍵
+            source_file: 渲染文件路徑
+            metadata: 附加的元數據
+            
+        Returns:
+            緩存文件路徑
+        """
+        extension = os.path.splitext(source_file)[1]
+        file_name = f"{key}{extension}"
+        cache_file = os.path.join(self.cache_dir, file_name)
+        
+        # 先複製到臨時文件再重命名，避免並發讀取到不完整的文件
+        _copy_atomic(source_file, cache_file)
+        
+        now = time.time()
+        with self._lock:
+            self.index[key] = {
+                "file": file_name,
+                "size": os.path.getsize(cache_file),
+                "created": now,
+                "last_access": now,
+                "metadata": metadata or {}
+            }
+            self.stats["stores"] += 1
+            self._evict(now)
+            self._save_index()
+        
+        return cache_file
+    
+    def _evict(self, now: float) -> None:
+        """淘汰過期條目，並按最近最少使用順序淘汰直到總大小低於上限，跳過正在被讀取的條目（調用方需持有鎖）"""
+        for key in [k for k, entry in self.index.items() if self._is_expired(entry, now) and k not in self._pins]:
+            self._remove_entry(key)
+        
+        if not self.max_bytes:
+            return
+        
+        total_bytes = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_access"]):
+            if total_bytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            total_bytes -= self.index[key]["size"]
+            self._remove_entry(key)
+    
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        獲取所有未過期的緩存條目
+        
+        Returns:
+            緩存條目列表，每個元素包含key和索引中記錄的字段
+        """
+        now = time.time()
+        with self._lock:
+            return [
+                dict(entry, key=key) for key, entry in self.index.items()
+                if not self._is_expired(entry, now)
+            ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        獲取緩存統計數據
+        
+        Returns:
+            包含命中次數、未命中次數、命中率、條目數和總大小的字典
+        """
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                hit_ratio=self.stats["hits"] / lookups if lookups else 0.0,
+                entries=len(self.index),
+                bytes=sum(entry["size"] for entry in self.index.values())
+            )
+
+class SceneRenderCache(RenderCache):
+    """場景渲染緩存類，以標準化提示詞、風格、分辨率和時長為鍵，並支持近似場景描述的相似匹配"""
+    
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        similarity_threshold: Optional[float] = None
+    ):
+        """
+        初始化場景渲染緩存類
+        
+        Args:
+            cache_dir: 緩存目錄，默認讀取SCENE_CACHE_DIR環境變量
+            max_bytes: 緩存總大小上限（字節），默認讀取SCENE_CACHE_MAX_BYTES環境變量，0表示不限制
+            max_age: 緩存條目最長存活時間（秒），默認讀取SCENE_CACHE_MAX_AGE環境變量，0表示不過期
+            similarity_threshold: 重用近似場景的最低餘弦相似度，默認讀取SCENE_CACHE_SIMILARITY環境變量（默認0.9），
+                大於1時只使用精確匹配
+        """
+        super().__init__(
+            cache_dir=cache_dir or os.getenv(
+                "SCENE_CACHE_DIR",
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "scenes")
+            ),
+            max_bytes=_limit_from_env(max_bytes, "SCENE_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024, int),
+            max_age=_limit_from_env(max_age, "SCENE_CACHE_MAX_AGE", 30 * 24 * 3600, float)
+        )
+        self.stats["trimmed_hits"] = 0
+        self.stats["similar_hits"] = 0
+        
+        if similarity_threshold is None:
+            similarity_threshold = float(os.getenv("SCENE_CACHE_SIMILARITY", "0.9"))
+        self.similarity_threshold = similarity_threshold
+        
+        # 相似匹配索引：每個緩存條目一行詞頻向量，列為場景描述中出現過的詞
+        # 條目的渲染參數（風格、分辨率、服務提供商）編號後與時長一起存為數組，篩選時不需要逐條比較
+        self._vocabulary: Dict[str, int] = {}
+        self._contexts: Dict[Tuple[str, str, str], int] = {}
+        self._term_counts = np.zeros((64, 64), dtype=np.float32)
+        self._document_frequency = np.zeros(64, dtype=np.float32)
+        self._row_context = np.full(64, -1, dtype=np.int32)
+        self._row_duration = np.zeros(64, dtype=np.float32)
+        self._row_keys: List[Optional[str]] = []
+        self._key_rows: Dict[str, int] = {}
+        
+        # 被淘汰條目空出的行，新條目優先使用，行數不隨淘汰次數增長
+        self._free_rows: List[int] = []
+        
+        for key, entry in self.index.items():
+            metadata = entry.get("metadata", {})
+            self._index_prompt(
+                key, metadata.get("prompt", ""), metadata.get("style", ""), metadata.get("resolution", ""),
+                metadata.get("provider", ""), metadata.get("duration", 0)
+            )
+    
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """
+        標準化場景描述：統一大小寫、空白和標點
+        
+        Args:
+            prompt: 場景描述
+            
+        Returns:
+            標準化後的場景描述
+        """
+        prompt = prompt.lower().replace("，", ",").replace("、", ",")
+        prompt = re.sub(r"\s*,\s*", ", ", prompt)
+        prompt = re.sub(r"\s+", " ", prompt)
+        return prompt.strip(" .。!！?？\"「」")
+    
+    def make_group(self, prompt: str, style: str, resolution: str, provider: str) -> str:
+        """
+        生成不含時長的分組鍵，同組內的條目可以相互裁剪
+        
+        Args:
+            prompt: 場景描述
+            style: 視覺風格
+            resolution: 視頻分辨率
+            provider: 場景生成服務提供商
+            
+        Returns:
+            分組鍵
+        """
+        raw = json.dumps(
+            [self.normalize_prompt(prompt), style, resolution, provider],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+    
+    def lookup(
+        self,
+        prompt: str,
+        output_file: str,
+        style: str,
+        duration: float,
+        resolution: str,
+        provider: str
+    ) -> Optional[str]:
+        """
+        查找可用的緩存場景並寫入輸出文件
+        
+        優先使用時長完全一致的條目；否則使用同組中時長最短但足夠長的條目並裁剪。
+        
+        Args:
+            prompt: 場景描述
+            output_file: 輸出文件路徑
+            style: 視覺風格
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
+            provider: 場景生成服務提供商
+            
+        Returns:
+            輸出文件路徑，未命中時返回None
+        """
+        group = self.make_group(prompt, style, resolution, provider)
+        
+        candidates = [
+            entry for entry in self.entries()
+            if entry["metadata"].get("group") == group and entry["metadata"].get("duration", 0) >= duration
+        ]
+        
+        if candidates:
+            best = min(candidates, key=lambda entry: entry["metadata"]["duration"])
+        else:
+            # 精確未命中時查找描述相近的場景，例如只是關鍵詞順序不同
+            best = self.find_similar(prompt, style, resolution, provider, duration)
+            if best is None:
+                with self._lock:
+                    self.stats["misses"] += 1
+                CACHE_LOOKUPS.inc(cache=type(self).__name__, result="miss")
+                return None
+            print(f"場景相似緩存命中: {prompt} -> {best['metadata']['prompt']}（相似度 {best['similarity']:.2f}）")
+        
+        trim = best["metadata"]["duration"] != duration
+        if trim:
+            # 先取出到輸出目錄的臨時文件再裁剪，裁剪期間緩存條目被淘汰也不受影響
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            fd, cached_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_file)), suffix=".mp4")
+            os.close(fd)
+            try:
+                if self.get(best["key"], cached_file) is None:
+                    return None
+                self._trim(cached_file, output_file, duration)
+            except Exception as e:
+                print(f"裁剪緩存場景時發生錯誤: {str(e)}")
+                return None
+            finally:
+                if os.path.exists(cached_file):
+                    os.remove(cached_file)
+        elif self.get(best["key"], output_file) is None:
+            return None
+        
+        with self._lock:
+            if not candidates:
+                self.stats["similar_hits"] += 1
+            if trim:
+                self.stats["trimmed_hits"] += 1
+        return output_file
+    
+    def store(
+        self,
+        prompt: str,
+        scene_file: str,
+        style: str,
+        duration: float,
+        resolution: str,
+        provider: str
+    ) -> Optional[str]:
+        """
+        將新渲染的場景寫入緩存
+        
+        Args:
+            prompt: 場景描述
+            scene_file: 場景視頻文件路徑
+            style: 視覺風格
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
+            provider: 場景生成服務提供商
+            
+        Returns:
+            緩存文件路徑，文件無效時返回None
+        """
+        if not os.path.exists(scene_file) or os.path.getsize(scene_file) == 0:
+            return None
+        
+        group = self.make_group(prompt, style, resolution, provider)
+        key = f"{group}_{duration}s"
+        
+        cache_file = self.put(key, scene_file, {
+            "group": group,
+            "prompt": prompt,
+            "style": style,
+            "duration": duration,
+            "resolution": resolution,
+            "provider": provider
+        })
+        
+        with self._lock:
+            if key in self.index:
+                self._index_prompt(key, prompt, style, resolution, provider, duration)
+        
+        return cache_file
+    
+    def find_similar(
+        self,
+        prompt: str,
+        style: str,
+        resolution: str,
+        provider: str,
+        duration: float
+    ) -> Optional[Dict[str, Any]]:
+        """
+        查找與場景描述最相似的緩存條目
+        
+        以緩存中所有場景描述計算IDF，對詞頻矩陣整體加權後一次矩陣乘法得到全部餘弦相似度。
+        只考慮風格、分辨率和服務提供商相同且時長足夠的條目。
+        
+        Args:
+            prompt: 場景描述
+            style: 視覺風格
+            resolution: 視頻分辨率
+            provider: 場景生成服務提供商
+            duration: 視頻時長（秒）
+            
+        Returns:
+            緩存條目（含key和similarity），沒有超過閾值的條目時返回None
+        """
+        if self.similarity_threshold > 1:
+            return None
+        
+        tokens = prompt_terms(prompt)
+        if not tokens:
+            return None
+        
+        with self._lock:
+            context = self._contexts.get((style, resolution, provider))
+            rows, columns = len(self._row_keys), len(self._vocabulary)
+            if context is None or not rows:
+                return None
+            
+            candidate_rows = np.flatnonzero(
+                (self._row_context[:rows] == context) & (self._row_duration[:rows] >= duration)
+            )
+            if not len(candidate_rows):
+                return None
+            
+            # 平滑的IDF，與素材庫的評分方式一致
+            n_active = len(self._key_rows)
+            idf = np.log((1.0 + n_active) / (1.0 + self._document_frequency[:columns])) + 1.0
+            
+            query = np.zeros(columns, dtype=np.float32)
+            unknown = 0.0
+            for token in tokens:
+                if token in self._vocabulary:
+                    query[self._vocabulary[token]] += 1
+                else:
+                    unknown += 1
+            
+            # 緩存中沒有出現過的詞也計入查詢向量的模，降低相似度
+            query_weights = query * idf
+            unknown_weight = unknown * (np.log(1.0 + n_active) + 1.0)
+            query_norm = np.sqrt(query_weights @ query_weights + unknown_weight ** 2)
+            
+            # 只取候選行，條目的IDF權重併入查詢向量，點積和加權後的模都是矩陣與向量的乘法
+            counts = self._term_counts[candidate_rows, :columns]
+            norms = np.sqrt(np.square(counts) @ np.square(idf))
+            similarity = (counts @ (query_weights * idf)) / np.maximum(norms * query_norm, 1e-12)
+            
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.similarity_threshold:
+                return None
+            
+            key = self._row_keys[candidate_rows[best]]
+            return dict(self.index[key], key=key, similarity=float(similarity[best]))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        獲取緩存統計數據
+        
+        Returns:
+            RenderCache.get_stats的字段，以及相似命中次數和節省的渲染次數
+        """
+        stats = super().get_stats()
+        stats["renders_saved"] = stats["hits"]
+        return stats
+    
+    def _remove_entry(self, key: str) -> None:
+        """刪除緩存條目，並從相似匹配索引中移除（調用方需持有鎖）"""
+        super()._remove_entry(key)
+        row = self._key_rows.pop(key, None)
+        if row is not None:
+            self._document_frequency -= self._term_counts[row, :len(self._document_frequency)] > 0
+            self._row_keys[row] = None
+            self._row_context[row] = -1
+            self._row_duration[row] = 0
+            self._term_counts[row] = 0
+            self._free_rows.append(row)
+            
+            # 不再出現在任何條目中的詞超過一半時壓縮詞彙，避免列數隨淘汰的場景描述無限增長
+            columns = len(self._vocabulary)
+            unused = columns - int(np.count_nonzero(self._document_frequency[:columns]))
+            if unused > max(64, columns // 2):
+                self._compact_vocabulary()
+    
+    def _compact_vocabulary(self) -> None:
+        """移除文檔頻率為0的詞，並把詞頻矩陣中仍在使用的列移到前面（調用方需持有鎖）"""
+        columns = len(self._vocabulary)
+        keep = np.flatnonzero(self._document_frequency[:columns] > 0)
+        
+        terms = sorted(self._vocabulary, key=self._vocabulary.get)
+        self._vocabulary = {terms[column]: index for index, column in enumerate(keep)}
+        
+        count = len(keep)
+        self._term_counts[:, :count] = self._term_counts[:, keep]
+        self._term_counts[:, count:] = 0
+        self._document_frequency[:count] = self._document_frequency[keep]
+        self._document_frequency[count:] = 0
+    
+    def _index_prompt(
+        self,
+        key: str,
+        prompt: str,
+        style: str,
+        resolution: str,
+        provider: str,
+        duration: float
+    ) -> None:
+        """
+        將緩存條目的場景描述加入相似匹配索引（調用方需持有鎖）
+        
+        Args:
+            key: 緩存鍵
+            prompt: 場景描述
+            style: 視覺風格
+            resolution: 視頻分辨率
+            provider: 場景生成服務提供商
+            duration: 視頻時長（秒）
+        """
+        tokens = prompt_terms(prompt)
+        if not tokens:
+            return
+        
+        columns = [self._vocabulary.setdefault(token, len(self._vocabulary)) for token in tokens]
+        row = self._key_rows.get(key)
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+                self._row_keys[row] = key
+            else:
+                row = len(self._row_keys)
+                self._row_keys.append(key)
+            self._key_rows[key] = row
+        
+        # 行數或詞彙超出容量時成倍擴容
+        capacity_rows, capacity_columns = self._term_counts.shape
+        if row >= capacity_rows or len(self._vocabulary) > capacity_columns:
+            new_rows = capacity_rows * 2 if row >= capacity_rows else capacity_rows
+            new_columns = max(capacity_columns, 1 << (len(self._vocabulary) - 1).bit_length())
+            term_counts = np.zeros((new_rows, new_columns), dtype=np.float32)
+            term_counts[:capacity_rows, :capacity_columns] = self._term_counts
+            self._term_counts = term_counts
+            self._document_frequency = np.concatenate([
+                self._document_frequency, np.zeros(new_columns - capacity_columns, dtype=np.float32)
+            ])
+            if new_rows > capacity_rows:
+                self._row_context = np.concatenate([self._row_context, np.full(new_rows - capacity_rows, -1, dtype=np.int32)])
+                self._row_duration = np.concatenate([self._row_duration, np.zeros(new_rows - capacity_rows, dtype=np.float32)])
+        
+        self._document_frequency -= self._term_counts[row] > 0
+        self._term_counts[row] = 0
+        np.add.at(self._term_counts[row], columns, 1)
+        self._document_frequency += self._term_counts[row] > 0
+        self._row_context[row] = self._contexts.setdefault((style, resolution, provider), len(self._contexts))
+        self._row_duration[row] = duration
+    
+    def _trim(self, input_file: str, output_file: str, duration: float) -> str:
+        """
+        使用流複製從開頭裁剪視頻
+        
+        Args:
+            input_file: 輸入視頻文件路徑
+            output_file: 輸出視頻文件路徑
+            duration: 保留的時長（秒）
+            
+        Returns:
+            輸出文件路徑
+        """
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", input_file,
+            "-t", str(duration),
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_file
+        ]
+        subprocess.run(command, capture_output=True, check=True)
+        return output_file
+
+class AvatarRenderCache(RenderCache):
+    """數字人渲染緩存類，以頭像ID、音頻內容摘要和渲染參數為鍵"""
+    
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None
+    ):
+        """
+        初始化數字人渲染緩存類
+        
+        Args:
+            cache_dir: 緩存目錄，默認讀取AVATAR_CACHE_DIR環境變量
+            max_bytes: 磁盤配額（字節），默認讀取AVATAR_CACHE_MAX_BYTES環境變量，0表示不限制
+            max_age: 緩存條目最長存活時間（秒），默認讀取AVATAR_CACHE_MAX_AGE環境變量，0表示不過期
+        """
+        super().__init__(
+            cache_dir=cache_dir or os.getenv(
+                "AVATAR_CACHE_DIR",
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "avatars")
+            ),
+            max_bytes=_limit_from_env(max_bytes, "AVATAR_CACHE_MAX_BYTES", 20 * 1024 * 1024 * 1024, int),
+            max_age=_limit_from_env(max_age, "AVATAR_CACHE_MAX_AGE", 30 * 24 * 3600, float)
+        )
+    
+    def make_key(
+        self,
+        avatar_id: str,
+        audio_file: str,
+        background_color: str,
+        resolution: str,
+        expressions: Optional[List[Dict[str, Any]]],
+        provider: str
+    ) -> str:
+        """
+        生成緩存鍵，音頻以內容摘要參與計算，與文件名和存放位置無關
+        
+        Args:
+            avatar_id: 數字人頭像ID
+            audio_file: 音頻文件路徑
+            background_color: 背景顏色
+            resolution: 視頻分辨率
+            expressions: 表情和動作列表
+            provider: 數字人服務提供商
+            
+        Returns:
+            緩存鍵
+        """
+        raw = json.dumps(
+            [avatar_id, file_digest(audio_file), background_color.upper(), resolution, expressions or [], provider],
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+    
+    def lookup(self, key: str, output_file: str) -> Optional[str]:
+        """
+        查找緩存的數字人視頻並複製到輸出文件
+        
+        Args:
+            key: make_key生成的緩存鍵
+            output_file: 輸出視頻文件路徑
+            
+        Returns:
+            輸出文件路徑，未命中時返回None
+        """
+        return self.get(key, output_file)
+    
+    def store(self, key: str, video_file: str, avatar_id: str, resolution: str) -> Optional[str]:
+        """
+        將新渲染的數字人視頻寫入緩存
+        
+        Args:
+            key: make_key生成的緩存鍵
+            video_file: 數字人視頻文件路徑
+            avatar_id: 數字人頭像ID
+            resolution: 視頻分辨率
+            
+        Returns:
+            緩存文件路徑，文件無效時返回None
+        """
+        if not os.path.exists(video_file) or os.path.getsize(video_file) == 0:
+            return None
+        
+        return self.put(key, video_file, {"avatar_id": avatar_id, "resolution": resolution})
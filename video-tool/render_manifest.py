@@ -0,0 +1,215 @@
+"""
+渲染清單模塊 - 記錄每個任務逐段落的渲染產物，修改演講稿後只重新渲染有變化的段落
+
+此模塊提供以下功能：
+1. 為每個段落的語音、數字人片段、場景合成和編碼段落分別計算輸入內容摘要
+2. 將任務的段落產物（語音ID、視頻ID、編碼段落文件及其摘要）持久化為JSON清單
+3. 比較修訂後的演講稿與原清單，逐段落決定可以重用到哪個階段
+4. 段落順序調整或插入新段落時，未變化的段落同樣可以重用
+"""
+
+import os
+import json
+import time
+import hashlib
+from typing import Dict, List, Optional, Any
+
+from render_cache import file_digest
+
+MANIFEST_VERSION = 1
+
+# 影響數字人片段的渲染設置字段
+AVATAR_SETTING_KEYS = ("quality", "resolution", "fps", "profile")
+
+def content_hash(*parts: Any) -> str:
+    """
+    計算任意JSON可序列化內容的摘要
+    
+    Args:
+        *parts: 參與計算的內容
+        
+    Returns:
+        十六進制摘要字符串
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def segment_hashes(paragraph: str, params: Dict[str, Any], render_settings: Dict[str, Any]) -> Dict[str, str]:
+    """
+    計算段落各階段的輸入摘要，每個階段的摘要包含前一階段的摘要
+    
+    Args:
+        paragraph: 段落文本
+        params: 任務參數（voice_id、language、avatar_id、video_mode、scene_type）
+        render_settings: 渲染設置
+        
+    Returns:
+        {"audio": 語音摘要, "avatar": 數字人片段摘要, "scene": 場景合成和編碼段落摘要}
+    """
+    audio = content_hash("audio", paragraph, params.get("voice_id"), params.get("language"))
+    avatar = content_hash(
+        "avatar", audio, params.get("avatar_id"),
+        {key: render_settings.get(key) for key in AVATAR_SETTING_KEYS}
+    )
+    scene = content_hash(
+        "scene", avatar, paragraph, params.get("video_mode"), params.get("scene_type"), render_settings
+    )
+    return {"audio": audio, "avatar": avatar, "scene": scene}
+
+class RenderManifest:
+    """渲染清單類，記錄一個任務逐段落的渲染產物"""
+    
+    def __init__(
+        self,
+        job_id: str,
+        params: Dict[str, Any],
+        render_settings: Dict[str, Any],
+        parent_job_id: Optional[str] = None
+    ):
+        """
+        初始化渲染清單類
+        
+        Args:
+            job_id: 任務ID
+            params: 任務參數（voice_id、language、avatar_id、video_mode、scene_type）
+            render_settings: 渲染設置
+            parent_job_id: 修訂任務對應的原任務ID
+        """
+        self.job_id = job_id
+        self.params = params
+        self.render_settings = render_settings
+        self.parent_job_id = parent_job_id
+        self.segments: Dict[int, Dict[str, Any]] = {}
+        self.final_file: Optional[str] = None
+    
+    @staticmethod
+    def manifest_path(manifest_dir: str, job_id: str) -> str:
+        """清單文件路徑"""
+        return os.path.join(manifest_dir, f"{job_id}.manifest.json")
+    
+    @classmethod
+    def load(cls, manifest_dir: str, job_id: str) -> Optional["RenderManifest"]:
+        """
+        讀取任務的渲染清單
+        
+        Args:
+            manifest_dir: 清單目錄
+            job_id: 任務ID
+            
+        Returns:
+            渲染清單，不存在、損壞或版本不一致時返回None
+        """
+        try:
+            with open(cls.manifest_path(manifest_dir, job_id), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        
+        manifest = cls(data["job_id"], data["params"], data["render_settings"], data.get("parent_job_id"))
+        manifest.segments = {int(index): segment for index, segment in data.get("segments", {}).items()}
+        manifest.final_file = data.get("final_file")
+        return manifest
+    
+    def save(self, manifest_dir: str) -> str:
+        """
+        原子地保存渲染清單
+        
+        Args:
+            manifest_dir: 清單目錄
+            
+        Returns:
+            清單文件路徑
+        """
+        os.makedirs(manifest_dir, exist_ok=True)
+        manifest_file = self.manifest_path(manifest_dir, self.job_id)
+        
+        data = {
+            "version": MANIFEST_VERSION,
+            "job_id": self.job_id,
+            "parent_job_id": self.parent_job_id,
+            "params": self.params,
+            "render_settings": self.render_settings,
+            "segments": {str(index): segment for index, segment in sorted(self.segments.items())},
+            "final_file": self.final_file,
+            "updated_at": time.time()
+        }
+        
+        temp_file = f"{manifest_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, manifest_file)
+        
+        return manifest_file
+    
+    def set_segment(self, index: int, segment: Dict[str, Any]) -> None:
+        """
+        記錄段落的渲染產物
+        
+        Args:
+            index: 段落序號
+            segment: 段落產物，包含text、hashes、audio_id、digital_human_video_id、scene_video_id、
+                section_file和section_hash
+        """
+        self.segments[index] = segment
+    
+    def plan(
+        self,
+        paragraphs: List[str],
+        params: Dict[str, Any],
+        render_settings: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """
+        為修訂後的段落制定渲染計劃，逐段落找出可以重用的最後一個階段
+        
+        重用級別：
+            section - 輸入完全相同且編碼段落文件完好，直接流複製拼接
+            avatar - 只有場景相關的參數變化，重用語音和數字人片段
+            audio - 聲線和文本相同，只重用語音
+            None - 全部重新渲染
+        
+        Args:
+            paragraphs: 修訂後的段落列表
+            params: 修訂後的任務參數
+            render_settings: 修訂後的渲染設置
+            
+        Returns:
+            與段落順序一致的計劃列表，每個元素包含index、text、hashes、level和reuse（可重用的原段落產物）
+        """
+        by_stage: Dict[str, Dict[str, Dict[str, Any]]] = {"scene": {}, "avatar": {}, "audio": {}}
+        for segment in self.segments.values():
+            for stage in by_stage:
+                by_stage[stage].setdefault(segment["hashes"][stage], segment)
+        
+        # 同一個編碼段落文件只校驗一次摘要
+        verified: Dict[str, bool] = {}
+        
+        plan = []
+        for index, paragraph in enumerate(paragraphs):
+            hashes = segment_hashes(paragraph, params, render_settings)
+            level, reuse = None, None
+            
+            previous = by_stage["scene"].get(hashes["scene"])
+            if previous and self._section_intact(previous, verified):
+                level, reuse = "section", previous
+            elif hashes["avatar"] in by_stage["avatar"]:
+                level, reuse = "avatar", by_stage["avatar"][hashes["avatar"]]
+            elif hashes["audio"] in by_stage["audio"]:
+                level, reuse = "audio", by_stage["audio"][hashes["audio"]]
+            
+            plan.append({"index": index, "text": paragraph, "hashes": hashes, "level": level, "reuse": reuse})
+        
+        return plan
+    
+    @staticmethod
+    def _section_intact(segment: Dict[str, Any], verified: Dict[str, bool]) -> bool:
+        """檢查編碼段落文件存在且內容未被修改"""
+        section_file = segment.get("section_file")
+        if not section_file or not segment.get("section_hash"):
+            return False
+        
+        if section_file not in verified:
+            verified[section_file] = os.path.exists(section_file) and file_digest(section_file) == segment["section_hash"]
+        return verified[section_file]
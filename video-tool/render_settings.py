@@ -0,0 +1,201 @@
+"""
+渲染設置模塊 - 統一管理各渲染階段的畫質參數和編碼參數
+
+此模塊提供以下功能：
+1. 定義渲染質量（草稿預覽和最終成片）
+2. 提供每種質量對應的分辨率、幀率和編碼器預設
+3. 定義編碼配置（fast、balanced、archival），控制編碼預設、CRF/碼率、線程數、GOP和像素格式
+4. 將請求中的質量和編碼配置參數解析為渲染設置，供網關、數字人、場景和合成模塊共用
+"""
+
+import os
+from enum import Enum
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+class RenderQuality(Enum):
+    """渲染質量枚舉"""
+    DRAFT = "draft"  # 草稿預覽：低分辨率、低幀率、最快的編碼預設
+    FINAL = "final"  # 最終成片
+
+class RenderProfile(Enum):
+    """編碼配置枚舉"""
+    FAST = "fast"  # 編碼速度優先，文件較大
+    BALANCED = "balanced"  # 速度和文件大小的平衡
+    ARCHIVAL = "archival"  # 畫質和壓縮率優先，用於存檔
+
+# 各渲染質量的參數，草稿預覽的編碼參數覆蓋編碼配置
+QUALITY_SETTINGS = {
+    RenderQuality.DRAFT: {
+        "resolution": "360p",
+        "fps": 15,
+        "preset": "ultrafast",
+        "crf": 32,
+        "audio_bitrate": "64k"
+    },
+    RenderQuality.FINAL: {
+        "resolution": "1080p",
+        "fps": 25,
+        "audio_bitrate": "192k"
+    }
+}
+
+# 各編碼配置的參數
+# video_bitrate為None時使用CRF恆定質量模式；threads為0時由編碼器自動選擇；gop以秒為單位
+PROFILE_SETTINGS = {
+    RenderProfile.FAST: {
+        "codec": "libx264",
+        "preset": "superfast",
+        "crf": 24,
+        "video_bitrate": None,
+        "threads": 0,
+        "gop": 2,
+        "pix_fmt": "yuv420p"
+    },
+    RenderProfile.BALANCED: {
+        "codec": "libx264",
+        "preset": "veryfast",
+        "crf": 20,
+        "video_bitrate": None,
+        "threads": 0,
+        "gop": 2,
+        "pix_fmt": "yuv420p"
+    },
+    RenderProfile.ARCHIVAL: {
+        "codec": "libx264",
+        "preset": "slow",
+        "crf": 18,
+        "video_bitrate": None,
+        "threads": 0,
+        "gop": 10,
+        "pix_fmt": "yuv420p"
+    }
+}
+
+# 分辨率名稱到幀尺寸的映射
+RESOLUTIONS = {
+    "360p": (640, 360),
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080)
+}
+
+def parse_quality(quality: Optional[Union[str, RenderQuality]]) -> RenderQuality:
+    """
+    解析渲染質量參數
+    
+    Args:
+        quality: 質量名稱或枚舉值，為空時使用最終成片質量
+        
+    Returns:
+        渲染質量枚舉
+    """
+    if isinstance(quality, RenderQuality):
+        return quality
+    if not quality:
+        return RenderQuality.FINAL
+    
+    try:
+        return RenderQuality(str(quality).lower())
+    except ValueError:
+        print(f"警告: 未知的渲染質量 {quality}，將使用最終成片質量")
+        return RenderQuality.FINAL
+
+def parse_profile(profile: Optional[Union[str, RenderProfile]]) -> RenderProfile:
+    """
+    解析編碼配置參數
+    
+    Args:
+        profile: 配置名稱或枚舉值，為空時讀取RENDER_PROFILE環境變量（默認為balanced）
+        
+    Returns:
+        編碼配置枚舉
+    """
+    if isinstance(profile, RenderProfile):
+        return profile
+    profile = profile or os.getenv("RENDER_PROFILE", RenderProfile.BALANCED.value)
+    
+    try:
+        return RenderProfile(str(profile).lower())
+    except ValueError:
+        print(f"警告: 未知的編碼配置 {profile}，將使用balanced配置")
+        return RenderProfile.BALANCED
+
+def get_encoder_settings(profile: Optional[Union[str, RenderProfile]] = None) -> Dict[str, Any]:
+    """
+    獲取編碼配置對應的編碼參數
+    
+    RENDER_THREADS環境變量可以為整個服務限制編碼線程數。
+    
+    Args:
+        profile: 配置名稱或枚舉值
+        
+    Returns:
+        編碼參數字典，包含profile、codec、preset、crf、video_bitrate、threads、gop和pix_fmt
+    """
+    profile = parse_profile(profile)
+    settings = dict(PROFILE_SETTINGS[profile])
+    settings["profile"] = profile.value
+    
+    if os.getenv("RENDER_THREADS"):
+        settings["threads"] = int(os.getenv("RENDER_THREADS"))
+    
+    return settings
+
+def get_render_settings(
+    quality: Optional[Union[str, RenderQuality]] = None,
+    profile: Optional[Union[str, RenderProfile]] = None
+) -> Dict[str, Any]:
+    """
+    獲取渲染質量和編碼配置對應的渲染設置
+    
+    Args:
+        quality: 質量名稱或枚舉值
+        profile: 編碼配置名稱或枚舉值
+        
+    Returns:
+        渲染設置字典，包含quality、resolution、fps、audio_bitrate以及get_encoder_settings返回的編碼參數
+    """
+    quality = parse_quality(quality)
+    settings = get_encoder_settings(profile)
+    settings.update(QUALITY_SETTINGS[quality])
+    settings["quality"] = quality.value
+    return settings
+
+def video_encoder_args(settings: Optional[Dict[str, Any]] = None, fps: Optional[float] = None) -> List[str]:
+    """
+    將編碼參數轉換為FFmpeg視頻編碼參數
+    
+    Args:
+        settings: 編碼參數（get_encoder_settings或get_render_settings的返回值），缺少的字段使用默認配置
+        fps: 輸出幀率，用於將GOP秒數換算為幀數，為None時不設置GOP
+        
+    Returns:
+        FFmpeg命令參數列表
+    """
+    encoder = get_encoder_settings()
+    encoder.update({key: value for key, value in (settings or {}).items() if value is not None})
+    
+    args = ["-c:v", encoder["codec"], "-preset", encoder["preset"]]
+    if encoder.get("video_bitrate"):
+        args += ["-b:v", str(encoder["video_bitrate"])]
+    else:
+        args += ["-crf", str(encoder["crf"])]
+    
+    if fps and encoder.get("gop"):
+        args += ["-g", str(max(1, int(round(encoder["gop"] * fps))))]
+    
+    args += ["-pix_fmt", encoder["pix_fmt"], "-threads", str(encoder["threads"])]
+    return args
+
+def get_frame_size(resolution: str, default: str = "720p") -> Tuple[int, int]:
+    """
+    獲取分辨率對應的幀尺寸
+    
+    Args:
+        resolution: 分辨率名稱
+        default: 未知分辨率時使用的分辨率
+        
+    Returns:
+        (寬度, 高度)
+    """
+    return RESOLUTIONS.get(resolution, RESOLUTIONS[default])
@@ -0,0 +1,370 @@
+"""
+渲染任務跟蹤模塊 - 在後台統一跟蹤服務提供商的遠程渲染任務
+
+此模塊提供以下功能：
+1. 在單個後台asyncio事件循環中跟蹤所有未完成的渲染任務ID
+2. 自適應輪詢間隔：任務剛提交時頻繁輪詢，等待越久輪詢越稀疏
+3. 可選的Webhook接收端，驗證簽名後立即查詢對應任務的狀態，輪詢只作為兜底
+4. 任務完成時設置Future結果並更新任務狀態，調用方無需阻塞線程等待
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Any, Callable
+
+from metrics import get_registry
+
+# Webhook簽名請求頭，值為請求體的HMAC-SHA256十六進制摘要（可帶sha256=前綴）
+WEBHOOK_SIGNATURE_HEADER = "X-Webhook-Signature"
+
+# 服務提供商表示渲染完成或失敗的狀態值
+COMPLETED_STATUSES = {"complete", "completed", "succeeded", "success"}
+FAILED_STATUSES = {"failed", "error", "cancelled", "rejected"}
+
+class RenderTracker:
+    """渲染任務跟蹤類，使用一個後台輪詢任務跟蹤所有未完成的渲染"""
+    
+    def __init__(
+        self,
+        min_interval: float = 2.0,
+        max_interval: float = 15.0,
+        webhook_interval: float = 60.0,
+        timeout: float = 1800.0
+    ):
+        """
+        初始化渲染任務跟蹤類
+        
+        Args:
+            min_interval: 最短輪詢間隔（秒）
+            max_interval: 最長輪詢間隔（秒）
+            webhook_interval: 啟用Webhook後的兜底輪詢間隔（秒）
+            timeout: 單個渲染任務的最長等待時間（秒）
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.webhook_interval = webhook_interval
+        self.timeout = timeout
+        self.webhook_enabled = False
+        
+        self._renders: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        
+        # 在守護線程中運行事件循環，所有輪詢都在這個循環中進行
+        self._loop = asyncio.new_event_loop()
+        self._wakeup = asyncio.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="render-tracker", daemon=True)
+        self._thread.start()
+    
+    def _run_loop(self) -> None:
+        """後台線程入口：運行輪詢任務"""
+        asyncio.set_event_loop(self._loop)
+        self._loop.create_task(self._poll_loop())
+        self._loop.run_forever()
+    
+    def track(
+        self,
+        render_id: str,
+        fetch_status: Callable[[str], Dict[str, Any]],
+        provider: str = ""
+    ) -> Future:
+        """
+        開始跟蹤一個渲染任務
+        
+        Args:
+            render_id: 服務提供商返回的渲染任務ID
+            fetch_status: 查詢任務狀態的函數，返回包含status、download和error的字典
+            provider: 服務提供商名稱，用於狀態展示
+            
+        Returns:
+            渲染完成時設置為下載URL的Future；失敗或超時時設置異常。
+            同一任務正在跟蹤或已完成時返回已有的Future
+        """
+        now = time.time()
+        
+        with self._lock:
+            # 重複跟蹤同一任務時共用已有的Future，不覆蓋記錄，否則先前的等待方永遠得不到結果
+            existing = self._renders.get(render_id)
+            if existing is not None and existing["status"] in ("pending", "complete"):
+                return existing["future"]
+            
+            future = Future()
+            self._renders[render_id] = {
+                "render_id": render_id,
+                "provider": provider,
+                "fetch_status": fetch_status,
+                "future": future,
+                "status": "pending",
+                "submitted_at": now,
+                "next_poll": now + self.min_interval,
+                "polling": False,
+                "polls": 0
+            }
+        
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return future
+    
+    def handle_webhook(self, payload: Dict[str, Any]) -> bool:
+        """
+        處理服務提供商的Webhook回調
+        
+        支持 {"id", ...} 以及 {"type", "data": {...}} 兩種格式。回調只用於觸發立即查詢，
+        任務狀態和下載URL仍以服務提供商API的查詢結果為準，不使用回調中的URL。
+        
+        Args:
+            payload: 回調JSON
+            
+        Returns:
+            回調對應的任務正在跟蹤時返回True
+        """
+        data = payload.get("data", payload)
+        render_id = data.get("id")
+        
+        with self._lock:
+            render = self._renders.get(render_id)
+            if render is None or render["status"] != "pending":
+                return False
+            render["next_poll"] = 0.0
+        
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+    
+    def run_in_background(self, func: Callable, *args) -> Future:
+        """
+        在跟蹤器的線程池中執行阻塞函數（如下載完成的視頻）
+        
+        Args:
+            func: 要執行的函數
+            *args: 函數參數
+            
+        Returns:
+            函數結果的Future
+        """
+        return asyncio.run_coroutine_threadsafe(asyncio.to_thread(func, *args), self._loop)
+    
+    def get_state(self, render_id: str) -> Optional[Dict[str, Any]]:
+        """
+        獲取渲染任務的當前狀態
+        
+        Args:
+            render_id: 渲染任務ID
+            
+        Returns:
+            狀態字典，任務不存在時返回None
+        """
+        with self._lock:
+            render = self._renders.get(render_id)
+            if render is None:
+                return None
+            return {
+                "render_id": render_id,
+                "provider": render["provider"],
+                "status": render["status"],
+                "elapsed": time.time() - render["submitted_at"],
+                "polls": render["polls"]
+            }
+    
+    def pending(self) -> List[str]:
+        """
+        獲取所有未完成的渲染任務ID
+        
+        Returns:
+            渲染任務ID列表
+        """
+        with self._lock:
+            return [rid for rid, render in self._renders.items() if render["status"] == "pending"]
+    
+    def _next_interval(self, render: Dict[str, Any], now: float) -> float:
+        """
+        計算下一次輪詢間隔：約為已等待時間的10%，限制在最短和最長間隔之間
+        
+        Args:
+            render: 渲染任務記錄
+            now: 當前時間
+            
+        Returns:
+            輪詢間隔（秒）
+        """
+        if self.webhook_enabled:
+            return self.webhook_interval
+        elapsed = now - render["submitted_at"]
+        return min(self.max_interval, max(self.min_interval, elapsed * 0.1))
+    
+    async def _poll_loop(self) -> None:
+        """輪詢主循環：為到期的任務各啟動一個查詢，然後休眠到下一個任務到期或被喚醒"""
+        while True:
+            now = time.time()
+            with self._lock:
+                # 清理完成超過一小時的任務記錄
+                for render_id in [
+                    rid for rid, r in self._renders.items()
+                    if r["status"] != "pending" and now - r["finished_at"] > 3600
+                ]:
+                    del self._renders[render_id]
+                due = [
+                    r for r in self._renders.values()
+                    if r["status"] == "pending" and not r["polling"] and r["next_poll"] <= now
+                ]
+                for render in due:
+                    render["polling"] = True
+            
+            # 每個查詢獨立運行，一個響應慢的任務不會推遲其他到期任務的查詢
+            for render in due:
+                self._loop.create_task(self._poll_one(render))
+            
+            with self._lock:
+                next_polls = [
+                    r["next_poll"] for r in self._renders.values() if r["status"] == "pending" and not r["polling"]
+                ]
+            sleep_time = max(0.0, min(next_polls) - time.time()) if next_polls else self.max_interval
+            
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_time)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    async def _poll_one(self, render: Dict[str, Any]) -> None:
+        """查詢單個渲染任務的狀態，完成後喚醒主循環重新計算休眠時間"""
+        try:
+            now = time.time()
+            
+            if now - render["submitted_at"] > self.timeout:
+                self._finish(render, "timeout", error=TimeoutError(f"等待渲染任務超時: {render['render_id']}"))
+                return
+            
+            render["polls"] += 1
+            try:
+                data = await asyncio.to_thread(render["fetch_status"], render["render_id"])
+            except Exception as e:
+                print(f"查詢渲染任務狀態時發生錯誤: {render['render_id']}, {str(e)}")
+                data = None
+            
+            if data:
+                self._apply_status(render, data)
+            
+            with self._lock:
+                # 查詢期間收到Webhook時next_poll已置零，保留以便立即再查一次
+                if render["status"] == "pending" and render["next_poll"] > 0:
+                    render["next_poll"] = time.time() + self._next_interval(render, time.time())
+        finally:
+            render["polling"] = False
+            self._wakeup.set()
+    
+    def _apply_status(self, render: Dict[str, Any], data: Dict[str, Any]) -> None:
+        """根據查詢結果或回調更新任務狀態"""
+        if render["status"] != "pending":
+            return
+        
+        status = str(data.get("status", "")).lower()
+        if status in COMPLETED_STATUSES:
+            self._finish(render, "complete", result=data.get("download"))
+        elif status in FAILED_STATUSES:
+            self._finish(render, "failed", error=RuntimeError(f"渲染任務失敗: {data.get('error')}"))
+    
+    def _finish(
+        self,
+        render: Dict[str, Any],
+        status: str,
+        result: Optional[str] = None,
+        error: Optional[Exception] = None
+    ) -> None:
+        """結束渲染任務並設置Future"""
+        with self._lock:
+            render["status"] = status
+            render["finished_at"] = time.time()
+            # 已完成的任務只保留狀態，不再持有回調函數
+            render["fetch_status"] = None
+        
+        future = render["future"]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+_shared_tracker = None
+_shared_tracker_lock = threading.Lock()
+
+def get_render_tracker() -> RenderTracker:
+    """
+    獲取進程內共享的渲染任務跟蹤器
+    
+    Returns:
+        RenderTracker實例
+    """
+    global _shared_tracker
+    with _shared_tracker_lock:
+        if _shared_tracker is None:
+            _shared_tracker = RenderTracker()
+            
+            # 等待服務提供商完成的渲染任務數，即遠程渲染隊列的深度
+            tracker = _shared_tracker
+            get_registry().gauge_callback(
+                "render_tracker_pending_renders", "等待服務提供商完成的渲染任務數", lambda: len(tracker.pending())
+            )
+        return _shared_tracker
+
+def verify_webhook_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """
+    驗證Webhook請求體的HMAC-SHA256簽名
+    
+    Args:
+        secret: 與服務提供商約定的共享密鑰
+        body: 原始請求體
+        signature: 簽名請求頭的值，十六進制摘要，可帶sha256=前綴
+        
+    Returns:
+        簽名有效時返回True
+    """
+    if not signature:
+        return False
+    if signature.startswith("sha256="):
+        signature = signature[len("sha256="):]
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+def register_webhook_route(
+    app: Any,
+    tracker: RenderTracker,
+    path: str = "/webhooks/render",
+    secret: Optional[str] = None
+) -> None:
+    """
+    在Flask應用中註冊渲染完成回調的接收端
+    
+    回調必須帶有效的簽名請求頭，否則返回401。
+    
+    Args:
+        app: Flask應用
+        tracker: 渲染任務跟蹤器
+        path: 回調路徑
+        secret: 簽名共享密鑰，默認讀取RENDER_WEBHOOK_SECRET環境變量
+        
+    Raises:
+        ValueError: 沒有配置共享密鑰
+    """
+    from flask import request, jsonify
+    
+    secret = secret or os.getenv("RENDER_WEBHOOK_SECRET")
+    if not secret:
+        raise ValueError("註冊渲染回調需要共享密鑰，請設置RENDER_WEBHOOK_SECRET環境變量")
+    
+    tracker.webhook_enabled = True
+    
+    def render_webhook():
+        """渲染完成回調端點"""
+        if not verify_webhook_signature(secret, request.get_data(), request.headers.get(WEBHOOK_SIGNATURE_HEADER)):
+            return jsonify({"error": "Invalid signature"}), 401
+        
+        payload = request.get_json(silent=True) or {}
+        if tracker.handle_webhook(payload):
+            return jsonify({"status": "ok"})
+        return jsonify({"status": "ignored"}), 202
+    
+    app.add_url_rule(path, "render_webhook", render_webhook, methods=["POST"])
@@ -15,8 +15,14 @@ import uuid
 import requests
 import re
 import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
 from enum import Enum
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Callable
 from dotenv import load_dotenv
 
 # 導入NLP工具
@@ -32,6 +38,17 @@ import cv2
 import numpy as np
 from moviepy.editor import VideoFileClip, AudioFileClip, ImageClip, CompositeVideoClip, concatenate_videoclips
 
+# 導入渲染緩存、渲染設置和靜態圖片動畫
+from render_cache import SceneRenderCache
+from render_settings import get_encoder_settings, get_frame_size, get_render_settings, video_encoder_args
+from video_concat import FFMPEG_BINARY, VideoConcatenator
+from ken_burns import KenBurnsAnimator
+from scene_library import SceneLibrary, prompt_terms
+from tracing import get_tracer, register_trace_routes, traced
+from metrics import get_registry, register_metrics_route
+from provider_rate_limiter import provider_request, register_priority_hook
+from concurrent_scenes import ConcurrentSceneGenerator, get_provider_concurrency
+
 # 加載環境變量
 load_dotenv()
 
@@ -55,6 +72,11 @@ class SceneGenerationProvider(Enum):
     RUNWAY = "runway"
     MOCK = "mock"  # 模擬模式
 
+class SceneType(Enum):
+    """場景類型枚舉"""
+    VIDEO = "video"  # 由服務提供商從文本生成視頻
+    STILL = "still"  # 單張圖片加Ken Burns推拉平移運動，在本地渲染
+
 class ContentAnalyzer:
     """內容分析類，用於分析文本並提取關鍵主題和場景"""
     
@@ -85,6 +107,11 @@ class ContentAnalyzer:
         
         # 初始化TF-IDF向量化器
         self.vectorizer = TfidfVectorizer(max_features=100)
+        
+        # 按文本摘要緩存分析結果，草稿和最終成片使用相同的段落和場景描述
+        self._analysis_cache = OrderedDict()
+        self._analysis_cache_size = 128
+        self._analysis_lock = threading.Lock()
     
     def detect_language(self, text: str) -> str:
         """
@@ -217,6 +244,7 @@ class ContentAnalyzer:
         
         return entities
     
+    @traced("scene.analyze_content")
     def analyze_content(self, text: str) -> List[Dict[str, Any]]:
         """
         分析文本內容，提取段落、關鍵詞和場景描述
@@ -227,6 +255,12 @@ class ContentAnalyzer:
         Returns:
             分析結果列表，每個元素包含段落文本、關鍵詞和場景描述
         """
+        text_digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._analysis_lock:
+            if text_digest in self._analysis_cache:
+                self._analysis_cache.move_to_end(text_digest)
+                return [dict(item) for item in self._analysis_cache[text_digest]]
+        
         # 分割文本為段落
         paragraphs = self.segment_text(text)
         
@@ -254,6 +288,11 @@ class ContentAnalyzer:
                 "scene_description": scene_description
             })
         
+        with self._analysis_lock:
+            self._analysis_cache[text_digest] = [dict(item) for item in results]
+            while len(self._analysis_cache) > self._analysis_cache_size:
+                self._analysis_cache.popitem(last=False)
+        
         return results
     
     def generate_scene_description(self, text: str, keywords: List[str], entities: List[str]) -> str:
@@ -295,14 +334,31 @@ class ContentAnalyzer:
 class SceneGenerator:
     """場景生成類，用於生成與內容相關的視覺場景"""
     
-    def __init__(self, provider: SceneGenerationProvider = SceneGenerationProvider.MOCK):
+    def __init__(
+        self,
+        provider: SceneGenerationProvider = SceneGenerationProvider.MOCK,
+        cache: Optional[SceneRenderCache] = None
+    ):
         """
         初始化場景生成類
         
         Args:
             provider: 場景生成服務提供商，默認為模擬模式
+            cache: 場景渲染緩存，默認不使用緩存
         """
         self.provider = provider
+        self.cache = cache
+        
+        # 記錄當前線程的渲染是否回退到模擬模式，回退結果不寫入緩存
+        self._render_state = threading.local()
+        
+        # 本地場景素材庫，生成之前先檢索
+        self.library = SceneLibrary()
+        
+        # 靜態圖片場景：默認場景類型和生成圖片的緩存目錄
+        self.default_scene_type = os.getenv("SCENE_TYPE", SceneType.VIDEO.value)
+        self.image_cache_dir = os.getenv("SCENE_IMAGE_CACHE", os.path.join(tempfile.gettempdir(), "scene_images"))
+        self.ken_burns = KenBurnsAnimator()
         
         # 初始化Zebracat配置
         if provider == SceneGenerationProvider.ZEBRACAT:
@@ -312,7 +368,7 @@ class SceneGenerator:
                 print("警告: 未設置ZEBRACAT_API_KEY環境變量，將使用模擬模式")
                 self.provider = SceneGenerationProvider.MOCK
             
-            self.api_base_url = "https://api.zebracat.ai/v1"
+            self.api_base_url = os.getenv("ZEBRACAT_API_BASE_URL", "https://api.zebracat.ai/v1")
         
         # 初始化Runway配置
         elif provider == SceneGenerationProvider.RUNWAY:
@@ -322,15 +378,21 @@ class SceneGenerator:
                 print("警告: 未設置RUNWAY_API_KEY環境變量，將使用模擬模式")
                 self.provider = SceneGenerationProvider.MOCK
             
-            self.api_base_url = "https://api.runwayml.com/v1"
+            self.api_base_url = os.getenv("RUNWAY_API_BASE_URL", "https://api.runwayml.com/v1")
     
+    @traced("scene.generate_scene")
     def generate_scene(
         self, 
         prompt: str, 
         output_file: str,
         style: str = "realistic",
         duration: int = 5,
-        resolution: str = "1080p"
+        resolution: str = "1080p",
+        quality: Optional[str] = None,
+        scene_type: Optional[str] = None,
+        image_file: Optional[str] = None,
+        profile: Optional[str] = None,
+        keywords: Optional[List[str]] = None
     ) -> str:
         """
         生成場景視頻
@@ -341,27 +403,66 @@ class SceneGenerator:
             style: 視覺風格
             duration: 視頻時長（秒）
             resolution: 視頻分辨率
+            quality: 渲染質量（draft或final），指定時使用該質量的分辨率
+            scene_type: 場景類型（video或still），默認讀取SCENE_TYPE環境變量
+            image_file: 靜態圖片場景使用的圖片，不指定時使用素材庫中的圖片或生成圖片
+            profile: 靜態圖片場景在本地編碼使用的編碼配置
+            keywords: 段落的關鍵詞和實體，用於檢索素材庫，不指定時從場景描述中提取
             
         Returns:
             輸出文件路徑
         """
+        if quality:
+            resolution = get_render_settings(quality)["resolution"]
+        
+        # 先從本地素材庫檢索，足夠相關時不再生成
+        if not image_file:
+            library_file = self.generate_from_library(prompt, output_file, style, duration, resolution, quality, keywords, profile)
+            if library_file:
+                return library_file
+        
+        if (scene_type or self.default_scene_type) == SceneType.STILL.value:
+            return self.generate_still_scene(prompt, output_file, style, duration, resolution, quality, image_file, profile)
+        
+        # 先查找緩存，命中時直接返回（必要時從較長的緩存片段裁剪）
+        if self.cache:
+            cached_file = self.cache.lookup(prompt, output_file, style, duration, resolution, self.provider.value)
+            if cached_file:
+                print(f"場景緩存命中: {prompt}")
+                return cached_file
+        
+        self._render_state.used_mock_fallback = False
+        
+        # 與generate_scenes共用服務提供商的並發上限
         if self.provider == SceneGenerationProvider.ZEBRACAT:
-            return self._generate_zebracat_scene(prompt, output_file, style, duration, resolution)
+            with get_provider_concurrency(self.provider.value).hold():
+                result = self._generate_zebracat_scene(prompt, output_file, style, duration, resolution)
         elif self.provider == SceneGenerationProvider.RUNWAY:
-            return self._generate_runway_scene(prompt, output_file, style, duration, resolution)
+            with get_provider_concurrency(self.provider.value).hold():
+                result = self._generate_runway_scene(prompt, output_file, style, duration, resolution)
         else:
-            return self._generate_mock_scene(prompt, output_file, style, duration, resolution)
+            result = self._generate_mock_scene(prompt, output_file, style, duration, resolution)
+        
+        # 回退到模擬模式的結果不能代表提供商的渲染，不寫入緩存
+        if self.cache and not self._render_state.used_mock_fallback:
+            self.cache.store(prompt, result, style, duration, resolution, self.provider.value)
+        
+        return result
     
-    def _generate_zebracat_scene(
-        self, 
-        prompt: str, 
+    @traced("scene.generate_still")
+    def generate_still_scene(
+        self,
+        prompt: str,
         output_file: str,
         style: str = "realistic",
         duration: int = 5,
-        resolution: str = "1080p"
+        resolution: str = "1080p",
+        quality: Optional[str] = None,
+        image_file: Optional[str] = None,
+        profile: Optional[str] = None
     ) -> str:
         """
-        使用Zebracat生成場景視頻
+        使用單張圖片和Ken Burns運動生成場景視頻，不調用文本生成視頻服務
         
         Args:
             prompt: 場景描述
@@ -369,23 +470,166 @@ class SceneGenerator:
             style: 視覺風格
             duration: 視頻時長（秒）
             resolution: 視頻分辨率
+            quality: 渲染質量（draft或final），指定時使用該質量的幀率和編碼參數
+            image_file: 場景圖片，不指定時生成
+            profile: 編碼配置（fast、balanced或archival）
             
         Returns:
             輸出文件路徑
         """
+        settings = get_render_settings(quality, profile) if quality else get_encoder_settings(profile)
+        image_file = self._find_scene_image(prompt, style, resolution, image_file)
+        
+        # 靜態場景與提供商無關，以圖片和編碼配置區分緩存
+        cache_provider = f"{SceneType.STILL.value}:{os.path.basename(image_file)}:{settings['profile']}"
+        if self.cache:
+            cached_file = self.cache.lookup(prompt, output_file, style, duration, resolution, cache_provider)
+            if cached_file:
+                print(f"場景緩存命中: {prompt}")
+                return cached_file
+        
         try:
-            url = f"{self.api_base_url}/scenes"
+            result = self.ken_burns.render(
+                image_file, output_file, duration, resolution,
+                motion=self.ken_burns.choose_motion(prompt), fps=settings.get("fps"), encoder=settings
+            )
+        except Exception as e:
+            print(f"生成靜態圖片場景時發生錯誤: {str(e)}")
+            return self._generate_mock_scene(prompt, output_file, style, duration, resolution)
+        
+        if self.cache:
+            self.cache.store(prompt, result, style, duration, resolution, cache_provider)
+        
+        return result
+    
+    @traced("scene.library_lookup")
+    def generate_from_library(
+        self,
+        prompt: str,
+        output_file: str,
+        style: str = "realistic",
+        duration: int = 5,
+        resolution: str = "1080p",
+        quality: Optional[str] = None,
+        keywords: Optional[List[str]] = None,
+        profile: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        使用素材庫中最相關的素材生成場景：視頻片段直接截取，圖片加Ken Burns運動
+        
+        Args:
+            prompt: 場景描述
+            output_file: 輸出文件路徑
+            style: 視覺風格
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
+            quality: 渲染質量（draft或final）
+            keywords: 段落的關鍵詞和實體，不指定時從場景描述中提取
+            profile: 圖片素材在本地編碼使用的編碼配置
             
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+        Returns:
+            輸出文件路徑，沒有得分超過閾值的素材時返回None
+        """
+        asset = self.library.match(keywords or prompt_terms(prompt), min_duration=duration)
+        if not asset:
+            return None
+        
+        print(f"場景素材庫命中: {asset['file']}（相似度 {asset['score']:.2f}）")
+        
+        if asset["type"] == "image":
+            return self.generate_still_scene(prompt, output_file, style, duration, resolution, quality, asset["path"], profile)
+        
+        try:
+            return self.library.export_clip(asset, output_file, duration)
+        except Exception as e:
+            print(f"截取素材片段時發生錯誤: {str(e)}")
+            return None
+    
+    def generate_scenes(
+        self,
+        jobs: List[Dict[str, Any]],
+        max_concurrency: Optional[int] = None,
+        on_complete: Optional[Callable[[int, str], None]] = None
+    ) -> List[str]:
+        """
+        並發生成多個場景視頻
+        
+        Args:
+            jobs: 場景任務列表，每個元素包含prompt、output_file，以及可選的style、duration、resolution、quality、
+                scene_type、image_file、profile和keywords
+            max_concurrency: 當前服務提供商的最大並發數，默認使用提供商的默認限制
+            on_complete: 每個場景完成時的回調函數，參數為任務索引和輸出文件路徑
+            
+        Returns:
+            與任務順序一致的輸出文件路徑列表
+        """
+        limits = {self.provider.value: max_concurrency} if max_concurrency else None
+        runner = ConcurrentSceneGenerator(self, max_concurrency=limits)
+        return runner.generate_scenes(jobs, on_complete=on_complete)
+    
+    def build_scene_jobs(self, analysis: List[Dict[str, Any]], output_dir: str, **options) -> List[Dict[str, Any]]:
+        """
+        將內容分析結果轉換為場景任務，段落的關鍵詞和實體用於檢索素材庫
+        
+        Args:
+            analysis: ContentAnalyzer.analyze_content的返回值
+            output_dir: 場景視頻的輸出目錄
+            **options: 每個任務共用的參數，例如style、duration、resolution、quality和scene_type
+            
+        Returns:
+            可傳給generate_scenes的場景任務列表
+        """
+        return [
+            dict(
+                options,
+                prompt=item["scene_description"],
+                output_file=os.path.join(output_dir, f"scene_{index:04d}.mp4"),
+                keywords=item.get("keywords", []) + item.get("entities", [])
+            )
+            for index, item in enumerate(analysis)
+        ]
+    
+    def _get_api_headers(self) -> Dict[str, str]:
+        """
+        獲取服務提供商API的請求頭
+        
+        Returns:
+            請求頭字典
+        """
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    def _build_provider_request(
+        self,
+        prompt: str,
+        style: str = "realistic",
+        duration: int = 5,
+        resolution: str = "1080p"
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """
+        構建當前服務提供商的場景生成請求
+        
+        Args:
+            prompt: 場景描述
+            style: 視覺風格
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
             
+        Returns:
+            (請求URL, 請求頭, 請求數據)
+        """
+        headers = self._get_api_headers()
+        
+        if self.provider == SceneGenerationProvider.ZEBRACAT:
             # 解析分辨率
             if resolution == "1080p":
                 width, height = 1920, 1080
             elif resolution == "720p":
                 width, height = 1280, 720
+            elif resolution == "360p":
+                width, height = 640, 360
             else:
                 width, height = 1280, 720
             
@@ -401,12 +645,78 @@ class SceneGenerator:
                 "format": "mp4"
             }
             
-            # 發送請求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            return f"{self.api_base_url}/scenes", headers, data
+        
+        # 準備請求數據
+        data = {
+            "prompt": prompt,
+            "num_frames": duration * 30,  # 假設30fps
+            "style_preset": style
+        }
+        
+        return f"{self.api_base_url}/text-to-video", headers, data
+    
+    def _get_result_url(self, result: Dict[str, Any]) -> Optional[str]:
+        """
+        從服務提供商的響應中獲取場景視頻URL
+        
+        Args:
+            result: 響應JSON
+            
+        Returns:
+            視頻URL，任務尚未完成時返回None
+        """
+        if self.provider == SceneGenerationProvider.ZEBRACAT:
+            return result.get("url")
+        return result.get("output")
+    
+    def _get_job_status_url(self, job_id: str) -> str:
+        """
+        獲取異步渲染任務的狀態查詢URL
+        
+        Args:
+            job_id: 服務提供商返回的任務ID
+            
+        Returns:
+            狀態查詢URL
+        """
+        if self.provider == SceneGenerationProvider.ZEBRACAT:
+            return f"{self.api_base_url}/scenes/{job_id}"
+        return f"{self.api_base_url}/tasks/{job_id}"
+    
+    @traced("scene.zebracat")
+    def _generate_zebracat_scene(
+        self, 
+        prompt: str, 
+        output_file: str,
+        style: str = "realistic",
+        duration: int = 5,
+        resolution: str = "1080p"
+    ) -> str:
+        """
+        使用Zebracat生成場景視頻
+        
+        Args:
+            prompt: 場景描述
+            output_file: 輸出文件路徑
+            style: 視覺風格
+            duration: 視頻時長（秒）
+            resolution: 視頻分辨率
+            
+        Returns:
+            輸出文件路徑
+        """
+        try:
+            url, headers, data = self._build_provider_request(prompt, style, duration, resolution)
+            
+            # 在配額內發送請求
+            response = provider_request(
+                self.provider.value, "generate", "post", url, headers=headers, data=json.dumps(data)
+            )
             
             if response.status_code == 200:
                 result = response.json()
-                scene_url = result.get("url")
+                scene_url = self._get_result_url(result)
                 
                 # 下載視頻
                 self._download_file(scene_url, output_file)
@@ -419,6 +729,7 @@ class SceneGenerator:
             print(f"生成Zebracat場景時發生錯誤: {str(e)}")
             return self._generate_mock_scene(prompt, output_file, style, duration, resolution)
     
+    @traced("scene.runway")
     def _generate_runway_scene(
         self, 
         prompt: str, 
@@ -441,26 +752,16 @@ class SceneGenerator:
             輸出文件路徑
         """
         try:
-            url = f"{self.api_base_url}/text-to-video"
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # 準備請求數據
-            data = {
-                "prompt": prompt,
-                "num_frames": duration * 30,  # 假設30fps
-                "style_preset": style
-            }
+            url, headers, data = self._build_provider_request(prompt, style, duration, resolution)
             
-            # 發送請求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            # 在配額內發送請求
+            response = provider_request(
+                self.provider.value, "generate", "post", url, headers=headers, data=json.dumps(data)
+            )
             
             if response.status_code == 200:
                 result = response.json()
-                video_url = result.get("output")
+                video_url = self._get_result_url(result)
                 
                 # 下載視頻
                 self._download_file(video_url, output_file)
@@ -473,6 +774,69 @@ class SceneGenerator:
             print(f"生成Runway場景時發生錯誤: {str(e)}")
             return self._generate_mock_scene(prompt, output_file, style, duration, resolution)
     
+    def _find_scene_image(
+        self,
+        prompt: str,
+        style: str = "realistic",
+        resolution: str = "1080p",
+        image_file: Optional[str] = None
+    ) -> str:
+        """
+        獲取靜態場景使用的圖片：指定的圖片或生成的圖片
+        
+        Args:
+            prompt: 場景描述
+            style: 視覺風格
+            resolution: 視頻分辨率
+            image_file: 指定的圖片
+            
+        Returns:
+            圖片文件路徑
+        """
+        if image_file and os.path.exists(image_file):
+            return image_file
+        
+        return self._generate_scene_image(prompt, style, resolution)
+    
+    def _generate_scene_image(self, prompt: str, style: str = "realistic", resolution: str = "1080p") -> str:
+        """
+        生成場景圖片並按描述緩存，相同描述只生成一次
+        
+        Args:
+            prompt: 場景描述
+            style: 視覺風格
+            resolution: 視頻分辨率，圖片比輸出幀大，留出推拉平移的空間
+            
+        Returns:
+            圖片文件路徑
+        """
+        digest = hashlib.sha256(f"{prompt}|{style}|{resolution}".encode("utf-8")).hexdigest()[:32]
+        image_file = os.path.join(self.image_cache_dir, f"{digest}.jpg")
+        if os.path.exists(image_file):
+            return image_file
+        
+        width, height = get_frame_size(resolution)
+        width, height = int(width * 1.5), int(height * 1.5)
+        rng = np.random.default_rng(int(digest[:8], 16))
+        
+        # 以描述決定配色的漸變背景和若干圓形，推拉平移時能看出運動
+        start_color, end_color = rng.integers(40, 220, size=(2, 3))
+        ramp = np.linspace(0.0, 1.0, width)[None, :, None]
+        image = np.repeat((start_color * (1 - ramp) + end_color * ramp).astype(np.uint8), height, axis=0)
+        for _ in range(12):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            radius = int(rng.integers(height // 20, height // 6))
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            cv2.circle(image, center, radius, color, -1, lineType=cv2.LINE_AA)
+        
+        os.makedirs(self.image_cache_dir, exist_ok=True)
+        temp_file = f"{image_file}.{uuid.uuid4().hex}.jpg"
+        cv2.imwrite(temp_file, image)
+        os.replace(temp_file, image_file)
+        
+        return image_file
+    
+    @traced("scene.download")
     def _download_file(self, url: str, output_file: str) -> None:
         """
         下載文件
@@ -524,6 +888,9 @@ class SceneGenerator:
         Returns:
             輸出文件路徑
         """
+        if self.provider != SceneGenerationProvider.MOCK:
+            self._render_state.used_mock_fallback = True
+        
         try:
             print(f"生成模擬場景視頻: {prompt}")
             print(f"輸出文件: {output_file}")
@@ -538,7 +905,634 @@ class SceneGenerator:
                 width, height = 1280, 720
             elif resolution == "480p":
                 width, height = 854, 480
+            elif resolution == "360p":
+                width, height = 640, 360
             else:
                 width, height = 1280, 720
             
-            # 確保輸出<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>
\ No newline at end of file
+            # 確保輸出目錄存在
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            
+            # 以描述和風格決定底色，色相隨時間循環變化，相鄰場景切換時能看出區別
+            color = hashlib.sha256(f"{prompt}|{style}".encode("utf-8")).hexdigest()[:6]
+            fps = self.ken_burns.fps
+            command = [
+                FFMPEG_BINARY, "-y", "-v", "error",
+                "-f", "lavfi", "-i", f"color=c=0x{color}:s={width}x{height}:r={fps}:d={duration}",
+                "-vf", f"hue=h=360*t/{max(duration, 1)}",
+                *video_encoder_args(get_encoder_settings(), fps),
+                "-an",
+                "-movflags", "+faststart",
+                output_file
+            ]
+            subprocess.run(command, capture_output=True, check=True)
+            
+            return output_file
+        except Exception as e:
+            print(f"生成模擬場景視頻時發生錯誤: {str(e)}")
+            # 創建一個空文件
+            with open(output_file, "wb") as f:
+                f.write(b"")
+            return output_file
+
+class VideoComposer:
+    """視頻合成類，將數字人視頻與場景視頻合成為場景切換或畫中畫視頻"""
+    
+    # 數字人視頻的綠幕顏色，以及去除綠幕時的顏色相似度和邊緣過渡
+    CHROMA_KEY = "0x00FF00:0.3:0.1"
+    
+    # 畫中畫位置到overlay坐標的映射，邊距為主畫面寬度的3%
+    PIP_POSITIONS = {
+        "top-left": ("main_w*0.03", "main_w*0.03"),
+        "top-right": ("main_w-overlay_w-main_w*0.03", "main_w*0.03"),
+        "bottom-left": ("main_w*0.03", "main_h-overlay_h-main_w*0.03"),
+        "bottom-right": ("main_w-overlay_w-main_w*0.03", "main_h-overlay_h-main_w*0.03")
+    }
+    
+    def __init__(self, temp_dir: Optional[str] = None, quality: Optional[str] = None, profile: Optional[str] = None):
+        """
+        初始化視頻合成類
+        
+        Args:
+            temp_dir: 場景拼接的臨時目錄，默認為系統臨時目錄
+            quality: 默認渲染質量（draft或final），指定時使用該質量的分辨率、幀率和編碼參數
+            profile: 默認編碼配置（fast、balanced或archival），默認讀取RENDER_PROFILE環境變量
+        """
+        self.temp_dir = temp_dir or os.path.join(tempfile.gettempdir(), "video_composer")
+        self.quality = quality
+        self.profile = profile
+        os.makedirs(self.temp_dir, exist_ok=True)
+    
+    def _get_settings(self, quality: Optional[str] = None, profile: Optional[str] = None) -> Dict[str, Any]:
+        """
+        獲取本次合成的渲染設置，未指定的參數使用初始化時的設置
+        
+        Args:
+            quality: 渲染質量
+            profile: 編碼配置
+            
+        Returns:
+            get_render_settings或get_encoder_settings的返回值
+        """
+        quality = quality or self.quality
+        profile = profile or self.profile
+        return get_render_settings(quality, profile) if quality else get_encoder_settings(profile)
+    
+    @traced("compose.concat_scenes")
+    def concatenate_scenes(
+        self,
+        scene_videos: List[str],
+        output_file: str,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None
+    ) -> str:
+        """
+        按順序拼接場景視頻，參數一致的片段直接流複製，只歸一化不一致的片段
+        
+        Args:
+            scene_videos: 按播放順序排列的場景視頻文件路徑列表
+            output_file: 輸出視頻文件路徑
+            quality: 渲染質量（draft或final）
+            profile: 歸一化片段使用的編碼配置
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        concatenator = VideoConcatenator(temp_dir=self.temp_dir, encoder=self._get_settings(quality, profile))
+        return concatenator.concatenate(scene_videos, output_file)
+    
+    @traced("compose.scene_switching")
+    def compose_video(
+        self,
+        digital_human_video: str,
+        scene_videos: List[str],
+        output_file: str,
+        audio_file: Optional[str] = None,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None
+    ) -> str:
+        """
+        合成場景切換視頻：數字人去除綠幕後疊加在依次切換的場景上
+        
+        場景先拼接為一條背景軌，背景比數字人視頻短時循環播放，輸出時長與數字人視頻一致。
+        整個合成只在疊加數字人時編碼一次。
+        
+        Args:
+            digital_human_video: 綠幕背景的數字人視頻文件路徑
+            scene_videos: 按播放順序排列的場景視頻文件路徑列表
+            output_file: 輸出視頻文件路徑
+            audio_file: 音頻文件路徑，默認使用數字人視頻的音軌
+            quality: 渲染質量（draft或final），默認使用初始化時的設置
+            profile: 編碼配置（fast、balanced或archival），默認使用初始化時的設置
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        settings = self._get_settings(quality, profile)
+        scene_videos = [f for f in scene_videos if os.path.exists(f) and os.path.getsize(f) > 0]
+        if not scene_videos:
+            raise ValueError("沒有可用的場景視頻")
+        
+        background_file = os.path.join(self.temp_dir, f"background_{uuid.uuid4().hex}.mp4")
+        try:
+            self.concatenate_scenes(scene_videos, background_file, quality, profile)
+            return self._overlay(
+                background_file, digital_human_video, output_file, audio_file, settings,
+                presenter_filter=f"colorkey={self.CHROMA_KEY}", position=("0", "0"), size_ratio=1.0
+            )
+        finally:
+            if os.path.exists(background_file):
+                os.remove(background_file)
+    
+    @traced("compose.picture_in_picture")
+    def create_picture_in_picture(
+        self,
+        main_video: str,
+        pip_video: str,
+        output_file: str,
+        position: str = "bottom-right",
+        size_ratio: float = 0.3,
+        audio_file: Optional[str] = None,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None
+    ) -> str:
+        """
+        合成畫中畫視頻：縮小的畫中畫視頻疊加在主畫面的角落
+        
+        主畫面比畫中畫視頻短時循環播放，輸出時長與畫中畫視頻一致。
+        
+        Args:
+            main_video: 主畫面視頻文件路徑
+            pip_video: 畫中畫視頻文件路徑（通常為數字人視頻）
+            output_file: 輸出視頻文件路徑
+            position: 畫中畫位置（top-left、top-right、bottom-left或bottom-right）
+            size_ratio: 畫中畫寬度佔主畫面寬度的比例
+            audio_file: 音頻文件路徑，默認使用畫中畫視頻的音軌
+            quality: 渲染質量（draft或final），默認使用初始化時的設置
+            profile: 編碼配置（fast、balanced或archival），默認使用初始化時的設置
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        if position not in self.PIP_POSITIONS:
+            print(f"警告: 未知的畫中畫位置 {position}，將使用bottom-right")
+            position = "bottom-right"
+        
+        return self._overlay(
+            main_video, pip_video, output_file, audio_file, self._get_settings(quality, profile),
+            presenter_filter="null", position=self.PIP_POSITIONS[position], size_ratio=size_ratio
+        )
+    
+    def _overlay(
+        self,
+        background_video: str,
+        presenter_video: str,
+        output_file: str,
+        audio_file: Optional[str],
+        settings: Dict[str, Any],
+        presenter_filter: str,
+        position: Tuple[str, str],
+        size_ratio: float
+    ) -> str:
+        """
+        將前景視頻疊加到循環播放的背景視頻上並編碼輸出
+        
+        Args:
+            background_video: 背景視頻文件路徑
+            presenter_video: 前景視頻文件路徑，決定輸出時長
+            output_file: 輸出視頻文件路徑
+            audio_file: 音頻文件路徑，為None時使用前景視頻的音軌
+            settings: 渲染設置，包含resolution和fps時按此輸出，否則沿用前景視頻的參數
+            presenter_filter: 前景視頻縮放後應用的濾鏡
+            position: 前景在背景上的overlay坐標表達式
+            size_ratio: 前景寬度佔背景寬度的比例
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        presenter = VideoConcatenator(temp_dir=self.temp_dir).probe(presenter_video)
+        if settings.get("resolution"):
+            width, height = get_frame_size(settings["resolution"])
+        else:
+            width, height = presenter["width"], presenter["height"]
+        fps = settings.get("fps") or presenter["fps"] or 25
+        
+        # 前景按比例縮放，寬高取偶數以滿足yuv420p
+        presenter_width = max(2, int(width * size_ratio) // 2 * 2)
+        filter_complex = (
+            f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height},setsar=1[background];"
+            f"[1:v]scale={presenter_width}:-2,{presenter_filter}[presenter];"
+            f"[background][presenter]overlay=x={position[0]}:y={position[1]}:shortest=1,fps={fps}[video]"
+        )
+        
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-stream_loop", "-1", "-i", background_video,
+            "-i", presenter_video
+        ]
+        if audio_file:
+            command += ["-i", audio_file]
+        command += [
+            "-filter_complex", filter_complex,
+            "-map", "[video]",
+            "-map", "2:a:0?" if audio_file else "1:a:0?",
+            *video_encoder_args(settings, float(fps)),
+            "-c:a", "aac", "-b:a", settings.get("audio_bitrate", "192k"),
+            "-shortest",
+            "-movflags", "+faststart",
+            output_file
+        ]
+        
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        result = subprocess.run(command, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"視頻合成失敗: {result.stderr.decode('utf-8', errors='ignore')}")
+        
+        return output_file
+
+class SceneGenerationAndComposition:
+    """場景生成和合成類，依次完成內容分析、場景生成和視頻合成"""
+    
+    def __init__(
+        self,
+        provider: SceneGenerationProvider = SceneGenerationProvider.MOCK,
+        temp_dir: Optional[str] = None,
+        cache: Optional[SceneRenderCache] = None
+    ):
+        """
+        初始化場景生成和合成類
+        
+        Args:
+            provider: 場景生成服務提供商，默認為模擬模式
+            temp_dir: 場景視頻和合成的臨時目錄，默認為系統臨時目錄
+            cache: 場景渲染緩存，默認不使用緩存
+        """
+        self.temp_dir = temp_dir or os.path.join(tempfile.gettempdir(), "scene_composition")
+        os.makedirs(self.temp_dir, exist_ok=True)
+        
+        self.content_analyzer = ContentAnalyzer()
+        self.scene_generator = SceneGenerator(provider=provider, cache=cache)
+        self.video_composer = VideoComposer(temp_dir=self.temp_dir)
+    
+    def generate_scene_videos(
+        self,
+        text: str,
+        output_dir: str,
+        style: str = "realistic",
+        scene_duration: int = 5,
+        resolution: str = "1080p",
+        quality: Optional[str] = None,
+        profile: Optional[str] = None,
+        scene_type: Optional[str] = None
+    ) -> List[str]:
+        """
+        分析文本並為每個段落生成一個場景視頻，各段落的場景按服務提供商的並發上限同時生成
+        
+        Args:
+            text: 演講文本
+            output_dir: 場景視頻的輸出目錄
+            style: 視覺風格
+            scene_duration: 每個場景的時長（秒）
+            resolution: 視頻分辨率
+            quality: 渲染質量（draft或final）
+            profile: 編碼配置（fast、balanced或archival）
+            scene_type: 場景類型（video或still）
+            
+        Returns:
+            按段落順序排列的場景視頻文件路徑列表
+        """
+        analysis = self.content_analyzer.analyze_content(text)
+        
+        jobs = self.scene_generator.build_scene_jobs(
+            analysis, output_dir,
+            style=style, duration=scene_duration, resolution=resolution,
+            quality=quality, scene_type=scene_type, profile=profile
+        )
+        return self.scene_generator.generate_scenes(jobs)
+    
+    @traced("compose.process")
+    def process(
+        self,
+        text: str,
+        digital_human_video: str,
+        output_file: str,
+        audio_file: Optional[str] = None,
+        style: str = "realistic",
+        scene_duration: int = 5,
+        resolution: str = "1080p",
+        quality: Optional[str] = None,
+        profile: Optional[str] = None,
+        scene_type: Optional[str] = None
+    ) -> str:
+        """
+        生成與文本內容相關的場景，並與數字人視頻合成為場景切換視頻
+        
+        Args:
+            text: 演講文本
+            digital_human_video: 綠幕背景的數字人視頻文件路徑
+            output_file: 輸出視頻文件路徑
+            audio_file: 音頻文件路徑，默認使用數字人視頻的音軌
+            style: 視覺風格
+            scene_duration: 每個場景的時長（秒）
+            resolution: 視頻分辨率
+            quality: 渲染質量（draft或final）
+            profile: 編碼配置（fast、balanced或archival）
+            scene_type: 場景類型（video或still）
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        scene_dir = tempfile.mkdtemp(prefix="scenes_", dir=self.temp_dir)
+        try:
+            scene_videos = self.generate_scene_videos(
+                text, scene_dir, style, scene_duration, resolution, quality, profile, scene_type
+            )
+            return self.video_composer.compose_video(
+                digital_human_video, scene_videos, output_file, audio_file, quality, profile
+            )
+        finally:
+            shutil.rmtree(scene_dir, ignore_errors=True)
+    
+    @traced("compose.process_pip")
+    def create_picture_in_picture_mode(
+        self,
+        text: str,
+        digital_human_video: str,
+        output_file: str,
+        audio_file: Optional[str] = None,
+        style: str = "realistic",
+        scene_duration: int = 5,
+        resolution: str = "1080p",
+        pip_position: str = "bottom-right",
+        pip_size_ratio: float = 0.3,
+        quality: Optional[str] = None,
+        profile: Optional[str] = None,
+        scene_type: Optional[str] = None
+    ) -> str:
+        """
+        生成與文本內容相關的場景作為主畫面，數字人視頻以畫中畫方式疊加
+        
+        Args:
+            text: 演講文本
+            digital_human_video: 數字人視頻文件路徑
+            output_file: 輸出視頻文件路徑
+            audio_file: 音頻文件路徑，默認使用數字人視頻的音軌
+            style: 視覺風格
+            scene_duration: 每個場景的時長（秒）
+            resolution: 視頻分辨率
+            pip_position: 畫中畫位置
+            pip_size_ratio: 畫中畫寬度佔主畫面寬度的比例
+            quality: 渲染質量（draft或final）
+            profile: 編碼配置（fast、balanced或archival）
+            scene_type: 場景類型（video或still）
+            
+        Returns:
+            輸出視頻文件路徑
+        """
+        scene_dir = tempfile.mkdtemp(prefix="scenes_", dir=self.temp_dir)
+        try:
+            scene_videos = self.generate_scene_videos(
+                text, scene_dir, style, scene_duration, resolution, quality, profile, scene_type
+            )
+            main_video = self.video_composer.concatenate_scenes(
+                [f for f in scene_videos if os.path.exists(f) and os.path.getsize(f) > 0],
+                os.path.join(scene_dir, "scenes.mp4"), quality, profile
+            )
+            return self.video_composer.create_picture_in_picture(
+                main_video, digital_human_video, output_file, pip_position, pip_size_ratio, audio_file, quality, profile
+            )
+        finally:
+            shutil.rmtree(scene_dir, ignore_errors=True)
+
+def create_app(provider: Optional[SceneGenerationProvider] = None):
+    """
+    創建場景生成和合成服務的Flask應用
+    
+    數字人視頻和音頻優先從與其他服務共用的輸出目錄讀取，不存在時從數字人服務和TTS服務下載。
+    場景渲染緩存默認開啟，緩存目錄和限制見SceneRenderCache，設置SCENE_CACHE_ENABLED=false時關閉。
+    
+    Args:
+        provider: 場景生成服務提供商，默認讀取SCENE_PROVIDER環境變量（默認mock）
+        
+    Returns:
+        Flask應用
+    """
+    from flask import Flask, request, jsonify, send_file
+    
+    app = Flask(__name__)
+    
+    # 鏈路追蹤、Prometheus指標和服務提供商配額的請求優先級
+    tracer = get_tracer()
+    register_trace_routes(app, tracer, "scene")
+    register_metrics_route(app, get_registry(), "scene")
+    register_priority_hook(app)
+    
+    output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    tts_service_url = os.getenv("TTS_SERVICE_URL", "http://localhost:5000")
+    digital_human_service_url = os.getenv("DIGITAL_HUMAN_SERVICE_URL", "http://localhost:5001")
+    
+    cache = None
+    if os.getenv("SCENE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+        cache = SceneRenderCache()
+    
+    processor = SceneGenerationAndComposition(
+        provider=provider or SceneGenerationProvider(os.getenv("SCENE_PROVIDER", SceneGenerationProvider.MOCK.value)),
+        cache=cache
+    )
+    
+    def fetch_input(file_id: str, extension: str, url: str) -> str:
+        """取得上游服務生成的文件：共用輸出目錄中已有時直接使用，否則下載到輸出目錄"""
+        if not file_id or '..' in file_id or '/' in file_id:
+            raise ValueError(f"無效的文件ID: {file_id}")
+        
+        local_file = os.path.join(output_dir, f"{file_id}.{extension}")
+        if os.path.exists(local_file):
+            return local_file
+        
+        response = requests.get(url, stream=True, headers=tracer.inject(), timeout=300)
+        response.raise_for_status()
+        
+        # 先寫入臨時文件，下載中斷時不會留下被當作完整文件的輸出
+        fd, temp_file = tempfile.mkstemp(dir=output_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+            os.replace(temp_file, local_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        return local_file
+    
+    def compose(pip: bool):
+        """處理場景切換或畫中畫合成請求"""
+        try:
+            data = request.json
+            text = data.get('text')
+            if not text or not data.get('digital_human_video_id'):
+                return jsonify({"error": "缺少必要參數: text或digital_human_video_id"}), 400
+            
+            digital_human_video = fetch_input(
+                data['digital_human_video_id'], "mp4",
+                f"{digital_human_service_url}/video/{data['digital_human_video_id']}"
+            )
+            audio_file = None
+            if data.get('audio_file_id'):
+                audio_file = fetch_input(
+                    data['audio_file_id'], "mp3", f"{tts_service_url}/audio/{data['audio_file_id']}"
+                )
+            
+            video_id = str(uuid.uuid4())
+            options = dict(
+                text=text,
+                digital_human_video=digital_human_video,
+                output_file=os.path.join(output_dir, f"{video_id}.mp4"),
+                audio_file=audio_file,
+                style=data.get('style', 'realistic'),
+                scene_duration=int(data.get('scene_duration', 5)),
+                resolution=data.get('resolution', '1080p'),
+                quality=data.get('quality'),
+                profile=data.get('profile'),
+                scene_type=data.get('scene_type')
+            )
+            
+            if pip:
+                processor.create_picture_in_picture_mode(
+                    pip_position=data.get('pip_position', 'bottom-right'),
+                    pip_size_ratio=float(data.get('pip_size_ratio', 0.3)),
+                    **options
+                )
+            else:
+                processor.process(**options)
+            
+            return jsonify({"message": "視頻合成成功", "video_id": video_id})
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        """健康檢查端點"""
+        return jsonify({"status": "ok", "message": "場景生成服務正常運行"})
+    
+    @app.route('/analyze', methods=['POST'])
+    def analyze_content():
+        """
+        分析文本內容
+        
+        請求參數:
+        - text: 要分析的文本
+        
+        返回:
+        - 每個段落的關鍵詞、實體和場景描述
+        """
+        try:
+            text = (request.json or {}).get('text')
+            if not text:
+                return jsonify({"error": "缺少必要參數: text"}), 400
+            
+            return jsonify({"analysis": processor.content_analyzer.analyze_content(text)})
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/generate-scene', methods=['POST'])
+    def generate_scene():
+        """
+        生成單個場景視頻
+        
+        請求參數:
+        - prompt: 場景描述
+        - style: 視覺風格 (可選，默認realistic)
+        - duration: 時長（秒）(可選，默認5)
+        - resolution: 分辨率 (可選，默認1080p)
+        - quality, profile, scene_type: 渲染質量、編碼配置和場景類型 (可選)
+        
+        返回:
+        - 場景視頻ID
+        """
+        try:
+            data = request.json or {}
+            prompt = data.get('prompt')
+            if not prompt:
+                return jsonify({"error": "缺少必要參數: prompt"}), 400
+            
+            video_id = str(uuid.uuid4())
+            processor.scene_generator.generate_scene(
+                prompt=prompt,
+                output_file=os.path.join(output_dir, f"{video_id}.mp4"),
+                style=data.get('style', 'realistic'),
+                duration=int(data.get('duration', 5)),
+                resolution=data.get('resolution', '1080p'),
+                quality=data.get('quality'),
+                scene_type=data.get('scene_type'),
+                profile=data.get('profile')
+            )
+            
+            return jsonify({"message": "場景生成成功", "video_id": video_id})
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/process', methods=['POST'])
+    def process():
+        """
+        場景切換模式：生成場景並與數字人視頻合成
+        
+        請求參數:
+        - text: 演講文本
+        - digital_human_video_id: 數字人服務生成的視頻ID
+        - audio_file_id: TTS服務生成的音頻ID (可選)
+        - style, scene_duration, resolution, quality, profile, scene_type (可選)
+        
+        返回:
+        - 合成視頻ID
+        """
+        return compose(pip=False)
+    
+    @app.route('/picture-in-picture', methods=['POST'])
+    def picture_in_picture():
+        """
+        畫中畫模式：場景作為主畫面，數字人視頻疊加在角落
+        
+        請求參數:
+        - 與/process相同
+        - pip_position: 畫中畫位置 (可選，默認bottom-right)
+        - pip_size_ratio: 畫中畫寬度比例 (可選，默認0.3)
+        
+        返回:
+        - 合成視頻ID
+        """
+        return compose(pip=True)
+    
+    @app.route('/video/<video_id>', methods=['GET'])
+    def get_video(video_id):
+        """
+        獲取生成的視頻文件
+        
+        路徑參數:
+        - video_id: 視頻ID
+        
+        返回:
+        - 視頻文件
+        """
+        try:
+            if not video_id or '..' in video_id:
+                return jsonify({"error": "無效的視頻ID"}), 400
+            
+            file_path = os.path.join(output_dir, f"{video_id}.mp4")
+            if not os.path.exists(file_path):
+                return jsonify({"error": "文件不存在"}), 404
+            
+            return send_file(file_path, mimetype='video/mp4')
+        
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    return app
+
+if __name__ == '__main__':
+    create_app().run(host='0.0.0.0', port=int(os.getenv("SCENE_SERVICE_PORT", "5002")))
@@ -0,0 +1,407 @@
+"""
+場景素材庫模塊 - 在生成場景之前先從本地素材庫檢索可用的片段和圖片
+
+此模塊提供以下功能：
+1. 管理帶關鍵詞標籤的本地視頻片段和圖片，標籤來自素材清單或文件名
+2. 構建持久化的倒排索引，素材變化時自動重建
+3. 使用TF-IDF加權的餘弦相似度為段落的關鍵詞和實體打分
+4. 只有最高得分超過閾值時才使用素材，否則由調用方生成新場景
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Any, Iterable
+
+from video_concat import FFMPEG_BINARY, VideoConcatenator
+
+# 素材清單和索引文件名
+MANIFEST_FILE = "library.json"
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".webm", ".mkv"}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# 場景描述模板中的詞，不參與匹配
+TEMPLATE_WORDS = {"scene", "related", "to", "展示", "與", "相關", "的", "場景"}
+
+def tokenize_terms(terms: Iterable[str]) -> List[str]:
+    """
+    將關鍵詞、實體或描述標準化為檢索詞
+    
+    多詞短語同時保留完整短語和其中的單詞，例如"machine learning"產生
+    "machine learning"、"machine"和"learning"。
+    
+    Args:
+        terms: 關鍵詞列表
+        
+    Returns:
+        檢索詞列表（可能重複，重複次數即詞頻）
+    """
+    tokens = []
+    for term in terms:
+        term = re.sub(r"\s+", " ", str(term).lower().replace("_", " ").replace("-", " ")).strip(" ,.，。、\"「」")
+        if not term:
+            continue
+        
+        words = [w for w in re.findall(r"[a-z0-9]+|[\u4e00-\u9fff]+", term) if w not in TEMPLATE_WORDS]
+        if len(words) > 1:
+            tokens.append(" ".join(words))
+        tokens.extend(words)
+    
+    return tokens
+
+def _write_json_atomic(path: str, data: Any, **kwargs) -> None:
+    """
+    原子地寫入JSON文件，臨時文件名唯一，並發寫入時不會互相覆蓋
+    
+    Args:
+        path: 文件路徑
+        data: 要寫入的數據
+        **kwargs: 傳給json.dump的其他參數
+    """
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **kwargs)
+        os.replace(temp_file, path)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def prompt_terms(prompt: str) -> List[str]:
+    """
+    從場景描述中提取檢索詞，用於沒有關鍵詞的請求
+    
+    Args:
+        prompt: 場景描述，例如"Scene related to AI, technology, data"或"展示與人工智能, 數據相關的場景"
+        
+    Returns:
+        檢索詞列表
+    """
+    # 去掉ContentAnalyzer.generate_scene_description的模板文字，只保留關鍵詞
+    prompt = re.sub(r"^\s*(scene related to|展示與)\s*", "", prompt, flags=re.IGNORECASE)
+    prompt = re.sub(r"\s*相關的場景\s*$", "", prompt)
+    return tokenize_terms(re.split(r"[,，、]", prompt))
+
+class SceneLibrary:
+    """場景素材庫類，以倒排索引和TF-IDF評分檢索本地素材"""
+    
+    def __init__(self, library_dir: Optional[str] = None, threshold: Optional[float] = None):
+        """
+        初始化場景素材庫類
+        
+        Args:
+            library_dir: 素材目錄，默認讀取SCENE_LIBRARY_DIR環境變量，未設置時素材庫為空
+            threshold: 使用素材的最低相似度（0到1），默認讀取SCENE_LIBRARY_THRESHOLD環境變量（默認0.35）
+        """
+        self.library_dir = library_dir if library_dir is not None else os.getenv("SCENE_LIBRARY_DIR", "")
+        self.threshold = threshold if threshold is not None else float(os.getenv("SCENE_LIBRARY_THRESHOLD", "0.35"))
+        
+        self.assets: List[Dict[str, Any]] = []
+        self.postings: Dict[str, List[List[float]]] = {}
+        self.idf: Dict[str, float] = {}
+        self.norms: List[float] = []
+        
+        self._lock = threading.Lock()
+        self.stats = {
+            "lookups": 0,
+            "matches": 0
+        }
+        
+        if self.enabled:
+            self.refresh()
+    
+    @property
+    def enabled(self) -> bool:
+        """素材目錄存在時素材庫可用"""
+        return bool(self.library_dir) and os.path.isdir(self.library_dir)
+    
+    def refresh(self) -> None:
+        """加載持久化索引，素材或清單有變化時重建索引"""
+        signature = self._signature()
+        index = self._load_index()
+        
+        if not index or index.get("version") != INDEX_VERSION or index.get("signature") != signature:
+            index = self._build_index(signature)
+            try:
+                self._save_index(index)
+            except OSError as e:
+                print(f"保存場景素材庫索引失敗: {str(e)}")
+        
+        with self._lock:
+            self.assets = index["assets"]
+            self.postings = index["postings"]
+            self.idf = index["idf"]
+            self.norms = index["norms"]
+    
+    def search(
+        self,
+        terms: Iterable[str],
+        top_k: int = 5,
+        media_type: Optional[str] = None,
+        min_duration: float = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        按TF-IDF加權的餘弦相似度檢索素材
+        
+        Args:
+            terms: 關鍵詞和實體列表
+            top_k: 最多返回的素材數
+            media_type: 只返回指定類型（video或image）的素材
+            min_duration: 視頻片段的最短時長（秒），圖片不受限制
+            
+        Returns:
+            按得分從高到低排列的素材列表，每個元素包含file、type、keywords、duration和score
+        """
+        query = {}
+        for token in tokenize_terms(terms):
+            query[token] = query.get(token, 0) + 1
+        
+        with self._lock:
+            # 查詢向量同樣使用TF-IDF權重，只遍歷查詢詞的倒排列表
+            weights = {token: count * self.idf[token] for token, count in query.items() if token in self.idf}
+            query_norm = math.sqrt(sum(w * w for w in weights.values()))
+            if not query_norm:
+                return []
+            
+            scores: Dict[int, float] = {}
+            for token, weight in weights.items():
+                for asset_id, asset_weight in self.postings[token]:
+                    asset_id = int(asset_id)
+                    scores[asset_id] = scores.get(asset_id, 0.0) + weight * asset_weight
+            
+            results = []
+            for asset_id, score in scores.items():
+                asset = self.assets[asset_id]
+                if media_type and asset["type"] != media_type:
+                    continue
+                if asset["type"] == "video" and asset.get("duration", 0) < min_duration:
+                    continue
+                results.append(dict(asset, score=score / (query_norm * self.norms[asset_id])))
+        
+        results.sort(key=lambda item: item["score"], reverse=True)
+        return results[:top_k]
+    
+    def match(
+        self,
+        terms: Iterable[str],
+        media_type: Optional[str] = None,
+        min_duration: float = 0
+    ) -> Optional[Dict[str, Any]]:
+        """
+        查找得分超過閾值的最佳素材
+        
+        Args:
+            terms: 關鍵詞和實體列表
+            media_type: 只匹配指定類型（video或image）的素材
+            min_duration: 視頻片段的最短時長（秒）
+            
+        Returns:
+            素材字典（含完整路徑path），沒有足夠相關的素材時返回None
+        """
+        if not self.assets:
+            return None
+        
+        results = self.search(terms, top_k=1, media_type=media_type, min_duration=min_duration)
+        matched = results[0] if results and results[0]["score"] >= self.threshold else None
+        
+        with self._lock:
+            self.stats["lookups"] += 1
+            if matched:
+                self.stats["matches"] += 1
+        
+        if matched:
+            matched["path"] = os.path.join(self.library_dir, matched["file"])
+        return matched
+    
+    def export_clip(self, asset: Dict[str, Any], output_file: str, duration: float) -> str:
+        """
+        以流複製方式從素材片段開頭截取指定時長，不重新編碼
+        
+        Args:
+            asset: match或search返回的視頻素材
+            output_file: 輸出文件路徑
+            duration: 截取時長（秒）
+            
+        Returns:
+            輸出文件路徑
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        
+        # 素材的原始音軌與演講無關，只保留畫面
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", os.path.join(self.library_dir, asset["file"]),
+            "-t", str(duration),
+            "-map", "0:v:0", "-c", "copy", "-an",
+            "-movflags", "+faststart",
+            output_file
+        ]
+        subprocess.run(command, capture_output=True, check=True)
+        return output_file
+    
+    def add_asset(self, source_file: str, keywords: List[str]) -> str:
+        """
+        將素材複製到素材庫，記錄關鍵詞到素材清單並重建索引
+        
+        Args:
+            source_file: 素材文件路徑
+            keywords: 素材的關鍵詞標籤
+            
+        Returns:
+            素材庫中的文件路徑
+        """
+        if not self.library_dir:
+            raise ValueError("未設置素材目錄")
+        os.makedirs(self.library_dir, exist_ok=True)
+        
+        file_name = os.path.basename(source_file)
+        target_file = os.path.join(self.library_dir, file_name)
+        if os.path.abspath(source_file) != os.path.abspath(target_file):
+            shutil.copyfile(source_file, target_file)
+        
+        manifest = self._load_manifest()
+        manifest[file_name] = {"keywords": list(keywords)}
+        
+        _write_json_atomic(
+            os.path.join(self.library_dir, MANIFEST_FILE),
+            {"assets": [dict(item, file=name) for name, item in manifest.items()]},
+            indent=2
+        )
+        
+        self.refresh()
+        return target_file
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        獲取素材庫統計數據
+        
+        Returns:
+            包含素材數、詞條數、查詢次數、命中次數和命中率的字典
+        """
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return dict(
+                self.stats,
+                match_ratio=self.stats["matches"] / lookups if lookups else 0.0,
+                assets=len(self.assets),
+                terms=len(self.postings)
+            )
+    
+    def _signature(self) -> List[List[Any]]:
+        """素材目錄中各文件的名稱、大小和修改時間，用於判斷索引是否過期"""
+        signature = []
+        for name in sorted(os.listdir(self.library_dir)):
+            ext = os.path.splitext(name)[1].lower()
+            if name == MANIFEST_FILE or ext in VIDEO_EXTENSIONS or ext in IMAGE_EXTENSIONS:
+                stat = os.stat(os.path.join(self.library_dir, name))
+                signature.append([name, stat.st_size, int(stat.st_mtime)])
+        return signature
+    
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """
+        加載素材清單
+        
+        清單格式為 {"assets": [{"file": "ocean.mp4", "keywords": ["ocean", "sunset"]}]}
+        
+        Returns:
+            以文件名為鍵的素材信息
+        """
+        try:
+            with open(os.path.join(self.library_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        
+        return {item["file"]: item for item in data.get("assets", []) if item.get("file")}
+    
+    def _load_index(self) -> Optional[Dict[str, Any]]:
+        """加載持久化索引，不存在或損壞時返回None"""
+        try:
+            with open(os.path.join(self.library_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _save_index(self, index: Dict[str, Any]) -> None:
+        """原子地保存索引"""
+        _write_json_atomic(os.path.join(self.library_dir, INDEX_FILE), index)
+    
+    def _build_index(self, signature: List[List[Any]]) -> Dict[str, Any]:
+        """
+        掃描素材目錄並構建倒排索引
+        
+        Args:
+            signature: 素材目錄簽名
+            
+        Returns:
+            索引字典，包含素材列表、倒排列表（詞 -> [[素材編號, TF-IDF權重]]）、IDF和素材向量的模
+        """
+        manifest = self._load_manifest()
+        concatenator = VideoConcatenator()
+        
+        assets = []
+        term_counts = []
+        for name, _, _ in signature:
+            ext = os.path.splitext(name)[1].lower()
+            if name == MANIFEST_FILE:
+                continue
+            
+            # 清單中沒有標籤的素材以文件名作為標籤，例如 ocean_sunset.jpg
+            keywords = manifest.get(name, {}).get("keywords") or re.split(r"[_\-\s]+", os.path.splitext(name)[0])
+            asset = {"file": name, "type": "video" if ext in VIDEO_EXTENSIONS else "image", "keywords": keywords}
+            
+            if asset["type"] == "video":
+                try:
+                    asset["duration"] = concatenator.probe(os.path.join(self.library_dir, name))["duration"]
+                except Exception as e:
+                    print(f"探測素材時長失敗: {name}, {str(e)}")
+                    continue
+            
+            counts: Dict[str, int] = {}
+            for token in tokenize_terms(keywords):
+                counts[token] = counts.get(token, 0) + 1
+            if not counts:
+                continue
+            
+            assets.append(asset)
+            term_counts.append(counts)
+        
+        # 平滑的IDF：在越少素材中出現的詞權重越高
+        document_frequency: Dict[str, int] = {}
+        for counts in term_counts:
+            for token in counts:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        idf = {
+            token: math.log((1 + len(assets)) / (1 + df)) + 1.0
+            for token, df in document_frequency.items()
+        }
+        
+        postings: Dict[str, List[List[float]]] = {}
+        norms = []
+        for asset_id, counts in enumerate(term_counts):
+            squared = 0.0
+            for token, count in counts.items():
+                weight = count * idf[token]
+                postings.setdefault(token, []).append([asset_id, weight])
+                squared += weight * weight
+            norms.append(math.sqrt(squared))
+        
+        print(f"場景素材庫索引已重建: {len(assets)}個素材，{len(postings)}個詞條")
+        
+        return {
+            "version": INDEX_VERSION,
+            "signature": signature,
+            "assets": assets,
+            "postings": postings,
+            "idf": idf,
+            "norms": norms
+        }
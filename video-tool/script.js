@@ -2,6 +2,8 @@
 let fileId = null;
 let fileExt = null;
 let selectedAvatarId = null;
+let lastDraftJobId = null;
+let uploadTraceId = null;
 
 // 頁面加載完成後執行
 document.addEventListener('DOMContentLoaded', function() {
@@ -127,6 +129,7 @@ function initEventListeners() {
                     if (data.file_id) {
                         fileId = data.file_id;
                         fileExt = data.file_ext;
+                        uploadTraceId = data.trace_id;
                         
                         // 如果是文本文件，顯示提取的文本
                         if (data.text) {
@@ -231,15 +234,26 @@ function initEventListeners() {
         const language = document.getElementById('language-select').value;
         const gender = document.getElementById('gender-select').value;
         const videoMode = document.getElementById('video-mode').value;
+        const sceneType = document.getElementById('scene-type').value;
+        const quality = document.getElementById('render-quality').value;
+        const progressive = document.getElementById('progressive-mode').checked;
         
         let requestData = {
             language: language,
             gender: gender,
             voice_id: voiceId,
             avatar_id: selectedAvatarId,
-            video_mode: videoMode
+            video_mode: videoMode,
+            scene_type: sceneType,
+            quality: quality,
+            progressive: progressive
         };
         
+        // 最終成片重用上一次草稿的語音和分析結果
+        if (quality === 'final' && lastDraftJobId) {
+            requestData.draft_id = lastDraftJobId;
+        }
+        
         if (inputType === 'text') {
             requestData.text = document.getElementById('text-input').value.trim();
         } else {
@@ -250,27 +264,46 @@ function initEventListeners() {
         // 更新進度
         updateProgress(10, '正在處理請求...');
         
+        // 上傳文件和生成視頻使用同一個追蹤ID，文本提取的耗時也記錄在任務時間線中
+        const headers = {
+            'Content-Type': 'application/json'
+        };
+        if (uploadTraceId) {
+            headers['X-Trace-Id'] = uploadTraceId;
+        }
+        
         // 發送生成請求
         fetch('/api/generate', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
+            headers: headers,
             body: JSON.stringify(requestData)
         })
             .then(response => response.json())
             .then(data => {
-                if (data.final_video_id) {
+                if (data.live_url) {
+                    // 漸進式生成：立即開始播放直播播放列表，並輪詢任務進度
+                    updateProgress(20, '正在渲染第一個段落...');
+                    
+                    document.getElementById('video-container').classList.remove('d-none');
+                    playVideo(document.getElementById('preview-video'), data.live_url, null);
+                    
+                    pollProgressiveJob(data.status_url);
+                } else if (data.final_video_id) {
+                    if (data.quality === 'draft') {
+                        lastDraftJobId = data.job_id;
+                    }
+                    
                     // 更新進度
-                    updateProgress(100, '視頻生成完成！');
+                    updateProgress(100, data.quality === 'draft' ? '草稿預覽生成完成！' : '視頻生成完成！');
                     
                     // 顯示視頻
                     const videoContainer = document.getElementById('video-container');
                     videoContainer.classList.remove('d-none');
                     
+                    // HLS在後台打包，打包完成前先播放MP4
                     const previewVideo = document.getElementById('preview-video');
-                    previewVideo.src = data.preview_url;
-                    previewVideo.load();
+                    playVideo(previewVideo, null, data.preview_url);
+                    upgradeToHls(previewVideo, data.hls_url);
                     
                     // 顯示下載按鈕
                     const downloadContainer = document.getElementById('download-container');
@@ -300,6 +333,7 @@ function initEventListeners() {
         document.getElementById('file-input').value = '';
         fileId = null;
         fileExt = null;
+        uploadTraceId = null;
         selectedAvatarId = null;
         
         // 重置頭像選擇
@@ -415,6 +449,94 @@ function loadAvatars() {
         });
 }
 
+// 播放視頻：優先使用自適應碼率HLS，不支持時回退到MP4
+let activeHls = null;
+
+function playVideo(videoElement, hlsUrl, mp4Url) {
+    videoElement.dataset.pendingHls = '';
+    
+    if (activeHls) {
+        activeHls.destroy();
+        activeHls = null;
+    }
+    
+    if (hlsUrl && window.Hls && Hls.isSupported()) {
+        // 漸進式生成的EVENT播放列表需要從頭開始播放，而不是從直播邊緣開始
+        activeHls = new Hls({ startPosition: 0 });
+        activeHls.loadSource(hlsUrl);
+        activeHls.attachMedia(videoElement);
+    } else if (hlsUrl && videoElement.canPlayType('application/vnd.apple.mpegurl')) {
+        // Safari原生支持HLS
+        videoElement.src = hlsUrl;
+        videoElement.load();
+    } else {
+        videoElement.src = mp4Url;
+        videoElement.load();
+    }
+}
+
+// 輪詢HLS打包狀態（打包中返回202），完成後從當前播放位置切換到自適應碼率
+function upgradeToHls(videoElement, hlsUrl, attempts = 0) {
+    const hlsSupported = (window.Hls && Hls.isSupported()) || videoElement.canPlayType('application/vnd.apple.mpegurl');
+    if (!hlsUrl || !hlsSupported || attempts >= 100) {
+        return;
+    }
+    videoElement.dataset.pendingHls = hlsUrl;
+    
+    fetch(hlsUrl)
+        .then(response => {
+            // 已經開始播放其他視頻時不再切換
+            if (videoElement.dataset.pendingHls !== hlsUrl) {
+                return;
+            }
+            if (response.status === 202) {
+                setTimeout(() => upgradeToHls(videoElement, hlsUrl, attempts + 1), 3000);
+            } else if (response.ok) {
+                const position = videoElement.currentTime;
+                const paused = videoElement.paused;
+                
+                playVideo(videoElement, hlsUrl, videoElement.currentSrc);
+                videoElement.addEventListener('loadedmetadata', () => {
+                    videoElement.currentTime = position;
+                    if (!paused) {
+                        videoElement.play();
+                    }
+                }, { once: true });
+            }
+        })
+        .catch(error => {
+            console.error('獲取HLS播放列表時出錯，繼續播放MP4:', error);
+        });
+}
+
+// 輪詢漸進式生成任務的進度，完成後顯示下載按鈕
+function pollProgressiveJob(statusUrl) {
+    fetch(statusUrl)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'completed') {
+                updateProgress(100, '視頻生成完成！');
+                
+                document.getElementById('download-container').classList.remove('d-none');
+                document.getElementById('download-link').href = data.download_url;
+                
+                setTimeout(() => {
+                    document.getElementById('generation-progress').classList.add('d-none');
+                }, 1000);
+            } else if (data.status === 'failed') {
+                updateProgress(0, '視頻生成失敗: ' + (data.error || '未知錯誤'));
+            } else {
+                const percent = 20 + Math.round(data.rendered / Math.max(data.total, 1) * 75);
+                updateProgress(percent, `已完成 ${data.rendered}/${data.total} 個段落，可播放 ${data.published} 個段落`);
+                setTimeout(() => pollProgressiveJob(statusUrl), 2000);
+            }
+        })
+        .catch(error => {
+            console.error('獲取生成進度時出錯:', error);
+            updateProgress(0, '獲取生成進度時出錯，請查看控制台獲取詳細信息');
+        });
+}
+
 // 更新進度條
 function updateProgress(percent, text) {
     const progressBar = document.querySelector('.progress-bar');
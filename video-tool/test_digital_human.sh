@@ -57,9 +57,42 @@ print(f'生成的視頻文件: {video_file}')
 print(f'文件存在: {os.path.exists(video_file)}')
 "
 
+# 測試真實服務提供商的請求路徑（上傳音頻、提交任務、下載視頻），使用本地替身
+echo -e "\n測試服務提供商替身..."
+python3 -c "
+import os
+import requests
+from fake_providers import CLIENT_ENV, load_config, start_fake_providers
+
+providers = ['deepbrain', 'synthesia']
+fakes, servers = start_fake_providers(load_config(None, providers, {}), None)
+for name, fake in fakes.items():
+    env_name, path = CLIENT_ENV[name]
+    os.environ[env_name] = fake.base_url + path
+    os.environ[name.upper() + '_API_KEY'] = 'fake'
+
+from digital_human_module import DigitalHumanGenerator, DigitalHumanProvider, AvatarLanguage, AvatarGender
+
+try:
+    for name in providers:
+        generator = DigitalHumanGenerator(provider=DigitalHumanProvider(name))
+        avatar_id = generator.get_available_avatars(AvatarLanguage.MANDARIN, AvatarGender.FEMALE)[0]['id']
+        output_file = f'test_output/test_video_{name}.mp4'
+        generator.generate_video(avatar_id=avatar_id, audio_file='test_output/test_audio.mp3', output_file=output_file)
+        
+        stats = requests.get(fakes[name].base_url + '/_fake/stats').json()
+        requests_made = sum(stats['responses'].values())
+        print(f'{name}: 替身收到 {requests_made} 個請求，響應 {stats[\"responses\"]}')
+        assert requests_made > 0, f'{name} 沒有請求服務提供商'
+        assert os.path.getsize(output_file) > 0, f'{name} 沒有下載到視頻'
+finally:
+    for server in servers:
+        server.shutdown()
+"
+
 # 啟動 API 服務（後台運行）
 echo -e "\n啟動 API 服務..."
-python3 api.py > api.log 2>&1 &
+python3 digital_human_module.py > api.log 2>&1 &
 API_PID=$!
 
 # 等待 API 啟動
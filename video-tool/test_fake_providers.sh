@@ -0,0 +1,127 @@
+#!/bin/bash
+
+# 創建測試目錄
+mkdir -p test_output
+
+# 設置測試環境
+export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# 任何一個部分失敗時以非零狀態退出
+STATUS=0
+
+# 替身不設置延遲，異步任務在1秒後完成
+export FAKE_OVERRIDES='{"latency": "0", "render_latency": "1"}'
+
+# 啟動替身並把客戶端指向替身，返回提供商名稱到替身的映射和服務器列表
+FAKE_SETUP="
+import os
+import json
+import requests
+from fake_providers import CLIENT_ENV, load_config, start_fake_providers
+
+def start(providers):
+    fakes, servers = start_fake_providers(load_config(None, providers, json.loads(os.environ['FAKE_OVERRIDES'])), None)
+    for name, fake in fakes.items():
+        env_name, path = CLIENT_ENV[name]
+        os.environ[env_name] = fake.base_url + path
+        os.environ[name.upper() + '_API_KEY'] = 'fake'
+    return fakes, servers
+
+# 檢查替身收到的請求：至少expected個成功響應，沒有服務器錯誤
+def check(fakes, name, expected):
+    stats = requests.get(fakes[name].base_url + '/_fake/stats', timeout=5).json()
+    responses = stats['responses']
+    succeeded = sum(count for code, count in responses.items() if code.startswith('2'))
+    print(f'{name}: 響應 {responses}，任務 {stats[\"jobs\"]}')
+    assert succeeded >= expected, f'{name} 只收到 {succeeded} 個成功請求，預期至少 {expected} 個'
+    assert not any(code.startswith('5') for code in responses), f'{name} 返回了服務器錯誤'
+    return stats
+"
+
+# 測試TTS客戶端：每次合成一個請求
+echo "測試TTS服務提供商替身..."
+python3 -c "
+$FAKE_SETUP
+fakes, servers = start(['google', 'azure'])
+os.environ['AZURE_SPEECH_KEY'] = 'fake'
+os.environ['AZURE_SPEECH_REGION'] = 'local'
+
+from tts_module import TextToSpeech, TTSProvider, Language, Gender
+
+try:
+    for name in ('google', 'azure'):
+        tts = TextToSpeech(provider=TTSProvider(name))
+        output_file = f'test_output/fake_{name}.mp3'
+        tts.synthesize_speech('這是一個測試。', Language.MANDARIN, Gender.FEMALE, output_file)
+        assert os.path.getsize(output_file) > 0, f'{name} 沒有寫入音頻'
+        check(fakes, name, 1)
+finally:
+    for server in servers:
+        server.shutdown()
+" || STATUS=1
+
+# 測試數字人客戶端：查詢頭像、上傳音頻、提交渲染（Synthesia還需輪詢狀態）並下載視頻
+echo -e "\n測試數字人服務提供商替身..."
+python3 -c "
+$FAKE_SETUP
+import subprocess
+from video_concat import FFMPEG_BINARY
+
+fakes, servers = start(['deepbrain', 'synthesia'])
+
+from digital_human_module import DigitalHumanGenerator, DigitalHumanProvider, AvatarLanguage, AvatarGender
+
+audio_file = 'test_output/fake_audio.wav'
+subprocess.run([
+    FFMPEG_BINARY, '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=220:duration=2', audio_file
+], check=True)
+
+try:
+    for name, expected in (('deepbrain', 4), ('synthesia', 5)):
+        generator = DigitalHumanGenerator(provider=DigitalHumanProvider(name))
+        avatar_id = generator.get_available_avatars(AvatarLanguage.MANDARIN, AvatarGender.FEMALE)[0]['id']
+        output_file = f'test_output/fake_{name}.mp4'
+        generator.generate_video(avatar_id=avatar_id, audio_file=audio_file, output_file=output_file)
+        assert os.path.getsize(output_file) > 0, f'{name} 沒有下載到視頻'
+        check(fakes, name, expected)
+finally:
+    for server in servers:
+        server.shutdown()
+" || STATUS=1
+
+# 測試場景客戶端：並發提交異步任務並輪詢到完成
+echo -e "\n測試場景服務提供商替身..."
+python3 -c "
+$FAKE_SETUP
+import uuid
+fakes, servers = start(['zebracat', 'runway'])
+
+from scene_generation_module import SceneGenerator, SceneGenerationProvider
+from concurrent_scenes import ConcurrentSceneGenerator
+
+try:
+    for name in ('zebracat', 'runway'):
+        generator = SceneGenerator(provider=SceneGenerationProvider(name))
+        jobs = [
+            {'prompt': f'Fake provider scene {uuid.uuid4().hex}', 'output_file': f'test_output/fake_{name}_{index}.mp4',
+             'duration': 2, 'resolution': '360p'}
+            for index in range(2)
+        ]
+        results = ConcurrentSceneGenerator(generator, poll_interval=0.5).generate_scenes(jobs)
+        assert all(os.path.getsize(result) > 0 for result in results), f'{name} 沒有下載到場景'
+
+        # 每個場景一個提交請求、至少一個輪詢請求和一個下載請求
+        stats = check(fakes, name, 6)
+        assert stats['responses'].get('202') == 2, f'{name} 應該提交2個異步任務'
+        assert stats['jobs'].get('complete') == 2
+finally:
+    for server in servers:
+        server.shutdown()
+" || STATUS=1
+
+if [ $STATUS -ne 0 ]; then
+    echo -e "\n測試失敗！"
+    exit $STATUS
+fi
+
+echo -e "\n測試完成！"
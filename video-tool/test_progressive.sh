@@ -0,0 +1,83 @@
+#!/bin/bash
+
+# 創建測試目錄
+mkdir -p test_output
+
+# 設置測試環境
+export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# 測試漸進式生成和修訂接口
+echo "測試漸進式生成和修訂..."
+python3 -c "
+import time
+import uuid
+import subprocess
+import app as gateway
+from video_concat import FFMPEG_BINARY
+
+client = gateway.app.test_client()
+rendered = []
+
+# 模擬段落渲染：不調用下游服務，直接生成測試視頻
+def fake_render(paragraph, params, render_settings, level=None, reuse=None, ticket=None):
+    rendered.append(paragraph)
+    video_file = f'test_output/progressive_{uuid.uuid4().hex}.mp4'
+    subprocess.run([
+        FFMPEG_BINARY, '-y', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=2:size=320x240:rate=25',
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', video_file
+    ], check=True)
+    return {'audio_id': uuid.uuid4().hex, 'digital_human_video_id': uuid.uuid4().hex,
+            'scene_video_id': uuid.uuid4().hex, 'video_file': video_file}
+
+gateway.render_paragraph_video = fake_render
+
+def wait_for(job_id, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f'/api/progressive/{job_id}/status').get_json()
+        if status['status'] in ('completed', 'failed'):
+            return status
+        time.sleep(0.5)
+    raise AssertionError(f'任務超時: {job_id}')
+
+# 漸進式生成：所有段落渲染並按順序發布
+print('測試漸進式生成...')
+text = '第一段內容。\n第二段內容。\n第三段內容。'
+response = client.post('/api/generate', json={
+    'text': text, 'voice_id': 'zh-CN-female-1', 'avatar_id': 'zh-f-01', 'progressive': True
+})
+assert response.status_code == 200, response.get_json()
+job_id = response.get_json()['job_id']
+status = wait_for(job_id)
+print(status)
+assert status['status'] == 'completed' and status['published'] == 3 and status['rendered'] == 3
+playlist = client.get(f'/api/progressive/{job_id}/index.m3u8').get_data(as_text=True)
+assert '#EXT-X-ENDLIST' in playlist and playlist.count('#EXT-X-DISCONTINUITY') == 2
+
+# 修訂：只重新渲染變化的段落
+print('測試修訂...')
+rendered.clear()
+response = client.post(f'/api/revise/{job_id}', json={'text': '第一段內容。\n修改後的第二段。\n第三段內容。'})
+assert response.status_code == 200, response.get_json()
+body = response.get_json()
+print(body['message'])
+assert body['reused'] == 2
+status = wait_for(body['job_id'])
+assert status['status'] == 'completed' and status['published'] == 3
+assert rendered == ['修改後的第二段。'], rendered
+
+# 修訂不存在的任務
+assert client.post('/api/revise/missing', json={'text': '文本'}).status_code == 404
+
+# 結束超過保留時間的任務從內存中移除
+print('測試任務過期...')
+gateway.app.config['PROGRESSIVE_JOB_TTL'] = 0
+time.sleep(0.1)
+assert gateway.expire_progressive_jobs() >= 2
+assert job_id not in gateway.progressive_jobs
+assert client.get(f'/api/progressive/{job_id}/status').status_code == 404
+
+print('漸進式生成測試通過')
+"
+
+echo -e "\n測試完成！"
@@ -0,0 +1,88 @@
+#!/bin/bash
+
+# 創建測試目錄
+mkdir -p test_output
+
+# 設置測試環境
+export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# 客戶端配額高於服務提供商替身的速率限制，使替身返回429
+export PROVIDER_RATE_LIMITS="google=100/s:100"
+
+# 測試服務提供商限流
+echo "測試服務提供商限流..."
+python3 -c "
+import time
+import threading
+from email.utils import formatdate
+from provider_rate_limiter import ProviderRateLimiter, RateLimitTimeout, parse_retry_after, provider_request, get_rate_limiter
+from fake_providers import load_config, start_fake_providers
+
+# 解析秒數和HTTP日期格式的Retry-After
+print('測試Retry-After解析...')
+assert parse_retry_after('3') == 3.0
+assert 3.0 <= parse_retry_after(formatdate(time.time() + 5, usegmt=True)) <= 5.0
+assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0.0
+assert parse_retry_after('soon') is None and parse_retry_after(None) is None
+
+# HTTP日期格式的Retry-After按實際時間暫停令牌桶
+limiter = ProviderRateLimiter({'x': '100/s:1'}, max_wait=10)
+seconds = limiter.throttled('x', None, formatdate(time.time() + 2, usegmt=True))
+start = time.time()
+limiter.acquire('x')
+print(f'暫停 {seconds:.2f} 秒，實際等待 {time.time() - start:.2f} 秒')
+assert 1.0 <= seconds <= 2.0 and time.time() - start >= seconds - 0.1
+
+# 沒有令牌時高優先級的請求先獲得令牌
+print('測試優先級排隊...')
+limiter = ProviderRateLimiter({'x': '4/s:1'}, max_wait=10)
+limiter.acquire('x')
+order = []
+def acquire(priority):
+    limiter.acquire('x', priority=priority)
+    order.append(priority)
+threads = []
+for priority in ('batch', 'batch', 'interactive', 'draft'):
+    thread = threading.Thread(target=acquire, args=(priority,))
+    thread.start()
+    threads.append(thread)
+    time.sleep(0.02)
+for thread in threads:
+    thread.join()
+print(order)
+assert order[:2] == ['draft', 'interactive'], order
+
+# 排隊超過max_wait時拋出RateLimitTimeout
+print('測試排隊超時...')
+limiter = ProviderRateLimiter({'x': '1/min:1'}, max_wait=0.2)
+limiter.acquire('x')
+try:
+    limiter.acquire('x')
+    raise AssertionError('應該排隊超時')
+except RateLimitTimeout as e:
+    print(f'排隊超時: {e}')
+
+# 替身返回429時按Retry-After暫停配額並重試
+print('測試429重試...')
+config = load_config(None, ['google'], {'rate_limit': 1, 'burst': 1, 'latency': '0'})
+fakes, servers = start_fake_providers(config, None)
+fake = fakes['google']
+url = f'{fake.base_url}/v1/text:synthesize'
+try:
+    statuses = [
+        provider_request('google', 'synthesize', 'post', url, json={'input': {'text': '測試'}}, timeout=10).status_code
+        for _ in range(3)
+    ]
+    stats = __import__('requests').get(f'{fake.base_url}/_fake/stats', timeout=5).json()
+finally:
+    for server in servers:
+        server.shutdown()
+print(statuses, stats['responses'])
+assert statuses == [200, 200, 200], '重試後應該成功'
+assert stats['responses'].get('429', 0) >= 1
+assert get_rate_limiter().report()['google']['throttled'] >= 1
+
+print('限流測試通過')
+"
+
+echo -e "\n測試完成！"
@@ -0,0 +1,135 @@
+#!/bin/bash
+
+# 創建測試目錄
+mkdir -p test_output
+
+# 設置測試環境
+export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# 測試渲染緩存
+echo "測試渲染緩存..."
+python3 -c "
+import os
+import shutil
+import subprocess
+import threading
+from render_cache import RenderCache, SceneRenderCache, AvatarRenderCache
+from video_concat import FFMPEG_BINARY
+
+cache_root = 'test_output/render_cache'
+shutil.rmtree(cache_root, ignore_errors=True)
+os.makedirs(cache_root)
+
+# 創建測試文件
+def make_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+# 測試寫入、命中和未命中
+print('測試寫入和查找...')
+cache = RenderCache(os.path.join(cache_root, 'basic'), max_bytes=3000)
+cache.put('a', make_file('test_output/cache_a.bin', 1000))
+assert cache.get('a', 'test_output/cache_a_out.bin') == 'test_output/cache_a_out.bin'
+assert open('test_output/cache_a_out.bin', 'rb').read() == open('test_output/cache_a.bin', 'rb').read()
+assert cache.get('missing', 'test_output/cache_missing.bin') is None
+
+# 測試按大小淘汰最近最少使用的條目
+print('測試LRU淘汰...')
+cache.put('b', make_file('test_output/cache_b.bin', 1000))
+cache.get('a', 'test_output/cache_a_out.bin')
+cache.put('c', make_file('test_output/cache_c.bin', 1500))
+assert cache.get('b', 'test_output/cache_b_out.bin') is None, 'b應該被淘汰'
+assert cache.get('a', 'test_output/cache_a_out.bin') is not None, 'a最近被訪問，不應被淘汰'
+print(cache.get_stats())
+
+# 測試0表示不限制
+print('測試不限制大小和存活時間...')
+unlimited = SceneRenderCache(os.path.join(cache_root, 'unlimited'), max_bytes=0, max_age=0)
+assert unlimited.max_bytes == 0 and unlimited.max_age == 0
+for index in range(5):
+    unlimited.put(f'k{index}', make_file(f'test_output/cache_k{index}.bin', 100000))
+assert unlimited.get_stats()['entries'] == 5
+
+# 測試並發寫入同一個鍵，臨時文件不能互相覆蓋
+print('測試並發寫入...')
+errors = []
+def writer(index):
+    try:
+        cache.put('same', make_file(f'test_output/cache_same_{index}.bin', 200))
+    except Exception as e:
+        errors.append(e)
+threads = [threading.Thread(target=writer, args=(index,)) for index in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert not errors, errors
+assert not [name for name in os.listdir(cache.cache_dir) if name.endswith('.tmp')], '殘留臨時文件'
+assert cache.get('same', 'test_output/cache_same_out.bin') is not None
+
+# 測試複製在鎖外進行，正在被讀取的條目不會被淘汰
+print('測試讀取期間的淘汰...')
+import render_cache
+pinned = RenderCache(os.path.join(cache_root, 'pinned'), max_bytes=1500)
+pinned.put('old', make_file('test_output/cache_old.bin', 1000))
+copying, release = threading.Event(), threading.Event()
+copy_atomic = render_cache._copy_atomic
+def slow_copy(source_file, output_file):
+    copying.set()
+    release.wait(10)
+    copy_atomic(source_file, output_file)
+render_cache._copy_atomic = slow_copy
+reader = threading.Thread(target=pinned.get, args=('old', 'test_output/cache_old_out.bin'))
+reader.start()
+copying.wait(10)
+render_cache._copy_atomic = copy_atomic
+pinned.put('new', make_file('test_output/cache_new.bin', 1000))
+assert 'old' in pinned.index, '正在讀取的條目不應被淘汰'
+release.set()
+reader.join()
+assert open('test_output/cache_old_out.bin', 'rb').read() == open('test_output/cache_old.bin', 'rb').read()
+pinned.put('newer', make_file('test_output/cache_newer.bin', 1000))
+assert 'old' not in pinned.index and 'newer' in pinned.index, '讀取結束後條目應該可以淘汰'
+
+# 測試場景緩存的裁剪命中和相似命中
+print('測試場景緩存...')
+scene_file = 'test_output/cache_scene.mp4'
+subprocess.run([
+    FFMPEG_BINARY, '-y', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=6:size=320x240:rate=25',
+    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', scene_file
+], check=True)
+scenes = SceneRenderCache(os.path.join(cache_root, 'scenes'), similarity_threshold=0.8)
+scenes.store('Scene related to AI, technology, data', scene_file, 'realistic', 6, '720p', 'mock')
+print('精確命中:', scenes.lookup('scene related to ai, technology, data', 'test_output/cache_scene_exact.mp4', 'realistic', 6, '720p', 'mock'))
+print('裁剪命中:', scenes.lookup('Scene related to AI, technology, data', 'test_output/cache_scene_trim.mp4', 'realistic', 3, '720p', 'mock'))
+print('相似命中:', scenes.lookup('Scene related to data, technology, AI', 'test_output/cache_scene_similar.mp4', 'realistic', 6, '720p', 'mock'))
+print('不同風格:', scenes.lookup('Scene related to AI, technology, data', 'test_output/cache_scene_other.mp4', 'cartoon', 6, '720p', 'mock'))
+stats = scenes.get_stats()
+print(stats)
+assert stats['hits'] == 3 and stats['trimmed_hits'] == 1 and stats['similar_hits'] == 1
+
+# 測試淘汰後相似匹配索引的行和詞彙不會無限增長
+print('測試相似匹配索引的回收...')
+churn = SceneRenderCache(os.path.join(cache_root, 'churn'), max_bytes=100 * 20, max_age=0)
+small_file = make_file('test_output/cache_small.bin', 100)
+for index in range(500):
+    churn.store(f'Scene related to topic{index}, word{index}a, word{index}b', small_file, 'realistic', 5, '720p', 'mock')
+print(f'條目 {len(churn.index)}，索引行 {len(churn._row_keys)}，詞彙 {len(churn._vocabulary)}')
+assert len(churn._row_keys) <= 20 and len(churn._vocabulary) <= 200
+assert churn.find_similar('Scene related to word499b, topic499, word499a', 'realistic', '720p', 'mock', 5) is not None
+
+# 測試數字人緩存以音頻內容為鍵
+print('測試數字人緩存...')
+avatars = AvatarRenderCache(os.path.join(cache_root, 'avatars'))
+audio = make_file('test_output/cache_audio.mp3', 2048)
+shutil.copyfile(audio, 'test_output/cache_audio_copy.mp3')
+key = avatars.make_key('zh-f-01', audio, '#00ff00', '720p', None, 'mock')
+assert key == avatars.make_key('zh-f-01', 'test_output/cache_audio_copy.mp3', '#00FF00', '720p', None, 'mock')
+avatars.store(key, scene_file, 'zh-f-01', '720p')
+assert avatars.lookup(key, 'test_output/cache_avatar_out.mp4') == 'test_output/cache_avatar_out.mp4'
+
+print('渲染緩存測試通過')
+"
+
+echo -e "\n測試完成！結果保存在 test_output 目錄中。"
@@ -221,6 +221,28 @@ print(f'創建的場景視頻: {scene_videos}')
 print(f'創建的音頻文件: {audio_file}')
 "
 
+# 測試流複製拼接功能
+echo -e "\n測試流複製拼接功能..."
+python3 -c "
+from video_concat import VideoConcatenator
+import os
+
+concatenator = VideoConcatenator(temp_dir='test_output')
+
+scene_videos = [
+    'test_output/scene_1.mp4',
+    'test_output/scene_2.mp4',
+    'test_output/scene_3.mp4'
+]
+
+print(f'片段參數一致: {concatenator.is_compatible(scene_videos)}')
+
+result = concatenator.concatenate(scene_videos, 'test_output/concatenated_scenes.mp4')
+
+print(f'拼接的視頻: {result}')
+print(f'文件存在: {os.path.exists(result)}')
+"
+
 # 測試視頻合成功能
 echo -e "\n測試視頻合成功能..."
 python3 -c "
@@ -320,7 +342,7 @@ print(f'文件存在: {os.path.exists(pip_result)}')
 
 # 啟動 API 服務（後台運行）
 echo -e "\n啟動 API 服務..."
-python3 api.py > api.log 2>&1 &
+python3 scene_generation_module.py > api.log 2>&1 &
 API_PID=$!
 
 # 等待 API 啟動
@@ -0,0 +1,77 @@
+#!/bin/bash
+
+# 創建測試目錄
+mkdir -p test_output
+
+# 設置測試環境
+export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# 調度器配置：只允許一個任務執行、兩個任務排隊（每個租戶一個），排隊超時1秒
+export SCHEDULER_MAX_JOBS=1
+export SCHEDULER_MAX_QUEUE=2
+export SCHEDULER_MAX_QUEUE_PER_TENANT=1
+export SCHEDULER_QUEUE_TIMEOUT=1
+
+# 測試任務調度器的背壓和公平排隊
+echo "測試任務調度器..."
+python3 -c "
+import json
+from app import app, scheduler
+
+client = app.test_client()
+request_data = {'text': '測試文本', 'voice_id': 'zh-CN-female-1', 'avatar_id': 'zh-f-01'}
+
+def generate(tenant):
+    response = client.post('/api/generate', json=request_data, headers={'X-Tenant-Id': tenant})
+    return response.status_code, response.headers.get('Retry-After'), response.get_json()
+
+# 佔用唯一的執行位置
+running = scheduler.acquire('acme')
+
+# 同步請求排隊超時返回429
+print('測試排隊超時...')
+status, retry_after, body = generate('acme')
+print(status, retry_after, body)
+assert status == 429 and retry_after, '排隊超時應返回429和Retry-After'
+
+# 租戶隊列已滿時立即返回429
+print('測試租戶隊列已滿...')
+queued = scheduler.submit('acme', 'batch')
+status, retry_after, body = generate('acme')
+print(status, retry_after, body)
+assert status == 429 and int(retry_after) >= 1 and 'acme' in body['error']
+
+# 總隊列已滿時其他租戶同樣返回429
+print('測試總隊列已滿...')
+other = scheduler.submit('gamma', 'batch')
+status, retry_after, body = generate('beta')
+print(status, retry_after, body)
+assert status == 429 and 'acme' not in body['error']
+
+# 調度器狀態
+print('調度器狀態:')
+print(json.dumps(client.get('/api/scheduler').get_json(), ensure_ascii=False, indent=2))
+
+other.release()
+queued.release()
+running.release()
+
+# 草稿和交互任務優先於批量任務
+print('測試優先級...')
+running = scheduler.acquire('acme')
+scheduler.jobs.max_queue = scheduler.jobs.max_queue_per_tenant = None
+batch = scheduler.submit('acme', 'batch')
+interactive = scheduler.submit('beta', 'interactive')
+draft = scheduler.submit('gamma', 'draft')
+running.release()
+assert draft.granted and not interactive.granted and not batch.granted
+draft.release()
+assert interactive.granted and not batch.granted
+interactive.release()
+assert batch.granted
+batch.release()
+
+print('調度器測試通過')
+"
+
+echo -e "\n測試完成！"
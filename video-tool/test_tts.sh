@@ -57,6 +57,28 @@ print(f'生成英語語音: {output_file}')
 print(f'音頻時長: {tts.get_audio_duration(output_file):.2f} 秒')
 "
 
+# 測試模擬模塊按擴展名輸出MP3，長文本分塊合成
+echo "測試模擬 TTS 模塊..."
+python3 -c "
+from tts_module_mock import TextToSpeech, Language, Gender
+from latency_model import LatencyModel
+
+tts = TextToSpeech(latency=LatencyModel.from_spec('base=0'))
+text = '$MANDARIN_TEXT'
+
+output_file = 'test_output/test_mock.mp3'
+tts.synthesize_speech(text, Language.MANDARIN, Gender.FEMALE, output_file)
+with open(output_file, 'rb') as f:
+    header = f.read(3)
+assert header == b'ID3' or header[0] == 0xFF, 'MP3文件應以ID3標籤或MPEG幀頭開始'
+print(f'MP3音頻時長: {tts.get_audio_duration(output_file):.2f} 秒')
+print(tts.get_timestamps(text, output_file))
+
+samples = tts.synthesize_samples(text * 40, Language.MANDARIN, Gender.MALE)
+assert samples.dtype.name == 'float32' and abs(samples).max() <= 1.0
+print(f'長文本採樣數: {len(samples)}')
+"
+
 # 啟動 API 服務（後台運行）
 echo "啟動 API 服務..."
 python3 api.py > api.log 2>&1 &
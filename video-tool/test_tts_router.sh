@@ -0,0 +1,77 @@
+#!/bin/bash
+
+# 創建測試目錄
+mkdir -p test_output
+
+# 設置測試環境
+export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# 測試TTS路由的對沖和故障切換
+echo "測試TTS路由..."
+python3 -c "
+import os
+import time
+from tts_router import TTSRouter
+from tracing import get_tracer
+from provider_rate_limiter import request_priority, current_priority
+
+# 模擬服務提供商：固定延遲，可以設置為失敗，並記錄調用時的上下文
+class FakeEngine:
+    def __init__(self, name, delay, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+
+    def synthesize_speech(self, text, language, gender, output_file, speaking_rate=1.0, pitch=0.0):
+        self.calls.append((get_tracer().current_trace_id(), current_priority()))
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f'{self.name} 不可用')
+        with open(output_file, 'wb') as f:
+            f.write(self.name.encode('utf-8'))
+        return output_file
+
+output_file = 'test_output/router_test.mp3'
+
+# 主服務提供商變慢時對沖到第二個服務提供商
+print('測試對沖...')
+slow, fast = FakeEngine('slow', 2.0), FakeEngine('fast', 0.1)
+router = TTSRouter({'slow': slow, 'fast': fast}, hedge_after=0.3, explore_ratio=0)
+start = time.time()
+result, provider, role = router.synthesize_with_provider('測試', None, None, output_file)
+elapsed = time.time() - start
+print(f'採用 {provider}（{role}），耗時 {elapsed:.2f} 秒')
+assert provider == 'fast' and role == 'hedge' and elapsed < 1.5
+assert open(output_file, 'rb').read() == b'fast'
+
+# 未被採用的請求完成後刪除臨時文件
+time.sleep(2.0)
+assert not os.path.exists('test_output/router_test.slow.mp3'), '未刪除對沖失敗方的臨時文件'
+
+# 追蹤ID和請求優先級傳遞到服務提供商的調用線程
+print('測試上下文傳遞...')
+tracer = get_tracer()
+trace_id = tracer.start_trace()
+with request_priority('draft'):
+    router.synthesize_speech('測試', None, None, output_file)
+tracer.end_trace()
+print('調用上下文:', fast.calls[-1])
+assert fast.calls[-1][1] == 'draft'
+assert trace_id is None or fast.calls[-1][0] == trace_id
+
+# 服務提供商失敗時切換到下一個
+print('測試故障切換...')
+broken, backup = FakeEngine('broken', 0.05, fail=True), FakeEngine('backup', 0.05)
+router = TTSRouter({'broken': broken, 'backup': backup}, min_samples=2, cooldown=60, explore_ratio=0)
+roles = [router.synthesize_with_provider('測試', None, None, output_file)[1:] for _ in range(6)]
+print(roles)
+assert all(provider == 'backup' for provider, _ in roles)
+print(router.report())
+assert not router.report()['broken']['healthy'], '錯誤率過高的服務提供商應暫停使用'
+assert len(broken.calls) < 6, '暫停期間不應再把請求發送到失敗的服務提供商'
+
+print('TTS路由測試通過')
+"
+
+echo -e "\n測試完成！"
@@ -0,0 +1,381 @@
+"""
+鏈路追蹤模塊 - 記錄一次生成任務在網關和各服務中每個階段的耗時
+
+此模塊提供以下功能：
+1. 以上下文管理器或裝飾器記錄處理階段（span），同一線程內的階段按時間自然嵌套
+2. 通過X-Trace-Id請求頭在網關和各服務的HTTP調用之間傳遞追蹤ID
+3. 將追蹤導出為Chrome trace格式的JSON時間線，可在chrome://tracing或Perfetto中查看
+4. 關閉追蹤（TRACING_ENABLED=false）時裝飾器直接返回原函數，當前沒有追蹤時span返回共享的空對象
+"""
+
+import os
+import time
+import uuid
+import threading
+import functools
+import contextvars
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable, Iterable
+
+import requests
+
+# 在HTTP調用之間傳遞追蹤ID的請求頭
+TRACE_HEADER = "X-Trace-Id"
+
+# 當前請求或任務的追蹤ID，沒有追蹤時為None
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace_id", default=None)
+
+class _NoopSpan:
+    """沒有追蹤時使用的空span，所有操作都不做任何事"""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> "_NoopSpan":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+    
+    def set(self, **attrs: Any) -> None:
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """一個處理階段，退出時以Chrome trace的完整事件（ph=X）記錄到追蹤"""
+    
+    __slots__ = ("tracer", "trace_id", "name", "args", "wall_start", "start")
+    
+    def __init__(self, tracer: "Tracer", trace_id: str, name: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.args = args
+        self.wall_start = 0.0
+        self.start = 0.0
+    
+    def __enter__(self) -> "Span":
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        
+        self.tracer.record(self.trace_id, {
+            "name": self.name,
+            "cat": self.tracer.service,
+            "ph": "X",
+            "ts": int(self.wall_start * 1e6),
+            "dur": int(duration * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args
+        })
+        return False
+    
+    def set(self, **attrs: Any) -> None:
+        """為階段添加屬性，例如緩存是否命中、服務提供商"""
+        self.args.update(attrs)
+
+class Tracer:
+    """追蹤類，在內存中保存最近的追蹤，每個追蹤是一組Chrome trace事件"""
+    
+    def __init__(
+        self,
+        service: str = "video-tool",
+        enabled: Optional[bool] = None,
+        max_traces: Optional[int] = None,
+        max_spans: int = 10000
+    ):
+        """
+        初始化追蹤類
+        
+        Args:
+            service: 服務名稱，顯示為時間線中的進程名
+            enabled: 是否啟用追蹤，默認讀取TRACING_ENABLED環境變量
+            max_traces: 內存中保留的最大追蹤數，默認讀取TRACING_MAX_TRACES環境變量
+            max_spans: 單個追蹤最多記錄的階段數
+        """
+        if enabled is None:
+            enabled = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+        
+        self.service = service
+        self.enabled = enabled
+        self.max_traces = max_traces or int(os.getenv("TRACING_MAX_TRACES", "200"))
+        self.max_spans = max_spans
+        
+        self._traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def start_trace(self, trace_id: Optional[str] = None) -> Optional[str]:
+        """
+        在當前上下文中開始（或繼續）一個追蹤
+        
+        Args:
+            trace_id: 上游傳來的追蹤ID，為None時生成新ID
+            
+        Returns:
+            追蹤ID，追蹤關閉時返回None
+        """
+        if not self.enabled:
+            return None
+        
+        trace_id = trace_id or uuid.uuid4().hex
+        _current_trace.set(trace_id)
+        return trace_id
+    
+    def end_trace(self) -> None:
+        """清除當前上下文的追蹤ID，避免線程復用時串到下一個請求"""
+        _current_trace.set(None)
+    
+    @staticmethod
+    def current_trace_id() -> Optional[str]:
+        """當前上下文的追蹤ID"""
+        return _current_trace.get()
+    
+    def span(self, name: str, **attrs: Any):
+        """
+        記錄一個處理階段
+        
+        Args:
+            name: 階段名稱
+            **attrs: 階段屬性
+            
+        Returns:
+            上下文管理器，當前沒有追蹤時返回共享的空對象
+        """
+        trace_id = _current_trace.get()
+        if trace_id is None:
+            return _NOOP_SPAN
+        return Span(self, trace_id, name, attrs)
+    
+    def traced(self, name: Optional[str] = None) -> Callable:
+        """
+        將函數的每次調用記錄為一個階段的裝飾器
+        
+        Args:
+            name: 階段名稱，默認使用函數的限定名
+            
+        Returns:
+            裝飾器，追蹤關閉時直接返回原函數
+        """
+        def decorator(func: Callable) -> Callable:
+            if not self.enabled:
+                return func
+            
+            span_name = name or func.__qualname__
+            
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                trace_id = _current_trace.get()
+                if trace_id is None:
+                    return func(*args, **kwargs)
+                with Span(self, trace_id, span_name, {}):
+                    return func(*args, **kwargs)
+            
+            return wrapper
+        
+        return decorator
+    
+    def bind(self, func: Callable) -> Callable:
+        """
+        將當前追蹤ID綁定到函數，用於提交到線程池或後台線程的任務
+        
+        Args:
+            func: 要在其他線程執行的函數
+            
+        Returns:
+            在執行時恢復追蹤ID的函數，當前沒有追蹤時返回原函數
+        """
+        trace_id = _current_trace.get()
+        if trace_id is None:
+            return func
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current_trace.set(trace_id)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current_trace.reset(token)
+        
+        return wrapper
+    
+    def inject(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        在HTTP請求頭中加入當前追蹤ID
+        
+        Args:
+            headers: 原有的請求頭
+            
+        Returns:
+            新的請求頭字典
+        """
+        headers = dict(headers or {})
+        trace_id = _current_trace.get()
+        if trace_id is not None:
+            headers[TRACE_HEADER] = trace_id
+        return headers
+    
+    def record(self, trace_id: str, event: Dict[str, Any]) -> None:
+        """
+        記錄一個事件，超出保留數量時淘汰最早的追蹤
+        
+        Args:
+            trace_id: 追蹤ID
+            event: Chrome trace事件
+        """
+        with self._lock:
+            events = self._traces.get(trace_id)
+            if events is None:
+                events = self._traces[trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if len(events) < self.max_spans:
+                events.append(event)
+    
+    def get_events(self, trace_id: str) -> List[Dict[str, Any]]:
+        """
+        獲取本進程記錄的追蹤事件
+        
+        Args:
+            trace_id: 追蹤ID
+            
+        Returns:
+            事件列表，追蹤不存在時返回空列表
+        """
+        with self._lock:
+            return list(self._traces.get(trace_id, []))
+    
+    def export_chrome_trace(self, trace_id: str, extra_events: Iterable[Dict[str, Any]] = ()) -> Dict[str, Any]:
+        """
+        導出Chrome trace格式的時間線
+        
+        Args:
+            trace_id: 追蹤ID
+            extra_events: 從其他服務收集的事件
+            
+        Returns:
+            Chrome trace JSON對象
+        """
+        events = sorted(self.get_events(trace_id) + list(extra_events), key=lambda event: event["ts"])
+        
+        # 每個進程顯示為以服務名命名的一行
+        processes = {(event["pid"], event.get("cat", "")) for event in events}
+        metadata = [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": service}}
+            for pid, service in sorted(processes)
+        ]
+        
+        return {
+            "traceEvents": metadata + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": trace_id}
+        }
+    
+    def collect(self, trace_id: str, service_urls: Iterable[str], timeout: float = 2.0) -> Dict[str, Any]:
+        """
+        從各服務收集同一追蹤的事件，合併為一條時間線
+        
+        Args:
+            trace_id: 追蹤ID
+            service_urls: 服務的基礎URL列表
+            timeout: 每個服務的請求超時（秒）
+            
+        Returns:
+            Chrome trace JSON對象，無法訪問的服務會被跳過
+        """
+        remote_events = []
+        for service_url in service_urls:
+            try:
+                response = requests.get(f"{service_url}/trace/{trace_id}", timeout=timeout)
+                if response.status_code == 200:
+                    remote_events.extend(response.json().get("traceEvents", []))
+            except (requests.RequestException, ValueError) as e:
+                print(f"獲取服務追蹤失敗: {service_url}, {str(e)}")
+        
+        return self.export_chrome_trace(trace_id, remote_events)
+
+_shared_tracer = None
+_shared_tracer_lock = threading.Lock()
+
+def get_tracer() -> Tracer:
+    """
+    獲取進程內共享的追蹤器
+    
+    Returns:
+        Tracer實例
+    """
+    global _shared_tracer
+    with _shared_tracer_lock:
+        if _shared_tracer is None:
+            _shared_tracer = Tracer(service=os.getenv("SERVICE_NAME", "video-tool"))
+        return _shared_tracer
+
+def trace_span(name: str, **attrs: Any):
+    """使用共享追蹤器記錄一個處理階段"""
+    return get_tracer().span(name, **attrs)
+
+def traced(name: Optional[str] = None) -> Callable:
+    """使用共享追蹤器的函數裝飾器"""
+    return get_tracer().traced(name)
+
+def register_trace_routes(
+    app: Any,
+    tracer: Tracer,
+    service: str,
+    root_endpoints: Iterable[str] = (),
+    path: str = "/trace"
+) -> None:
+    """
+    在Flask應用中接收上游傳來的追蹤ID，並註冊導出本進程追蹤事件的端點
+    
+    帶有X-Trace-Id請求頭的請求和root_endpoints中的端點會被記錄為一個階段；
+    其他請求（健康檢查、進度輪詢等）不產生追蹤。
+    
+    Args:
+        app: Flask應用
+        tracer: 追蹤器
+        service: 服務名稱
+        root_endpoints: 沒有上游追蹤ID時也開始新追蹤的端點名稱
+        path: 導出端點路徑
+    """
+    from flask import request, jsonify, g
+    
+    tracer.service = service
+    root_endpoints = set(root_endpoints)
+    
+    @app.before_request
+    def start_request_trace():
+        g.trace_span = None
+        trace_id = request.headers.get(TRACE_HEADER)
+        if not trace_id and request.endpoint not in root_endpoints:
+            return
+        if tracer.start_trace(trace_id):
+            g.trace_span = tracer.span(f"{request.method} {request.path}")
+            g.trace_span.__enter__()
+    
+    @app.after_request
+    def add_trace_header(response):
+        trace_id = tracer.current_trace_id()
+        if trace_id:
+            response.headers[TRACE_HEADER] = trace_id
+            if g.get("trace_span") is not None:
+                g.trace_span.set(status=response.status_code)
+        return response
+    
+    @app.teardown_request
+    def end_request_trace(exc):
+        span = g.pop("trace_span", None)
+        if span is not None:
+            span.__exit__(type(exc) if exc else None, exc, None)
+        tracer.end_trace()
+    
+    def get_trace(trace_id):
+        """導出本進程記錄的追蹤事件"""
+        return jsonify(tracer.export_chrome_trace(trace_id))
+    
+    app.add_url_rule(f"{path}/<trace_id>", "get_trace", get_trace, methods=["GET"])
@@ -12,6 +12,7 @@
 1. 設置環境變量GOOGLE_APPLICATION_CREDENTIALS指向您的Google Cloud憑證JSON文件
 2. 或者設置AZURE_SPEECH_KEY和AZURE_SPEECH_REGION環境變量以使用Azure
 3. 調用synthesize_speech函數生成語音文件
+4. 離線測試時設置GOOGLE_TTS_ENDPOINT或AZURE_SPEECH_ENDPOINT指向本地替身（見fake_providers.py）
 """
 
 import os
@@ -19,8 +20,12 @@ import tempfile
 from enum import Enum
 from typing import Optional, Dict, Any, Tuple
 
+import requests
+
 # 導入Google Cloud Text-to-Speech
 from google.cloud import texttospeech
+from google.auth.credentials import AnonymousCredentials
+from google.api_core.exceptions import TooManyRequests
 
 # 導入Azure Speech Service
 import azure.cognitiveservices.speech as speechsdk
@@ -31,6 +36,9 @@ from dotenv import load_dotenv
 # 導入音頻處理
 from pydub import AudioSegment
 
+# 導入服務提供商限流
+from provider_rate_limiter import get_rate_limiter
+
 # 加載環境變量
 load_dotenv()
 
@@ -62,14 +70,23 @@ class TextToSpeech:
         """
         self.provider = provider
         
-        # 初始化Google客戶端
+        # 初始化Google客戶端，指定GOOGLE_TTS_ENDPOINT時使用REST接口連接該地址（例如本地替身），不需要憑證
         if provider == TTSProvider.GOOGLE:
-            self.google_client = texttospeech.TextToSpeechClient()
+            google_endpoint = os.getenv("GOOGLE_TTS_ENDPOINT")
+            if google_endpoint:
+                self.google_client = texttospeech.TextToSpeechClient(
+                    credentials=AnonymousCredentials(),
+                    transport="rest",
+                    client_options={"api_endpoint": google_endpoint}
+                )
+            else:
+                self.google_client = texttospeech.TextToSpeechClient()
         
-        # 初始化Azure配置
+        # 初始化Azure配置，指定AZURE_SPEECH_ENDPOINT時改用REST接口連接該地址
         elif provider == TTSProvider.AZURE:
             self.azure_speech_key = os.getenv("AZURE_SPEECH_KEY")
             self.azure_speech_region = os.getenv("AZURE_SPEECH_REGION")
+            self.azure_speech_endpoint = os.getenv("AZURE_SPEECH_ENDPOINT")
             
             if not self.azure_speech_key or not self.azure_speech_region:
                 raise ValueError("Azure Speech服務需要設置AZURE_SPEECH_KEY和AZURE_SPEECH_REGION環境變量")
@@ -152,10 +169,19 @@ class TextToSpeech:
             pitch=pitch
         )
         
-        # 執行請求
-        response = self.google_client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+        # 在配額內執行請求，仍被限流時暫停配額後重試
+        limiter = get_rate_limiter()
+        for attempt in range(3):
+            limiter.acquire("google", "synthesize")
+            try:
+                response = self.google_client.synthesize_speech(
+                    input=synthesis_input, voice=voice, audio_config=audio_config
+                )
+                break
+            except TooManyRequests:
+                if attempt == 2:
+                    raise
+                limiter.throttled("google", "synthesize")
         
         # 寫入音頻文件
         with open(output_file, "wb") as out:
@@ -186,14 +212,28 @@ class TextToSpeech:
         Returns:
             輸出文件路徑
         """
+        # 選擇語音
+        voice_name = self.get_voice_name(language, gender)
+        
+        # 調整語速和音調
+        ssml_text = f"""
+        <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{language.value}">
+            <voice name="{voice_name}">
+                <prosody rate="{speaking_rate}" pitch="{pitch}%">
+                    {text}
+                </prosody>
+            </voice>
+        </speak>
+        """
+        
+        if self.azure_speech_endpoint:
+            return self._synthesize_speech_azure_rest(ssml_text, output_file)
+        
         # 創建語音配置
         speech_config = speechsdk.SpeechConfig(
             subscription=self.azure_speech_key,
             region=self.azure_speech_region
         )
-        
-        # 選擇語音
-        voice_name = self.get_voice_name(language, gender)
         speech_config.speech_synthesis_voice_name = voice_name
         
         # 創建音頻配置
@@ -205,19 +245,16 @@ class TextToSpeech:
             audio_config=audio_config
         )
         
-        # 調整語速和音調
-        ssml_text = f"""
-        <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{language.value}">
-            <voice name="{voice_name}">
-                <prosody rate="{speaking_rate}" pitch="{pitch}%">
-                    {text}
-                </prosody>
-            </voice>
-        </speak>
-        """
-        
-        # 執行語音合成
-        result = speech_synthesizer.speak_ssml_async(ssml_text).get()
+        # 在配額內執行語音合成，因限流被取消時暫停配額後重試（SDK不提供Retry-After，暫停1秒）
+        limiter = get_rate_limiter()
+        for attempt in range(3):
+            limiter.acquire("azure", "synthesize")
+            result = speech_synthesizer.speak_ssml_async(ssml_text).get()
+            if result.reason != speechsdk.ResultReason.Canceled or attempt == 2:
+                break
+            if result.cancellation_details.error_code != speechsdk.CancellationErrorCode.TooManyRequests:
+                break
+            limiter.throttled("azure", "synthesize")
         
         # 檢查結果
         if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
@@ -228,6 +265,43 @@ class TextToSpeech:
         else:
             raise Exception(f"語音合成失敗: {result.reason}")
     
+    def _synthesize_speech_azure_rest(self, ssml_text: str, output_file: str) -> str:
+        """
+        通過Azure Speech REST接口生成語音
+        
+        Args:
+            ssml_text: SSML文本
+            output_file: 輸出文件路徑
+            
+        Returns:
+            輸出文件路徑
+        """
+        # 在配額內發送請求，仍被限流時按Retry-After暫停配額後重試
+        limiter = get_rate_limiter()
+        for attempt in range(3):
+            limiter.acquire("azure", "synthesize")
+            response = requests.post(
+                f"{self.azure_speech_endpoint.rstrip('/')}/cognitiveservices/v1",
+                headers={
+                    "Ocp-Apim-Subscription-Key": self.azure_speech_key,
+                    "Content-Type": "application/ssml+xml",
+                    "X-Microsoft-OutputFormat": "audio-16khz-128kbitrate-mono-mp3"
+                },
+                data=ssml_text.encode("utf-8"),
+                timeout=60
+            )
+            if response.status_code != 429 or attempt == 2:
+                break
+            limiter.throttled("azure", "synthesize", response.headers.get("Retry-After"))
+        
+        if response.status_code != 200:
+            raise Exception(f"語音合成失敗: {response.status_code}, {response.text}")
+        
+        with open(output_file, "wb") as out:
+            out.write(response.content)
+        
+        return output_file
+    
     def synthesize_speech(
         self, 
         text: str, 
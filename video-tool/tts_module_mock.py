@@ -3,13 +3,86 @@
 
 此模塊提供與正式版本相同的接口，但使用模擬數據而非實際調用API。
 用於開發和測試環境，無需實際的API憑證。
+
+模擬語音是可解碼的16位單聲道音頻，輸出文件擴展名為.wav時寫入WAV，其他擴展名（例如.mp3）
+由ffmpeg按擴展名編碼，與正式版本的輸出格式一致。每個字符佔一個音節，句子之間有固定的停頓，
+時長由文本長度、語言和語速決定，句子邊界可以精確還原。
 """
 
 import os
-import time
-import random
+import re
+import zlib
+import wave
+import subprocess
 from enum import Enum
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, List
+
+import numpy as np
+
+from latency_model import LatencyModel
+from video_concat import FFMPEG_BINARY
+
+# 模擬處理時間的默認延遲模型，可通過MOCK_TTS_LATENCY環境變量覆蓋，格式見LatencyModel.from_spec
+DEFAULT_MOCK_LATENCY = "base=0.5"
+
+# 模擬語音的採樣率
+SAMPLE_RATE = 16000
+
+# 語速為1.0時每秒的字符數（中文每字一個音節，英文按字母計）
+CHARS_PER_SECOND = {
+    "zh-CN": 4.5,
+    "zh-HK": 5.0,
+    "en-US": 14.0
+}
+
+# 句子之間的停頓，以音節（字符）時長為單位，使停頓隨語速縮放
+PAUSE_SLOTS = 2
+
+# 分塊合成時每塊的音節數，中間數組的大小與文本長度無關
+CHUNK_SLOTS = 64
+
+# 各聲線性別的基頻（Hz）
+BASE_PITCH = {
+    "MALE": 120.0,
+    "FEMALE": 210.0
+}
+
+def split_sentences(text: str) -> List[str]:
+    """
+    將文本分割為句子，句末標點不計入句子
+    
+    Args:
+        text: 原始文本
+        
+    Returns:
+        句子列表
+    """
+    normalized = text.replace('。', '.').replace('！', '!').replace('？', '?')
+    return [s.strip() for s in re.split(r'[.!?]', normalized) if s.strip()]
+
+def layout_sentences(sentences: List[str], slot_duration: float) -> List[Tuple[float, float]]:
+    """
+    計算每個句子的開始和結束時間：每個字符佔一個音節，句子之間停頓PAUSE_SLOTS個音節
+    
+    Args:
+        sentences: 句子列表
+        slot_duration: 一個音節的時長（秒）
+        
+    Returns:
+        每個句子的 (開始時間, 結束時間) 列表
+    """
+    spans = []
+    current = 0.0
+    for i, sentence in enumerate(sentences):
+        if i > 0:
+            current += PAUSE_SLOTS * slot_duration
+        spans.append((current, current + len(sentence) * slot_duration))
+        current += len(sentence) * slot_duration
+    return spans
+
+def total_slots(sentences: List[str]) -> int:
+    """文本的總音節數，包括句間停頓"""
+    return sum(len(s) for s in sentences) + PAUSE_SLOTS * max(0, len(sentences) - 1)
 
 class Language(Enum):
     """支持的語言枚舉"""
@@ -31,14 +104,16 @@ class TTSProvider(Enum):
 class TextToSpeech:
     """文本轉語音類，模擬版本"""
     
-    def __init__(self, provider: TTSProvider = TTSProvider.MOCK):
+    def __init__(self, provider: TTSProvider = TTSProvider.MOCK, latency: Optional[LatencyModel] = None):
         """
         初始化文本轉語音類
         
         Args:
             provider: TTS服務提供商，默認為模擬模式
+            latency: 模擬處理時間的延遲模型，工作量為文本字符數，默認讀取MOCK_TTS_LATENCY環境變量
         """
         self.provider = TTSProvider.MOCK  # 強制使用模擬模式
+        self.latency = latency or LatencyModel.from_spec(os.getenv("MOCK_TTS_LATENCY", DEFAULT_MOCK_LATENCY))
         print(f"初始化TTS模擬模式，原始提供商: {provider.value}")
     
     def get_voice_name(self, language: Language, gender: Gender) -> str:
@@ -94,42 +169,153 @@ class TextToSpeech:
         # 確保輸出目錄存在
         os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
         
-        # 模擬處理時間
-        time.sleep(0.5)
+        # 模擬處理時間，延遲隨文本長度變化
+        self.latency.wait(len(text))
         
-        # 創建一個空的MP3文件
-        with open(output_file, "wb") as f:
-            # 寫入一個最小的有效MP3頭部
-            f.write(bytes.fromhex("FFFB9064000000000000000000000000"))
-            # 添加一些隨機數據
-            f.write(os.urandom(1024))
+        samples = self.synthesize_samples(text, language, gender, speaking_rate, pitch)
+        pcm = (samples * 32767).astype(np.int16).tobytes()
+        
+        if output_file.lower().endswith(".wav"):
+            with wave.open(output_file, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(SAMPLE_RATE)
+                f.writeframes(pcm)
+        else:
+            # 按擴展名編碼（.mp3為MP3），與API返回的文件類型一致
+            subprocess.run([
+                FFMPEG_BINARY, "-y", "-v", "error",
+                "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "-",
+                "-b:a", "64k",
+                output_file
+            ], input=pcm, capture_output=True, check=True)
         
         print(f"模擬語音生成完成: {output_file}")
         return output_file
     
+    def synthesize_samples(
+        self,
+        text: str,
+        language: Language,
+        gender: Gender,
+        speaking_rate: float = 1.0,
+        pitch: float = 0.0
+    ) -> np.ndarray:
+        """
+        以向量化方式合成模擬語音的PCM採樣
+        
+        每個字符是一個音節：音量先升後降，音色（低頻諧波、中頻諧波和高頻噪聲的比例）由字符決定，
+        標點和空格是靜音音節，句子之間是PAUSE_SLOTS個靜音音節。相同參數每次生成相同的採樣。
+        每次合成CHUNK_SLOTS個音節並寫入輸出數組，長文本的內存佔用只有輸出數組本身。
+        
+        Args:
+            text: 要轉換的文本
+            language: 語言選擇
+            gender: 性別選擇
+            speaking_rate: 語速
+            pitch: 音調（半音）
+            
+        Returns:
+            取值在-1到1之間的float32採樣數組
+        """
+        sentences = split_sentences(text)
+        slot_samples = max(1, int(round(SAMPLE_RATE / (CHARS_PER_SECOND[language.value] * max(speaking_rate, 0.25)))))
+        
+        # 每個音節對應的字符碼，0為靜音
+        codes = []
+        for i, sentence in enumerate(sentences):
+            if i > 0:
+                codes.extend([0] * PAUSE_SLOTS)
+            codes.extend(0 if not ch.isalnum() else ord(ch) for ch in sentence)
+        if not codes:
+            return np.zeros(0, dtype=np.float32)
+        codes = np.array(codes, dtype=np.int64)
+        
+        # 音節包絡：靜音音節為0
+        voiced = (codes != 0).astype(np.float32)
+        position = np.arange(slot_samples, dtype=np.float32) / slot_samples
+        syllable = (np.sin(np.pi * position) ** 0.6).astype(np.float32)
+        
+        # 音色權重由字符碼決定，不同字符產生不同的口型
+        low_weight = (0.5 + 0.5 * ((codes % 3) == 0)).astype(np.float32)
+        mid_weight = (0.2 + 0.6 * ((codes // 3) % 2)).astype(np.float32)
+        high_weight = (0.1 * ((codes // 6) % 3)).astype(np.float32)
+        
+        base_f0 = BASE_PITCH[gender.value] * 2 ** (pitch / 12)
+        seed = zlib.crc32(text.encode("utf-8"))
+        signal = np.empty(len(codes) * slot_samples, dtype=np.float32)
+        chunks = [
+            (first, min(first + CHUNK_SLOTS, len(codes)))
+            for first in range(0, len(codes), CHUNK_SLOTS)
+        ]
+        
+        rng = np.random.default_rng(seed)
+        phase_offset = 0.0
+        peak = 1e-6
+        for first, last in chunks:
+            start, end = first * slot_samples, last * slot_samples
+            count = last - first
+            t = np.arange(start, end) / SAMPLE_RATE
+            
+            # 基頻帶輕微的顫動和逐句下降的語調，相位跨塊連續
+            f0 = base_f0 * (1 + 0.03 * np.sin(2 * np.pi * 5 * t) - 0.08 * np.tile(position, count))
+            phase = phase_offset + 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+            phase_offset = float(phase[-1]) % (2 * np.pi)
+            phase = (phase % (2 * np.pi)).astype(np.float32)
+            
+            noise = rng.standard_normal(end - start, dtype=np.float32)
+            envelope = np.repeat(voiced[first:last], slot_samples) * np.tile(syllable, count)
+            low = np.sin(phase) + 0.5 * np.sin(2 * phase)
+            mid = np.sin(4 * phase) + 0.6 * np.sin(6 * phase) + 0.4 * np.sin(8 * phase)
+            chunk = envelope * (
+                np.repeat(low_weight[first:last], slot_samples) * low
+                + np.repeat(mid_weight[first:last], slot_samples) * mid
+                + np.repeat(high_weight[first:last], slot_samples) * noise
+            )
+            signal[start:end] = chunk
+            peak = max(peak, float(np.max(np.abs(chunk))))
+        
+        # 歸一化並加入很弱的底噪，以相同種子重新生成與合成時相同的噪聲
+        rng = np.random.default_rng(seed)
+        scale = np.float32(0.6 / peak)
+        for first, last in chunks:
+            chunk = signal[first * slot_samples:last * slot_samples]
+            chunk *= scale
+            chunk += np.float32(0.002) * rng.standard_normal(len(chunk), dtype=np.float32)
+            np.clip(chunk, -1.0, 1.0, out=chunk)
+        return signal
+    
     def get_audio_duration(self, audio_file: str) -> float:
         """
-        模擬獲取音頻文件的持續時間（秒）
+        獲取音頻文件的持續時間（秒）
         
         Args:
             audio_file: 音頻文件路徑
             
         Returns:
-            模擬的音頻持續時間（秒）
+            音頻持續時間（秒），無法讀取時返回0.0
         """
-        # 根據文本長度模擬持續時間
         try:
-            file_size = os.path.getsize(audio_file)
-            # 模擬持續時間：文件大小除以1000，加上一些隨機性
-            duration = (file_size / 1000) + random.uniform(1.0, 5.0)
-            return duration
-        except:
-            # 如果文件不存在或其他錯誤，返回隨機持續時間
-            return random.uniform(3.0, 10.0)
+            if audio_file.lower().endswith(".wav"):
+                with wave.open(audio_file, "rb") as f:
+                    return f.getnframes() / f.getframerate()
+            
+            # 壓縮格式解碼後按採樣數計算，不受編碼器填充影響，句子時間戳保持精確
+            result = subprocess.run([
+                FFMPEG_BINARY, "-v", "error", "-i", audio_file,
+                "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"
+            ], capture_output=True, check=True)
+            return len(result.stdout) / 2 / SAMPLE_RATE
+        except (OSError, EOFError, wave.Error, subprocess.CalledProcessError) as e:
+            print(f"讀取音頻時長失敗: {audio_file}, {str(e)}")
+            return 0.0
     
     def get_timestamps(self, text: str, audio_file: str) -> Dict[str, Tuple[float, float]]:
         """
-        模擬估算文本中每個句子的時間戳
+        計算文本中每個句子的時間戳
+        
+        模擬語音的每個音節時長相同，由音頻總時長和總音節數即可還原合成時的句子邊界，
+        不需要知道合成時的語言和語速。
         
         Args:
             text: 原始文本
@@ -138,34 +324,13 @@ class TextToSpeech:
         Returns:
             句子到時間戳的映射，格式為 {句子: (開始時間, 結束時間)}
         """
-        # 分割句子
-        sentences = [s.strip() for s in text.replace('。', '.').replace('！', '!').replace('？', '?').split('.') if s.strip()]
-        
-        # 獲取總時長
-        total_duration = self.get_audio_duration(audio_file)
-        
-        # 計算每個句子的字符數
-        char_counts = [len(s) for s in sentences]
-        total_chars = sum(char_counts) if sum(char_counts) > 0 else 1
-        
-        # 估算每個句子的時間戳
-        timestamps = {}
-        current_time = 0.0
-        
-        for i, sentence in enumerate(sentences):
-            if not sentence:
-                continue
-                
-            # 估算句子持續時間
-            duration = (char_counts[i] / total_chars) * total_duration
-            
-            # 記錄時間戳
-            timestamps[sentence] = (current_time, current_time + duration)
-            
-            # 更新當前時間
-            current_time += duration
+        sentences = split_sentences(text)
+        slots = total_slots(sentences)
+        if not slots:
+            return {}
         
-        return timestamps
+        slot_duration = self.get_audio_duration(audio_file) / slots
+        return dict(zip(sentences, layout_sentences(sentences, slot_duration)))
 
 # 示例用法
 def example_usage():
@@ -0,0 +1,352 @@
+"""
+TTS路由模塊 - 按各服務提供商的實時延遲和錯誤率選擇TTS服務，並可對慢請求發起對沖
+
+此模塊提供以下功能：
+1. 記錄每個服務提供商最近若干次調用的延遲（p50/p95）和錯誤率
+2. 每個請求發送到當前最快的健康服務提供商，錯誤率過高的服務提供商暫停使用一段時間
+3. 請求失敗時依次切換到其他服務提供商
+4. 對沖：主請求超過延遲閾值仍未完成時向第二個服務提供商發起同一請求，採用先完成的結果，降低尾延遲
+
+配置（環境變量）：
+    TTS_PROVIDERS       參與路由的服務提供商，例如 "google,azure"，無法初始化的服務提供商會被跳過
+    TTS_HEDGE_AFTER     對沖閾值（秒），設置為auto時使用主服務提供商的p95延遲，不設置時不對沖
+    TTS_ROUTER_WINDOW   計算延遲和錯誤率的最近調用數，默認50
+"""
+
+import os
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Any, Callable, Tuple, Union
+
+from metrics import get_registry, provider_call
+
+class ProviderStats:
+    """單個服務提供商最近若干次調用的延遲和結果"""
+    
+    def __init__(self, window: int = 50):
+        """
+        初始化調用統計
+        
+        Args:
+            window: 保留的最近調用數
+        """
+        self.samples: deque = deque(maxlen=window)
+        self.unhealthy_until = 0.0
+        self._lock = threading.Lock()
+    
+    def record(self, latency: float, ok: bool) -> None:
+        """記錄一次調用的延遲和結果"""
+        with self._lock:
+            self.samples.append((latency, ok))
+    
+    def latency(self, quantile: float) -> Optional[float]:
+        """
+        成功調用延遲的分位數
+        
+        Args:
+            quantile: 分位數，範圍0-1
+            
+        Returns:
+            延遲（秒），沒有成功調用時返回None
+        """
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+    
+    @property
+    def count(self) -> int:
+        """窗口內的調用數"""
+        return len(self.samples)
+    
+    @property
+    def error_rate(self) -> float:
+        """窗口內的錯誤率"""
+        with self._lock:
+            if not self.samples:
+                return 0.0
+            return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+    
+    def healthy(self, now: float) -> bool:
+        """是否不在暫停期內"""
+        return now >= self.unhealthy_until
+
+class TTSRouter:
+    """TTS路由類，提供與TextToSpeech相同的synthesize_speech接口"""
+    
+    def __init__(
+        self,
+        engines: Dict[str, Any],
+        hedge_after: Optional[Union[float, str]] = None,
+        window: int = 50,
+        min_samples: int = 5,
+        max_error_rate: float = 0.5,
+        cooldown: float = 30.0,
+        explore_ratio: float = 0.05,
+        seed: Optional[int] = None
+    ):
+        """
+        初始化TTS路由類
+        
+        Args:
+            engines: 服務提供商名稱到TextToSpeech實例的映射
+            hedge_after: 對沖閾值（秒），為auto時使用主服務提供商的p95延遲，為None時不對沖
+            window: 計算延遲和錯誤率的最近調用數
+            min_samples: 調用數少於此值的服務提供商優先獲得請求，以收集延遲數據
+            max_error_rate: 錯誤率超過此值時暫停使用該服務提供商
+            cooldown: 暫停的秒數，之後重新嘗試
+            explore_ratio: 隨機發送到非最快服務提供商的請求比例，使其延遲數據保持更新
+            seed: 隨機數種子
+        """
+        if not engines:
+            raise ValueError("TTS路由至少需要一個服務提供商")
+        
+        self.engines = engines
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.explore_ratio = explore_ratio
+        self.stats = {name: ProviderStats(window) for name in engines}
+        
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 4 * len(engines)), thread_name_prefix="tts-router")
+        
+        registry = get_registry()
+        self._routed = registry.counter("tts_routed_total", "TTS路由採用的結果數", ("provider", "role"))
+        registry.gauge_callback(
+            "tts_provider_latency_seconds", "TTS服務提供商最近調用的延遲分位數（秒）", self._latency_samples,
+            ("provider", "quantile")
+        )
+        registry.gauge_callback(
+            "tts_provider_error_rate", "TTS服務提供商最近調用的錯誤率",
+            lambda: {(name,): stats.error_rate for name, stats in self.stats.items()}, ("provider",)
+        )
+    
+    @classmethod
+    def from_env(cls, factory: Callable[[Any], Any], provider_enum: Any) -> "TTSRouter":
+        """
+        根據環境變量創建路由器
+        
+        Args:
+            factory: 以服務提供商枚舉值創建TextToSpeech實例的函數
+            provider_enum: 服務提供商枚舉類
+            
+        Returns:
+            TTSRouter實例
+        """
+        engines = {}
+        for name in os.getenv("TTS_PROVIDERS", "google,azure").split(","):
+            name = name.strip()
+            if not name:
+                continue
+            try:
+                engines[name] = factory(provider_enum(name))
+            except Exception as e:
+                print(f"初始化TTS服務提供商失敗，不參與路由: {name}, {str(e)}")
+        
+        hedge_after = os.getenv("TTS_HEDGE_AFTER")
+        if hedge_after and hedge_after != "auto":
+            hedge_after = float(hedge_after)
+        
+        return cls(engines, hedge_after=hedge_after or None, window=int(os.getenv("TTS_ROUTER_WINDOW", "50")))
+    
+    def route(self) -> List[str]:
+        """
+        按當前狀態排列服務提供商：健康的在前，調用數不足的優先，其餘按p50延遲從低到高
+        
+        Returns:
+            服務提供商名稱列表
+        """
+        now = time.time()
+        
+        def score(name: str) -> Tuple[int, float]:
+            stats = self.stats[name]
+            if stats.count < self.min_samples:
+                return (0, stats.count)
+            return (1, stats.latency(0.5) or float("inf"))
+        
+        healthy = sorted((name for name in self.engines if self.stats[name].healthy(now)), key=score)
+        unhealthy = sorted(
+            (name for name in self.engines if not self.stats[name].healthy(now)), key=lambda n: self.stats[n].error_rate
+        )
+        
+        # 偶爾把請求發送到較慢的服務提供商，避免其延遲數據過時後再也得不到請求
+        with self._random_lock:
+            explore = len(healthy) > 1 and self._random.random() < self.explore_ratio
+            if explore:
+                healthy.insert(0, healthy.pop(self._random.randrange(1, len(healthy))))
+        
+        return healthy + unhealthy
+    
+    def hedge_threshold(self, name: str) -> Optional[float]:
+        """
+        主服務提供商為name時的對沖閾值
+        
+        Returns:
+            閾值（秒），不對沖時返回None
+        """
+        if self.hedge_after is None:
+            return None
+        if self.hedge_after == "auto":
+            stats = self.stats[name]
+            p95 = stats.latency(0.95) if stats.count >= self.min_samples else None
+            return max(0.1, p95) if p95 is not None else None
+        return float(self.hedge_after)
+    
+    def synthesize_speech(
+        self,
+        text: str,
+        language: Any,
+        gender: Any,
+        output_file: str,
+        speaking_rate: float = 1.0,
+        pitch: float = 0.0
+    ) -> str:
+        """
+        生成語音，參數與TextToSpeech.synthesize_speech相同
+        
+        Returns:
+            輸出文件路徑
+        """
+        return self.synthesize_with_provider(text, language, gender, output_file, speaking_rate, pitch)[0]
+    
+    def synthesize_with_provider(
+        self,
+        text: str,
+        language: Any,
+        gender: Any,
+        output_file: str,
+        speaking_rate: float = 1.0,
+        pitch: float = 0.0
+    ) -> Tuple[str, str, str]:
+        """
+        生成語音並返回採用的服務提供商
+        
+        請求先發送到排在最前的服務提供商；超過對沖閾值仍未完成時向下一個服務提供商發起對沖請求，
+        請求失敗時切換到下一個服務提供商。每個請求寫入各自的臨時文件，採用的結果移動到output_file。
+        
+        Returns:
+            (輸出文件路徑, 採用的服務提供商名稱, 角色：primary、hedge或failover)
+        """
+        candidates = iter(self.route())
+        root, ext = os.path.splitext(output_file)
+        pending: Dict[Future, Tuple[str, str, str]] = {}
+        errors = []
+        hedged = False
+        
+        def launch(role: str) -> Optional[str]:
+            name = next(candidates, None)
+            if name is not None:
+                part_file = f"{root}.{name}{ext}"
+                # 每個請求在調用線程上下文的副本中執行，保留追蹤ID和請求優先級等上下文變量
+                future = self._executor.submit(
+                    contextvars.copy_context().run,
+                    self._attempt, name, text, language, gender, part_file, speaking_rate, pitch
+                )
+                pending[future] = (name, role, part_file)
+            return name
+        
+        primary = launch("primary")
+        while pending:
+            timeout = None if hedged else self.hedge_threshold(primary)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                hedged = True
+                if launch("hedge"):
+                    print(f"TTS請求超過{timeout:.2f}秒，對沖到其他服務提供商")
+                continue
+            
+            for future in done:
+                name, role, part_file = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(f"{name}: {str(e)}")
+                    print(f"TTS服務提供商失敗: {name}, {str(e)}")
+                    self._discard(part_file)
+                    continue
+                
+                os.replace(part_file, output_file)
+                self._routed.inc(provider=name, role=role)
+                
+                # 未完成的請求無法取消，完成後刪除其臨時文件
+                for other, (_, _, other_file) in pending.items():
+                    other.add_done_callback(lambda _, path=other_file: self._discard(path))
+                return output_file, name, role
+            
+            if not pending:
+                launch("failover")
+        
+        raise RuntimeError(f"所有TTS服務提供商均失敗: {'; '.join(errors)}")
+    
+    def _attempt(
+        self,
+        name: str,
+        text: str,
+        language: Any,
+        gender: Any,
+        part_file: str,
+        speaking_rate: float,
+        pitch: float
+    ) -> str:
+        """調用單個服務提供商並記錄延遲和結果，錯誤率過高時暫停該服務提供商"""
+        stats = self.stats[name]
+        start = time.perf_counter()
+        try:
+            with provider_call(name):
+                self.engines[name].synthesize_speech(text, language, gender, part_file, speaking_rate, pitch)
+        except Exception:
+            stats.record(time.perf_counter() - start, False)
+            if stats.count >= self.min_samples and stats.error_rate > self.max_error_rate:
+                stats.unhealthy_until = time.time() + self.cooldown
+            raise
+        stats.record(time.perf_counter() - start, True)
+        return part_file
+    
+    def _discard(self, part_file: str) -> None:
+        """刪除未被採用或失敗請求的臨時文件"""
+        if os.path.exists(part_file):
+            try:
+                os.remove(part_file)
+            except OSError:
+                pass
+    
+    def _latency_samples(self) -> Dict[Tuple[str, str], float]:
+        """各服務提供商的p50和p95延遲，供指標導出"""
+        samples = {}
+        for name, stats in self.stats.items():
+            for quantile in (0.5, 0.95):
+                value = stats.latency(quantile)
+                if value is not None:
+                    samples[(name, str(quantile))] = value
+        return samples
+    
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """各服務提供商的調用數、p50和p95延遲、錯誤率和健康狀態"""
+        now = time.time()
+        return {
+            name: {
+                "calls": stats.count,
+                "p50": stats.latency(0.5),
+                "p95": stats.latency(0.95),
+                "error_rate": round(stats.error_rate, 4),
+                "healthy": stats.healthy(now)
+            }
+            for name, stats in self.stats.items()
+        }
+    
+    def get_audio_duration(self, audio_file: str) -> float:
+        """獲取音頻文件的持續時間（秒）"""
+        return next(iter(self.engines.values())).get_audio_duration(audio_file)
+    
+    def get_timestamps(self, text: str, audio_file: str) -> Dict[str, Tuple[float, float]]:
+        """估算文本中每個句子的時間戳"""
+        return next(iter(self.engines.values())).get_timestamps(text, audio_file)
@@ -0,0 +1,323 @@
+"""
+視頻拼接模塊 - 支持對編碼參數一致的視頻片段進行流複製拼接
+
+此模塊提供以下功能：
+1. 使用ffprobe探測視頻的編碼器、分辨率、幀率和像素格式
+2. 判斷多個視頻片段能否直接以數據包級流複製方式拼接
+3. 只對參數不一致的片段進行重新編碼（歸一化）
+4. 流複製失敗時回退到MoviePy重新編碼拼接
+5. 以流複製方式為拼接結果重新封裝完整音軌
+"""
+
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import subprocess
+from collections import Counter
+from fractions import Fraction
+from typing import Dict, List, Optional, Any, Tuple
+
+from render_settings import get_encoder_settings
+
+# FFmpeg可執行文件，可通過環境變量覆蓋（與MoviePy使用相同的變量名）
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+
+# 編碼器名稱到FFmpeg編碼器的映射，用於歸一化不一致的片段
+VIDEO_ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "vp9": "libvpx-vp9",
+    "mpeg4": "mpeg4"
+}
+
+AUDIO_ENCODERS = {
+    "aac": "aac",
+    "mp3": "libmp3lame",
+    "opus": "libopus"
+}
+
+class VideoConcatenator:
+    """視頻拼接類，參數一致的片段使用流複製，不一致的片段先歸一化"""
+    
+    def __init__(self, temp_dir: Optional[str] = None, encoder: Optional[Dict[str, Any]] = None):
+        """
+        初始化視頻拼接類
+        
+        Args:
+            temp_dir: 歸一化片段和拼接列表的臨時目錄，默認為系統臨時目錄
+            encoder: 重新編碼時的編碼參數（get_encoder_settings返回值），默認使用RENDER_PROFILE環境變量對應的配置
+        """
+        self.temp_dir = temp_dir or tempfile.gettempdir()
+        self.encoder = encoder or get_encoder_settings()
+        os.makedirs(self.temp_dir, exist_ok=True)
+    
+    def probe(self, video_file: str) -> Dict[str, Any]:
+        """
+        探測視頻文件的流參數
+        
+        Args:
+            video_file: 視頻文件路徑
+            
+        Returns:
+            流參數字典，包含codec、width、height、fps、pix_fmt、time_base及音頻參數
+        """
+        command = [
+            FFPROBE_BINARY, "-v", "error",
+            "-show_entries",
+            "stream=codec_type,codec_name,width,height,r_frame_rate,pix_fmt,time_base,sample_rate,channels:format=duration",
+            "-of", "json",
+            video_file
+        ]
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout or "{}")
+        
+        info = {
+            "codec": None,
+            "width": None,
+            "height": None,
+            "fps": None,
+            "pix_fmt": None,
+            "time_base": None,
+            "audio_codec": None,
+            "sample_rate": None,
+            "channels": None,
+            "duration": float(data.get("format", {}).get("duration", 0) or 0)
+        }
+        
+        for stream in data.get("streams", []):
+            if stream.get("codec_type") == "video" and info["codec"] is None:
+                info["codec"] = stream.get("codec_name")
+                info["width"] = stream.get("width")
+                info["height"] = stream.get("height")
+                info["fps"] = Fraction(stream.get("r_frame_rate", "0/1"))
+                info["pix_fmt"] = stream.get("pix_fmt")
+                info["time_base"] = stream.get("time_base")
+            elif stream.get("codec_type") == "audio" and info["audio_codec"] is None:
+                info["audio_codec"] = stream.get("codec_name")
+                info["sample_rate"] = int(stream.get("sample_rate", 0) or 0)
+                info["channels"] = stream.get("channels")
+        
+        return info
+    
+    @staticmethod
+    def stream_signature(info: Dict[str, Any]) -> Tuple:
+        """
+        生成決定能否流複製拼接的參數簽名
+        
+        Args:
+            info: probe返回的流參數
+            
+        Returns:
+            參數簽名元組
+        """
+        return (
+            info["codec"], info["width"], info["height"], info["fps"],
+            info["pix_fmt"], info["time_base"],
+            info["audio_codec"], info["sample_rate"], info["channels"]
+        )
+    
+    def is_compatible(self, video_files: List[str]) -> bool:
+        """
+        判斷所有視頻片段能否直接流複製拼接
+        
+        Args:
+            video_files: 視頻文件路徑列表
+            
+        Returns:
+            所有片段參數一致時返回True
+        """
+        signatures = {self.stream_signature(self.probe(f)) for f in video_files}
+        return len(signatures) <= 1
+    
+    def normalize(self, video_file: str, output_file: str, reference: Dict[str, Any]) -> str:
+        """
+        將視頻片段重新編碼為與參考參數一致
+        
+        Args:
+            video_file: 輸入視頻文件路徑
+            output_file: 輸出視頻文件路徑
+            reference: 參考流參數（probe返回值）
+            
+        Returns:
+            輸出文件路徑
+        """
+        source = self.probe(video_file)
+        
+        command = [FFMPEG_BINARY, "-y", "-v", "error", "-i", video_file]
+        
+        # 參考有音頻而片段沒有時，補一條靜音音軌以保持流佈局一致
+        needs_silence = reference["audio_codec"] and not source["audio_codec"]
+        if needs_silence:
+            layout = "stereo" if reference["channels"] == 2 else "mono"
+            command += [
+                "-f", "lavfi",
+                "-i", f"anullsrc=channel_layout={layout}:sample_rate={reference['sample_rate']}"
+            ]
+        
+        command += [
+            "-map", "0:v:0",
+            "-vf", f"scale={reference['width']}:{reference['height']},fps={reference['fps']}",
+            "-c:v", VIDEO_ENCODERS.get(reference["codec"], "libx264"),
+            "-pix_fmt", reference["pix_fmt"]
+        ]
+        
+        # 像素格式和編碼器必須與參考一致，只有速度和碼率控制參數取自編碼配置
+        if VIDEO_ENCODERS.get(reference["codec"], "libx264") in ("libx264", "libx265"):
+            command += ["-preset", self.encoder["preset"]]
+            if self.encoder.get("video_bitrate"):
+                command += ["-b:v", str(self.encoder["video_bitrate"])]
+            else:
+                command += ["-crf", str(self.encoder["crf"])]
+        command += ["-threads", str(self.encoder["threads"])]
+        
+        if reference["time_base"]:
+            command += ["-video_track_timescale", str(Fraction(reference["time_base"]).denominator)]
+        
+        if reference["audio_codec"]:
+            command += [
+                "-map", "1:a:0" if needs_silence else "0:a:0",
+                "-c:a", AUDIO_ENCODERS.get(reference["audio_codec"], "aac"),
+                "-ar", str(reference["sample_rate"]),
+                "-ac", str(reference["channels"])
+            ]
+            if needs_silence:
+                command += ["-shortest"]
+        else:
+            command += ["-an"]
+        
+        command.append(output_file)
+        subprocess.run(command, capture_output=True, check=True)
+        
+        return output_file
+    
+    def concatenate(self, video_files: List[str], output_file: str) -> str:
+        """
+        拼接視頻片段，參數一致時使用流複製，只歸一化不一致的片段
+        
+        Args:
+            video_files: 按播放順序排列的視頻文件路徑列表
+            output_file: 輸出視頻文件路徑
+            
+        Returns:
+            輸出文件路徑
+        """
+        if not video_files:
+            raise ValueError("沒有需要拼接的視頻片段")
+        
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        
+        if len(video_files) == 1:
+            shutil.copyfile(video_files[0], output_file)
+            return output_file
+        
+        temp_files = []
+        
+        try:
+            infos = [self.probe(f) for f in video_files]
+            signatures = [self.stream_signature(info) for info in infos]
+            
+            # 以出現次數最多的參數作為參考，盡量減少需要重新編碼的片段
+            reference_signature = Counter(signatures).most_common(1)[0][0]
+            reference = infos[signatures.index(reference_signature)]
+            
+            inputs = []
+            for video_file, signature in zip(video_files, signatures):
+                if signature == reference_signature:
+                    inputs.append(video_file)
+                else:
+                    print(f"片段參數不一致，進行歸一化: {video_file}")
+                    normalized_file = os.path.join(self.temp_dir, f"normalized_{uuid.uuid4()}.mp4")
+                    temp_files.append(normalized_file)
+                    inputs.append(self.normalize(video_file, normalized_file, reference))
+            
+            list_file = os.path.join(self.temp_dir, f"concat_{uuid.uuid4()}.txt")
+            temp_files.append(list_file)
+            with open(list_file, "w", encoding="utf-8") as f:
+                for path in inputs:
+                    escaped_path = os.path.abspath(path).replace("'", "'\\''")
+                    f.write(f"file '{escaped_path}'\n")
+            
+            command = [
+                FFMPEG_BINARY, "-y", "-v", "error",
+                "-f", "concat", "-safe", "0",
+                "-i", list_file,
+                "-c", "copy",
+                "-movflags", "+faststart",
+                output_file
+            ]
+            subprocess.run(command, capture_output=True, check=True)
+            
+            return output_file
+        except Exception as e:
+            print(f"流複製拼接失敗，回退到重新編碼: {str(e)}")
+            return self._concatenate_with_moviepy(video_files, output_file)
+        finally:
+            for temp_file in temp_files:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+    
+    def replace_audio(self, video_file: str, audio_file: str, output_file: str) -> str:
+        """
+        用完整音頻替換視頻的音軌，視頻流直接複製不重新編碼
+        
+        分段渲染的視頻拼接後，各片段音頻編碼器的首尾填充會累積成偏移，
+        重新封裝原始音頻可以保證整段音畫精確對齊。
+        
+        Args:
+            video_file: 視頻文件路徑
+            audio_file: 音頻文件路徑
+            output_file: 輸出視頻文件路徑
+            
+        Returns:
+            輸出文件路徑
+        """
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", video_file,
+            "-i", audio_file,
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "copy",
+            "-c:a", "aac",
+            "-shortest",
+            "-movflags", "+faststart",
+            output_file
+        ]
+        subprocess.run(command, capture_output=True, check=True)
+        
+        return output_file
+    
+    def _concatenate_with_moviepy(self, video_files: List[str], output_file: str) -> str:
+        """
+        使用MoviePy解碼並重新編碼拼接視頻
+        
+        Args:
+            video_files: 視頻文件路徑列表
+            output_file: 輸出視頻文件路徑
+            
+        Returns:
+            輸出文件路徑
+        """
+        from moviepy.editor import VideoFileClip, concatenate_videoclips
+        
+        clips = [VideoFileClip(f) for f in video_files]
+        try:
+            final_clip = concatenate_videoclips(clips, method="compose")
+            bitrate_params = (
+                ["-b:v", str(self.encoder["video_bitrate"])] if self.encoder.get("video_bitrate")
+                else ["-crf", str(self.encoder["crf"])]
+            )
+            final_clip.write_videofile(
+                output_file,
+                codec=self.encoder["codec"],
+                preset=self.encoder["preset"],
+                threads=self.encoder["threads"] or None,
+                ffmpeg_params=bitrate_params + ["-pix_fmt", self.encoder["pix_fmt"]]
+            )
+        finally:
+            for clip in clips:
+                clip.close()
+        
+        return output_file
@@ -0,0 +1,271 @@
+"""
+視頻打包模塊 - 將生成的視頻打包為自適應碼率的HLS流
+
+此模塊提供以下功能：
+1. 定義1080p/720p/480p多碼率階梯
+2. 只解碼一次源視頻，通過split濾鏡在同一個FFmpeg進程中並行編碼所有碼率
+3. 輸出fMP4分片、各碼率的媒體播放列表和主播放列表
+4. 關鍵幀對齊分片邊界，播放器可以在任意分片處切換碼率
+5. 在後台線程池中打包，請求方無需等待編碼完成
+"""
+
+import os
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Callable, Union
+
+from video_concat import FFMPEG_BINARY, VideoConcatenator
+
+# 默認碼率階梯，從高到低排列
+HLS_LADDER = [
+    {"name": "1080p", "height": 1080, "video_bitrate": "5000k", "maxrate": "5350k", "bufsize": "7500k", "audio_bitrate": "192k"},
+    {"name": "720p", "height": 720, "video_bitrate": "2800k", "maxrate": "2996k", "bufsize": "4200k", "audio_bitrate": "128k"},
+    {"name": "480p", "height": 480, "video_bitrate": "1400k", "maxrate": "1498k", "bufsize": "2100k", "audio_bitrate": "96k"}
+]
+
+# 主播放列表文件名
+MASTER_PLAYLIST = "master.m3u8"
+
+def _scale_bitrate(bitrate: str, scale: float) -> str:
+    """
+    按比例縮放以k結尾的碼率字符串
+    
+    Args:
+        bitrate: 碼率，例如"1400k"
+        scale: 縮放比例
+        
+    Returns:
+        縮放後的碼率，不低於100k
+    """
+    return f"{max(100, int(float(bitrate.rstrip('k')) * scale))}k"
+
+class VideoPackager:
+    """視頻打包類，將MP4視頻轉換為多碼率fMP4 HLS"""
+    
+    def __init__(self, segment_duration: int = 4, preset: str = "veryfast", max_workers: int = 1):
+        """
+        初始化視頻打包類
+        
+        Args:
+            segment_duration: 分片時長（秒）
+            preset: libx264編碼預設
+            max_workers: 後台同時打包的視頻數
+        """
+        self.segment_duration = segment_duration
+        self.preset = preset
+        
+        # 同一個輸出目錄同時只允許一個打包進程
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        
+        # 後台打包的狀態：輸出目錄 -> packaging、failed或missing，以及失敗原因
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="hls-packager")
+        self._states: Dict[str, Dict[str, Any]] = {}
+    
+    def select_ladder(self, source_height: int, ladder: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        根據源視頻高度選擇碼率，不放大低分辨率的源視頻
+        
+        源視頻低於最低一檔時按源視頻高度輸出一檔，碼率按像素數從最低一檔等比例降低。
+        
+        Args:
+            source_height: 源視頻高度
+            ladder: 碼率階梯，默認為HLS_LADDER
+            
+        Returns:
+            選中的碼率列表，至少包含一檔
+        """
+        ladder = ladder or HLS_LADDER
+        selected = [rendition for rendition in ladder if rendition["height"] <= source_height]
+        if selected:
+            return selected
+        
+        lowest = ladder[-1]
+        height = max(2, source_height - source_height % 2)
+        scale = (height / lowest["height"]) ** 2
+        return [dict(
+            lowest,
+            name=f"{height}p",
+            height=height,
+            **{key: _scale_bitrate(lowest[key], scale) for key in ("video_bitrate", "maxrate", "bufsize")}
+        )]
+    
+    def is_packaged(self, output_dir: str) -> bool:
+        """
+        檢查輸出目錄是否已有完整的HLS打包結果
+        
+        Args:
+            output_dir: 輸出目錄
+            
+        Returns:
+            主播放列表存在時返回True
+        """
+        return os.path.exists(os.path.join(output_dir, MASTER_PLAYLIST))
+    
+    def package_in_background(self, source: Union[str, Callable[[], Optional[str]]], output_dir: str) -> None:
+        """
+        在後台線程池中打包，已打包或正在打包時不做任何事
+        
+        Args:
+            source: 輸入視頻文件路徑，或在後台線程中返回路徑的函數（例如先從其他服務下載），
+                返回None表示視頻不存在
+            output_dir: 輸出目錄
+        """
+        key = os.path.abspath(output_dir)
+        with self._locks_lock:
+            state = self._states.get(key)
+            if self.is_packaged(output_dir) or (state and state["status"] == "packaging"):
+                return
+            self._states[key] = {"status": "packaging", "error": None}
+        
+        def run():
+            try:
+                input_file = source() if callable(source) else source
+                if not input_file:
+                    result = {"status": "missing", "error": "視頻不存在"}
+                else:
+                    self.package(input_file, output_dir)
+                    result = None
+            except Exception as e:
+                print(f"HLS打包失敗: {output_dir}, {str(e)}")
+                result = {"status": "failed", "error": str(e)}
+            
+            with self._locks_lock:
+                if result is None:
+                    self._states.pop(key, None)
+                else:
+                    self._states[key] = result
+        
+        self._executor.submit(run)
+    
+    def packaging_state(self, output_dir: str) -> Dict[str, Any]:
+        """
+        查詢打包狀態
+        
+        Args:
+            output_dir: 輸出目錄
+            
+        Returns:
+            包含status（packaged、packaging、failed、missing或none）和error的字典
+        """
+        if self.is_packaged(output_dir):
+            return {"status": "packaged", "error": None}
+        with self._locks_lock:
+            return dict(self._states.get(os.path.abspath(output_dir)) or {"status": "none", "error": None})
+    
+    def package(self, input_file: str, output_dir: str, ladder: Optional[List[Dict[str, Any]]] = None) -> str:
+        """
+        將視頻打包為多碼率HLS，已打包時直接返回
+        
+        Args:
+            input_file: 輸入視頻文件路徑
+            output_dir: 輸出目錄
+            ladder: 碼率階梯，默認為HLS_LADDER
+            
+        Returns:
+            主播放列表路徑
+        """
+        master_file = os.path.join(output_dir, MASTER_PLAYLIST)
+        
+        with self._locks_lock:
+            lock = self._locks.setdefault(os.path.abspath(output_dir), threading.Lock())
+        
+        with lock:
+            if self.is_packaged(output_dir):
+                return master_file
+            
+            info = VideoConcatenator().probe(input_file)
+            renditions = self.select_ladder(info["height"], ladder)
+            has_audio = bool(info["audio_codec"])
+            
+            # 先輸出到臨時目錄，完成後再替換，避免播放器讀到未完成的播放列表
+            temp_dir = f"{output_dir.rstrip(os.sep)}.tmp"
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            os.makedirs(temp_dir, exist_ok=True)
+            
+            try:
+                command = self._build_command(input_file, temp_dir, renditions, has_audio)
+                subprocess.run(command, capture_output=True, check=True)
+                
+                shutil.rmtree(output_dir, ignore_errors=True)
+                os.replace(temp_dir, output_dir)
+            except subprocess.CalledProcessError as e:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise RuntimeError(f"HLS打包失敗: {e.stderr.decode('utf-8', errors='ignore')}")
+        
+        return master_file
+    
+    def _build_command(
+        self,
+        input_file: str,
+        output_dir: str,
+        renditions: List[Dict[str, Any]],
+        has_audio: bool
+    ) -> List[str]:
+        """
+        構建一次解碼、多路並行編碼的FFmpeg命令
+        
+        Args:
+            input_file: 輸入視頻文件路徑
+            output_dir: 輸出目錄
+            renditions: 碼率列表
+            has_audio: 源視頻是否有音軌
+            
+        Returns:
+            FFmpeg命令參數列表
+        """
+        count = len(renditions)
+        
+        # 解碼一次後用split分成多路，各路分別縮放
+        filters = [f"[0:v]split={count}" + "".join(f"[s{i}]" for i in range(count))]
+        for i, rendition in enumerate(renditions):
+            filters.append(f"[s{i}]scale=-2:{rendition['height']}[v{i}]")
+        
+        command = [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", input_file,
+            "-filter_complex", ";".join(filters)
+        ]
+        
+        for i in range(count):
+            command += ["-map", f"[v{i}]"]
+        if has_audio:
+            for i in range(count):
+                command += ["-map", "0:a:0"]
+        
+        command += ["-c:v", "libx264", "-preset", self.preset, "-pix_fmt", "yuv420p", "-sc_threshold", "0"]
+        for i, rendition in enumerate(renditions):
+            command += [
+                f"-b:v:{i}", rendition["video_bitrate"],
+                f"-maxrate:v:{i}", rendition["maxrate"],
+                f"-bufsize:v:{i}", rendition["bufsize"]
+            ]
+            if has_audio:
+                command += [f"-b:a:{i}", rendition["audio_bitrate"]]
+        if has_audio:
+            command += ["-c:a", "aac", "-ac", "2"]
+        
+        # 關鍵幀與分片邊界對齊，各碼率可以無縫切換
+        command += ["-force_key_frames", f"expr:gte(t,n_forced*{self.segment_duration})"]
+        
+        stream_map = " ".join(
+            f"v:{i},a:{i},name:{r['name']}" if has_audio else f"v:{i},name:{r['name']}"
+            for i, r in enumerate(renditions)
+        )
+        
+        command += [
+            "-f", "hls",
+            "-hls_time", str(self.segment_duration),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4",
+            "-hls_flags", "independent_segments",
+            "-hls_fmp4_init_filename", "init.mp4",
+            "-master_pl_name", MASTER_PLAYLIST,
+            "-var_stream_map", stream_map,
+            "-hls_segment_filename", os.path.join(output_dir, "%v", "segment_%05d.m4s"),
+            os.path.join(output_dir, "%v", "index.m3u8")
+        ]
+        
+        return command